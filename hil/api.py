@@ -4,12 +4,15 @@ TODO: Spec out and document what sanitization is required.
 """
 import json
 import requests
+import time
 import uuid
 
-from schema import Schema, And, Optional, SchemaError
+from flask import Response
+from schema import Schema, And, Optional, SchemaError, Use
 from urlparse import urlparse
 
-from hil import model, errors
+from hil import model, changes, completion, deferred, errors, metrics, \
+    profiler, replicas, tracing
 from hil.model import db
 from hil.auth import get_auth_backend
 from hil.config import cfg
@@ -118,8 +121,7 @@ def project_detach_node(project, node):
     if num_attachments != 0:
         raise errors.BlockedError("Node attached to a network")
     for nic in node.nics:
-        if nic.current_action is not None and \
-           nic.current_action.status == 'PENDING':
+        if nic.pending_actions():
             raise errors.BlockedError("Node has pending network actions")
 
     node.obm.stop_console()
@@ -259,6 +261,7 @@ def node_power_cycle(node, force=False):
     node = get_or_404(model.Node, node)
     get_auth_backend().require_project_access(node.project)
     node.obm.power_cycle(force)
+    db.session.commit()
 
 
 @rest_call('POST', '/node/<node>/power_off', Schema({'node': basestring}))
@@ -267,6 +270,7 @@ def node_power_off(node):
     node = get_or_404(model.Node, node)
     get_auth_backend().require_project_access(node.project)
     node.obm.power_off()
+    db.session.commit()
 
 
 @rest_call('PUT', '/node/<node>/boot_device', Schema({
@@ -280,6 +284,7 @@ def node_set_bootdev(node, bootdev):
     node.obm.require_legal_bootdev(bootdev)
 
     node.obm.set_bootdev(bootdev)
+    db.session.commit()
 
 
 @rest_call('DELETE', '/node/<node>', Schema({'node': basestring}))
@@ -350,21 +355,14 @@ def node_connect_network(node, nic, network, channel=None):
     Raises ProjectMismatchError if the node is not in a project, or if the
     project does not have access rights to the given network.
 
-    Raises BlockedError if there is a pending network action, or if the network
-    is already attached to the nic, or if the channel is in use.
+    Raises BlockedError if the nic has too many pending network actions, or if
+    the network is already attached to the nic, or if the channel is in use.
+    Pending actions count as done: e.g. a network may be attached on a channel
+    which a pending action is detaching.
 
     Raises BadArgumentError if the channel is invalid for the network.
     """
 
-    def _have_attachment(nic, query):
-        """Return if there are any attachments matching ``query`` for ``nic``.
-
-        ``query`` should an argument suitable to pass to db.query(...).filter
-        """
-        return model.NetworkAttachment.query.filter(
-            model.NetworkAttachment.nic == nic,
-            query,
-        ).first() is not None
     auth_backend = get_auth_backend()
 
     node = get_or_404(model.Node, node)
@@ -388,14 +386,15 @@ def node_connect_network(node, nic, network, channel=None):
         raise errors.ProjectMismatchError(
             "Project does not have access to given network.")
 
-    if _have_attachment(nic, model.NetworkAttachment.network == network):
+    planned = nic.planned_networks()
+    if network in planned.values():
         raise errors.BlockedError(
             "The network is already attached to the nic.")
 
     if channel is None:
         channel = allocator.get_default_channel()
 
-    if _have_attachment(nic, model.NetworkAttachment.channel == channel):
+    if channel in planned:
         raise errors.BlockedError("The channel is already in use on the nic.")
 
     if not allocator.is_legal_channel_for(channel, network.network_id):
@@ -411,6 +410,8 @@ def node_connect_network(node, nic, network, channel=None):
                                           new_network=network,
                                           channel=channel,
                                           uuid=unique_id,
+                                          trace_id=tracing.keep_trace(),
+                                          priority=_action_priority(node),
                                           status='PENDING'))
     db.session.commit()
     return json.dumps({'status_id': unique_id}), 202
@@ -424,9 +425,10 @@ def node_detach_network(node, nic, network):
 
     Raises ProjectMismatchError if the node is not in a project.
 
-    Raises BlockedError if there is already a pending network action.
+    Raises BlockedError if the nic has too many pending network actions.
 
-    Raises BadArgumentError if the network is not attached to the nic.
+    Raises BadArgumentError if the network is not attached to the nic, once its
+    pending actions are done.
     """
     auth_backend = get_auth_backend()
 
@@ -440,20 +442,24 @@ def node_detach_network(node, nic, network):
 
     check_pending_action(nic)
 
-    attachment = model.NetworkAttachment.query \
-        .filter_by(nic=nic, network=network).one_or_none()
-    if attachment is None:
+    channels = [channel for (channel, planned_network)
+                in nic.planned_networks().items()
+                if planned_network == network]
+    if not channels:
         raise errors.BadArgumentError(
             "The network is not attached to the nic.")
+    channel = channels[0]
 
     switch = nic.port.owner
-    switch.ensure_legal_operation(nic, 'detach', attachment.channel)
+    switch.ensure_legal_operation(nic, 'detach', channel)
 
     unique_id = str(uuid.uuid4())
     db.session.add(model.NetworkingAction(type='modify_port',
                                           nic=nic,
-                                          channel=attachment.channel,
+                                          channel=channel,
                                           uuid=unique_id,
+                                          trace_id=tracing.keep_trace(),
+                                          priority=_action_priority(node),
                                           status='PENDING',
                                           new_network=None))
 
@@ -994,11 +1000,18 @@ def show_switch(switch):
     """
     get_auth_backend().require_admin()
     switch = get_or_404(model.Switch, switch)
+    open_until = switch.breaker_open_until
     return json.dumps({
         'name': switch.label,
         'ports': [{'label': port.label}
                   for port in switch.ports],
         'capabilities': switch.get_capabilities(),
+        'breaker': {
+            'state': switch.breaker_state(),
+            'failures': switch.breaker_failures,
+            'open_until': None if open_until is None
+            else open_until.isoformat(),
+        },
     }, sort_keys=True)
 
 
@@ -1114,6 +1127,8 @@ def port_revert(switch, port):
                                     nic=port.nic,
                                     channel='',
                                     uuid=unique_id,
+                                    trace_id=tracing.keep_trace(),
+                                    priority=_action_priority(port.nic.owner),
                                     status='PENDING',
                                     new_network=None)
 
@@ -1122,31 +1137,148 @@ def port_revert(switch, port):
     return json.dumps({'status_id': unique_id})
 
 
+# The longest (in seconds) show_networking_action(s) will wait for actions
+# to finish:
+MAX_ACTION_WAIT = 60
+
+
 @rest_call('GET', '/networking_action/<status_id>', Schema({
-    'status_id': basestring}))
-def show_networking_action(status_id):
+    'status_id': basestring,
+    Optional('wait'): And(Use(int), lambda n: 0 <= n <= MAX_ACTION_WAIT),
+}))
+def show_networking_action(status_id, wait=None):
     """Returns the status of the networking action by finding the status_id
-    in the networking actions table.
+    in the networking actions table, or else in the archive.
+
+    If ``wait`` is given and the action is pending, we wait up to ``wait``
+    seconds for it to finish before responding, so clients can long-poll
+    for the result.
     """
-    action = model.NetworkingAction.query.filter_by(uuid=status_id).first()
+    return json.dumps(_wait_for_actions([status_id], wait)[status_id])
+
+
+@rest_call('GET', '/networking_actions', Schema({
+    'status_ids': basestring,
+    Optional('wait'): And(Use(int), lambda n: 0 <= n <= MAX_ACTION_WAIT),
+}))
+def show_networking_actions(status_ids, wait=None):
+    """Returns the status of several networking actions.
+
+    ``status_ids`` is a comma-separated list of status ids. Returns a JSON
+    object mapping each of them to the status of the action, as given by
+    `show_networking_action`. If ``wait`` is given, we wait up to ``wait``
+    seconds for all of the actions to finish.
+    """
+    status_ids = [status_id for status_id in status_ids.split(',')
+                  if status_id]
+    if not status_ids:
+        raise errors.BadArgumentError('No status ids given.')
+    return json.dumps(_wait_for_actions(status_ids, wait))
+
+
+def _wait_for_actions(status_ids, wait):
+    """Return the status of the networking actions `status_ids`.
+
+    If `wait` is given, wait up to `wait` seconds for any pending actions to
+    finish first. Rather than querying them over and over, we wait for the
+    network daemon's notifications (see `hil.completion`). The result is a
+    dict mapping each status id to the status of its action.
+    """
+    if not wait:
+        return _networking_action_statuses(status_ids)
+    # The notifications come from the primary, which replicas may lag
+    # behind:
+    replicas.use_primary()
+    deadline = time.time() + wait
+    with completion.Listener() as listener:
+        while True:
+            statuses = _networking_action_statuses(status_ids)
+            pending = [status_id for status_id in status_ids
+                       if statuses[status_id]['status'] == 'PENDING']
+            if not pending or time.time() >= deadline:
+                return statuses
+            # Don't hold a transaction open while we wait:
+            db.session.commit()
+            listener.wait(pending, deadline - time.time())
+
+
+def _networking_action_statuses(status_ids):
+    """Return the status of each of the networking actions `status_ids`.
+
+    See `_wait_for_actions`. Raises a NotFoundError if any of them can't be
+    found, and an AuthorizationError if the client may not see them.
+    """
+    actions = model.NetworkingAction.query \
+        .filter(model.NetworkingAction.uuid.in_(status_ids)).all()
+    positions = deferred.queue_positions(actions)
+    actions = dict((action.uuid, action) for action in actions)
+
+    result = {}
+    for status_id in status_ids:
+        action = actions.get(status_id)
+        if action is None:
+            result[status_id] = _archived_action_status(status_id)
+            continue
+        get_auth_backend().require_project_access(action.nic.owner.project)
+        result[status_id] = {
+            'status': action.status,
+            'node': action.nic.owner.label,
+            'nic': action.nic.label,
+            'type': action.type,
+            'channel': action.channel,
+            'queue_position': positions[action.id],
+            'new_network': (action.new_network.label
+                            if action.new_network is not None else None),
+        }
+    return result
+
+
+def _archived_action_status(status_id):
+    """Return the status of the archived networking action `status_id`.
+
+    This is for `_networking_action_statuses`, and gives the same fields.
+    """
+    action = model.ArchivedNetworkingAction.query \
+        .filter_by(uuid=status_id).first()
     if action is None:
         raise errors.NotFoundError('status_id not found')
 
-    project = action.nic.owner.project
+    project = None
+    if action.project is not None:
+        project = model.Project.query.filter_by(label=action.project).first()
     get_auth_backend().require_project_access(project)
 
-    action_info = {'status': action.status,
-                   'node': action.nic.owner.label,
-                   'nic': action.nic.label,
-                   'type': action.type,
-                   'channel': action.channel}
+    return {'status': action.status,
+            'node': action.node,
+            'nic': action.nic,
+            'type': action.type,
+            'channel': action.channel,
+            'queue_position': None,
+            'new_network': action.new_network}
 
-    if action.new_network is None:
-        action_info['new_network'] = None
-    else:
-        action_info['new_network'] = action.new_network.label
 
-    return json.dumps(action_info)
+@rest_call('GET', '/networking_action/<status_id>/trace', Schema({
+    'status_id': basestring}))
+def show_networking_action_trace(status_id):
+    """Show the trace of the networking action with the given status_id.
+
+    Returns a JSON array of the root spans of the trace, oldest first; see
+    `hil.tracing.span_tree` for their format. Typically there is one for the
+    API call which queued the action and one for the network daemon's
+    handling of it. Like `show_networking_action`, this falls back to the
+    archive if the action isn't in the journal.
+    """
+    action = model.NetworkingAction.query.filter_by(uuid=status_id).first()
+    if action is not None:
+        get_auth_backend().require_project_access(action.nic.owner.project)
+        return json.dumps(tracing.span_tree(action.trace_id or action.uuid))
+
+    # _archived_action_status checks that the action exists, and that the
+    # client may see it:
+    _archived_action_status(status_id)
+    action = model.ArchivedNetworkingAction.query \
+        .filter_by(uuid=status_id).first()
+    return json.dumps(tracing.span_tree(action.trace_id or action.uuid))
 
 
 @rest_call('GET', '/nodes/<is_free>', Schema({'is_free': basestring}))
@@ -1293,17 +1425,137 @@ def list_active_extensions():
     return json.dumps(extensions)
 
 
+# Metrics code #
+################
+@rest_call('GET', '/metrics', Schema({}))
+def show_metrics():
+    """Show per-endpoint metrics, in the Prometheus text format.
+
+    See `hil.metrics` for what is collected, and `hil.replicas` for the
+    metrics about read replicas.
+    """
+    get_auth_backend().require_admin()
+    return Response(metrics.render(replicas.metrics()),
+                    content_type=metrics.CONTENT_TYPE)
+
+
+# The most slow requests list_slow_requests will return:
+MAX_SLOW_REQUESTS = 100
+
+
+@rest_call('GET', '/profiler/requests', Schema({
+    Optional('limit'): And(Use(int),
+                           lambda n: 0 < n <= MAX_SLOW_REQUESTS),
+}))
+def list_slow_requests(limit=20):
+    """List recently profiled or slow requests, newest first.
+
+    Returns a JSON array of summaries of the dumps made by `hil.profiler`;
+    the full traces are kept in the profiling directory, under each
+    request's uuid.
+
+    Example: '[{"uuid": "...", "endpoint": "list_nodes", "status": 200,
+                "started_at": "2018-04-07T19:10:35.243712",
+                "seconds": 1.7, "profiled": false,
+                "sql_count": 3, "call_count": 0}]'
+    """
+    get_auth_backend().require_admin()
+    return json.dumps(profiler.recent_traces(limit))
+
+
+# Change log code #
+###################
+
+# The most changes list_changes will return at once:
+MAX_CHANGES = 1000
+
+
+@rest_call('GET', '/changes', Schema({
+    Optional('since'): And(Use(int), lambda n: n >= 0),
+    Optional('limit'): And(Use(int), lambda n: 0 < n <= MAX_CHANGES),
+}))
+def list_changes(since=0, limit=MAX_CHANGES):
+    """List the changes to the inventory after revision ``since``.
+
+    See `hil.changes`. Up to ``limit`` changes are returned, oldest first.
+    ``next`` is the revision to pass as ``since`` to get the changes after
+    these, and ``latest`` is the latest revision; once ``next`` reaches
+    it, the caller is up to date.
+
+    Example: '{"changes": [{"revision": 7, "type": "node",
+                            "label": "node-1", "op": "updated",
+                            "changed_at": "2018-04-07T19:10:35.243712"}],
+               "next": 7,
+               "latest": 9}'
+    """
+    get_auth_backend().require_admin()
+    result = [{'revision': change.id,
+               'type': change.type,
+               'label': change.label,
+               'op': change.op,
+               'changed_at': change.changed_at.isoformat()}
+              for change in changes.changes_since(since, limit)]
+    return json.dumps({
+        'changes': result,
+        'next': result[-1]['revision'] if result else since,
+        'latest': changes.latest_revision(),
+    })
+
+
 # Console code #
 ################
-@rest_call('GET', '/node/<nodename>/console', Schema({'nodename': basestring}))
-def show_console(nodename):
-    """Show the contents of the console log."""
+
+# The longest (in seconds) show_console will wait for new output in follow
+# mode, and how often it checks for it:
+MAX_CONSOLE_FOLLOW = 60
+CONSOLE_FOLLOW_INTERVAL = 0.5
+
+
+@rest_call('GET', '/node/<nodename>/console', Schema({
+    'nodename': basestring,
+    Optional('offset'): And(Use(int), lambda n: n >= 0),
+    Optional('tail'): And(Use(int), lambda n: n >= 0),
+    Optional('max_bytes'): And(Use(int), lambda n: n > 0),
+    Optional('follow'): And(Use(int), lambda n: 0 <= n <= MAX_CONSOLE_FOLLOW),
+}))
+def show_console(nodename, offset=None, tail=None, max_bytes=None,
+                 follow=None):
+    """Show the contents of the console log.
+
+    By default the whole log is returned. ``offset`` starts at the given
+    byte offset instead, ``tail`` returns only the last ``tail`` bytes, and
+    ``max_bytes`` limits the size of the response. The log is streamed to
+    the client rather than read into memory.
+
+    The response includes an ``X-Console-Offset`` header (if the driver
+    supports it), which is the offset to pass next time to get only newer
+    output. If ``follow`` is given along with ``offset``, and there is no
+    output past ``offset`` yet, we wait up to ``follow`` seconds for some to
+    arrive before responding, so clients can long-poll for new output.
+    """
+    if offset is not None and tail is not None:
+        raise errors.BadArgumentError(
+            'At most one of offset and tail may be specified.')
     node = get_or_404(model.Node, nodename)
-    log = node.obm.get_console()
-    if log is None:
-        raise errors.NotFoundError(
-            'The console log for %s does not exist.' % nodename)
-    return log
+
+    deadline = time.time() + (follow or 0)
+    while True:
+        log = node.obm.get_console(offset=offset,
+                                   tail=tail,
+                                   max_bytes=max_bytes)
+        if log is None:
+            raise errors.NotFoundError(
+                'The console log for %s does not exist.' % nodename)
+        chunks, next_offset = log
+        if offset is None or next_offset != offset or \
+                time.time() >= deadline:
+            break
+        time.sleep(CONSOLE_FOLLOW_INTERVAL)
+
+    response = Response(chunks, mimetype='text/plain')
+    if next_offset is not None:
+        response.headers['X-Console-Offset'] = str(next_offset)
+    return response
 
 
 @rest_call('PUT', '/node/<nodename>/console', Schema({'nodename': basestring}))
@@ -1311,6 +1563,7 @@ def start_console(nodename):
     """Start logging output from the console."""
     node = get_or_404(model.Node, nodename)
     node.obm.start_console()
+    db.session.commit()
 
 
 @rest_call('DELETE', '/node/<nodename>/console', Schema({
@@ -1321,6 +1574,7 @@ def stop_console(nodename):
     node = get_or_404(model.Node, nodename)
     node.obm.stop_console()
     node.obm.delete_console()
+    db.session.commit()
 
 
 # Helper functions #
@@ -1455,13 +1709,32 @@ def _maintain(project, node, node_label):
                     ' failed with response: %s', response.text)
 
 
+def _action_priority(node):
+    """Return the priority of a networking action on a nic of `node`.
+
+    See `model.NetworkingAction.priority`.
+    """
+    if get_auth_backend().have_admin():
+        return model.NetworkingAction.ADMIN_PRIORITY
+    if node.project is not None and \
+            cfg.has_option('maintenance', 'maintenance_project') and \
+            node.project.label == cfg.get('maintenance',
+                                          'maintenance_project'):
+        return model.NetworkingAction.MAINTENANCE_PRIORITY
+    return model.NetworkingAction.NORMAL_PRIORITY
+
+
+# The most pending networking actions a nic may have queued:
+MAX_QUEUED_ACTIONS = 8
+
+
 def check_pending_action(nic):
-    """Raises an error if the nic has a pending action
-    Otherwise deletes the completed action"""
-    if nic.current_action:
-        if nic.current_action.status == 'PENDING':
-            raise errors.BlockedError(
-                "A networking operation is already active on the nic.")
-        else:
-            db.session.delete(nic.current_action)
-    return
+    """Raises an error if the nic's queue of pending actions is full
+
+    Otherwise archives the nic's completed actions"""
+    if len(nic.pending_actions()) >= MAX_QUEUED_ACTIONS:
+        raise errors.BlockedError(
+            "Too many networking operations are pending on the nic.")
+    for action in list(nic.actions):
+        if action.status != 'PENDING':
+            deferred.archive_action(action)
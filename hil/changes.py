@@ -0,0 +1,152 @@
+"""A log of the changes to HIL's inventory, for consumers to sync from.
+
+Whenever a transaction which changes a node, network, project, switch or
+headnode commits, a `model.Change` is written for each of them, in the same
+transaction. The id of a change is its revision: revisions increase with
+each change, and are visible in that order, so a consumer which has seen
+the changes up to some revision only needs to ask for those after it (see
+`hil.api.list_changes`), rather than listing everything again.
+
+Changes to things which belong to one of those (a node's nics and metadata,
+a switch's ports, attachments of networks to nics, ...) are recorded as the
+owner being updated. A change only records what was changed, not how;
+consumers look that up with the usual API calls.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.interfaces import ONETOMANY
+
+from hil import model
+from hil.model import db
+
+# The key of the PostgreSQL advisory lock which keeps revisions in order:
+LOCK_KEY = 0x48494c
+
+# The things whose changes are recorded under their own labels:
+_TOP_LEVEL = (model.Node, model.Network, model.Project, model.Switch,
+              model.Headnode)
+
+# The things whose changes are recorded (see `_owners`):
+_TRACKED = _TOP_LEVEL + (model.Nic, model.Metadata, model.Port, model.Hnic,
+                         model.NetworkAttachment)
+
+# Attributes which the network daemon keeps up to date, and which aren't
+# worth telling consumers about:
+_IGNORED = frozenset(['breaker_failures', 'breaker_open_until'])
+
+
+def _owners(obj):
+    """Return the ``(type, label)`` of each thing `obj` belongs to.
+
+    `obj` must be one of `_TRACKED`.
+    """
+    if isinstance(obj, model.Node):
+        return [('node', obj.label)]
+    if isinstance(obj, model.Network):
+        return [('network', obj.label)]
+    if isinstance(obj, model.Project):
+        return [('project', obj.label)]
+    if isinstance(obj, model.Switch):
+        return [('switch', obj.label)]
+    if isinstance(obj, model.Headnode):
+        return [('headnode', obj.label)]
+    if isinstance(obj, (model.Nic, model.Metadata)):
+        return [('node', obj.owner.label)]
+    if isinstance(obj, model.Port):
+        return [('switch', obj.owner.label)]
+    if isinstance(obj, model.Hnic):
+        return [('headnode', obj.owner.label)]
+    return [('node', obj.nic.owner.label),
+            ('network', obj.network.label)]
+
+
+def _modified(obj):
+    """Return whether `obj` (which is in ``session.dirty``) has changed.
+
+    Its columns and the things it refers to count, but not the lists of
+    things which refer to it, so that e.g. queueing a networking action on
+    a nic doesn't count as a change to the nic.
+    """
+    state = inspect(obj)
+    names = [attr.key for attr in state.mapper.column_attrs] + \
+        [rel.key for rel in state.mapper.relationships
+         if rel.direction != ONETOMANY]
+    return any(state.attrs[name].history.has_changes()
+               for name in names if name not in _IGNORED)
+
+
+def _note(session, obj, op):
+    """Note that `obj` was created, updated or deleted (`op`).
+
+    Things which own `obj` count as updated.
+    """
+    if not isinstance(obj, _TOP_LEVEL):
+        op = 'updated'
+    pending = session.info.setdefault('hil_changes', {})
+    for owner in _owners(obj):
+        # Being created or deleted is the more useful thing to know:
+        if op != 'updated' or owner not in pending:
+            pending[owner] = op
+
+
+@event.listens_for(Session, 'before_flush')
+def _before_flush(session, flush_context, instances):
+    """Note the changes which are about to be flushed."""
+    with session.no_autoflush:
+        for obj in session.new:
+            if isinstance(obj, _TRACKED):
+                _note(session, obj, 'created')
+        for obj in session.dirty:
+            if isinstance(obj, _TRACKED) and _modified(obj):
+                _note(session, obj, 'updated')
+        for obj in session.deleted:
+            if isinstance(obj, _TRACKED):
+                _note(session, obj, 'deleted')
+
+
+@event.listens_for(Session, 'before_commit')
+def _before_commit(session):
+    """Write the noted changes, as part of the transaction."""
+    # The changes are only noted when they are flushed:
+    session.flush()
+    pending = session.info.pop('hil_changes', None)
+    if not pending:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        # Transactions which write changes commit one at a time, so that
+        # the revisions become visible in order. (SQLite only has one
+        # writer at a time anyway.) This must happen on the primary, even
+        # if the session reads from a replica (see `hil.replicas`):
+        session.execute(db.text('SELECT pg_advisory_xact_lock(:key)'),
+                        {'key': LOCK_KEY}, bind=db.engine)
+    now = datetime.utcnow()
+    for (type_, label), op in sorted(pending.items()):
+        session.add(model.Change(changed_at=now,
+                                 type=type_,
+                                 label=label,
+                                 op=op))
+    session.flush()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    """Forget the changes which were rolled back."""
+    session.info.pop('hil_changes', None)
+
+
+def latest_revision():
+    """Return the revision of the latest change, or 0 if there are none."""
+    return db.session.query(db.func.max(model.Change.id)).scalar() or 0
+
+
+def changes_since(revision, limit):
+    """Return up to `limit` of the changes after `revision`, oldest first.
+    """
+    return model.Change.query \
+        .filter(model.Change.id > revision) \
+        .order_by(model.Change.id) \
+        .limit(limit) \
+        .all()
@@ -13,3 +13,12 @@ def networking_action():
 def show_networking_action(status_id):
     """Displays the status of the networking action"""
     print client.node.show_networking_action(status_id)
+
+
+@networking_action.command('wait')
+@click.argument('status_ids', nargs=-1, required=True)
+@click.option('--timeout', type=int,
+              help='Give up after TIMEOUT seconds (default: never)')
+def wait_for_networking_actions(status_ids, timeout):
+    """Wait for networking actions to finish, and display their status"""
+    print client.node.wait_for_actions(list(status_ids), timeout=timeout)
@@ -174,9 +174,26 @@ def node_console():
 
 @node_console.command(name='show', short_help='Show console')
 @click.argument('node')
-def node_show_console(node):
+@click.option('--tail', type=int, help='Show only the last TAIL bytes')
+@click.option('--follow', is_flag=True,
+              help='Keep printing new output as it arrives')
+def node_show_console(node, tail, follow):
     """Display console log for <node>"""
-    print(client.node.show_console(node))
+    if not follow:
+        print(client.node.show_console(node, tail=tail))
+        return
+    output, offset = client.node.read_console(node, tail=tail)
+    while True:
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        if offset is None:
+            # The node's obm doesn't keep a log we can read on from (e.g.
+            # obmd), so we would only print the same output again.
+            raise click.ClickException(
+                "--follow is not supported by this node's obm")
+        output, offset = client.node.read_console(node,
+                                                  offset=offset,
+                                                  follow=30)
 
 
 @node_console.command(name='start', short_help='Start console')
@@ -1,9 +1,15 @@
 """Client support for node related api calls."""
 import json
+import math
+import time
 from hil.client.base import ClientBase, FailedAPICallException
 from hil.client.base import check_reserved_chars
 from hil.errors import BadArgumentError, UnknownSubtypeError
 
+# The longest the server will wait for networking actions to finish, in one
+# call to show_networking_action(s):
+MAX_ACTION_WAIT = 60
+
 
 class Node(ClientBase):
     """Consists of calls to query and manipulate node related
@@ -141,15 +147,46 @@ class Node(ClientBase):
         url = self.object_url('node', node, 'metadata', label)
         return self.check_response(self.httpClient.request('DELETE', url))
 
-    @check_reserved_chars()
-    def show_console(self, node):
-        """Display console log for <node> """
+    @check_reserved_chars(dont_check=['offset', 'tail', 'max_bytes'])
+    def show_console(self, node, offset=None, tail=None, max_bytes=None):
+        """Display console log for <node>
+
+        See `read_console` for the meaning of the optional arguments.
+        """
+        return self.read_console(node, offset=offset, tail=tail,
+                                 max_bytes=max_bytes)[0]
+
+    @check_reserved_chars(dont_check=['offset', 'tail', 'max_bytes',
+                                      'follow'])
+    def read_console(self, node, offset=None, tail=None, max_bytes=None,
+                     follow=None):
+        """Read (part of) the console log for <node>
+
+        <offset> starts reading at that byte offset, <tail> returns only the
+        last <tail> bytes, and <max_bytes> limits the size of the output. If
+        there is no output past <offset> yet, <follow> waits up to that many
+        seconds for some to arrive.
+
+        Returns a pair (output, next_offset), where next_offset is the
+        offset to pass next time to get only newer output (or None, if the
+        obm driver does not support offsets).
+        """
+        params = {}
+        for key, value in [('offset', offset),
+                           ('tail', tail),
+                           ('max_bytes', max_bytes),
+                           ('follow', follow)]:
+            if value is not None:
+                params[key] = value
         url = self.object_url('node', node, 'console')
-        response = self.httpClient.request('GET', url)
+        response = self.httpClient.request('GET', url, params=params or None)
         # we don't call check_response here because we want to return the
         # raw byte stream, rather than converting it to json.
         if 200 <= response.status_code < 300:
-            return response.content
+            next_offset = response.headers.get('X-Console-Offset')
+            if next_offset is not None:
+                next_offset = int(next_offset)
+            return response.content, next_offset
         raise FailedAPICallException(error_type=response.status_code,
                                      message=response.content)
 
@@ -165,7 +202,52 @@ class Node(ClientBase):
         url = self.object_url('node', node, 'console')
         return self.check_response(self.httpClient.request('DELETE', url))
 
-    def show_networking_action(self, status_id):
-        """Returns the status of the networking action"""
+    def show_networking_action(self, status_id, wait=None):
+        """Returns the status of the networking action
+
+        If the action is pending, <wait> waits up to that many seconds (at
+        most 60) for it to finish.
+        """
+        params = None
+        if wait is not None:
+            params = {'wait': wait}
         url = self.object_url('networking_action', status_id)
-        return self.check_response(self.httpClient.request('GET', url))
+        return self.check_response(
+            self.httpClient.request('GET', url, params=params))
+
+    def show_networking_actions(self, status_ids, wait=None):
+        """Returns the status of each of the networking actions <status_ids>
+
+        The result is a dict mapping each status id to what
+        `show_networking_action` gives for it. <wait> waits up to that many
+        seconds (at most 60) for all of the actions to finish.
+        """
+        params = {'status_ids': ','.join(status_ids)}
+        if wait is not None:
+            params['wait'] = wait
+        url = self.object_url('networking_actions')
+        return self.check_response(
+            self.httpClient.request('GET', url, params=params))
+
+    def wait_for_actions(self, status_ids, timeout=None):
+        """Wait for the networking actions <status_ids> to finish
+
+        Waits for up to <timeout> seconds, or for as long as it takes if
+        <timeout> is None, long-polling the server rather than asking it
+        over and over. Returns the status of each of the actions, as
+        `show_networking_actions` does; any which haven't finished by then
+        are still PENDING.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            wait = MAX_ACTION_WAIT
+            if deadline is not None:
+                wait = int(math.ceil(min(wait, deadline - time.time())))
+            statuses = self.show_networking_actions(status_ids,
+                                                    wait=max(wait, 0))
+            if all(status['status'] != 'PENDING'
+                   for status in statuses.values()) or \
+                    (deadline is not None and time.time() >= deadline):
+                return statuses
@@ -1,6 +1,8 @@
 """Implement the hil-admin command."""
-from hil import config, model, deferred, server, migrations, rest
+from hil import config, model, deferred, server, migrations, rest, \
+    network_stats
 from hil.commands import db
+from hil.commands.bulk_power import BulkPower
 from hil.commands.migrate_ipmi_info import MigrateIpmiInfo
 from hil.commands.util import ensure_not_root
 from hil.flaskapp import app
@@ -9,6 +11,7 @@ from flask_script import Manager, Command, Option
 
 import sys
 import logging
+import requests
 from click import IntRange
 manager = Manager(app)
 
@@ -40,14 +43,55 @@ class ServeNetworks(Command):
         else:
             sleep_time = 2
 
+        stats_port = network_stats.get_stats_port()
+        if stats_port is not None:
+            network_stats.serve(stats_port)
+
         while True:
-            # Empty the journal until it's empty; then delay so we don't tight
-            # loop.
+            # Empty the journal until it's empty; then archive old actions,
+            # and delay so we don't tight loop.
             while deferred.apply_networking():
                 pass
+            deferred.archive_actions()
             sleep(sleep_time)
 
 
+class NetworkStats(Command):
+    """Show the state of the networking journal and the network daemon.
+
+    Statistics about switch calls are fetched from the network daemon's stats
+    server, if `stats_port` is set in the [network-daemon] section.
+    """
+
+    # pylint: disable=arguments-differ
+    def run(self):
+        server.init()
+        journal = network_stats.journal_stats()
+        print('Pending actions:     %d' % journal['depth'])
+        if journal['oldest_pending_age'] is not None:
+            print('Oldest pending age:  %.1fs' % journal['oldest_pending_age'])
+
+        port = network_stats.get_stats_port()
+        if port is None:
+            return
+        try:
+            resp = requests.get('http://127.0.0.1:%d/' % port)
+            resp.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            sys.exit("Error: could not reach the network daemon: %s" % e)
+        daemon = resp.json()
+        print('Actions per second:  %.2f' % daemon['actions_per_sec'])
+        if not daemon['switches']:
+            return
+        print('')
+        print('%-20s %-8s %-8s %-10s %-10s %s' %
+              ('switch', 'calls', 'errors', 'p50 (s)', 'p99 (s)', 'type'))
+        for switch in daemon['switches']:
+            print('%-20s %-8d %-8d %-10.3f %-10.3f %s' %
+                  (switch['label'], switch['calls'], switch['errors'],
+                   switch['p50'], switch['p99'], switch['type']))
+
+
 class RunDevelopmentServer(Command):
     """Run a development api server. Don't use this in production.
     Specify the port with -p or --port otherwise defaults to 5000"""
@@ -102,7 +146,9 @@ class CreateAdminUser(Command):
 
 manager.add_command('db', db.command)
 manager.add_command('migrate-ipmi-info', MigrateIpmiInfo())
+manager.add_command('bulk-power', BulkPower())
 manager.add_command('serve-networks', ServeNetworks())
+manager.add_command('network-stats', NetworkStats())
 manager.add_command('run-dev-server', RunDevelopmentServer())
 manager.add_command('create-admin-user', CreateAdminUser())
 
@@ -0,0 +1,100 @@
+"""The ``hil-admin bulk-power`` command.
+
+This powers many obmd nodes at once, using the obmd driver's ``bulk_*``
+functions, rather than making one API call per node.
+"""
+
+import sys
+
+from flask_script import Command, Option
+
+from hil import model, server
+from hil.flaskapp import app
+
+OBMD_API_NAME = 'http://schema.massopencloud.org/haas/v0/obm/obmd'
+
+
+class BulkPower(Command):
+    """Power cycle or power off many nodes with obmd obms at once.
+
+    The nodes are named on the command line, or selected with --project. If
+    --bootdev is given, their boot device is set first.
+    """
+
+    option_list = (
+        Option('operation', choices=['cycle', 'off'],
+               help='Whether to power cycle or power off the nodes'),
+        Option('nodes', nargs='*', help='Labels of the nodes'),
+        Option('--project', dest='project',
+               help='Use all of the nodes in this project'),
+        Option('--bootdev', dest='bootdev',
+               help='Boot device to set first (disk, pxe or none)'),
+        Option('--force', dest='force', action='store_true', default=False,
+               help='Force the power cycle'),
+        Option('--jobs', dest='jobs', type=int, default=None,
+               help='Number of nodes to work on at once'),
+    )
+
+    # pylint: disable=arguments-differ
+    def run(self, operation, nodes, project, bootdev, force, jobs):
+        server.init()
+        with app.app_context():
+            try:
+                failed = bulk_power(operation, nodes, project, bootdev,
+                                    force, jobs)
+            except ValueError as e:
+                sys.exit("Error: %s" % e)
+        if failed:
+            sys.exit("Failed to power %s nodes: %s" %
+                     (operation, ', '.join(sorted(failed))))
+
+
+def bulk_power(operation, labels, project=None, bootdev=None, force=False,
+               jobs=None):
+    """Power cycle (``operation='cycle'``) or power off (``'off'``) nodes.
+
+    The nodes are those named by ``labels``, plus those in ``project``; they
+    must all have obmd obms. If ``bootdev`` is given, the boot device of the
+    nodes is set first, and the nodes for which that fails are left alone.
+    New node tokens are committed.
+
+    Returns a dictionary mapping the labels of the nodes for which the
+    operation failed to the corresponding OBMError. Raises a ValueError if
+    the nodes can't be found, or don't have obmd obms. This must be run
+    inside of an app context.
+    """
+    nodes = []
+    if labels:
+        nodes = model.Node.query.filter(model.Node.label.in_(labels)).all()
+        missing = set(labels) - set(node.label for node in nodes)
+        if missing:
+            raise ValueError('No such nodes: %s' % ', '.join(sorted(missing)))
+    if project is not None:
+        project = model.Project.query.filter_by(label=project).first()
+        if project is None:
+            raise ValueError('No such project')
+        nodes += [node for node in project.nodes if node not in nodes]
+    if not nodes:
+        raise ValueError('No nodes given')
+    other = [node.label for node in nodes if node.obm.type != OBMD_API_NAME]
+    if other:
+        raise ValueError('Nodes without obmd obms: %s' %
+                         ', '.join(sorted(other)))
+
+    # The nodes' obms are loaded, so the extension is too:
+    from hil.ext.obm import obmd
+    if bootdev is not None and bootdev not in obmd.Obmd.valid_bootdevices:
+        raise ValueError('Invalid boot device')
+
+    failures = {}
+    try:
+        if bootdev is not None:
+            failures = obmd.bulk_set_bootdev(nodes, bootdev, jobs)
+            nodes = [node for node in nodes if node.label not in failures]
+        if operation == 'cycle':
+            failures.update(obmd.bulk_power_cycle(nodes, force, jobs))
+        else:
+            failures.update(obmd.bulk_power_off(nodes, jobs))
+    finally:
+        model.db.session.commit()
+    return failures
@@ -5,8 +5,10 @@ This is part of our obmd migration strategy; see issue #928.
 
 import sys
 import json
+from multiprocessing.pool import ThreadPool
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from flask_script import Command, Option
 
@@ -23,6 +25,8 @@ class MigrateIpmiInfo(Command):
                help='Base url for the obmd api'),
         Option('--obmd-admin-token', dest='obmd_admin_token',
                help='Admin token for obmd'),
+        Option('--jobs', dest='jobs', type=int, default=16,
+               help='Number of nodes to upload to obmd at once'),
     )
 
     # the correct arguments to this are a function of the available options;
@@ -30,11 +34,17 @@ class MigrateIpmiInfo(Command):
     # arguments.
     #
     # pylint: disable=arguments-differ
-    def run(self, obmd_base_url, obmd_admin_token):
+    def run(self, obmd_base_url, obmd_admin_token, jobs):
         server.init()
         with app.app_context():
             info = db_extract_ipmi_info()
-            obmd_upload_ipmi_info(obmd_base_url, obmd_admin_token, info)
+            failed = obmd_upload_ipmi_info(obmd_base_url,
+                                           obmd_admin_token,
+                                           info,
+                                           jobs=jobs)
+            if failed:
+                sys.exit("Failed to upload ipmi info for nodes: %s" %
+                         ', '.join(sorted(failed)))
             db_add_obmd_info(obmd_base_url, obmd_admin_token)
 
 
@@ -91,7 +101,7 @@ def db_extract_ipmi_info():
     return info
 
 
-def obmd_upload_ipmi_info(obmd_base_url, obmd_admin_token, info):
+def obmd_upload_ipmi_info(obmd_base_url, obmd_admin_token, info, jobs=16):
     """Upload nodes' info to obmd.
 
     `info` should be a dictionary of the form returned by
@@ -102,19 +112,43 @@ def obmd_upload_ipmi_info(obmd_base_url, obmd_admin_token, info):
 
     `obmd_admin_token` is the admin token to use when authenticating against
     obmd.
+
+    Up to `jobs` nodes are uploaded at once, over a shared pool of
+    keep-alive connections. Returns a list of the labels of the nodes whose
+    upload failed.
     """
     sess = requests.Session()
     sess.auth = ('admin', obmd_admin_token)
-
-    for key, val in info.items():
-        sess.put(obmd_base_url + '/node/' + key, data=json.dumps({
-            'type': 'ipmi',
-            'info': {
-                'addr': val['host'],
-                'user': val['user'],
-                'pass': val['password'],
-            },
-        }))
+    adapter = HTTPAdapter(pool_connections=jobs, pool_maxsize=jobs)
+    sess.mount('http://', adapter)
+    sess.mount('https://', adapter)
+
+    def upload(item):
+        """Upload one node's info, returning whether it succeeded."""
+        key, val = item
+        try:
+            resp = sess.put(obmd_base_url + '/node/' + key, data=json.dumps({
+                'type': 'ipmi',
+                'info': {
+                    'addr': val['host'],
+                    'user': val['user'],
+                    'pass': val['password'],
+                },
+            }))
+        except requests.exceptions.RequestException:
+            return False
+        return 200 <= resp.status_code < 300
+
+    items = info.items()
+    if not items:
+        return []
+    pool = ThreadPool(max(1, min(jobs, len(items))))
+    try:
+        results = pool.map(upload, items)
+    finally:
+        pool.close()
+        pool.join()
+    return [key for (key, _), ok in zip(items, results) if not ok]
 
 
 def db_add_obmd_info(obmd_base_url, obmd_admin_token):
@@ -0,0 +1,155 @@
+"""Notifications that networking actions have finished.
+
+The network daemon calls `notify` for each action it finishes, and API calls
+which wait for actions to finish (see `hil.api.show_networking_actions`) use
+a `Listener`. On PostgreSQL these are ``NOTIFY`` and ``LISTEN``: the
+notification is sent when the daemon commits, and wakes up the waiting API
+calls straight away. Each process listens on a single connection of its own,
+outside of the connection pool, and a thread hands the notifications out to
+the waiting listeners; that way, waiting requests don't tie up pooled
+connections. Other databases can't send notifications between processes, so
+there the listeners check back every `POLL_INTERVAL` seconds instead.
+"""
+
+import logging
+import select
+import threading
+import time
+
+from hil.model import db
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'hil_networking_action'
+POLL_INTERVAL = 0.5
+
+
+def _have_notifications():
+    """Return whether the database supports notifications."""
+    return db.engine.dialect.name == 'postgresql'
+
+
+def notify(action):
+    """Let the listeners know that `action` has finished.
+
+    The notification is sent when the session commits (and not at all if it
+    is rolled back).
+    """
+    if _have_notifications():
+        db.session.execute(db.text('SELECT pg_notify(:channel, :uuid)'),
+                           {'channel': CHANNEL, 'uuid': action.uuid})
+
+
+class _Dispatcher(object):
+    """Hands out the notifications received on `connection` to listeners.
+
+    `connection` is a psycopg2 connection which is listening on `CHANNEL`.
+    Once `start`ed, a thread reads the notifications, and adds the uuids of
+    the actions which finished to the ``finished`` set of each registered
+    `Listener`, waking them up. If the connection fails, ``failed`` is set,
+    and the listeners fall back to polling.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.condition = threading.Condition()
+        self.listeners = set()
+        self.failed = False
+
+    def start(self):
+        """Start handing out notifications, in a thread of their own."""
+        thread = threading.Thread(target=self.run,
+                                  name='hil-completion-dispatcher')
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        """Hand out notifications until the connection fails."""
+        try:
+            while True:
+                select.select([self.connection], [], [])
+                self.connection.poll()
+                finished = set(notification.payload
+                               for notification in self.connection.notifies)
+                del self.connection.notifies[:]
+                with self.condition:
+                    for listener in self.listeners:
+                        listener.finished |= finished
+                    self.condition.notify_all()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Lost the connection listening for finished '
+                             'networking actions')
+            with self.condition:
+                self.failed = True
+                self.condition.notify_all()
+            try:
+                self.connection.close()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def _get_dispatcher():
+    """Return this process's `_Dispatcher`, (re)starting it if need be."""
+    global _dispatcher  # pylint: disable=global-statement
+    with _dispatcher_lock:
+        if _dispatcher is None or _dispatcher.failed:
+            # LISTEN needs a connection of its own, outside of any
+            # transaction; it stays open for good, so it is taken out of the
+            # pool:
+            connection = db.engine.raw_connection()
+            connection.detach()
+            connection = connection.connection
+            connection.autocommit = True
+            connection.cursor().execute('LISTEN ' + CHANNEL)
+            _dispatcher = _Dispatcher(connection)
+            _dispatcher.start()
+        return _dispatcher
+
+
+class Listener(object):
+    """A context manager which listens for actions finishing.
+
+    Notifications are only received while the listener is open, so callers
+    should open it first, then check whether the actions they are interested
+    in have finished, and only then `wait`.
+    """
+
+    def __init__(self):
+        self.dispatcher = None
+        self.finished = set()
+
+    def __enter__(self):
+        if _have_notifications():
+            self.dispatcher = _get_dispatcher()
+            with self.dispatcher.condition:
+                self.dispatcher.listeners.add(self)
+        return self
+
+    def __exit__(self, *args):
+        if self.dispatcher is not None:
+            with self.dispatcher.condition:
+                self.dispatcher.listeners.discard(self)
+            self.dispatcher = None
+
+    def wait(self, uuids, timeout):
+        """Wait up to `timeout` seconds for one of the actions `uuids`.
+
+        This returns when one of them may have finished; callers should
+        check again, and wait some more if need be.
+        """
+        if self.dispatcher is None or self.dispatcher.failed:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return
+        uuids = set(uuids)
+        deadline = time.time() + timeout
+        with self.dispatcher.condition:
+            while not self.finished & uuids and not self.dispatcher.failed:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+                self.dispatcher.condition.wait(remaining)
+            self.finished -= uuids
@@ -36,6 +36,11 @@ def string_is_db_uri(option):
                Or('postgresql', 'sqlite')).validate(option)
 
 
+def string_is_db_uri_list(option):
+    """Check if a string is a whitespace separated list of valid DB URIs"""
+    return all(string_is_db_uri(uri) for uri in option.split())
+
+
 def string_is_dir(option):
     """Check if a string is a valid directory path"""
     return Use(os.path.isabs).validate(option)
@@ -47,6 +52,41 @@ def string_is_log_level(option):
                                   'critical', 'fatal')).validate(option)
 
 
+def string_is_positive_int(option):
+    """Check if a string is a positive integer"""
+    return option.isdigit() and int(option) > 0
+
+
+def string_is_non_negative_int(option):
+    """Check if a string is a non-negative integer"""
+    return option.isdigit()
+
+
+def string_is_non_negative_float(option):
+    """Check if a string is a non-negative number"""
+    try:
+        return float(option) >= 0
+    except ValueError:
+        return False
+
+
+def string_is_percent(option):
+    """Check if a string is a number between 0 and 100"""
+    return string_is_non_negative_float(option) and float(option) <= 100
+
+
+def string_is_sqlite_journal_mode(option):
+    """Check if a string is a valid SQLite journal mode"""
+    return And(Use(str.lower), Or('delete', 'truncate', 'persist', 'memory',
+                                  'wal', 'off')).validate(option)
+
+
+def string_is_sqlite_synchronous(option):
+    """Check if a string is a valid setting of SQLite's synchronous pragma"""
+    return And(Use(str.lower), Or('off', 'normal', 'full',
+                                  'extra')).validate(option)
+
+
 def string_has_vlans(option):
     """Check if a string is a valid list of VLANs"""
     for r in option.split(","):
@@ -75,6 +115,16 @@ core_schema = {
     },
     'database': {
         'uri': string_is_db_uri,
+        Optional('replicas'): string_is_db_uri_list,
+        Optional('replica_sticky_seconds'): string_is_non_negative_float,
+        Optional('pool_size'): string_is_positive_int,
+        Optional('max_overflow'): string_is_non_negative_int,
+        Optional('pool_timeout'): string_is_positive_int,
+        Optional('pool_recycle'): string_is_positive_int,
+        Optional('pool_pre_ping'): string_is_bool,
+        Optional('sqlite_journal_mode'): string_is_sqlite_journal_mode,
+        Optional('sqlite_busy_timeout_ms'): string_is_non_negative_int,
+        Optional('sqlite_synchronous'): string_is_sqlite_synchronous,
     },
     Optional('devel'): {
         Optional('dry_run'): string_is_bool,
@@ -84,8 +134,25 @@ core_schema = {
         Optional('url'): string_is_web_url,
         Optional('shutdown'): '',
     },
+    Optional('profiling'): {
+        'dir': string_is_dir,
+        Optional('sample_percent'): string_is_percent,
+        Optional('slow_ms'): string_is_positive_int,
+        Optional('keep'): string_is_positive_int,
+    },
     Optional('network-daemon'): {
         Optional('sleep_time'): int,
+        Optional('stats_port'): string_is_positive_int,
+        Optional('lease_time'): string_is_positive_int,
+        Optional('claim_switches'): string_is_positive_int,
+        Optional('max_attempts'): string_is_positive_int,
+        Optional('retry_delay'): string_is_positive_int,
+        Optional('retry_max_delay'): string_is_positive_int,
+        Optional('breaker_failures'): string_is_positive_int,
+        Optional('breaker_open_time'): string_is_positive_int,
+        Optional('retention_hours'): string_is_positive_int,
+        Optional('archive_batch'): string_is_positive_int,
+        Optional('archive_days'): string_is_positive_int,
     },
     'extensions': {
         Optional(str): '',
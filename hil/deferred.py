@@ -1,12 +1,75 @@
-"""Performs deferred networking actions."""
+"""Performs deferred networking actions.
 
-from hil import model
+Several network daemons may run at once. A daemon claims the pending actions
+of a few switches at a time (see `claim_actions`), and only applies the
+actions it has claimed. A claim on a switch is exclusive, so the actions on a
+switch are applied by a single switch session, and those on a nic in order.
+Claims
+last for ``lease_time`` seconds, and are renewed while the daemon works; if
+a daemon dies, its switches are taken over by another daemon once its claims
+run out (so an action may be applied twice, if the daemon died part way
+through it).
+
+A nic may have several pending actions. They are applied together, when the
+first of them comes up: the daemon works out their net result (see
+`coalesce`), and makes it with a single call to the switch (two, if one of
+them is a revert_port).
+
+Rather than strictly oldest first, the journal is worked through in a fair
+order (see `fair_keys`): actions with a higher priority come first, and
+otherwise the projects take turns, so that a project with many actions
+queued doesn't hold up the others.
+
+Actions which fail are tried again, up to ``max_attempts`` times, waiting
+twice as long each time (starting from ``retry_delay`` seconds, up to
+``retry_max_delay``). After ``breaker_failures`` failed calls to a switch in
+a row, the switch's circuit breaker trips: its actions are put off for
+``breaker_open_time`` seconds, after which the next action on the switch is
+tried as a probe (see `model.Switch.breaker_state`).
+
+Calls to switches are also limited by the options in the switch drivers'
+sections of hil.cfg; see `hil.throttling`.
+
+When an action finishes, API calls waiting for it are notified (see
+`hil.completion`). Finished actions are moved out of the journal, to the
+archive, after ``retention_hours`` hours (see `archive_actions`).
+"""
+
+from hil import completion, model, tracing
+from hil.config import cfg
+from hil.throttling import max_in_flight, throttle
 from hil.model import db
-from hil.errors import SwitchError
+from hil.errors import SwitchConnectionError, SwitchError
+from hil.network_stats import stats
+from datetime import datetime, timedelta
+import bisect
 import logging
+import os
+import socket
+import time
+
+import pexpect
 
 logger = logging.getLogger(__name__)
 
+# Defaults for the options in the [network-daemon] section:
+DEFAULT_LEASE_TIME = 60
+DEFAULT_CLAIM_SWITCHES = 10
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 5
+DEFAULT_RETRY_MAX_DELAY = 300
+DEFAULT_BREAKER_FAILURES = 3
+DEFAULT_BREAKER_OPEN_TIME = 60
+DEFAULT_RETENTION_HOURS = 24
+DEFAULT_ARCHIVE_BATCH = 500
+
+# Errors which may go away if the action is tried again: failures to reach the
+# switch, or to hear back from it in time. Other errors the drivers raise
+# (e.g. the switch refusing the change) fail the action straight away.
+TRANSIENT_ERRORS = (SwitchConnectionError, EnvironmentError,
+                    pexpect.ExceptionPexpect)
+DRIVER_ERRORS = (SwitchError,) + TRANSIENT_ERRORS
+
 
 class DaemonSession(object):
     """A daemon session tracks switch sessions during a call to
@@ -19,57 +82,228 @@ class DaemonSession(object):
 
     def __init__(self):
         self.switch_sessions = {}
+        # The trace id of the last action applied to each switch, so that
+        # the disconnect (and saving the config) can be traced too:
+        self.last_traces = {}
 
-    def handle_action(self, action):
-        """apply the networking action ``action``."""
+    def handle_actions(self, actions):
+        """Apply the networking actions ``actions``, together.
 
-        if action.type not in model.NetworkingAction.legal_types:
-            logger.warn('Illegal action type %r from server; ignoring.')
-        elif not action.nic.port:
-            logger.warn('Not modifying NIC %s; NIC is not on a port.',
-                        action.nic.label)
-        else:
-            getattr(self, action.type)(action)
+        ``actions`` are the pending actions on a nic, oldest first; they are
+        coalesced (see `coalesce`), so that the switch is called at most
+        once for the changes they make (plus once for a revert_port, if
+        there is one). They succeed or fail together.
 
-    def modify_port(self, action):
-        """Apply a modify_port action."""
-        session = self.get_session(action.nic.port.owner)
+        If the first action isn't due to be tried yet (e.g. because it
+        failed before), or the circuit breaker of the nic's switch is open,
+        the actions are put off instead.
+        """
+        now = datetime.utcnow()
+        head = actions[0]
+        if head.retry_at is not None and head.retry_at > now:
+            for action in actions:
+                action.retry_at = head.retry_at
+            return
+        port = head.nic.port
+        if port is not None and port.owner.breaker_state() == 'open':
+            for action in actions:
+                action.retry_at = port.owner.breaker_open_until
+            return
+        info = {}
+        if len(actions) > 1:
+            info['coalesced'] = [action.uuid for action in actions[1:]]
+        for action in actions:
+            action.started_at = now
+        tracing.start(head.trace_id or head.uuid, 'networking_action',
+                      started_at=head.queued_at,
+                      uuid=head.uuid,
+                      type=head.type,
+                      **info)
+        if head.queued_at is not None:
+            tracing.add_span('queue_wait', head.queued_at, now)
+        try:
+            self._handle_actions(actions)
+        finally:
+            for action in actions:
+                if action.status != 'PENDING':
+                    action.finished_at = datetime.utcnow()
+                    completion.notify(action)
+                    stats.record_action()
+            # Each of the actions gets a copy of the trace:
+            tracer = tracing.finish()
+            for action in actions:
+                tracer.trace_id = action.trace_id or action.uuid
+                tracer.save()
+
+    def _handle_actions(self, actions):
+        """Do the work of `handle_actions`."""
+        nic = actions[0].nic
+        legal = []
+        for action in actions:
+            if action.type in model.NetworkingAction.legal_types:
+                legal.append(action)
+            else:
+                logger.warn('Illegal action type %r from server; ignoring.',
+                            action.type)
+        if not nic.port:
+            logger.warn('Not modifying NIC %s; NIC is not on a port.',
+                        nic.label)
+            return
+        attachments = list(nic.attachments)
+        reverts = [index for index, action in enumerate(legal)
+                   if action.type == 'revert_port']
+        if reverts:
+            # Nothing before the last revert_port makes any difference:
+            last = reverts[-1] + 1
+            if not self.revert_port(legal[:last], legal):
+                return
+            legal = legal[last:]
+            attachments = []
+        if legal:
+            self.modify_port(legal, attachments)
 
-        if action.new_network is None:
-            network_id = None
-        else:
-            network_id = action.new_network.network_id
+    def modify_port(self, actions, attachments):
+        """Apply the modify_port ``actions``, in one call to the switch.
 
+        ``attachments`` are the nic's `NetworkAttachment`s before the
+        actions.
+        """
+        nic = actions[0].nic
+        switch = nic.port.owner
+        changes = coalesce(dict((attachment.channel, attachment.network)
+                                for attachment in attachments),
+                           actions)
+        network_ids = [(channel, network.network_id if network else None)
+                       for channel, network in changes]
+        context = model.ActionContext(nic.port, attachments)
         try:
-            session.modify_port(action.nic.port.label,
-                                action.channel,
-                                network_id)
-            if action.new_network is None:
-                model.NetworkAttachment.query \
-                    .filter_by(nic=action.nic, channel=action.channel)\
-                    .delete()
-            else:
-                db.session.add(model.NetworkAttachment(
-                    nic=action.nic,
-                    network=action.new_network,
-                    channel=action.channel))
-            action.status = 'DONE'
-        except SwitchError:
-            action.status = 'ERROR'
+            if len(network_ids) == 1:
+                [(channel, network_id)] = network_ids
+                self.call_driver(switch, 'modify_port',
+                                 nic.port.label,
+                                 channel,
+                                 network_id,
+                                 context=context)
+            elif network_ids:
+                self.call_driver(switch, 'modify_port_channels',
+                                 nic.port.label,
+                                 network_ids,
+                                 context=context)
+            changed = set(channel for channel, _ in changes)
+            for attachment in attachments:
+                if attachment.channel in changed:
+                    db.session.delete(attachment)
+            for channel, network in changes:
+                if network is not None:
+                    db.session.add(model.NetworkAttachment(
+                        nic=nic,
+                        network=network,
+                        channel=channel))
+            for action in actions:
+                action.status = 'DONE'
+            if network_ids:
+                self.succeeded(switch)
+        except DRIVER_ERRORS as e:
             logger.error('Modify port failed on port %s of switch %s',
-                         action.nic.port.label, action.nic.port.owner.label)
+                         nic.port.label, switch.label)
+            self.failed(actions, switch, e)
 
-    def revert_port(self, action):
-        """Apply a revert_port action."""
-        session = self.get_session(action.nic.port.owner)
+    def revert_port(self, actions, group):
+        """Apply ``actions``, the last of which is a revert_port.
+
+        Only the revert_port is sent to the switch; the actions before it
+        make no difference. If it fails, all of ``group`` (the actions being
+        applied together) fail with it. Returns whether it succeeded.
+        """
+        nic = actions[0].nic
+        switch = nic.port.owner
         try:
-            session.revert_port(action.nic.port.label)
-            model.NetworkAttachment.query.filter_by(nic=action.nic).delete()
-            action.status = 'DONE'
-        except SwitchError:
-            action.status = 'ERROR'
+            self.call_driver(switch, 'revert_port', nic.port.label)
+            for attachment in nic.attachments:
+                db.session.delete(attachment)
+            for action in actions:
+                action.status = 'DONE'
+            self.succeeded(switch)
+            return True
+        except DRIVER_ERRORS as e:
             logger.error('Revert port failed on port %s of switch %s',
-                         action.nic.port.label, action.nic.port.owner.label)
+                         nic.port.label, switch.label)
+            self.failed(group, switch, e)
+            return False
+
+    @staticmethod
+    def succeeded(switch):
+        """Record that a call to `switch` succeeded; this resets its breaker.
+        """
+        switch.breaker_failures = 0
+        switch.breaker_open_until = None
+
+    def failed(self, actions, switch, error):
+        """Record that `actions` failed on `switch`, with `error`.
+
+        If `error` is one of the `TRANSIENT_ERRORS`, this counts (once)
+        towards tripping the switch's circuit breaker, and the actions are
+        marked to be tried again later, or as ERRORs once one of them has
+        been tried ``max_attempts`` times. Otherwise, trying again won't
+        help, so they are marked as ERRORs straight away.
+        """
+        now = datetime.utcnow()
+        for action in actions:
+            action.attempts += 1
+        if not isinstance(error, TRANSIENT_ERRORS):
+            for action in actions:
+                action.status = 'ERROR'
+            return
+
+        if not isinstance(error, SwitchError):
+            # We may have lost the connection; make a new one next time.
+            self.switch_sessions.pop(switch.label, None)
+
+        switch.breaker_failures += 1
+        if switch.breaker_failures >= _get_option('breaker_failures',
+                                                  DEFAULT_BREAKER_FAILURES):
+            switch.breaker_open_until = now + timedelta(
+                seconds=_get_option('breaker_open_time',
+                                    DEFAULT_BREAKER_OPEN_TIME))
+            logger.warn('Circuit breaker of switch %s is open until %s, '
+                        'after %d failures in a row', switch.label,
+                        switch.breaker_open_until, switch.breaker_failures)
+
+        attempts = max(action.attempts for action in actions)
+        if attempts >= _get_option('max_attempts', DEFAULT_MAX_ATTEMPTS):
+            for action in actions:
+                action.status = 'ERROR'
+            return
+        delay = min(_get_option('retry_delay', DEFAULT_RETRY_DELAY) *
+                    2 ** (attempts - 1),
+                    _get_option('retry_max_delay', DEFAULT_RETRY_MAX_DELAY))
+        retry_at = max(now + timedelta(seconds=delay),
+                       switch.breaker_open_until or now)
+        for action in actions:
+            action.retry_at = retry_at
+            logger.info('Trying action %s again at %s (attempt %d failed)',
+                        action.uuid, retry_at, action.attempts)
+
+    def call_driver(self, switch, method, *args, **kwargs):
+        """Call ``method(*args, **kwargs)`` on the session for `switch`.
+
+        The time the call takes is recorded in `hil.network_stats.stats`,
+        and as a span in the current trace. The call is counted against the
+        switch's rate limits (see `hil.throttling`).
+        """
+        throttle.take(switch.label, type(switch).__module__)
+        session = self.get_session(switch)
+        tracer = tracing.current()
+        if tracer is not None:
+            self.last_traces[switch.label] = tracer.trace_id
+        start = time.time()
+        ok = False
+        try:
+            with tracing.span(method, switch=switch.label):
+                getattr(session, method)(*args, **kwargs)
+            ok = True
+        finally:
+            stats.record_call(switch, time.time() - start, ok)
 
     def get_session(self, switch):
         """Get a session for the switch.
@@ -77,22 +311,445 @@ class DaemonSession(object):
         If we don't already have one, create a new one and cache it. Otherwise,
         return the cached session.
         """
-        if switch.label not in self.switch_sessions:
-            self.switch_sessions[switch.label] = switch.session()
+        cached = switch.label in self.switch_sessions
+        with tracing.span('session', switch=switch.label, cached=cached):
+            if not cached:
+                self.switch_sessions[switch.label] = switch.session()
         return self.switch_sessions[switch.label]
 
     def close(self):
-        """Shut down all of the open switch sessions."""
-        for session in self.switch_sessions.values():
-            session.disconnect()
+        """Shut down all of the open switch sessions.
+
+        Each disconnect (which may include saving the switch's config) is
+        recorded in the trace of the last action applied to the switch; the
+        caller is responsible for committing.
+        """
+        for label, session in self.switch_sessions.items():
+            trace_id = self.last_traces.get(label)
+            if trace_id is None:
+                session.disconnect()
+                continue
+            tracing.start(trace_id, 'disconnect', switch=label)
+            try:
+                session.disconnect()
+            finally:
+                tracing.finish().save()
         self.switch_sessions = {}
+        self.last_traces = {}
+
+
+def coalesce(networks, actions):
+    """Return the changes which together make the same difference as `actions`.
+
+    `networks` is a dict mapping the nic's channels to the `Network`s on
+    them before the actions, and `actions` are the actions, oldest first.
+    The result is a list of ``(channel, network)`` pairs, each moving a
+    channel to a `Network` (or detaching it, if network is None), as
+    arguments to `model.SwitchSession.modify_port`. Only the net result is
+    kept: attaching and then detaching a channel cancel out, and only the
+    last of several changes to a channel is made.
+
+    Detaches come first, then attaches; trunked channels are detached
+    before the native one, and attached after it, so that the port always
+    has a native network while it has trunked ones.
+    """
+    before = dict(networks)
+    after = dict(networks)
+    for action in actions:
+        action.apply_to(after)
+
+    def _native_last(channel):
+        """Sort key putting the native channel after the others."""
+        return (channel == 'vlan/native', channel)
+
+    def _native_first(channel):
+        """Sort key putting the native channel before the others."""
+        return (channel != 'vlan/native', channel)
+
+    detached = sorted((channel for channel in before if channel not in after),
+                      key=_native_last)
+    attached = sorted((channel for channel in after
+                       if before.get(channel) != after[channel]),
+                      key=_native_first)
+    return [(channel, None) for channel in detached] + \
+        [(channel, after[channel]) for channel in attached]
+
+
+def worker_id():
+    """Return the name this process claims networking actions under."""
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+def _get_option(name, default):
+    """Return the integer option `name` of [network-daemon], or `default`."""
+    if cfg.has_option('network-daemon', name):
+        return cfg.getint('network-daemon', name)
+    return default
 
 
-def apply_networking():
+def _taken_switches(worker, now, switch_id=None):
+    """Return a query for the switches another daemon has a live claim on.
+
+    That is, switches with an action claimed by a daemon other than
+    `worker` whose claim hasn't run out at `now`. Claims on actions which
+    are done still count, so that a switch stays with the same daemon while
+    it keeps working. If `switch_id` is given, only that switch is looked
+    at.
+
+    The query uses its own aliases of the tables, so that it can be used as
+    a subquery of a query (or update) on those tables.
+    """
+    action = db.aliased(model.NetworkingAction)
+    nic = db.aliased(model.Nic)
+    port = db.aliased(model.Port)
+    query = db.session.query(port.owner_id) \
+        .join(nic, nic.port_id == port.id) \
+        .join(action, action.nic_id == nic.id) \
+        .filter(action.claimed_by != worker, action.claimed_until >= now)
+    if switch_id is not None:
+        query = query.filter(port.owner_id == switch_id)
+    return query
+
+
+def _due(now):
+    """Return a criterion for the actions which may be tried at `now`."""
+    return db.or_(model.NetworkingAction.retry_at.is_(None),
+                  model.NetworkingAction.retry_at <= now)
+
+
+def _lease_end(now):
+    """Return when a claim made (or renewed) at `now` runs out."""
+    return now + timedelta(seconds=_get_option('lease_time',
+                                               DEFAULT_LEASE_TIME))
+
+
+def fair_keys(rows):
+    """Return where each of the actions `rows` comes in the fair order.
+
+    `rows` are tuples ``(action id, priority, project id, nic id)``, where
+    the project is that of the nic's node (None if it has none). Returns a
+    dict mapping each action id to a key; the actions are applied in order
+    of these keys. Actions with a higher priority come first; among those of
+    the same priority, each project's oldest action comes first, then each
+    project's second oldest, and so on, oldest first within each round. An
+    action never comes before an older one on the same nic.
+    """
+    rounds = {}
+    last = {}
+    keys = {}
+    for action_id, priority, project_id, nic_id in sorted(rows):
+        group = (priority, project_id)
+        rounds[group] = rounds.get(group, -1) + 1
+        key = (-priority, rounds[group], action_id)
+        if nic_id in last and key < last[nic_id]:
+            key = last[nic_id][:2] + (action_id,)
+        keys[action_id] = last[nic_id] = key
+    return keys
+
+
+def _queue_rows():
+    """Return a query for the pending actions, as rows for `fair_keys`.
+
+    Columns may be added to the end of the rows, with ``add_columns``.
+    """
+    action = model.NetworkingAction
+    return db.session.query(action.id, action.priority,
+                            model.Node.project_id, action.nic_id) \
+        .join(model.Nic, action.nic_id == model.Nic.id) \
+        .join(model.Node, model.Nic.owner_id == model.Node.id) \
+        .filter(action.status == 'PENDING')
+
+
+def queue_position(action):
+    """Return the place of `action` in the queue of pending actions.
+
+    This is 1 if it is the next action to be applied (in the fair order;
+    see `fair_keys`), and None if it isn't pending.
+    """
+    return queue_positions([action])[action.id]
+
+
+def queue_positions(actions):
+    """Return the places of `actions` in the queue of pending actions.
+
+    Returns a dict mapping the ids of the actions to their places, as given
+    by `queue_position`.
+    """
+    positions = dict((action.id, None) for action in actions)
+    pending = [action for action in actions if action.status == 'PENDING']
+    if pending:
+        keys = fair_keys(_queue_rows().all())
+        queue = sorted(keys.itervalues())
+        for action in pending:
+            positions[action.id] = 1 + bisect.bisect_left(queue,
+                                                          keys[action.id])
+    return positions
+
+
+def _lock_rows(query, dialect=None):
+    """Lock the rows `query` selects, skipping those others have locked.
+
+    ``SKIP LOCKED`` is new in PostgreSQL 9.5; on older servers, the query
+    waits for the rows others have locked instead, which is slower, but
+    still safe, since the callers check the rows again once they have them.
+    `dialect` defaults to that of the database.
+    """
+    if dialect is None:
+        dialect = db.engine.dialect
+    if dialect.name == 'postgresql' and \
+            dialect.server_version_info < (9, 5):
+        return query.with_for_update()
+    return query.with_for_update(skip_locked=True)
+
+
+def claim_actions(worker):
+    """Claim pending actions for the daemon named `worker`.
+
+    The daemon is given all of the pending actions of up to
+    ``claim_switches`` switches which have an action due to be tried, and
+    which no other daemon has a live claim on; the switches whose first
+    action comes first in the fair order (see `fair_keys`) are chosen.
+    Switches whose type is at its ``max_in_flight`` limit (see
+    `hil.throttling`) are left alone. Returns the number of switches
+    claimed; the caller must commit.
+
+    The switches' rows are locked while claiming (``FOR UPDATE SKIP
+    LOCKED``, see `_lock_rows`), so concurrent daemons claim different
+    switches. Databases without row locks (SQLite) rely on the check that
+    the switch is free being part of the same statement as the claim.
+    """
+    action = model.NetworkingAction
+    now = datetime.utcnow()
+    rows = _queue_rows() \
+        .add_columns(model.Port.owner_id) \
+        .join(model.Port, model.Nic.port_id == model.Port.id) \
+        .filter(_due(now),
+                ~model.Port.owner_id.in_(_taken_switches(worker, now))) \
+        .all()
+    keys = fair_keys([row[:4] for row in rows])
+    first = {}
+    for row in rows:
+        key, switch_id = keys[row[0]], row[4]
+        if switch_id not in first or key < first[switch_id]:
+            first[switch_id] = key
+    candidates = sorted(first, key=first.get)[
+        :_get_option('claim_switches', DEFAULT_CLAIM_SWITCHES)]
+    if not candidates:
+        return 0
+    switch_ids = _lock_rows(db.session.query(model.Switch.id)
+                            .filter(model.Switch.id.in_(candidates))) \
+        .all()
+
+    claimed = 0
+    for switch_id in sorted((s for (s,) in switch_ids), key=first.get):
+        switch = model.Switch.query.get(switch_id)
+        limit = max_in_flight(type(switch).__module__)
+        if limit is not None and _busy_switches(switch, now) >= limit:
+            continue
+        nics = db.session.query(model.Nic.id) \
+            .join(model.Port, model.Nic.port_id == model.Port.id) \
+            .filter(model.Port.owner_id == switch_id)
+        taken = _taken_switches(worker, now, switch_id)
+        count = action.query \
+            .filter(action.status == 'PENDING',
+                    action.nic_id.in_(nics),
+                    ~taken.exists()) \
+            .update({'claimed_by': worker, 'claimed_until': _lease_end(now)},
+                    synchronize_session=False)
+        if count:
+            claimed += 1
+    return claimed
+
+
+def _busy_switches(switch, now):
+    """Return the number of other switches of `switch`'s type in use.
+
+    That is, the switches of the same type with pending actions which a
+    daemon has a live claim on.
+    """
+    action = model.NetworkingAction
+    return db.session.query(model.Port.owner_id) \
+        .join(model.Switch, model.Switch.id == model.Port.owner_id) \
+        .join(model.Nic, model.Nic.port_id == model.Port.id) \
+        .join(action, action.nic_id == model.Nic.id) \
+        .filter(model.Switch.type == switch.type,
+                model.Switch.id != switch.id,
+                action.status == 'PENDING',
+                action.claimed_until >= now) \
+        .distinct().count()
+
+
+def _renew_claims(worker):
+    """Extend the claims of `worker`; returns when they now run out.
+
+    The claims on pending actions are renewed even if they have run out,
+    as long as no other daemon has taken the actions over. The caller must
+    commit.
+    """
+    action = model.NetworkingAction
+    now = datetime.utcnow()
+    action.query \
+        .filter(action.claimed_by == worker,
+                db.or_(action.status == 'PENDING',
+                       action.claimed_until >= now)) \
+        .update({'claimed_until': _lease_end(now)},
+                synchronize_session=False)
+    return _lease_end(now)
+
+
+def _claimed_actions(worker):
+    """Return the due actions `worker` has claimed, in the fair order.
+
+    Each is given as a tuple ``(action id, nic id, switch label, driver)``,
+    where driver is the name of the module of the switch's driver.
+    """
+    action = model.NetworkingAction
+    drivers = model.Switch.__mapper__.polymorphic_map
+    rows = _queue_rows() \
+        .add_columns(model.Switch.label, model.Switch.type) \
+        .join(model.Port, model.Nic.port_id == model.Port.id) \
+        .join(model.Switch, model.Switch.id == model.Port.owner_id) \
+        .filter(action.claimed_by == worker,
+                _due(datetime.utcnow())) \
+        .all()
+    keys = fair_keys([row[:4] for row in rows])
+    rows.sort(key=lambda row: keys[row[0]])
+    return [(action_id, nic_id, label, drivers[switch_type].class_.__module__)
+            for action_id, _, _, nic_id, label, switch_type in rows]
+
+
+def _schedule(pending):
+    """Choose which of the actions `pending` to apply next.
+
+    `pending` is a list of actions, as returned by `_claimed_actions`. The
+    first action on each nic is a candidate, as long as its switch's rate
+    limits allow a call. Returns the index of the first candidate and None,
+    or, if no action may be applied now, None and the number of seconds
+    until one may be.
+    """
+    seen = set()
+    waits = {}
+    for index, (_, nic_id, label, driver) in enumerate(pending):
+        if nic_id in seen:
+            continue
+        seen.add(nic_id)
+        if label not in waits:
+            waits[label] = throttle.wait_time(label, driver)
+        if waits[label] <= 0:
+            return index, None
+    return None, min(waits.values())
+
+
+def _load_actions(nic_id, worker):
+    """Return the actions still pending for `worker` on the nic `nic_id`.
+
+    The actions are oldest first. Everything needed to apply them (the nic,
+    its port, switch and attachments, and the new networks) is loaded by
+    the same query.
+    """
+    nic = db.joinedload(model.NetworkingAction.nic)
+    return model.NetworkingAction.query \
+        .options(nic.joinedload(model.Nic.port)
+                 .joinedload(model.Port.owner),
+                 nic.joinedload(model.Nic.attachments)
+                 .joinedload(model.NetworkAttachment.network),
+                 db.joinedload(model.NetworkingAction.new_network)) \
+        .filter_by(nic_id=nic_id, status='PENDING', claimed_by=worker) \
+        .order_by(model.NetworkingAction.id) \
+        .all()
+
+
+def archive_action(action):
+    """Move the finished `action` from the journal to the archive.
+
+    The action's trace is kept, until the archived action is deleted (see
+    `archive_actions`). The caller must commit.
+    """
+    node = action.nic.owner
+    db.session.add(model.ArchivedNetworkingAction(
+        uuid=action.uuid,
+        status=action.status,
+        type=action.type,
+        channel=action.channel,
+        queued_at=action.queued_at,
+        finished_at=action.finished_at,
+        node=node.label,
+        nic=action.nic.label,
+        project=node.project.label if node.project is not None else None,
+        new_network=(action.new_network.label
+                     if action.new_network is not None else None),
+        trace_id=action.trace_id or action.uuid))
+    db.session.delete(action)
+
+
+def archive_actions():
+    """Archive a batch of the actions which finished a while ago, and commit.
+
+    Up to ``archive_batch`` actions which finished more than
+    ``retention_hours`` hours ago are moved to the archive. If
+    ``archive_days`` is set, up to ``archive_batch`` archived actions which
+    finished more than that many days ago are deleted as well, along with
+    their traces. Actions
+    which predate the timing of actions count as long finished. Returns the
+    number of actions archived.
+
+    The network daemon calls this when it has nothing else to do.
+    """
+    action = model.NetworkingAction
+    now = datetime.utcnow()
+    batch = _get_option('archive_batch', DEFAULT_ARCHIVE_BATCH)
+    cutoff = now - timedelta(hours=_get_option('retention_hours',
+                                               DEFAULT_RETENTION_HOURS))
+    # Lock the rows first, so that concurrent daemons archive different
+    # actions (or, before PostgreSQL 9.5, wait for each other; rows another
+    # daemon archived meanwhile are then gone, and not selected below):
+    ids = [action_id for (action_id,) in _lock_rows(
+        db.session.query(action.id)
+        .filter(action.status != 'PENDING',
+                db.or_(action.finished_at.is_(None),
+                       action.finished_at < cutoff))
+        .order_by(action.id)
+        .limit(batch))]
+    actions = []
+    if ids:
+        nic = db.joinedload(action.nic)
+        actions = action.query \
+            .options(nic.joinedload(model.Nic.owner)
+                     .joinedload(model.Node.project),
+                     db.joinedload(action.new_network)) \
+            .filter(action.id.in_(ids)) \
+            .all()
+    for old_action in actions:
+        archive_action(old_action)
+
+    if cfg.has_option('network-daemon', 'archive_days'):
+        archived = model.ArchivedNetworkingAction
+        cutoff = now - timedelta(days=_get_option('archive_days', None))
+        expired = db.session.query(archived.id, archived.trace_id) \
+            .filter(db.or_(archived.finished_at.is_(None),
+                           archived.finished_at < cutoff)) \
+            .limit(batch) \
+            .all()
+        for trace_id in set(trace_id for (_, trace_id) in expired):
+            if trace_id is not None:
+                tracing.delete_trace(trace_id)
+        if expired:
+            archived.query \
+                .filter(archived.id.in_([archived_id
+                                         for (archived_id, _) in expired])) \
+                .delete(synchronize_session=False)
+    db.session.commit()
+    return len(actions)
+
+
+def apply_networking(worker=None):
     """Do each networking action in the journal, then cross them off.
 
-    Returns False if the journal was empty, and True if there were journal
-    entries.  Equivalently, returns True if an action was performed, and False
+    Only the actions claimed by `worker` (by default, `worker_id()`) are
+    done; see `claim_actions`.
+
+    Returns False if there were no journal entries to claim, and True if there
+    were.  Equivalently, returns True if an action was performed, and False
     if no action was performed.
 
     The networking server calls this function in a loop, to ensure that all
@@ -106,26 +763,46 @@ def apply_networking():
     tight-looping.
     """
 
-    action = model.NetworkingAction.query \
-        .order_by(model.NetworkingAction.id) \
-        .filter_by(status='PENDING').first()
-
-    if action is None:
+    if worker is None:
+        worker = worker_id()
+    if not claim_actions(worker):
         db.session.commit()
         return False
+    db.session.commit()
+    now = datetime.utcnow()
+    renew_at = now + (_lease_end(now) - now) / 2
 
     session = DaemonSession()
-    while action is not None:
-        session.handle_action(action)
+    pending = _claimed_actions(worker)
+    while pending:
+        now = datetime.utcnow()
+        if now >= renew_at:
+            # Half of the lease has gone; renew the claims, and forget any
+            # actions another daemon has taken over.
+            renew_at = now + (_renew_claims(worker) - now) / 2
+            db.session.commit()
+            still_claimed = set(entry[0]
+                                for entry in _claimed_actions(worker))
+            pending = [entry for entry in pending
+                       if entry[0] in still_claimed]
+            continue
+        index, wait = _schedule(pending)
+        if index is None:
+            # Every switch we have actions for is at its rate limit:
+            db.session.commit()
+            time.sleep(min(wait, (renew_at - now).total_seconds()))
+            continue
+        nic_id = pending[index][1]
+        actions = _load_actions(nic_id, worker)
+        if actions:
+            session.handle_actions(actions)
         db.session.commit()
-        # Get the next action
-        action = model.NetworkingAction.query \
-            .order_by(model.NetworkingAction.id)\
-            .filter_by(status='PENDING').first()
+        # The nic's actions were all handled together:
+        pending = [entry for entry in pending if entry[1] != nic_id]
 
     # the last statement in the while loop opens a new db session that we must
-    # close when we exit the loop.
-    db.session.commit()
-
+    # close when we exit the loop. Closing the switch sessions records spans,
+    # which we commit here as well.
     session.close()
+    db.session.commit()
     return True
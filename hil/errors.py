@@ -110,3 +110,11 @@ class SwitchError(ServerError):
 
     Switch drviers can subclass this to be more specific about the error.
     """
+
+
+class SwitchConnectionError(SwitchError):
+    """The switch could not be reached, or did not answer in time.
+
+    Unlike other SwitchErrors, these may go away if the operation is tried
+    again; see `hil.deferred.TRANSIENT_ERRORS`.
+    """
@@ -0,0 +1,294 @@
+"""Bounded, segmented console logs.
+
+A console log is a directory holding a bounded number of segment files,
+plus an index. The capture process (``python -m hil.ext.obm._console_ring``)
+copies its standard input -- typically the output of ``ipmitool sol
+activate`` -- into the newest segment. When that fills up, a new segment is
+started. Segments older than the newest two are gzipped (by a background
+thread, so that compressing doesn't hold up reading the console), and once
+there are more than the configured number of segments, the oldest one is
+deleted. So a log never takes up much more than the configured amount of
+disk space, no matter how long the node has been running.
+
+Offsets into a log are positions in the console stream since capture
+started, so they remain valid across rotations (until the data they refer
+to is dropped). The index records the offset at which each segment starts.
+It only changes on rotation, so finding the end of the log -- and with it
+the most recent output -- takes a constant amount of work.
+
+This module is run as a separate process, so it must not import anything
+which touches the database or the config.
+"""
+
+import argparse
+import errno
+import gzip
+import json
+import os
+from os.path import join, exists
+import Queue
+import sys
+import threading
+
+from hil.ext.obm.common import CHUNK_SIZE, strip_non_ascii
+
+INDEX_NAME = 'index'
+
+
+def _segment_path(directory, num):
+    """Return the path of (uncompressed) segment number `num`."""
+    return join(directory, '%08d.log' % num)
+
+
+def read_index(directory):
+    """Read the index of the log in `directory`.
+
+    The index is a list of `[segment number, start offset]` pairs, one for
+    each segment that is still around, oldest first. Returns None if there
+    is no log in `directory`.
+    """
+    try:
+        with open(join(directory, INDEX_NAME)) as f:
+            return json.load(f)
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+
+
+def _write_index(directory, segments):
+    """Atomically replace the index of the log in `directory`."""
+    tmp = join(directory, INDEX_NAME + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(segments, f)
+    os.rename(tmp, join(directory, INDEX_NAME))
+
+
+def _open_segment(directory, num):
+    """Open segment number `num` for reading, whether or not it is gzipped.
+
+    Returns None if the segment no longer exists.
+    """
+    path = _segment_path(directory, num)
+    for opener, name in (open, path), (gzip.open, path + '.gz'):
+        try:
+            return opener(name, 'rb')
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+    return None
+
+
+class RingWriter(object):
+    """Writes a console stream into a log directory.
+
+    `max_bytes` is (roughly) the most disk space the log may use, before
+    compression, and `segments` is the number of segments it is split into.
+    If there is already a log in `directory`, we keep appending to it.
+
+    Old segments are compressed by a background thread. `_lock` guards
+    `segments` (the index) and the segment files, against rotation and
+    compression changing them at the same time.
+    """
+
+    def __init__(self, directory, max_bytes, segments):
+        self.directory = directory
+        self.max_segments = max(2, segments)
+        self.segment_size = max(1, max_bytes // self.max_segments)
+        if not exists(directory):
+            os.makedirs(directory)
+
+        self.segments = read_index(directory)
+        if self.segments is None:
+            self.segments = [[0, 0]]
+            _write_index(directory, self.segments)
+        num = self.segments[-1][0]
+        self.current = open(_segment_path(directory, num), 'ab')
+        self.current_size = os.fstat(self.current.fileno()).st_size
+
+        self._lock = threading.Lock()
+        self._to_compress = Queue.Queue()
+        self._compressor = threading.Thread(target=self._compress_queued,
+                                            name='hil-console-compress')
+        self._compressor.daemon = True
+        self._compressor.start()
+        # A previous writer may have been stopped before it got around to
+        # compressing everything:
+        for old_num, _ in self.segments[:-2]:
+            self._to_compress.put(old_num)
+
+    def write(self, data):
+        """Append `data` to the log, rotating segments as needed."""
+        while data:
+            room = self.segment_size - self.current_size
+            if room <= 0:
+                self._rotate()
+                continue
+            piece, data = data[:room], data[room:]
+            self.current.write(piece)
+            self.current_size += len(piece)
+        # Make the output visible to readers right away:
+        self.current.flush()
+
+    def _rotate(self):
+        """Start a new segment, compressing and dropping old ones."""
+        self.current.close()
+        num, start = self.segments[-1]
+        self.segments.append([num + 1, start + self.current_size])
+        self.current = open(_segment_path(self.directory, num + 1), 'ab')
+        self.current_size = 0
+
+        with self._lock:
+            dropped = self.segments[:-self.max_segments]
+            self.segments = self.segments[-self.max_segments:]
+            # Update the index before deleting anything, so readers never
+            # look for a segment which is supposed to exist but doesn't:
+            _write_index(self.directory, self.segments)
+            for old_num, _ in dropped:
+                for suffix in '', '.gz', '.gz.tmp':
+                    _remove(_segment_path(self.directory, old_num) + suffix)
+
+        # The newest two segments are left uncompressed, so that recent
+        # output can be read without decompressing anything.
+        if len(self.segments) > 2:
+            self._to_compress.put(self.segments[-3][0])
+
+    def _compress_queued(self):
+        """Compress the segments queued for it, until None is queued.
+
+        This runs in the background thread.
+        """
+        for num in iter(self._to_compress.get, None):
+            self._compress(num)
+
+    def _compress(self, num):
+        """Gzip segment number `num`, if it isn't already."""
+        path = _segment_path(self.directory, num)
+        try:
+            src = open(path, 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        with src:
+            dst = gzip.open(path + '.gz.tmp', 'wb')
+            try:
+                while True:
+                    data = src.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    dst.write(data)
+            finally:
+                dst.close()
+        with self._lock:
+            if num not in [seg_num for seg_num, _ in self.segments]:
+                # The segment was dropped while we were compressing it.
+                _remove(path + '.gz.tmp')
+                return
+            # Readers try the uncompressed file first, so at every point in
+            # this sequence one of the two is present and complete:
+            os.rename(path + '.gz.tmp', path + '.gz')
+            os.remove(path)
+
+    def close(self):
+        """Close the current segment, and finish compressing old ones."""
+        self.current.close()
+        self._to_compress.put(None)
+        self._compressor.join()
+
+
+def _remove(path):
+    """Remove the file at `path`, if there is one."""
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def read_ring(directory, offset=None, tail=None, max_bytes=None):
+    """Read part of the log in `directory`, as for `Obm.get_console`.
+
+    Returns None if there is no log. Otherwise returns a pair
+    `(chunks, next_offset)`, where `chunks` is an iterator over the
+    (ASCII-only) contents of the requested part of the log, and
+    `next_offset` is the offset just past its end.
+
+    `offset`, `tail` and `max_bytes` are as for `Obm.get_console`. If
+    `offset` refers to output which has already been dropped, we start at
+    the oldest output still available.
+    """
+    segments = read_index(directory)
+    if segments is None:
+        return None
+    num, start = segments[-1]
+    try:
+        end = start + os.stat(_segment_path(directory, num)).st_size
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        end = start
+
+    if tail is not None:
+        first = end - tail
+    elif offset is not None:
+        first = min(offset, end)
+    else:
+        first = 0
+    first = max(first, segments[0][1])
+    if max_bytes is not None:
+        end = min(end, first + max_bytes)
+    return _iter_ring(directory, segments, first, end), end
+
+
+def _iter_ring(directory, segments, first, end):
+    """Yield the stream positions [first, end) of a log, in chunks.
+
+    `segments` is the log's index. Non-ASCII bytes are removed. Segments
+    which are deleted out from under us are skipped.
+    """
+    bounds = [seg_start for _, seg_start in segments[1:]] + [end]
+    for (num, seg_start), seg_end in zip(segments, bounds):
+        if seg_end <= first:
+            continue
+        if seg_start >= end:
+            break
+        seg = _open_segment(directory, num)
+        if seg is None:
+            continue
+        with seg:
+            pos = max(first, seg_start)
+            seg.seek(pos - seg_start)
+            remaining = min(seg_end, end) - pos
+            while remaining > 0:
+                data = seg.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield strip_non_ascii(data)
+
+
+def main(argv=None):
+    """Copy standard input into a console log; see the module docstring."""
+    parser = argparse.ArgumentParser(
+        description='Capture console output into a bounded log.')
+    parser.add_argument('--max-bytes', type=int, required=True,
+                        help='maximum size of the log, in bytes')
+    parser.add_argument('--segments', type=int, default=8,
+                        help='number of segments to split the log into')
+    parser.add_argument('directory', help='directory to keep the log in')
+    args = parser.parse_args(argv)
+
+    writer = RingWriter(args.directory, args.max_bytes, args.segments)
+    try:
+        while True:
+            data = os.read(sys.stdin.fileno(), CHUNK_SIZE)
+            if not data:
+                break
+            writer.write(data)
+    finally:
+        writer.close()
+
+
+if __name__ == '__main__':
+    main()
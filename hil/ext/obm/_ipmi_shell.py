@@ -0,0 +1,221 @@
+"""Persistent ``ipmitool shell`` sessions.
+
+Running ``ipmitool -I lanplus <command>`` forks a new process and performs a
+full RMCP+ session handshake with the BMC every time. Instead, we can keep
+one ``ipmitool -I lanplus shell`` co-process per BMC, which holds its
+session open, and feed it commands on its standard input.
+
+The shell doesn't report exit statuses, so we wait for its prompt to know
+that a command has finished, and treat anything it wrote to standard error
+in the meantime as failure. ipmitool writes its errors before printing the
+next prompt, so by the time we've seen the prompt they are already waiting
+in the pipe.
+
+A shell which has been idle for too long is replaced rather than reused, as
+the BMC will have timed out its session. If a shell dies, or doesn't print
+its prompt within the timeout, it is killed and a new one is started for
+the next command.
+
+Running ``python -m hil.ext.obm._ipmi_shell`` benchmarks the two approaches
+against a single BMC.
+"""
+
+import argparse
+import atexit
+import errno
+import logging
+import os
+import select
+from subprocess import call, Popen, PIPE
+import threading
+import time
+
+PROMPT = 'ipmitool> '
+
+# How long (in seconds) to wait for a single command to finish:
+COMMAND_TIMEOUT = 60
+
+_shells = {}
+_shells_lock = threading.Lock()
+
+
+class Shell(object):
+    """An ``ipmitool shell`` co-process talking to one BMC.
+
+    The process is started lazily, and restarted as needed. Commands are
+    serialized; it is safe to call `run` from several threads.
+    """
+
+    def __init__(self, host, user, password, idle_timeout):
+        self.creds = (host, user, password)
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self._proc = None
+        self._last_used = None
+
+    def _start(self):
+        """Start the co-process, and wait for its first prompt."""
+        host, user, password = self.creds
+        self._proc = Popen(['ipmitool',
+                            '-I', 'lanplus',
+                            '-U', user,
+                            '-P', password,
+                            '-H', host,
+                            'shell'],
+                           stdin=PIPE,
+                           stdout=PIPE,
+                           stderr=PIPE)
+        self._read_until_prompt()
+        self._drain_stderr()
+
+    def _read_until_prompt(self):
+        """Read standard output up to the next prompt, and return it.
+
+        Raises IOError if the shell exits or times out first.
+        """
+        out = self._proc.stdout.fileno()
+        deadline = time.time() + COMMAND_TIMEOUT
+        data = ''
+        while not data.endswith(PROMPT):
+            remaining = deadline - time.time()
+            if remaining <= 0 or \
+                    not select.select([out], [], [], remaining)[0]:
+                raise IOError(errno.ETIMEDOUT, 'ipmitool shell timed out')
+            chunk = os.read(out, 4096)
+            if not chunk:
+                raise IOError(errno.EPIPE, 'ipmitool shell exited')
+            data += chunk
+        return data[:-len(PROMPT)]
+
+    def _drain_stderr(self):
+        """Return whatever is waiting on the shell's standard error."""
+        err = self._proc.stderr.fileno()
+        data = ''
+        while select.select([err], [], [], 0)[0]:
+            chunk = os.read(err, 4096)
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def _usable(self):
+        """Return whether the current co-process can take a command."""
+        return self._proc is not None and \
+            self._proc.poll() is None and \
+            time.time() - self._last_used < self.idle_timeout
+
+    def close(self):
+        """Stop the co-process, if it's running."""
+        if self._proc is None:
+            return
+        if self._proc.poll() is None:
+            try:
+                self._proc.stdin.write('exit\n')
+                self._proc.stdin.close()
+            except IOError:
+                pass
+            self._proc.kill()
+        self._proc.wait()
+        for f in self._proc.stdout, self._proc.stderr:
+            f.close()
+        self._proc = None
+
+    def run(self, args):
+        """Run the ipmitool command `args`, and return its exit status.
+
+        As with ipmitool itself, zero means success. The status of a failed
+        command is always 1.
+        """
+        assert not any(len(arg.split()) != 1 for arg in args), \
+            'ipmitool shell arguments must not contain whitespace: %r' % args
+        with self.lock:
+            try:
+                if not self._usable():
+                    self.close()
+                    self._start()
+                self._proc.stdin.write(' '.join(args) + '\n')
+                self._proc.stdin.flush()
+                self._read_until_prompt()
+                errors = self._drain_stderr()
+            except (IOError, OSError) as e:
+                logger = logging.getLogger(__name__)
+                logger.info('ipmitool shell for %s failed: %s',
+                            self.creds[0], e)
+                self.close()
+                return 1
+            self._last_used = time.time()
+            if errors:
+                logger = logging.getLogger(__name__)
+                logger.info('ipmitool shell for %s reported errors: %r',
+                            self.creds[0], errors)
+                return 1
+            return 0
+
+
+def get_shell(host, user, password, idle_timeout):
+    """Return the shared `Shell` for the BMC at `host`.
+
+    If the credentials for `host` have changed, the old shell is closed and
+    a new one is returned.
+    """
+    with _shells_lock:
+        shell = _shells.get(host)
+        if shell is not None and shell.creds != (host, user, password):
+            with shell.lock:
+                shell.close()
+            shell = None
+        if shell is None:
+            shell = Shell(host, user, password, idle_timeout)
+            _shells[host] = shell
+        shell.idle_timeout = idle_timeout
+        return shell
+
+
+@atexit.register
+def close_all():
+    """Stop all of the shells."""
+    with _shells_lock:
+        for shell in _shells.values():
+            with shell.lock:
+                shell.close()
+        _shells.clear()
+
+
+def main(argv=None):
+    """Compare forking ipmitool per command with a persistent shell."""
+    parser = argparse.ArgumentParser(
+        description='Measure ipmitool commands per second against one BMC.')
+    parser.add_argument('-H', dest='host', required=True)
+    parser.add_argument('-U', dest='user', required=True)
+    parser.add_argument('-P', dest='password', required=True)
+    parser.add_argument('-n', dest='count', type=int, default=20,
+                        help='number of commands to run each way')
+    parser.add_argument('command', nargs='*',
+                        default=['chassis', 'power', 'status'],
+                        help='command to run (default: chassis power status)')
+    args = parser.parse_args(argv)
+
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        for _ in range(args.count):
+            call(['ipmitool',
+                  '-I', 'lanplus',
+                  '-U', args.user,
+                  '-P', args.password,
+                  '-H', args.host] + args.command,
+                 stdout=devnull, stderr=devnull)
+        forked = time.time() - start
+
+    shell = Shell(args.host, args.user, args.password, float('inf'))
+    start = time.time()
+    for _ in range(args.count):
+        shell.run(args.command)
+    persistent = time.time() - start
+    shell.close()
+
+    print('fork per command: %8.2f ops/sec' % (args.count / forked))
+    print('persistent shell: %8.2f ops/sec' % (args.count / persistent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Helper methods for obm drivers"""
+
+# Size of the chunks console logs are streamed in:
+CHUNK_SIZE = 64 * 1024
+
+# All of the bytes which are not ASCII; see `strip_non_ascii`:
+_NON_ASCII = ''.join(chr(i) for i in range(128, 256))
+
+
+def strip_non_ascii(data):
+    """Remove all non-ASCII bytes from the string `data`.
+
+    This works on whole strings at once (via `str.translate`), rather than
+    one character at a time.
+    """
+    return data.translate(None, _NON_ASCII)
+
+
+def console_range(size, offset=None, tail=None, max_bytes=None):
+    """Work out which bytes of a console log to return.
+
+    `size` is the current size of the log. `offset` is the position to start
+    reading from, and `tail` asks for the last `tail` bytes instead; at most
+    one of them may be given. If neither is, we start at the beginning of the
+    log. `max_bytes`, if given, limits the length of the result.
+
+    Returns a pair `(start, end)`, such that the caller should return the
+    bytes in the range [start, end).
+    """
+    if tail is not None:
+        start = max(0, size - tail)
+    elif offset is not None:
+        start = min(offset, size)
+    else:
+        start = 0
+    end = size
+    if max_bytes is not None:
+        end = min(end, start + max_bytes)
+    return start, end
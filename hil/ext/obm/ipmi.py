@@ -6,16 +6,57 @@ import logging
 from hil.model import db, Obm
 from hil.errors import OBMError, BadArgumentError
 from hil.dev_support import no_dry_run
+from hil.ext.obm._console_ring import read_ring
+from hil.ext.obm import _ipmi_shell
+from hil.profiler import trace_call
+from multiprocessing.pool import ThreadPool
 from subprocess import call, Popen, PIPE
+import errno
 import os
+import shutil
+import signal
+import sys
+import threading
+import time
 
 from os.path import join, dirname
+from hil.config import cfg, core_schema, string_is_bool, string_is_dir, \
+    string_is_positive_int
 from hil.migrations import paths
+from schema import Optional
 from sqlalchemy import BigInteger
 from sqlalchemy.dialects import sqlite
 
 paths[__name__] = join(dirname(__file__), 'migrations', 'ipmi')
 
+core_schema[__name__] = {
+    Optional('console_log_dir'): string_is_dir,
+    Optional('console_log_mb'): string_is_positive_int,
+    Optional('console_log_segments'): string_is_positive_int,
+    Optional('persistent_sessions'): string_is_bool,
+    Optional('session_idle_timeout'): string_is_positive_int,
+}
+
+DEFAULT_CONSOLE_LOG_DIR = '/var/run/hil_console_logs'
+DEFAULT_CONSOLE_LOG_MB = 16
+DEFAULT_CONSOLE_LOG_SEGMENTS = 8
+# BMCs typically drop idle sessions after 60 seconds:
+DEFAULT_SESSION_IDLE_TIMEOUT = 30
+
+# Name of the file, in each console log directory, which records the pids of
+# the processes logging the console:
+PID_REGISTRY = 'pids'
+
+# How many `sol deactivate`s stop_orphan_consoles runs at once, and the name
+# of the thread it runs them in:
+SOL_DEACTIVATE_JOBS = 16
+SOL_DEACTIVATE_THREAD = 'hil-sol-deactivate'
+
+# How long (in seconds) _kill waits for processes to exit after SIGTERM
+# before it sends SIGKILL, and how often it checks whether they have:
+KILL_TIMEOUT = 5
+KILL_POLL_INTERVAL = 0.05
+
 BigIntegerType = BigInteger().with_variant(
                 sqlite.INTEGER(), 'sqlite')
 
@@ -53,12 +94,25 @@ class Ipmi(Obm):
 
         Note: Includes the ``-I lanplus`` flag, available only in IPMI v2+.
         This is needed for machines which do not accept the older version.
+
+        If the ``persistent_sessions`` option is set, the command is sent to
+        a long-lived ``ipmitool shell`` for the BMC instead of a new
+        ipmitool process; see `hil.ext.obm._ipmi_shell`.
         """
-        status = call(['ipmitool',
-                       '-I', 'lanplus',  # see docstring above
-                       '-U', self.user,
-                       '-P', self.password,
-                       '-H', self.host] + args)
+        with trace_call('ipmitool', '-H %s %s' % (self.host, ' '.join(args))):
+            if cfg.has_option(__name__, 'persistent_sessions') and \
+                    cfg.getboolean(__name__, 'persistent_sessions'):
+                shell = _ipmi_shell.get_shell(
+                    self.host, self.user, self.password,
+                    _int_option('session_idle_timeout',
+                                DEFAULT_SESSION_IDLE_TIMEOUT))
+                status = shell.run(args)
+            else:
+                status = call(['ipmitool',
+                               '-I', 'lanplus',  # see docstring above
+                               '-U', self.user,
+                               '-P', self.password,
+                               '-H', self.host] + args)
 
         if status != 0:
             logger = logging.getLogger(__name__)
@@ -101,13 +155,17 @@ class Ipmi(Obm):
 
     @no_dry_run
     def start_console(self):
-        """Starts logging the IPMI console."""
+        """Starts logging the IPMI console.
+
+        The output of ipmitool is piped into a capture process, which keeps
+        a bounded log; see `hil.ext.obm._console_ring`.
+        """
 
         # stdin and stderr are redirected to a PIPE that is never read in order
         # to prevent stdout from becoming garbled.  This happens because
         # ipmitool sets shell settings to behave like a tty when communicateing
         # over Serial over Lan
-        Popen(
+        ipmitool = Popen(
             ['ipmitool',
              '-H', self.host,
              '-U', self.user,
@@ -115,35 +173,264 @@ class Ipmi(Obm):
              '-I', 'lanplus',
              'sol', 'activate'],
             stdin=PIPE,
-            stdout=open(self.get_console_log_filename(), 'a'),
+            stdout=PIPE,
             stderr=PIPE)
+        max_mb = _int_option('console_log_mb', DEFAULT_CONSOLE_LOG_MB)
+        segments = _int_option('console_log_segments',
+                               DEFAULT_CONSOLE_LOG_SEGMENTS)
+        log_dir = self.get_console_log_filename()
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        capture = Popen(
+            [sys.executable, '-m', 'hil.ext.obm._console_ring',
+             '--max-bytes', str(max_mb * 1024 * 1024),
+             '--segments', str(segments),
+             log_dir],
+            stdin=ipmitool.stdout)
+        # The capture process has its own copy of the pipe; closing ours
+        # means it will see EOF once ipmitool exits.
+        ipmitool.stdout.close()
+        # Record both processes, so stop_console & stop_orphan_consoles can
+        # find them later:
+        with open(join(log_dir, PID_REGISTRY), 'a') as f:
+            f.write('%d\n%d\n' % (ipmitool.pid, capture.pid))
 
-    # stdin, stdout, and stderr are redirected to a pipe that is never read
-    # because we are not interested in the ouput of this command.
     @no_dry_run
     def stop_console(self):
-        call(['pkill', '-f', 'ipmitool -H %s' % self.host])
-        proc = Popen(
-            ['ipmitool',
-             '-H', self.host,
-             '-U', self.user,
-             '-P', self.password,
-             '-I', 'lanplus',
-             'sol', 'deactivate'],
-            stdin=PIPE,
-            stdout=PIPE,
-            stderr=PIPE)
-        proc.wait()
+        log_dir = self.get_console_log_filename()
+        dirs_by_host = {self.host: log_dir}
+        _kill([pid for pid in _registered_pids(log_dir)
+               if _console_owner(_cmdline(pid), dirs_by_host) == log_dir])
+        _deactivate_sol((self.host, self.user, self.password))
+
+    @classmethod
+    @no_dry_run
+    def stop_orphan_consoles(cls, obms):
+        """Stop orphaned consoles for all of ``obms`` at once.
+
+        We make a single pass over the process table, and kill every console
+        process belonging to one of ``obms`` -- both those in the pid
+        registries and any unregistered ones (e.g. started by an older
+        version of HIL). The logs are deleted as soon as those processes
+        have exited, but the ``sol deactivate`` calls, which are slow, are
+        run concurrently in a background thread so the server can start in
+        the meantime.
+        """
+        if not os.path.isdir('/proc'):
+            # We can't scan the process table; fall back to the slow way.
+            super(Ipmi, cls).stop_orphan_consoles(obms)
+            return
+
+        by_dir = dict((obm.get_console_log_filename(), obm) for obm in obms)
+        dirs_by_host = dict((obm.host, log_dir)
+                            for log_dir, obm in by_dir.items())
+        table = _process_table()
+
+        to_kill = set()
+        had_console = set()
+        for log_dir in by_dir:
+            for pid in _registered_pids(log_dir):
+                if _console_owner(table.get(pid), dirs_by_host) == log_dir:
+                    to_kill.add(pid)
+            if os.path.isdir(log_dir):
+                had_console.add(log_dir)
+        for pid, argv in table.items():
+            owner = _console_owner(argv, dirs_by_host)
+            if owner in by_dir:
+                to_kill.add(pid)
+                had_console.add(owner)
+
+        _kill(to_kill)
+        for log_dir in had_console:
+            by_dir[log_dir].delete_console()
+
+        creds = [(by_dir[log_dir].host,
+                  by_dir[log_dir].user,
+                  by_dir[log_dir].password) for log_dir in had_console]
+        logger = logging.getLogger(__name__)
+        logger.info('Stopped %d orphaned console processes; deactivating '
+                    'SOL for %d nodes in the background',
+                    len(to_kill), len(creds))
+        if creds:
+            thread = threading.Thread(target=_deactivate_sol_all,
+                                      args=(creds,),
+                                      name=SOL_DEACTIVATE_THREAD)
+            thread.daemon = True
+            thread.start()
 
     def delete_console(self):
-        if os.path.isfile(self.get_console_log_filename()):
-            os.remove(self.get_console_log_filename())
+        if os.path.isdir(self.get_console_log_filename()):
+            shutil.rmtree(self.get_console_log_filename())
 
-    def get_console(self):
-        if not os.path.isfile(self.get_console_log_filename()):
-            return None
-        with open(self.get_console_log_filename(), 'r') as log:
-            return "".join(i for i in log.read() if ord(i) < 128)
+    def get_console(self, offset=None, tail=None, max_bytes=None):
+        return read_ring(self.get_console_log_filename(),
+                         offset=offset,
+                         tail=tail,
+                         max_bytes=max_bytes)
 
     def get_console_log_filename(self):
-        return '/var/run/hil_console_logs/%s.log' % self.host
+        """Return the directory holding the console log.
+
+        The log is kept as a set of segments; see `hil.ext.obm._console_ring`.
+        """
+        if cfg.has_option(__name__, 'console_log_dir'):
+            log_dir = cfg.get(__name__, 'console_log_dir')
+        else:
+            log_dir = DEFAULT_CONSOLE_LOG_DIR
+        return join(log_dir, self.host)
+
+
+def _registered_pids(log_dir):
+    """Return the pids in the registry for the console log in `log_dir`."""
+    try:
+        with open(join(log_dir, PID_REGISTRY)) as f:
+            return [int(line) for line in f if line.strip()]
+    except IOError as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+
+
+def _cmdline(pid):
+    """Return the argument list of process `pid`, or None if it's gone."""
+    try:
+        with open('/proc/%d/cmdline' % pid) as f:
+            return f.read().rstrip('\0').split('\0')
+    except IOError:
+        return None
+
+
+def _process_table():
+    """Return a dictionary mapping each pid to its argument list.
+
+    This is one pass over /proc.
+    """
+    table = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            argv = _cmdline(int(name))
+            if argv is not None:
+                table[int(name)] = argv
+    return table
+
+
+def _console_owner(argv, dirs_by_host=None):
+    """Work out whose console process `argv` is, if anyone's.
+
+    If `argv` is the argument list of a console capture process, return the
+    directory of the console log it writes to. If it is the argument list of
+    an ``ipmitool sol activate`` process, and `dirs_by_host` (a dictionary
+    mapping ipmi hosts to log directories) is given, return the log
+    directory for its host. Otherwise, return None.
+    """
+    if not argv:
+        return None
+    if 'hil.ext.obm._console_ring' in argv:
+        return argv[-1]
+    if dirs_by_host is not None and \
+            os.path.basename(argv[0]) == 'ipmitool' and \
+            argv[-2:] == ['sol', 'activate'] and '-H' in argv[:-1]:
+        return dirs_by_host.get(argv[argv.index('-H') + 1])
+    return None
+
+
+def _signal(pids, signum):
+    """Send `signum` to each of `pids`, ignoring any that are already gone."""
+    for pid in pids:
+        try:
+            os.kill(pid, signum)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+
+def _exited(pid):
+    """Return whether process `pid` has exited.
+
+    If it is a child of ours, it is reaped. A zombie which isn't counts as
+    having exited too, since its parent may not reap it for a while.
+    """
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return True
+    except OSError as e:
+        if e.errno != errno.ECHILD:
+            raise
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # The state comes right after the command name, which is in
+            # parentheses (and may contain anything):
+            return f.read().rsplit(')', 1)[1].split()[0] == 'Z'
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+    if os.path.isdir('/proc'):
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.ESRCH
+    return False
+
+
+def _wait_for_exit(pids, timeout):
+    """Wait up to `timeout` seconds for `pids` to exit.
+
+    Returns those which haven't.
+    """
+    deadline = time.time() + timeout
+    while True:
+        pids = [pid for pid in pids if not _exited(pid)]
+        if not pids or time.time() >= deadline:
+            return pids
+        time.sleep(KILL_POLL_INTERVAL)
+
+
+def _kill(pids):
+    """Stop each of `pids`, and wait for them to exit.
+
+    They are sent SIGTERM, and then SIGKILL if they are still around after
+    `KILL_TIMEOUT` seconds; any that are already gone are ignored. Once this
+    returns, no capture process is writing to the logs any more, so they
+    can be deleted.
+    """
+    _signal(pids, signal.SIGTERM)
+    left = _wait_for_exit(pids, KILL_TIMEOUT)
+    if left:
+        _signal(left, signal.SIGKILL)
+        _wait_for_exit(left, KILL_TIMEOUT)
+
+
+# stdin, stdout, and stderr are redirected to a pipe that is never read
+# because we are not interested in the ouput of this command.
+def _deactivate_sol(creds):
+    """Run ``ipmitool sol deactivate`` for the `(host, user, password)`."""
+    host, user, password = creds
+    proc = Popen(
+        ['ipmitool',
+         '-H', host,
+         '-U', user,
+         '-P', password,
+         '-I', 'lanplus',
+         'sol', 'deactivate'],
+        stdin=PIPE,
+        stdout=PIPE,
+        stderr=PIPE)
+    proc.wait()
+
+
+def _deactivate_sol_all(creds):
+    """Run `_deactivate_sol` for each of `creds`, several at a time."""
+    pool = ThreadPool(min(SOL_DEACTIVATE_JOBS, len(creds)))
+    try:
+        pool.map(_deactivate_sol, creds)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _int_option(name, default):
+    """Return the integer config option `name`, or `default` if unset."""
+    if cfg.has_option(__name__, name):
+        return cfg.getint(__name__, name)
+    return default
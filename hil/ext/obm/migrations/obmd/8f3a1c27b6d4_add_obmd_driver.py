@@ -0,0 +1,29 @@
+"""Add obmd obm driver
+
+Revision ID: 8f3a1c27b6d4
+Revises:
+Create Date: 2018-03-02 14:12:45.392011
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '8f3a1c27b6d4'
+down_revision = None
+branch_labels = ('hil.ext.obm.obmd',)
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.create_table(
+        'obmd',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(['id'], ['obm.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('obmd')
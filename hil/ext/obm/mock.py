@@ -4,6 +4,7 @@ from sqlalchemy import Column, String, ForeignKey
 import schema
 
 from hil.model import Obm
+from hil.ext.obm.common import console_range
 
 from os.path import join, dirname
 from hil.migrations import paths
@@ -63,10 +64,12 @@ class MockObm(Obm):
     def delete_console(self):
         return
 
-    def get_console(self):
+    def get_console(self, offset=None, tail=None, max_bytes=None):
         state = LOCAL_STATE[self.id]
         if state['console']:
-            return "Some console output"
+            log = "Some console output"
+            start, end = console_range(len(log), offset, tail, max_bytes)
+            return [log[start:end]], end
 
     def get_console_log_filename(self):
         return
@@ -0,0 +1,370 @@
+"""obmd driver for implementing out of band management.
+
+Rather than talking to the BMC itself, this driver forwards each operation to
+obmd (https://github.com/CCI-MOC/obmd), using the ``obmd_uri`` and
+``obmd_admin_token`` stored on the node. All requests go through a single
+keep-alive connection pool shared by the whole process, and the ``bulk_*``
+functions fan an operation on many nodes out over a pool of threads (see
+``hil-admin bulk-power``).
+"""
+
+import json
+from multiprocessing.pool import ThreadPool
+from os.path import join, dirname
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+import schema
+from schema import Optional
+
+from hil.config import cfg, core_schema, string_is_positive_int
+from hil.dev_support import no_dry_run
+from hil.errors import OBMError, BadArgumentError
+from hil.ext.obm.common import strip_non_ascii
+from hil.migrations import paths
+from hil.model import db, Obm, BigIntegerType
+from hil.profiler import trace_call
+
+paths[__name__] = join(dirname(__file__), 'migrations', 'obmd')
+
+core_schema[__name__] = {
+    Optional('pool_size'): string_is_positive_int,
+    Optional('jobs'): string_is_positive_int,
+    Optional('timeout'): string_is_positive_int,
+    Optional('console_timeout'): string_is_positive_int,
+}
+
+DEFAULTS = {
+    # Number of keep-alive connections kept open to each obmd host:
+    'pool_size': 32,
+    # Number of worker threads used by the bulk_* functions:
+    'jobs': 16,
+    # Timeout (in seconds) for a single request to obmd:
+    'timeout': 30,
+    # How long (in seconds) get_console waits for console output:
+    'console_timeout': 2,
+}
+
+# The largest amount of console output get_console will return.
+MAX_CONSOLE_BYTES = 1024 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_option(name):
+    """Return the integer value of option ``name`` for this driver.
+
+    Falls back to the value in ``DEFAULTS`` if it is not set in hil.cfg.
+    """
+    if cfg.has_option(__name__, name):
+        return cfg.getint(__name__, name)
+    return DEFAULTS[name]
+
+
+def get_session():
+    """Return the process-wide requests session used to talk to obmd.
+
+    The session is created on first use. Its connection pool holds up to
+    ``pool_size`` keep-alive connections per host, so that concurrent
+    callers (e.g. the bulk_* functions) don't each pay for a new TCP/TLS
+    handshake.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = get_option('pool_size')
+            sess = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            sess.mount('http://', adapter)
+            sess.mount('https://', adapter)
+            _session = sess
+        return _session
+
+
+class _Client(object):
+    """Talks to obmd on behalf of a single node.
+
+    This holds plain copies of the node's obmd connection info, rather than
+    the node itself, so that it can be used from worker threads without
+    touching the database session. ``node_token`` is updated in place
+    whenever a new token is fetched; it is up to the caller to write it back
+    to the node.
+    """
+
+    def __init__(self, label, uri, admin_token, node_token):
+        self.label = label
+        self.uri = uri
+        self.admin_token = admin_token
+        self.node_token = node_token
+
+    @classmethod
+    def for_node(cls, node):
+        """Build a client from a ``model.Node``."""
+        return cls(node.label,
+                   node.obmd_uri,
+                   node.obmd_admin_token,
+                   node.obmd_node_token)
+
+    def _request(self, method, path, body=None, **kwargs):
+        """Make a request to ``path`` (relative to the node's uri).
+
+        Connection problems are reported as OBMErrors.
+        """
+        if body is not None:
+            kwargs['data'] = json.dumps(body)
+        kwargs.setdefault('timeout', get_option('timeout'))
+        try:
+            with trace_call('obmd', '%s %s' % (method, self.uri + path)):
+                return get_session().request(method, self.uri + path,
+                                             **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise OBMError('Could not reach obmd for node %s: %s' %
+                           (self.label, e))
+
+    def _check(self, resp, what):
+        """Raise an OBMError if ``resp`` does not indicate success."""
+        if not 200 <= resp.status_code < 300:
+            raise OBMError('obmd failed to %s for node %s (status %d)' %
+                           (what, self.label, resp.status_code))
+
+    def get_token(self):
+        """Fetch a new node token from obmd.
+
+        Note that this invalidates any previous token for the node.
+        """
+        resp = self._request('POST', '/token',
+                             auth=('admin', self.admin_token))
+        self._check(resp, 'issue a token')
+        self.node_token = resp.json()['token']
+
+    def delete_token(self):
+        """Invalidate the node's current token, if any."""
+        resp = self._request('DELETE', '/token',
+                             auth=('admin', self.admin_token))
+        self._check(resp, 'invalidate the token')
+        self.node_token = None
+
+    def _node_request(self, method, path, what, body=None, **kwargs):
+        """Make a request against the (non-admin) node api.
+
+        A token is fetched if we don't have one yet. If obmd rejects the
+        token we have (e.g. because obmd was restarted), we fetch a new one
+        and try exactly once more.
+        """
+        for retry in (False, True):
+            if self.node_token is None:
+                self.get_token()
+            resp = self._request(method, path, body,
+                                 params={'token': self.node_token},
+                                 **kwargs)
+            if resp.status_code != 401 or retry:
+                break
+            self.node_token = None
+        self._check(resp, what)
+        return resp
+
+    def power_cycle(self, force):
+        """Power cycle the node."""
+        self._node_request('POST', '/power_cycle', 'power cycle',
+                           body={'force': force})
+
+    def power_off(self):
+        """Power off the node."""
+        self._node_request('POST', '/power_off', 'power off')
+
+    def set_bootdev(self, dev):
+        """Set the node's boot device."""
+        self._node_request('PUT', '/boot_device', 'set the boot device',
+                           body={'bootdev': dev})
+
+    def read_console(self, timeout, max_bytes):
+        """Read from the node's console.
+
+        obmd only offers a live stream, so this collects whatever arrives
+        within ``timeout`` seconds, up to ``max_bytes`` bytes.
+        """
+        resp = self._node_request('GET', '/console', 'read the console',
+                                  stream=True, timeout=timeout)
+        chunks = []
+        size = 0
+        deadline = time.time() + timeout
+        try:
+            for chunk in resp.iter_content(chunk_size=4096):
+                chunks.append(chunk)
+                size += len(chunk)
+                if size >= max_bytes or time.time() >= deadline:
+                    break
+        except requests.exceptions.RequestException:
+            # The read timed out; that just means the console went quiet.
+            pass
+        finally:
+            resp.close()
+        return ''.join(chunks)[:max_bytes]
+
+
+class Obmd(Obm):
+    """obmd obm driver"""
+
+    valid_bootdevices = ['disk', 'pxe', 'none']
+
+    id = db.Column(BigIntegerType, db.ForeignKey('obm.id'), primary_key=True)
+
+    api_name = 'http://schema.massopencloud.org/haas/v0/obm/obmd'
+
+    __mapper_args__ = {
+        'polymorphic_identity': api_name,
+        }
+
+    @staticmethod
+    def validate(kwargs):
+        schema.Schema({
+            'type': Obmd.api_name,
+            }).validate(kwargs)
+
+    def _client(self):
+        """Return a ``_Client`` for this obm's node."""
+        return _Client.for_node(self.node[0])
+
+    def _save_token(self, client):
+        """Store the client's node token on the node, if it changed.
+
+        This doesn't commit: the token is saved along with whatever else
+        the API call changes, when it commits. If it doesn't (e.g. because
+        it fails), the token is lost, and we fetch a new one next time.
+        """
+        node = self.node[0]
+        if node.obmd_node_token != client.node_token:
+            node.obmd_node_token = client.node_token
+
+    def _call(self, method, *args):
+        """Invoke ``_Client.<method>(*args)`` for this obm's node."""
+        client = self._client()
+        try:
+            return getattr(client, method)(*args)
+        finally:
+            self._save_token(client)
+
+    @no_dry_run
+    def power_cycle(self, force):
+        self._call('power_cycle', force)
+
+    @no_dry_run
+    def power_off(self):
+        self._call('power_off')
+
+    def require_legal_bootdev(self, dev):
+        if dev not in self.valid_bootdevices:
+            raise BadArgumentError('Invald boot device')
+
+    @no_dry_run
+    def set_bootdev(self, dev):
+        self.require_legal_bootdev(dev)
+        self._call('set_bootdev', dev)
+
+    @no_dry_run
+    def start_console(self):
+        """Issue a fresh token, which cuts off any existing console readers."""
+        self._call('get_token')
+
+    @no_dry_run
+    def stop_console(self):
+        """Invalidate the node's token, which also closes the console."""
+        self._call('delete_token')
+
+    def delete_console(self):
+        # obmd doesn't keep a log, so there's nothing to delete.
+        return
+
+    def get_console(self, offset=None, tail=None, max_bytes=None):
+        """Return the output obmd streams within ``console_timeout`` seconds.
+
+        obmd doesn't keep a log, so ``offset`` is ignored, ``tail`` applies
+        to the output we collect, and there is no ``next_offset``.
+        """
+        if self.node[0].obmd_node_token is None:
+            # The console hasn't been started.
+            return None
+        limit = MAX_CONSOLE_BYTES
+        if max_bytes is not None and tail is None:
+            limit = min(limit, max_bytes)
+        data = self._call('read_console',
+                          get_option('console_timeout'),
+                          limit)
+        if tail is not None:
+            data = data[max(0, len(data) - tail):]
+        if max_bytes is not None:
+            data = data[:max_bytes]
+        return [strip_non_ascii(data)], None
+
+    def get_console_log_filename(self):
+        return None
+
+    @classmethod
+    def stop_orphan_consoles(cls, obms):
+        """Do nothing.
+
+        obmd's consoles don't run on the HIL server, so they aren't
+        orphaned when it shuts down uncleanly, and stopping them here would
+        invalidate every node's token for no reason.
+        """
+
+
+def _bulk(method, nodes, args, jobs=None):
+    """Run ``_Client.<method>(*args)`` for each of ``nodes`` concurrently.
+
+    At most ``jobs`` requests are in flight at once (default: the ``jobs``
+    option). New node tokens are stored on the nodes once all of the
+    requests have finished; as with the single-node calls, it is up to the
+    caller to commit them.
+
+    Returns a dictionary mapping the labels of the nodes for which the
+    operation failed to the corresponding OBMError. Must be called inside an
+    app context.
+    """
+    clients = [_Client.for_node(node) for node in nodes]
+
+    def run(client):
+        """Run the operation for one node, returning any OBMError."""
+        try:
+            getattr(client, method)(*args)
+        except OBMError as e:
+            return e
+        return None
+
+    if jobs is None:
+        jobs = get_option('jobs')
+    pool = ThreadPool(max(1, min(jobs, len(clients))))
+    try:
+        results = pool.map(run, clients)
+    finally:
+        pool.close()
+        pool.join()
+
+    failures = {}
+    for node, client, error in zip(nodes, clients, results):
+        if node.obmd_node_token != client.node_token:
+            node.obmd_node_token = client.node_token
+        if error is not None:
+            failures[node.label] = error
+    return failures
+
+
+def bulk_power_cycle(nodes, force, jobs=None):
+    """Power cycle each of ``nodes``; see ``_bulk`` for details."""
+    return _bulk('power_cycle', nodes, (force,), jobs)
+
+
+def bulk_power_off(nodes, jobs=None):
+    """Power off each of ``nodes``; see ``_bulk`` for details."""
+    return _bulk('power_off', nodes, (), jobs)
+
+
+def bulk_set_bootdev(nodes, dev, jobs=None):
+    """Set the boot device of each of ``nodes``; see ``_bulk`` for details."""
+    if dev not in Obmd.valid_bootdevices:
+        raise BadArgumentError('Invald boot device')
+    return _bulk('set_bootdev', nodes, (dev,), jobs)
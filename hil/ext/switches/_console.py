@@ -4,7 +4,9 @@ import logging
 import pexpect
 
 from abc import ABCMeta, abstractmethod
-from hil.model import Port, NetworkAttachment, SwitchSession
+from hil import tracing
+from hil.model import ActionContext, Port, SwitchSession
+from hil.profiler import trace_call
 from hil.ext.switches.common import should_save
 import re
 
@@ -78,20 +80,18 @@ class Session(SwitchSession):
             self._sendline('exit')
         logger.debug('Logged out of switch %r', self.switch)
 
-    def modify_port(self, port, channel, new_network):
+    def modify_port(self, port, channel, new_network, context=None):
         interface = port
-        port = Port.query.filter_by(label=port,
-                                    owner_id=self.switch.id).one()
 
         self.enter_if_prompt(interface)
         self.console.expect(self.if_prompt)
 
         if channel == 'vlan/native':
-            old_native = NetworkAttachment.query.filter_by(
-                channel='vlan/native',
-                nic_id=port.nic.id).one_or_none()
-            if old_native is not None:
-                old_native = old_native.network.network_id
+            if context is None:
+                context = ActionContext.for_port(
+                    Port.query.filter_by(label=port,
+                                         owner_id=self.switch.id).one())
+            old_native = context.old_native
 
             if new_network is not None:
                 self.set_native(old_native, new_network)
@@ -132,11 +132,27 @@ class Session(SwitchSession):
         elif lines == 'default':
             self.console.sendline('terminal length 40')
 
+    def _show(self, command, start):
+        """Run the show `command`, and return its output.
+
+        The output is taken to begin at the first match of the regex
+        `start` (skipping the echoed command, and anything left over from
+        before it), and to end at the next main prompt. Paging must be off
+        (see `_set_terminal_lines`).
+        """
+        self._sendline(command)
+        self.console.expect(start)
+        head = self.console.after
+        self.console.expect(self.main_prompt)
+        return head + self.console.before
+
     def _sendline(self, line):
         """logs switch command and then sends it"""
         logger.debug('Sending to switch %r: %r',
                      self.switch, line)
-        self.console.sendline(line)
+        with tracing.span('switch_command', command=line), \
+                trace_call('switch', '%s: %s' % (self.switch.label, line)):
+            self.console.sendline(line)
 
 
 def get_prompts(console):
@@ -174,19 +190,21 @@ def login(switch):
     """
 
     alternatives = ['User Name:', '[Pp]assword:*', '>', '#']
-    console = pexpect.spawn(
-            'ssh ' + switch.username + '@' + switch.hostname)
+    command = 'ssh ' + switch.username + '@' + switch.hostname
+    with trace_call('switch', command):
+        console = pexpect.spawn(command)
 
-    outcome = console.expect(alternatives)
-    if outcome == 0:
-        # some switches, like the dell powerconnect, ask for the username again
-        console.sendline(switch.username)
-        outcome = console.expect(alternatives)
-    if outcome == 1:
-        console.sendline(switch.password)
         outcome = console.expect(alternatives)
-    if outcome == 2:
-        console.sendline('enable')
+        if outcome == 0:
+            # some switches, like the dell powerconnect, ask for the username
+            # again
+            console.sendline(switch.username)
+            outcome = console.expect(alternatives)
+        if outcome == 1:
+            console.sendline(switch.password)
+            outcome = console.expect(alternatives)
+        if outcome == 2:
+            console.sendline('enable')
 
     logger.debug('Logged in to switch %r', switch)
     return console
@@ -3,7 +3,7 @@
 import re
 import logging
 
-from hil.ext.switches import _console
+from hil.ext.switches import _console, _parsers
 
 logger = logging.getLogger(__name__)
 
@@ -36,32 +36,12 @@ class _BaseSession(_console.Session):
         self._sendline('sw trunk native vlan none')
 
     def get_port_networks(self, ports):
-        num_re = re.compile(r'(\d+)')
         port_configs = self._port_configs(ports)
         result = {}
         for k, v in port_configs.iteritems():
-            native = v['Trunking Native Mode VLAN'].strip()
-            match = re.match(num_re, native)
-            if match:
-                # We need to call groups to get the part of the string that
-                # actually matched, because it could include some junk on the
-                # end, e.g. "100 (Inactive)".
-                num_str = match.groups()[0]
-                native = int(num_str)
-            else:
-                native = None
-            networks = []
-            range_str = v['Trunking VLANs Enabled']
-            for range_str in v['Trunking VLANs Enabled'].split(','):
-                for num_str in range_str.split('-'):
-                    num_str = num_str.strip()
-                    match = re.match(num_re, num_str)
-                    if match:
-                        # There may be other tokens in the output, e.g.
-                        # the string "(Inactive)" somteimtes appears.
-                        # We should only use the value if it's an actual number
-                        num_str = match.groups()[0]
-                        networks.append(('vlan/%s' % num_str, int(num_str)))
+            native = _parsers.first_number(v['Trunking Native Mode VLAN'])
+            networks = [('vlan/%d' % vlan, vlan) for vlan in
+                        _parsers.vlan_numbers(v['Trunking VLANs Enabled'])]
             if native is not None:
                 networks.append(('vlan/native', native))
             result[k] = networks
@@ -72,43 +52,23 @@ class _BaseSession(_console.Session):
         self._sendline('sw trunk native vlan none')
 
     def _port_configs(self, ports):
-        result = {}
-        for port in ports:
-            result[port] = self._int_config(port.label)
-        return result
+        self._set_terminal_lines('unlimited')
+        try:
+            result = {}
+            for port in ports:
+                result[port] = self._int_config(port.label)
+            return result
+        finally:
+            self._set_terminal_lines('default')
 
     def _int_config(self, interface):
         """Collect information about the specified interface
 
         Returns a dictionary from the output of ``show int sw <interface>``.
+        Paging must be off.
         """
-
-        alternatives = [
-            r'More: .*',  # Prompt to press a key to continue
-            r'Classification rules:\r\n',  # End
-            r'[^ \t\r\n][^:]*:[^\n]*\n',   # Key:Value\r\n,
-            r' [^\n]*\n',                  # continuation line (from k:v)
-        ]
-        self._sendline('show int sw %s' % interface)
-
-        # Name is the first field:
-        self.console.expect('Name: .*')
-        k, v = self.console.after.split(':', 1)
-        result = {k: v}
-        while True:
-            index = self.console.expect(alternatives)
-            if index == 0:
-                self.console.send(' ')
-            elif index == 1:
-                break
-            elif index == 2:
-                k, v = self.console.after.split(':', 1)
-                result[k] = v
-            elif index == 3:
-                result[k] += self.console.after
-
-        self.console.expect(self.main_prompt)
-        return result
+        output = self._show('show int sw %s' % interface, 'Name: ')
+        return _parsers.dell_int_config(output)
 
     def save_running_config(self):
         self._sendline('copy running-config startup-config')
@@ -0,0 +1,536 @@
+"""A fake switch console, standing in for ``ssh`` to a real switch.
+
+The console-based drivers (`dell`, `n3000` and `nexus`) log in to their
+switches by running ``ssh user@host`` under pexpect. `write_ssh_shim` writes
+an executable called ``ssh`` which runs this module instead; with its
+directory first in ``$PATH``, those drivers talk to a fake switch. It
+emulates the parts of the real consoles the drivers rely on: the login and
+mode prompts, the ``switchport`` commands, the output of ``show int sw``
+(including paging), and saving the configuration.
+
+Every session with the same ``--state`` file sees the same ports, kept in a
+`VlanTable`, and each command can be made to take a configurable time, so
+the drivers' throughput can be measured locally. For example::
+
+    python -m hil.ext.switches._fake_console --flavor nexus \\
+        --state /tmp/vlans.json --latency-ms 50 admin@switch-1
+
+Ports which have never been configured have no vlans.
+"""
+
+import argparse
+import os
+import pipes
+import re
+import sys
+import termios
+import time
+
+from hil.ext.switches._fake_vlans import VlanTable, delay, format_vlans, \
+    parse_vlans
+
+# Some of the drivers match output with greedy patterns (for instance
+# 'Name: .*', which pexpect compiles with re.DOTALL), and so rely on the
+# switch sending what follows in a separate chunk, as a real switch, being
+# slow, does. Where a flavor's output contains `SETTLE`, we pause for
+# SETTLE_SECONDS before sending the rest.
+SETTLE = object()
+SETTLE_SECONDS = 0.05
+
+# Abbreviations the drivers use, and the words they stand for:
+ABBREVIATIONS = {
+    'config': 'configure',
+    'int': 'interface',
+    'sw': 'switchport',
+}
+
+
+def _or_none(text):
+    """Return `text`, or 'none' if it is empty or None."""
+    return 'none' if text in ('', None) else str(text)
+
+
+def _show_powerconnect(port, config):
+    """Return the output of ``show int sw`` on a PowerConnect 55xx."""
+    return [
+        'Name: ' + port,
+        SETTLE,
+        'Switchport: enable',
+        'Administrative Mode: ' + config['mode'],
+        'Operational Mode: up',
+        'Access Mode VLAN: 1',
+        'Access Multicast TV VLAN: none',
+        'Trunking Native Mode VLAN: ' + _or_none(config['native']),
+        'Trunking VLANs Enabled: ' + _or_none(format_vlans(config['vlans'])),
+        'General PVID: 1',
+        'General VLANs Enabled: none',
+        'General Egress Tagged VLANs: none',
+        'General Forbidden VLANs: none',
+        'General Ingress Filtering: enabled',
+        'General Acceptable Frame Type: all',
+        'General GVRP status: disabled',
+        'Customer Mode VLAN: none',
+        'Private-vlan promiscuous-association primary VLAN: none',
+        'Private-vlan promiscuous-association Secondary VLANs: none',
+        'Private-vlan host-association primary VLAN: none',
+        'Private-vlan host-association Secondary VLAN: none',
+        'Private-vlan trunk native VLAN: none',
+        'Private-vlan trunk normal VLANs: none',
+        'Dynamically Added VLANs: none',
+        'Forbidden VLANs: none',
+        '',
+        'Classification rules:',
+    ]
+
+
+def _show_n3000(port, config):
+    """Return the output of ``show int sw`` on an N3000."""
+    return [
+        'Port: ' + port,
+        'VLAN Membership Mode: %s Mode' % config['mode'].capitalize(),
+        'Access Mode VLAN: 1 (default)',
+        'General Mode PVID: 1 (default)',
+        'General Mode Ingress Filtering: Enabled',
+        'General Mode Acceptable Frame Type: Admit All',
+        'General Mode Dynamically Added VLANs:',
+        'General Mode Untagged VLANs: 1',
+        'General Mode Tagged VLANs:',
+        'General Mode Forbidden VLANs:',
+        'Trunking Mode Native VLAN: ' + _or_none(config['native']),
+        'Trunking Mode Native VLAN Tagging: Disabled',
+        'Trunking Mode VLANs Enabled: ' +
+        _or_none(format_vlans(config['vlans'])),
+        'Protected Port: False',
+        '',
+    ]
+
+
+def _show_nexus(port, config):
+    """Return the output of ``show int sw`` on a Nexus, for one port."""
+    return [
+        'Name: ' + port,
+        '  Switchport: Enabled',
+        '  Switchport Monitor: Not enabled',
+        '  Operational Mode: ' + config['mode'],
+        '  Access Mode VLAN: 1 (default)',
+        '  Trunking Native Mode VLAN: ' + _or_none(config['native']),
+        '  Trunking VLANs Allowed: ' +
+        _or_none(format_vlans(config['vlans'])),
+        '  Voice VLAN: none',
+        '  Extended Trust State : not trusted [COS = 0]',
+        '  Administrative private-vlan primary host-association: none',
+        '  Administrative private-vlan secondary host-association: none',
+        '  Operational private-vlan: none',
+        '',
+    ]
+
+
+FLAVORS = {
+    'powerconnect55xx': {
+        'login': ['User Name:', 'Password:'],
+        'enable': True,
+        'prompt_suffix': '',
+        'if_mode': '(config-if-%s)',
+        'vlan_mode': '(config-vlan%s)',
+        'port_format': 'gi1/0/%d',
+        'more': 'More: <space>,  Quit: q or CTRL+Z, One line: <return> ',
+        'save_question': 'Overwrite file [startup-config].... (y/n) [n] ',
+        'saved': ['', 'Copy succeeded'],
+        'show': _show_powerconnect,
+        'invalid': '% Unrecognized command',
+    },
+    'delln3000': {
+        'login': ['Password:'],
+        'enable': True,
+        'prompt_suffix': '',
+        'if_mode': '(config-if-%s)',
+        'vlan_mode': '(config-vlan%s)',
+        'port_format': 'gi1/0/%d',
+        'more': '--More-- or (q)uit',
+        'save_question': '\nThis operation may take a few minutes.\n'
+                         'Are you sure you want to save? (y/n) ',
+        'saved': ['', 'Configuration Saved!'],
+        'show': _show_n3000,
+        'invalid': '% Invalid input detected at \'^\' marker.',
+    },
+    'nexus': {
+        'login': ['Password:'],
+        'enable': False,
+        'prompt_suffix': ' ',
+        'if_mode': '(config-if)',
+        'vlan_mode': '(config-vlan)',
+        'port_format': 'Ethernet1/%d',
+        'more': ' --More-- ',
+        'save_question': None,
+        'saved': ['[########################################] 100%',
+                  'Copy complete.'],
+        'show': _show_nexus,
+        'invalid': '% Invalid command at \'^\' marker.',
+    },
+}
+
+
+def _port_key(port):
+    """Sort key putting ports in their natural order (e.g. 1/2 before 1/10).
+    """
+    return [int(part) if part.isdigit() else part
+            for part in re.split(r'(\d+)', port)]
+
+
+class Console(object):
+    """One session with a fake switch.
+
+    The session reads commands from the file descriptor `infd` and writes
+    its output to `outfd`. `switch` is the switch's host name, which is
+    both its key in `table` (a `VlanTable`) and the base of its prompts.
+    `options` are the command line options described in `main`.
+    """
+
+    def __init__(self, flavor, switch, table, infd=0, outfd=1, **options):
+        self.flavor = FLAVORS[flavor]
+        self.switch = switch
+        self.name = switch.split('.')[0]
+        self.table = table
+        self.infd = infd
+        self.outfd = outfd
+        self.latency_ms = options.get('latency_ms', 0)
+        self.jitter_ms = options.get('jitter_ms', 0)
+        self.session_ms = options.get('session_ms', 0)
+        self.save_ms = options.get('save_ms', 0)
+        self.default_page_lines = options.get('page_lines', 24)
+        self.page_lines = self.default_page_lines
+        self.port_count = options.get('ports', 48)
+        self.mode = 'exec' if self.flavor['enable'] else 'main'
+        self.interface = None
+        self.closed = False
+        self._pending = ''
+
+    def run(self):
+        """Log in, then handle commands until logged out (or EOF)."""
+        try:
+            for question in self.flavor['login']:
+                self._write(question)
+                self._readline(echo=question != 'Password:')
+            delay(self.session_ms)
+            self._write('\n' + self._prompt())
+            while not self.closed:
+                self._command(self._readline())
+        except EOFError:
+            pass
+
+    def _write(self, text):
+        """Write `text` to the terminal."""
+        while text:
+            text = text[os.write(self.outfd, text):]
+
+    def _read(self, echo):
+        """Read whatever input is available into the pending input."""
+        data = os.read(self.infd, 1024)
+        if not data:
+            raise EOFError()
+        if echo:
+            self._write(data)
+        self._pending += data
+
+    def _readline(self, echo=True):
+        """Read one line of input, echoing it if `echo` is true."""
+        while '\n' not in self._pending:
+            self._read(echo)
+        line, self._pending = self._pending.split('\n', 1)
+        if not echo:
+            self._write('\n')
+        return line
+
+    def _readchar(self):
+        """Read a single key (without echoing it)."""
+        if not self._pending:
+            self._read(False)
+        char, self._pending = self._pending[0], self._pending[1:]
+        return char
+
+    def _prompt(self):
+        """Return the prompt for the current mode."""
+        mode = {
+            'exec': '>',
+            'main': '#',
+            'config': '(config)#',
+            'if': self.flavor['if_mode'].replace('%s', self.interface or '') +
+            '#',
+            'vlan': self.flavor['vlan_mode'].replace('%s', self.interface or
+                                                     '') + '#',
+        }[self.mode]
+        return self.name + mode + self.flavor['prompt_suffix']
+
+    def _show(self, lines):
+        """Write `lines` of output, and then the prompt.
+
+        The output is paged, unless paging has been turned off.
+        """
+        chunk = []
+        shown = 0
+        for line in lines:
+            if line is SETTLE:
+                self._write(''.join(chunk))
+                chunk = []
+                time.sleep(SETTLE_SECONDS)
+                continue
+            if self.page_lines and shown == self.page_lines:
+                self._write(''.join(chunk) + self.flavor['more'])
+                chunk = []
+                shown = 0
+                if self._readchar() in 'qQ\x1a':
+                    break
+                self._write('\n')
+            chunk.append(line + '\n')
+            shown += 1
+        if not self.closed:
+            chunk.append(self._prompt())
+        self._write(''.join(chunk))
+
+    def _command(self, line):
+        """Handle one line of input."""
+        words = [ABBREVIATIONS.get(word, word) for word in line.split()]
+        if words:
+            delay(self.latency_ms, self.jitter_ms)
+        handler = getattr(self, '_%s_command' % self.mode)
+        output = handler(words) if words else []
+        if output is None:
+            output = [self.flavor['invalid']]
+        self._show(output)
+
+    def _exec_command(self, words):
+        """Handle a command at the unprivileged prompt."""
+        if words == ['enable']:
+            self.mode = 'main'
+            return []
+        if words == ['exit']:
+            self.closed = True
+            return []
+
+    def _main_command(self, words):
+        """Handle a command at the main (privileged) prompt."""
+        if words[0] == 'configure':
+            self.mode = 'config'
+            return []
+        if words == ['exit']:
+            self.closed = True
+            return []
+        if words[:2] == ['show', 'interface'] and words[2:3] == \
+                ['switchport']:
+            return self._show_interfaces(words[3:])
+        if words[0] == 'show' and len(words) == 2 and \
+                words[1] in ('running-config', 'startup-config'):
+            return self._show_config(words[1] == 'startup-config')
+        if words == ['copy', 'running-config', 'startup-config']:
+            return self._save()
+        if words[:2] == ['terminal', 'length'] and len(words) == 3:
+            self.page_lines = int(words[2])
+            return []
+        if words == ['terminal', 'datadump']:
+            self.page_lines = 0
+            return []
+        if words == ['no', 'terminal', 'datadump']:
+            self.page_lines = self.default_page_lines
+            return []
+
+    def _config_command(self, words):
+        """Handle a command at the configuration prompt."""
+        if words[0] == 'interface' and len(words) == 2:
+            self.mode = 'if'
+            self.interface = self._port_name(words[1])
+            return []
+        if words[0] == 'vlan' and len(words) == 2:
+            self.mode = 'vlan'
+            self.interface = words[1]
+            return []
+        return self._leave(words, 'main')
+
+    def _vlan_command(self, words):
+        """Handle a command at the vlan configuration prompt."""
+        return self._leave(words, 'config') or []
+
+    def _if_command(self, words):
+        """Handle a command at the interface configuration prompt."""
+        if words[0] == 'switchport':
+            with self.table.update(self.switch, self.interface) as config:
+                return self._switchport(config, words[1:])
+        if words in (['shutdown'], ['no', 'shutdown']):
+            with self.table.update(self.switch, self.interface) as config:
+                config['shutdown'] = words[0] == 'shutdown'
+                return []
+        return self._leave(words, 'config')
+
+    def _leave(self, words, parent):
+        """Handle ``exit`` and ``end``, which leave the current mode.
+
+        `parent` is the mode ``exit`` returns to.
+        """
+        if words == ['exit']:
+            self.mode = parent
+        elif words == ['end']:
+            self.mode = 'main'
+        else:
+            return None
+        self.interface = None
+        return []
+
+    @staticmethod
+    def _switchport(config, words):
+        """Apply ``switchport`` + `words` to the port configuration `config`.
+        """
+        allowed = ['trunk', 'allowed', 'vlan']
+        native = ['trunk', 'native', 'vlan']
+        if not words:
+            pass
+        elif words[0] == 'mode' and words[1:] in (['trunk'], ['access']):
+            config['mode'] = words[1]
+        elif words == allowed + ['none']:
+            config['vlans'] = []
+        elif words[:4] == allowed + ['add'] and len(words) == 5:
+            config['vlans'] += parse_vlans(words[4])
+        elif words[:4] == allowed + ['remove'] and len(words) == 5:
+            removed = set(parse_vlans(words[4]))
+            config['vlans'] = [v for v in config['vlans'] if v not in removed]
+        elif words[:3] == allowed and len(words) == 4:
+            config['vlans'] = parse_vlans(words[3])
+        elif words == native + ['none']:
+            config['native'] = None
+        elif words[:3] == native and len(words) == 4 and words[3].isdigit():
+            config['native'] = int(words[3])
+        else:
+            return None
+        config['switchport'] = True
+        return []
+
+    def _port_name(self, name):
+        """Return the port name `name`, as the switch itself spells it."""
+        if name.lower().startswith('ethernet'):
+            return 'Ethernet' + name[len('ethernet'):]
+        return name
+
+    def _show_interfaces(self, words):
+        """Return the output of ``show int sw``, for the port in `words`.
+
+        With no port, the output covers all ports.
+        """
+        if words:
+            ports = [self._port_name(' '.join(words))]
+        else:
+            ports = set(self.table.ports(self.switch))
+            ports.update(self.flavor['port_format'] % i
+                         for i in range(1, self.port_count + 1))
+            ports = sorted(ports, key=_port_key)
+        output = []
+        for port in ports:
+            output += self.flavor['show'](port,
+                                          self.table.port(self.switch, port))
+        if not words:
+            output.append(SETTLE)
+        return output
+
+    def _show_config(self, startup):
+        """Return the running (or startup) configuration."""
+        output = [
+            '!Current Configuration:',
+            'hostname ' + self.name,
+            'username admin password ******** privilege 15',
+        ]
+        ports = self.table.ports(self.switch, startup=startup)
+        for port in sorted(ports, key=_port_key):
+            config = ports[port]
+            output.append('interface ' + port)
+            if config['mode'] == 'trunk':
+                output.append(' switchport mode trunk')
+            if config['native'] is not None:
+                output.append(' switchport trunk native vlan %d' %
+                              config['native'])
+            if config['vlans']:
+                output.append(' switchport trunk allowed vlan add ' +
+                              format_vlans(config['vlans']))
+            output.append('exit')
+        return output
+
+    def _save(self):
+        """Copy the running configuration to the startup configuration."""
+        question = self.flavor['save_question']
+        if question is not None:
+            self._write(question)
+            if not self._readline().strip().lower().startswith('y'):
+                return []
+        delay(self.save_ms)
+        self.table.save(self.switch)
+        return self.flavor['saved']
+
+
+def write_ssh_shim(directory, flavor, state, **options):
+    """Write an executable called ``ssh`` to `directory`.
+
+    The executable runs a fake console of flavor `flavor` (one of the keys
+    of `FLAVORS`) with the VLAN table `state`, instead of connecting to a
+    real switch. `options` are passed on as command line options, e.g.
+    ``latency_ms=50`` becomes ``--latency-ms=50``. Returns the path of the
+    executable.
+    """
+    args = ['--flavor=' + flavor, '--state=' + state]
+    for name, value in sorted(options.items()):
+        args.append('--%s=%s' % (name.replace('_', '-'), value))
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__)))))
+    path = os.path.join(directory, 'ssh')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n'
+                'PYTHONPATH=%s${PYTHONPATH:+:$PYTHONPATH}\n'
+                'export PYTHONPATH\n'
+                'exec %s -m hil.ext.switches._fake_console %s "$@"\n' % (
+                    pipes.quote(root),
+                    pipes.quote(sys.executable),
+                    ' '.join(pipes.quote(arg) for arg in args)))
+    os.chmod(path, 0o755)
+    return path
+
+
+def main(argv=None):
+    """Run a fake console session on standard input and output."""
+    parser = argparse.ArgumentParser(
+        description='Fake switch console, taking the place of ssh.')
+    parser.add_argument('--flavor', choices=sorted(FLAVORS), required=True)
+    parser.add_argument('--state', required=True,
+                        help='file holding the VLAN table')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='time each command takes')
+    parser.add_argument('--jitter-ms', type=float, default=0,
+                        help='maximum random extra time per command')
+    parser.add_argument('--session-ms', type=float, default=0,
+                        help='time logging in takes')
+    parser.add_argument('--save-ms', type=float, default=0,
+                        help='time saving the configuration takes')
+    parser.add_argument('--page-lines', type=int, default=24,
+                        help='lines per page of output (0 for no paging)')
+    parser.add_argument('--ports', type=int, default=48,
+                        help='number of ports shown by "show int sw"')
+    parser.add_argument('destination', help='user@host, as for ssh')
+    # Ignore any other ssh options:
+    args, _ = parser.parse_known_args(argv)
+
+    if os.isatty(0):
+        # Read keys as they are typed, and do our own echoing:
+        attrs = termios.tcgetattr(0)
+        attrs[3] &= ~(termios.ICANON | termios.ECHO)
+        attrs[6][termios.VMIN] = 1
+        attrs[6][termios.VTIME] = 0
+        termios.tcsetattr(0, termios.TCSANOW, attrs)
+
+    console = Console(args.flavor,
+                      args.destination.split('@')[-1],
+                      VlanTable(args.state),
+                      latency_ms=args.latency_ms,
+                      jitter_ms=args.jitter_ms,
+                      session_ms=args.session_ms,
+                      save_ms=args.save_ms,
+                      page_lines=args.page_lines,
+                      ports=args.ports)
+    console.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,373 @@
+"""A fake REST endpoint for the Brocade and Dell OS 9 switch drivers.
+
+`Server` speaks the subset of the two switches' XML APIs that the `brocade`
+and `dellnos9` drivers use, keeping the ports' VLAN configuration in a
+`VlanTable`. Point a switch's ``hostname`` at the server's `url` to use it.
+Each request can be made to take a configurable time, so the drivers'
+throughput can be measured locally. For example::
+
+    python -m hil.ext.switches._fake_rest --port 8080 --latency-ms 50
+
+The Brocade API lives under ``/rest`` and the Dell one under ``/api``, so
+one server can stand in for a switch of either kind. Like a real Dell OS 9
+switch, ports start out shut down, and a port with no untagged vlan reports
+the default vlan (1) as its native vlan.
+"""
+
+import argparse
+import BaseHTTPServer
+import logging
+import re
+from SocketServer import ThreadingMixIn
+import threading
+import urllib
+from urlparse import urlsplit
+
+from hil.ext.switches._fake_vlans import VlanTable, delay, format_vlans, \
+    parse_vlans
+
+logger = logging.getLogger(__name__)
+
+BROCADE_NS = 'urn:brocade.com:mgmt:brocade-interface'
+DELL_NS = 'http://www.dell.com/ns/dell:0.1/root'
+
+# The vlan a Dell OS 9 port is an untagged member of by default:
+DELL_DEFAULT_VLAN = 1
+
+_BROCADE_URL = re.compile(
+    r'^/rest/config/running/interface/[^/]+/"([^"]+)"(?:/switchport/?(.*))?$')
+_DELL_INTERFACE_URL = re.compile(
+    r'^/api/running/dell/interfaces/interface/[a-z]+-([0-9-]+)\\?$')
+_DELL_CLI_URL = '/api/running/dell/_operations/cli'
+_DELL_CLI_INPUT = re.compile(
+    r'<input><(config-commands|show-command|exec-command)>(.*)</\1></input>',
+    re.DOTALL)
+
+
+class Server(ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A fake switch, serving HTTP on ``(host, port)``.
+
+    `switch` is the switch's key in `table` (a `VlanTable`, a new one by
+    default). `latency_ms` and `jitter_ms` set how long each request takes,
+    and `save_ms` how long saving the configuration takes. A `port` of 0
+    picks a free port; `url` is the server's base url either way.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, switch='switch',
+                 table=None, latency_ms=0, jitter_ms=0, save_ms=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _Handler)
+        self.switch = switch
+        self.table = table if table is not None else VlanTable()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.save_ms = save_ms
+        self.url = 'http://%s:%d' % self.server_address
+
+    def start(self):
+        """Serve requests in a background thread. Returns the thread."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def stop(self):
+        """Stop serving requests (started by `start`)."""
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles one request to a `Server`."""
+
+    # requests keeps connections alive, and so must we to be realistic:
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        """Handle a GET request."""
+        self._dispatch('GET')
+
+    def do_POST(self):
+        """Handle a POST request."""
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        """Handle a PUT request."""
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        """Handle a DELETE request."""
+        self._dispatch('DELETE')
+
+    def log_message(self, format, *args):
+        """Log requests at debug level, rather than to stderr."""
+        logger.debug('%s', format % args)
+
+    def _dispatch(self, method):
+        """Call the handler for the request's url, and send its response.
+
+        Handlers return a (status, body) tuple.
+        """
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else ''
+        path = urllib.unquote(urlsplit(self.path).path)
+        delay(self.server.latency_ms, self.server.jitter_ms)
+
+        match = _BROCADE_URL.match(path)
+        if match is not None:
+            port, suffix = match.groups()
+            status, text = self._brocade(method, port, suffix or '', body)
+        elif path == _DELL_CLI_URL and method == 'POST':
+            status, text = self._dell_cli(body)
+        elif _DELL_INTERFACE_URL.match(path) is not None:
+            port = _DELL_INTERFACE_URL.match(path).group(1).replace('-', '/')
+            status, text = self._dell_interface(method, port, body)
+        else:
+            status, text = 404, '<errors>Not found</errors>'
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    def _update(self, port):
+        """Return a context manager updating `port`'s configuration."""
+        return self.server.table.update(self.server.switch, port)
+
+    def _port(self, port):
+        """Return `port`'s configuration."""
+        return self.server.table.port(self.server.switch, port)
+
+    def _brocade(self, method, port, suffix, body):
+        """Handle a request to the Brocade API, for `port`.
+
+        `suffix` is the part of the path after ``/switchport/``.
+        """
+        if suffix == '' and method == 'POST':
+            with self._update(port) as config:
+                if config['switchport']:
+                    return 409, '<errors>Object already exists</errors>'
+                config['switchport'] = True
+            return 201, ''
+        if suffix == 'mode' and method == 'GET':
+            return 200, '<mode xmlns="%s"><vlan-mode>%s</vlan-mode></mode>' \
+                % (BROCADE_NS, self._port(port)['mode'])
+        if suffix == 'mode' and method == 'PUT':
+            match = re.search(r'<vlan-mode>(access|trunk)<', body)
+            if match is None:
+                return 400, '<errors>Bad vlan-mode</errors>'
+            with self._update(port) as config:
+                config['mode'] = match.group(1)
+            return 204, ''
+        if suffix == 'trunk' and method == 'GET':
+            return 200, self._brocade_trunk(self._port(port))
+        if suffix == 'trunk' and method == 'PUT':
+            match = re.search(r'<native-vlan>(\d+)<', body)
+            if match is None:
+                return 400, '<errors>Bad native-vlan</errors>'
+            with self._update(port) as config:
+                config['native'] = int(match.group(1))
+            return 204, ''
+        if suffix == 'trunk/allowed/vlan' and method == 'PUT':
+            # Note that the driver sends '<add>N</vlan>', so we don't parse
+            # this as XML.
+            with self._update(port) as config:
+                for vlan in re.findall(r'<add>([\d,-]+)<', body):
+                    config['vlans'] += parse_vlans(vlan)
+                for vlan in re.findall(r'<remove>([\d,-]+)<', body):
+                    removed = parse_vlans(vlan)
+                    config['vlans'] = [v for v in config['vlans']
+                                       if v not in removed]
+                if '<none>true<' in body:
+                    config['vlans'] = []
+            return 204, ''
+        if suffix == 'trunk/native-vlan' and method == 'DELETE':
+            with self._update(port) as config:
+                config['native'] = None
+            return 204, ''
+        if suffix == 'trunk/tag/native-vlan' and method == 'DELETE':
+            return 204, ''
+        return 404, '<errors>Not found</errors>'
+
+    @staticmethod
+    def _brocade_trunk(config):
+        """Return the Brocade API's representation of a trunk port."""
+        allowed = ''
+        if config['vlans']:
+            allowed = '<add>%s</add>' % format_vlans(config['vlans'])
+        native = ''
+        if config['native'] is not None:
+            native = '<native-vlan>%d</native-vlan>' % config['native']
+        return '<trunk xmlns="%s"><allowed><vlan>%s</vlan></allowed>' \
+            '<tag><native-vlan>true</native-vlan></tag>%s</trunk>' % (
+                BROCADE_NS, allowed, native)
+
+    def _dell_interface(self, method, port, body):
+        """Handle a request for the Dell OS 9 interface `port`."""
+        if method == 'GET':
+            config = self._port(port)
+            return 200, '<interface xmlns="%s"><name>%s</name>' \
+                '<shutdown>%s</shutdown></interface>' % (
+                    DELL_NS, port, str(config['shutdown']).lower())
+        if method == 'PUT':
+            with self._update(port) as config:
+                if '<shutdown>true<' in body:
+                    config['shutdown'] = True
+                elif '<shutdown>false<' in body:
+                    config['shutdown'] = False
+                if '<switchport>' in body:
+                    config['switchport'] = True
+            return 204, ''
+        return 405, '<errors>Method not allowed</errors>'
+
+    def _dell_cli(self, body):
+        """Handle a command sent to the Dell OS 9 REST API's CLI."""
+        match = _DELL_CLI_INPUT.search(body)
+        if match is None:
+            return 400, '<errors>Bad input</errors>'
+        kind, command = match.groups()
+        if kind == 'config-commands':
+            return self._dell_config(command)
+        if kind == 'exec-command' and command.strip() == 'write':
+            delay(self.server.save_ms)
+            self.server.table.save(self.server.switch)
+            return self._dell_output(command, '')
+        if kind == 'show-command':
+            words = command.split()
+            if words[:2] == ['interfaces', 'switchport'] and len(words) == 4:
+                return self._dell_output(
+                    command, self._dell_switchport(words[2], words[3]))
+            if words in (['running-config'], ['startup-config']):
+                return self._dell_output(
+                    command, self._dell_config_text(words[0]))
+        return 400, '<errors>Unsupported command</errors>'
+
+    def _dell_config(self, commands):
+        """Apply the configuration commands `commands`.
+
+        `commands` holds ``interface vlan N`` lines, each followed by lines
+        like `` tagged GigabitEthernet 1/3`` or `` no untagged ...``.
+        """
+        vlan = None
+        for line in commands.split('\r\n'):
+            words = line.split()
+            if words[:2] == ['interface', 'vlan'] and len(words) == 3:
+                vlan = int(words[2])
+                continue
+            negate = words[:1] == ['no']
+            if negate:
+                words = words[1:]
+            if vlan is None or len(words) != 3 or \
+                    words[0] not in ('tagged', 'untagged'):
+                if words:
+                    return 400, '<errors>Bad command: %s</errors>' % line
+                continue
+            with self._update(words[2]) as config:
+                if config['shutdown']:
+                    return 400, '<errors>Port %s is not in Layer-2 mode' \
+                        '</errors>' % words[2]
+                if words[0] == 'tagged' and negate:
+                    config['vlans'] = [v for v in config['vlans']
+                                       if v != vlan]
+                elif words[0] == 'tagged':
+                    config['vlans'].append(vlan)
+                elif negate:
+                    if config['native'] == vlan:
+                        config['native'] = None
+                else:
+                    config['native'] = vlan
+        return 200, ''
+
+    def _dell_switchport(self, interface_type, port):
+        """Return the output of ``show interfaces switchport``."""
+        config = self._port(port)
+        native = config['native']
+        if native is None:
+            native = DELL_DEFAULT_VLAN
+        lines = [
+            'Codes:  U - Untagged, T - Tagged',
+            '        x - Dot1x untagged, X - Dot1x tagged',
+            '        G - GVRP tagged, M - Trunk',
+            '        i - Internal untagged, I - Internal tagged, '
+            'v - VLT untagged, V - VLT tagged',
+            '',
+            'Name: %s %s' % (interface_type, port),
+            '802.1QTagged: Hybrid',
+            'Vlan membership:',
+            'Q       Vlans',
+            'U       %d' % native,
+        ]
+        if config['vlans']:
+            lines.append('T       %s' % format_vlans(config['vlans']))
+        lines += ['', 'Native Vlan Id: %d.' % native, '']
+        return '\r\n'.join(lines)
+
+    def _dell_config_text(self, which):
+        """Return the running (or startup) configuration."""
+        ports = self.server.table.ports(self.server.switch,
+                                        startup=which == 'startup-config')
+        lines = [
+            'Current Configuration ...',
+            '! Version 9.11(0.0P6)',
+            '!',
+            'hostname ' + self.server.switch,
+            '!',
+            'username admin password 7 ******** privilege 15',
+        ]
+        vlans = {}
+        for port, config in sorted(ports.items()):
+            lines += ['!',
+                      'interface GigabitEthernet ' + port,
+                      ' portmode hybrid' if config['switchport'] else '',
+                      ' shutdown' if config['shutdown'] else ' no shutdown']
+            for vlan in config['vlans']:
+                vlans.setdefault(vlan, []).append(' tagged ' + port)
+            if config['native'] is not None:
+                vlans.setdefault(config['native'], []) \
+                    .append(' untagged ' + port)
+        for vlan in sorted(vlans):
+            lines += ['!', 'interface Vlan %d' % vlan] + vlans[vlan]
+        return '\r\n'.join(line for line in lines if line)
+
+    def _dell_output(self, command, text):
+        """Return a successful response to the CLI command `command`."""
+        output = '\r\n\r\n'.join([command, text, self.server.switch + '#'])
+        return 200, '<output xmlns="%s"><command>%s</command></output>' % (
+            DELL_NS, output)
+
+
+def main(argv=None):
+    """Run a fake REST switch until interrupted."""
+    parser = argparse.ArgumentParser(
+        description='Fake Brocade and Dell OS 9 REST API server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--switch', default='switch',
+                        help="the switch's host name")
+    parser.add_argument('--state',
+                        help='file holding the VLAN table (default: memory)')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='time each request takes')
+    parser.add_argument('--jitter-ms', type=float, default=0,
+                        help='maximum random extra time per request')
+    parser.add_argument('--save-ms', type=float, default=0,
+                        help='time saving the configuration takes')
+    args = parser.parse_args(argv)
+    server = Server(host=args.host,
+                    port=args.port,
+                    switch=args.switch,
+                    table=VlanTable(args.state),
+                    latency_ms=args.latency_ms,
+                    jitter_ms=args.jitter_ms,
+                    save_ms=args.save_ms)
+    print('Serving on %s' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
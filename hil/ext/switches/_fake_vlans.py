@@ -0,0 +1,136 @@
+"""Stateful VLAN tables for the fake switches.
+
+The fake console (`_fake_console`) and the fake REST server (`_fake_rest`)
+stand in for real switches when working on the drivers without hardware.
+Both keep the VLAN configuration of their ports in a `VlanTable`, so that
+what the drivers read back reflects what they configured.
+
+A fake console runs as a separate process for each ssh session, so its table
+is kept in a JSON file, which is locked while it is read or updated.
+"""
+
+from contextlib import contextmanager
+import copy
+import fcntl
+import json
+import random
+import re
+import threading
+import time
+
+# The configuration of a port which has never been touched:
+DEFAULT_PORT = {
+    'switchport': False,
+    'mode': 'access',
+    'native': None,
+    'vlans': [],
+    'shutdown': True,
+}
+
+
+class VlanTable(object):
+    """The VLAN configuration of the ports of one or more fake switches.
+
+    Each port's configuration is a dictionary like `DEFAULT_PORT`: 'vlans'
+    is a sorted list of the (tagged) vlan ids allowed on the port, 'native'
+    the native vlan id (or None), and 'mode' either 'access' or 'trunk'.
+
+    If `path` is given, the table is kept in that file, and may be shared
+    by several processes. Otherwise, it is kept in memory, and may be shared
+    by several threads.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._data = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self, exclusive):
+        """Lock the table, and yield its contents.
+
+        If `exclusive` is true, changes to the contents are saved when the
+        block exits (without raising).
+        """
+        if self.path is None:
+            with self._lock:
+                yield self._data
+            return
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            f.seek(0)
+            text = f.read()
+            data = json.loads(text) if text else {}
+            yield data
+            if exclusive:
+                f.seek(0)
+                f.truncate()
+                json.dump(data, f)
+
+    def port(self, switch, port):
+        """Return (a copy of) the configuration of `port` on `switch`."""
+        with self._locked(False) as data:
+            ports = data.get(switch, {}).get('running', {})
+            return copy.deepcopy(ports.get(port, DEFAULT_PORT))
+
+    def ports(self, switch, startup=False):
+        """Return (a copy of) the configuration of all ports on `switch`.
+
+        Only ports which have been configured are included. If `startup`
+        is true, return the saved configuration rather than the running one.
+        """
+        with self._locked(False) as data:
+            config = 'startup' if startup else 'running'
+            return copy.deepcopy(data.get(switch, {}).get(config, {}))
+
+    @contextmanager
+    def update(self, switch, port):
+        """Yield the configuration of `port` on `switch`, for modification.
+
+        The changes are saved when the block exits, unless it raises.
+        """
+        with self._locked(True) as data:
+            ports = data.setdefault(switch, {}).setdefault('running', {})
+            config = copy.deepcopy(ports.get(port, DEFAULT_PORT))
+            yield config
+            config['vlans'] = sorted(set(config['vlans']))
+            ports[port] = config
+
+    def save(self, switch):
+        """Copy the running configuration of `switch` to its startup one."""
+        with self._locked(True) as data:
+            config = data.setdefault(switch, {})
+            config['startup'] = copy.deepcopy(config.get('running', {}))
+
+
+def parse_vlans(text):
+    """Return the vlan ids in `text`, e.g. '12,14-16' or '12 14-16'.
+
+    The result is a sorted list of integers.
+    """
+    vlans = set()
+    for start, end in re.findall(r'(\d+)(?:-(\d+))?', text):
+        vlans.update(range(int(start), int(end or start) + 1))
+    return sorted(vlans)
+
+
+def format_vlans(vlans):
+    """Return the vlan ids `vlans` as a string, e.g. '12,14-16'.
+
+    Returns the empty string if `vlans` is empty.
+    """
+    ranges = []
+    for vlan in sorted(vlans):
+        if ranges and ranges[-1][1] == vlan - 1:
+            ranges[-1][1] = vlan
+        else:
+            ranges.append([vlan, vlan])
+    return ','.join(str(start) if start == end else '%d-%d' % (start, end)
+                    for start, end in ranges)
+
+
+def delay(latency_ms, jitter_ms=0):
+    """Sleep for `latency_ms`, plus up to `jitter_ms`, milliseconds."""
+    seconds = (latency_ms + random.uniform(0, jitter_ms)) / 1000.0
+    if seconds > 0:
+        time.sleep(seconds)
@@ -0,0 +1,173 @@
+"""Parsers for the output of switch commands.
+
+Each parser here takes the whole output of a command, as read from the
+switch, and parses it in a single pass, rather than matching it a line at a
+time as it arrives. This keeps parsing off the critical path of reading a
+large switch's configuration: the drivers only wait for the prompt which
+ends the output, and parse it afterwards.
+
+`hil.ext.switches._replay` can feed recorded outputs through the drivers
+which use these; the recordings used by the tests are under
+``tests/corpus/switches``.
+"""
+
+import re
+
+from hil.ext.switches.common import parse_vlans
+
+# A "Key: value" line, followed by any continuation lines (which are
+# indented) of the value:
+_KEY_VALUE_RE = re.compile(r'^([^\s:][^:\r\n]*):'
+                           r'([^\r\n]*(?:\r?\n[ \t]+[^\r\n]*)*)',
+                           re.M)
+
+# The start of a port in ``show int sw`` on a Nexus, or one of its (indented)
+# "Key: value" lines:
+_NEXUS_RE = re.compile(r'^Name:[ \t]*(\S+)'
+                       r'|^  ([A-Z][^:\r\n]*):([^\r\n]*)',
+                       re.M)
+
+_NUMBER_RE = re.compile(r'\d+')
+
+# A number, at the start of a list like "12,14-16", or after a separator:
+_VLAN_NUMBER_RE = re.compile(r'(?:^|[,-])\s*(\d+)')
+
+_NOS9_TAGGED_RE = re.compile(r'T(\d+(-\d+)?)(,\d+(-\d+)?)*')
+_NOS9_NATIVE_RE = re.compile(r'NativeVlanId:(\d+)\.')
+
+# An element of an ovsdb list or map; commas inside quotes don't end it:
+_OVS_ITEM_RE = re.compile(r'(?:"(?:[^"\\]|\\.)*"|[^,])+')
+_OVS_PAIR_RE = re.compile(r'((?:"(?:[^"\\]|\\.)*"|[^=:"])*)[=:](.*)')
+
+
+def key_values(text):
+    """Parse lines of the form "Key: value" into a dictionary.
+
+    Lines which are indented continue the value of the line before them.
+    Whitespace around (and inside) values is normalized to single spaces.
+    Lines without a colon are ignored.
+    """
+    return dict((key, ' '.join(value.split()))
+                for key, value in _KEY_VALUE_RE.findall(text))
+
+
+def dell_int_config(text):
+    """Parse the output of ``show int sw <port>`` on a PowerConnect 55xx.
+
+    Returns a dictionary of its fields, up to the classification rules.
+    """
+    end = text.find('Classification rules:')
+    if end != -1:
+        text = text[:end]
+    return key_values(text)
+
+
+def n3000_int_config(text):
+    """Parse the output of ``show int sw <port>`` on a Dell N3000.
+
+    Returns a dictionary of its fields.
+    """
+    return key_values(text)
+
+
+def nexus_int_configs(text):
+    """Parse the output of ``show int sw`` on a Nexus.
+
+    Returns a dictionary mapping the name of each interface (as the switch
+    calls it, e.g. "Ethernet1/12") to a dictionary of its fields.
+    """
+    result = {}
+    info = None
+    for name, key, value in _NEXUS_RE.findall(text):
+        if name:
+            info = result[name] = {}
+        elif info is not None:
+            info[key.strip()] = value.strip()
+    return result
+
+
+def first_number(text):
+    """Return the number `text` starts with, or None if there isn't one.
+
+    Anything after the number is ignored, e.g. "100 (Inactive)" gives 100.
+    """
+    match = _NUMBER_RE.match(text.strip())
+    if match is None:
+        return None
+    return int(match.group())
+
+
+def vlan_numbers(text):
+    """Return the numbers in a list of vlans like "12,14-16 (Inactive)".
+
+    Tokens which don't start with a number, like "none" or "(Inactive)",
+    are skipped.
+
+    XXX: a range only gives its ends: "14-16" is 14 and 16, not 14 to 16.
+    The console drivers have always read vlan lists this way.
+    """
+    return [int(num) for num in _VLAN_NUMBER_RE.findall(text)]
+
+
+def nos9_switchport(text):
+    """Parse ``show interfaces switchport <port>`` on Dell OS 9.
+
+    `text` is the body of the response to the show command. Returns a tuple
+    ``(tagged, native)``, where `tagged` is the list of tagged vlan ids, and
+    `native` the native vlan id, or None if the output has none. Vlan ids
+    are strings.
+    """
+    text = text.replace(' ', '')
+    match = _NOS9_TAGGED_RE.search(text)
+    if match is None:
+        tagged = []
+    else:
+        tagged = parse_vlans(match.group().replace('T', ''))
+    match = _NOS9_NATIVE_RE.search(text)
+    if match is None:
+        native = None
+    else:
+        native = match.group(1)
+    return tagged, native
+
+
+def _ovs_value(value):
+    """Convert one column of ``ovs-vsctl list`` output.
+
+    Lists become lists of strings, and maps dictionaries of strings; any
+    other value is left as it is (including quotes, if any).
+    """
+    if value.startswith('['):
+        return [item.strip() for item in _OVS_ITEM_RE.findall(value[1:-1])]
+    if value.startswith('{'):
+        result = {}
+        for item in _OVS_ITEM_RE.findall(value[1:-1]):
+            match = _OVS_PAIR_RE.match(item)
+            if match is not None:
+                result[match.group(1).strip()] = match.group(2).strip()
+        return result
+    return value
+
+
+def ovs_record(text):
+    """Parse the output of ``ovs-vsctl list <table> <record>``.
+
+    Returns a dictionary mapping each column to its value; see `_ovs_value`.
+    """
+    result = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition(':')
+        if sep:
+            result[key.strip()] = _ovs_value(value.strip())
+    return result
+
+
+def ovs_records(text):
+    """Parse the output of ``ovs-vsctl list <table> <record>...``.
+
+    Returns a list of the records (see `ovs_record`), in the order they
+    appear in `text`; they are separated by blank lines.
+    """
+    return [ovs_record(record)
+            for record in re.split(r'\n[ \t]*\n', text.strip())
+            if record]
@@ -0,0 +1,273 @@
+"""Record the output of switch commands, and replay it through the drivers.
+
+This lets the drivers' parsing be tested and benchmarked without a switch.
+A recording is the output of the command a driver runs to read a port's
+vlans (e.g. ``show int sw gi1/0/5``), kept in a ``.txt`` file, next to a
+``.json`` file describing it::
+
+    {
+        "command": "show int sw gi1/0/5",
+        "port": "gi1/0/5",
+        "networks": [["vlan/102", 102], ["vlan/native", 102]]
+    }
+
+where "networks" is what the driver's ``get_port_networks`` gives for the
+port. Recordings of the console-based drivers may also have a
+"dummy_vlan", the switch's dummy vlan if the driver has one. Line endings
+are stored as ``\\n``; the console ones are sent as ``\\r\\n`` on replay.
+
+To record the output of a real switch, run e.g.::
+
+    python -m hil.ext.switches._replay --driver nexus \\
+        --hostname switch.example.com --username admin --password secret \\
+        --dummy-vlan 2222 --port Ethernet1/5 --output tests/corpus/switches
+
+The ``.json`` files it writes give the networks which the driver currently
+reads from the output; check them against the switch's configuration
+before adding them to the corpus.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import re
+import subprocess
+
+import pexpect
+
+from hil.model import Port
+from hil.ext.switches import _console, _parsers
+
+# For each console-based driver: its module, switch class, and session class.
+CONSOLE_DRIVERS = {
+    'powerconnect55xx': ('hil.ext.switches.dell', 'PowerConnect55xx',
+                         '_PowerConnect55xxSession'),
+    'delln3000': ('hil.ext.switches.n3000', 'DellN3000',
+                  '_DellN3000Session'),
+    'nexus': ('hil.ext.switches.nexus', 'Nexus', '_Session'),
+}
+
+DRIVERS = sorted(list(CONSOLE_DRIVERS) + ['dellnos9', 'ovs'])
+
+
+class ReplayConsole(object):
+    """A stand-in for a pexpect console, which replays recorded output.
+
+    `responses` maps commands to their (recorded) output. Each line sent to
+    the console is echoed back, followed by its output, if any, and then
+    by `prompt`, as a switch would. The console starts out showing the
+    prompt.
+
+    If `trickle` is true, output only becomes available a line at a time,
+    as `expect` asks for more; otherwise, all of it is available as soon as
+    the command is sent. Real consoles are somewhere in between.
+    """
+
+    def __init__(self, responses, prompt='switch# ', trickle=False):
+        self.responses = responses
+        self.prompt = prompt
+        self.trickle = trickle
+        self.sent = []
+        self.buffer = ''
+        self.before = self.after = self.match = None
+        self._pending = []
+        self._queue('\r\n' + prompt)
+
+    def _queue(self, text):
+        """Make `text` the next output of the console."""
+        if self.trickle:
+            self._pending.extend(text.splitlines(True))
+        else:
+            self.buffer += text
+
+    def send(self, text):
+        """Send `text`, without a newline (e.g. to get past a pager)."""
+        self.sent.append(text)
+
+    def sendline(self, line=''):
+        """Send the command `line`, and queue up its recorded output."""
+        self.sent.append(line)
+        self._queue(line + '\r\n' + self.responses.get(line, '') + self.prompt)
+
+    def expect(self, pattern):
+        """Wait for `pattern`, like pexpect's ``spawn.expect``.
+
+        `pattern` is a regex, or a list of them; as with pexpect, the one
+        which matches earliest in the output wins, and ties go to the first
+        in the list. ``pexpect.EOF`` may be among them, and matches when the
+        output has run out. Raises ``pexpect.TIMEOUT`` if nothing matches.
+        """
+        if not isinstance(pattern, list):
+            pattern = [pattern]
+        regexes = [(index, re.compile(p, re.DOTALL))
+                   for index, p in enumerate(pattern)
+                   if isinstance(p, basestring)]
+        while True:
+            best = None
+            for index, regex in regexes:
+                match = regex.search(self.buffer)
+                if match is not None and \
+                        (best is None or match.start() < best[1].start()):
+                    best = (index, match)
+            if best is not None:
+                index, self.match = best
+                self.before = self.buffer[:self.match.start()]
+                self.after = self.match.group()
+                self.buffer = self.buffer[self.match.end():]
+                return index
+            if not self._pending:
+                break
+            self.buffer += self._pending.pop(0)
+        if pexpect.EOF in pattern:
+            self.before, self.after, self.buffer = self.buffer, pexpect.EOF, ''
+            return pattern.index(pexpect.EOF)
+        raise pexpect.TIMEOUT('%r not found in recorded output' % (pattern,))
+
+
+def load(path):
+    """Load the recording in `path` (without the extension).
+
+    Returns the contents of its ``.json`` file, with the recorded output
+    added as "output".
+    """
+    with open(path + '.json') as f:
+        recording = json.load(f)
+    with open(path + '.txt') as f:
+        recording['output'] = f.read()
+    return recording
+
+
+def _switch(driver, **kwargs):
+    """Return a (transient) switch object for `driver`."""
+    if driver in CONSOLE_DRIVERS:
+        module, cls, _ = CONSOLE_DRIVERS[driver]
+    elif driver == 'dellnos9':
+        module, cls = 'hil.ext.switches.dellnos9', 'DellNOS9'
+        kwargs.setdefault('interface_type', 'GigabitEthernet')
+    else:
+        module, cls = 'hil.ext.switches.ovs', 'Ovs'
+        kwargs = {'ovs_bridge': kwargs.get('hostname')}
+    cls = getattr(importlib.import_module(module), cls)
+    return cls(label='switch', **kwargs)
+
+
+def console_session(driver, responses, dummy_vlan=None, trickle=False):
+    """Return a session of the console-based `driver`, on a ReplayConsole.
+
+    `responses` and `trickle` are passed to the `ReplayConsole`.
+    """
+    module, _, session_cls = CONSOLE_DRIVERS[driver]
+    session_cls = getattr(importlib.import_module(module), session_cls)
+    kwargs = {}
+    if dummy_vlan is not None:
+        kwargs['dummy_vlan'] = dummy_vlan
+    switch = _switch(driver, hostname='switch', username='', password='',
+                     **kwargs)
+    console = ReplayConsole(responses, trickle=trickle)
+    return session_cls(switch=switch,
+                       console=console,
+                       **dict(_console.get_prompts(console), **kwargs))
+
+
+def port_networks(driver, recording):
+    """Replay `recording` (see `load`) through `driver`.
+
+    Returns what the driver's ``get_port_networks`` gives for the port.
+    """
+    output = recording['output']
+    if driver in CONSOLE_DRIVERS:
+        session = console_session(
+            driver, {recording['command']: output.replace('\n', '\r\n')},
+            dummy_vlan=recording.get('dummy_vlan'))
+        switch = session.switch
+    else:
+        switch = session = _switch(driver, hostname='switch', username='',
+                                   password='')
+        if driver == 'dellnos9':
+            session._is_port_on = lambda port: True
+            session._get_port_info = lambda port: output.replace(' ', '')
+        else:
+            session._ports_info = \
+                lambda ports: _parsers.ovs_records(output)
+    port = Port(recording['port'], switch)
+    return session.get_port_networks([port])[port]
+
+
+def record(args):
+    """Record the output of the command `args.driver` runs for `args.port`.
+
+    Returns the recording, like `load` would.
+    """
+    switch = _switch(args.driver,
+                     hostname=args.hostname,
+                     username=args.username,
+                     password=args.password,
+                     **({'dummy_vlan': args.dummy_vlan}
+                        if args.dummy_vlan else {}))
+    recording = {'port': args.port}
+    if args.dummy_vlan:
+        recording['dummy_vlan'] = args.dummy_vlan
+    if args.driver in CONSOLE_DRIVERS:
+        if args.driver == 'nexus':
+            command = 'show int sw'
+        else:
+            command = 'show int sw ' + args.port
+        session = switch.session()
+        session._set_terminal_lines('unlimited')
+        session.console.sendline(command)
+        session.console.expect(re.escape(command) + r'\r?\n')
+        session.console.expect(session.main_prompt)
+        output = session.console.before
+        session._set_terminal_lines('default')
+        session.disconnect()
+    elif args.driver == 'dellnos9':
+        from hil.ext.switches.dellnos9 import SHOW
+        command = 'interfaces switchport %s %s' % \
+            (switch.interface_type, args.port)
+        output = switch._execute(SHOW, command).text
+    else:
+        command = 'ovs-vsctl list port ' + args.port
+        output = subprocess.check_output(['sudo'] + command.split())
+    recording['command'] = command
+    recording['output'] = output.replace('\r\n', '\n')
+    return recording
+
+
+def main(argv=None):
+    """Record the output of a real switch, for the corpus."""
+    parser = argparse.ArgumentParser(
+        description='Record the output a switch driver parses.')
+    parser.add_argument('--driver', choices=DRIVERS, required=True)
+    parser.add_argument('--hostname', required=True,
+                        help='host name, API URL, or (ovs) bridge')
+    parser.add_argument('--username', default='')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--dummy-vlan', help='the switch\'s dummy vlan')
+    parser.add_argument('--port', required=True)
+    parser.add_argument('--name', help='name of the recording '
+                        '(default: the port, with "/" replaced by "-")')
+    parser.add_argument('--output', required=True,
+                        help='corpus directory to write the recording to')
+    args = parser.parse_args(argv)
+    if args.driver in ('delln3000', 'nexus') and not args.dummy_vlan:
+        parser.error('--dummy-vlan is required for delln3000 and nexus')
+
+    recording = record(args)
+    recording['networks'] = port_networks(args.driver, recording)
+    directory = os.path.join(args.output, args.driver)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    path = os.path.join(directory,
+                        args.name or args.port.replace('/', '-'))
+    with open(path + '.txt', 'w') as f:
+        f.write(recording.pop('output'))
+    with open(path + '.json', 'w') as f:
+        json.dump(recording, f, indent=4, separators=(',', ': '),
+                  sort_keys=True)
+        f.write('\n')
+    print('Wrote %s.txt and %s.json' % (path, path))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,8 +10,10 @@ import re
 import requests
 from schema import Schema, Optional
 
+from hil import throttling, tracing
 from hil.migrations import paths
 from hil.model import db, Switch, SwitchSession
+from hil.profiler import trace_call
 from hil.errors import BadArgumentError
 from hil.model import BigIntegerType
 from hil.errors import SwitchError
@@ -25,6 +27,7 @@ logger = logging.getLogger(__name__)
 core_schema[__name__] = {
     Optional('save'): string_is_bool
 }
+core_schema[__name__].update(throttling.SCHEMA)
 
 
 class Brocade(Switch, SwitchSession):
@@ -74,14 +77,8 @@ class Brocade(Switch, SwitchSession):
     def disconnect(self):
         pass
 
-    def modify_port(self, port, channel, new_network):
-        # XXX: We ought to be able to do a Port.query ... one() here, but
-        # there's somthing I(zenhack)  don't understand going on with when
-        # things are committed in the tests for this driver, and we don't
-        # get any results that way. We should figure out what's going on with
-        # that test and change this.
-        (port,) = filter(lambda p: p.label == port, self.ports)
-        interface = port.label
+    def modify_port(self, port, channel, new_network, context=None):
+        interface = port
 
         if channel == 'vlan/native':
             if new_network is None:
@@ -250,7 +247,8 @@ class Brocade(Switch, SwitchSession):
         """
         url = self._construct_url(interface, suffix='trunk/allowed/vlan')
         payload = '<vlan><none>true</none></vlan>'
-        requests.put(url, data=payload, auth=self._auth)
+        with trace_call('switch', 'PUT %s' % url):
+            requests.put(url, data=payload, auth=self._auth)
 
     def _set_native_vlan(self, interface, vlan):
         """ Set the native vlan of an interface.
@@ -317,7 +315,9 @@ class Brocade(Switch, SwitchSession):
 
     def _make_request(self, method, url, data=None,
                       acceptable_error_codes=()):
-        r = requests.request(method, url, data=data, auth=self._auth)
+        with tracing.span('switch_command', command='%s %s' % (method, url)), \
+                trace_call('switch', '%s %s' % (method, url)):
+            r = requests.request(method, url, data=data, auth=self._auth)
         if r.status_code >= 400 and \
            r.status_code not in acceptable_error_codes:
             logger.error('Bad Request to switch. '
@@ -1,7 +1,5 @@
 """Helper methods for switches"""
 from hil.config import cfg
-from hil import model
-from hil.model import db
 from hil.errors import BlockedError
 import ast
 
@@ -57,19 +55,21 @@ def should_save(switch_obj):
 def check_native_networks(nic, op_type, channel):
     """Check to ensure that native network is the first one to be added
     and last one to be removed
+
+    The check is against the networks the nic will be on once its pending
+    actions are done.
     """
-    table = model.NetworkAttachment
-    query = db.session.query(table).filter(table.nic_id == nic.id)
+    channels = nic.planned_networks()
 
     if channel != 'vlan/native' and op_type == 'connect' and \
-       query.filter(table.channel == 'vlan/native').count() == 0:
-        # checks if it is trying to attach a trunked network, and then in
-        # in the db see if nic does not have any networks attached natively
+       'vlan/native' not in channels:
+        # checks if it is trying to attach a trunked network, and then
+        # see if nic does not have any networks attached natively
         raise BlockedError("Please attach a native network first")
     elif channel == 'vlan/native' and op_type == 'detach' and \
-            query.filter(table.channel != 'vlan/native').count() > 0:
-        # if it is detaching a network, then check in the database if there
-        # are any trunked vlans.
+            any(other != 'vlan/native' for other in channels):
+        # if it is detaching a network, then check if there are any trunked
+        # vlans.
         raise BlockedError("Please remove all trunked Vlans"
                            " before removing the native vlan")
 
@@ -8,6 +8,7 @@ import logging
 from schema import Schema, Optional
 import re
 
+from hil import throttling
 from hil.model import db, Switch
 from hil.migrations import paths
 from hil.ext.switches import _console
@@ -23,6 +24,7 @@ logger = logging.getLogger(__name__)
 core_schema[__name__] = {
     Optional('save'): string_is_bool
 }
+core_schema[__name__].update(throttling.SCHEMA)
 
 
 class PowerConnect55xx(Switch):
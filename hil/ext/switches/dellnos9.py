@@ -9,12 +9,14 @@ import re
 import requests
 from schema import Schema, Optional
 
+from hil import throttling, tracing
 from hil.model import db, Switch, SwitchSession
+from hil.profiler import trace_call
 from hil.errors import BadArgumentError
 from hil.model import BigIntegerType
 from hil.network_allocator import get_network_allocator
-from hil.ext.switches.common import should_save, check_native_networks, \
- parse_vlans
+from hil.ext.switches import _parsers
+from hil.ext.switches.common import should_save, check_native_networks
 from hil.config import core_schema, string_is_bool
 
 
@@ -27,6 +29,7 @@ EXEC = 'exec-command'
 core_schema[__name__] = {
     Optional('save'): string_is_bool
 }
+core_schema[__name__].update(throttling.SCHEMA)
 
 
 class DellNOS9(Switch, SwitchSession):
@@ -75,9 +78,8 @@ class DellNOS9(Switch, SwitchSession):
         """Since the switch is not connection oriented, we don't need to
         establish a session or disconnect from it."""
 
-    def modify_port(self, port, channel, new_network):
-        (port,) = filter(lambda p: p.label == port, self.ports)
-        interface = port.label
+    def modify_port(self, port, channel, new_network, context=None):
+        interface = port
 
         if channel == 'vlan/native':
             if new_network is None:
@@ -110,10 +112,19 @@ class DellNOS9(Switch, SwitchSession):
     def get_port_networks(self, ports):
         response = {}
         for port in ports:
-            response[port] = self._get_vlans(port.label)
-            native = self._get_native_vlan(port.label)
+            # Get the port's vlans and its native vlan in one go, rather
+            # than with _get_vlans and _get_native_vlan, which would fetch
+            # the same output twice.
+            response[port] = []
+            if not self._is_port_on(port.label):
+                continue
+            tagged, native = _parsers.nos9_switchport(
+                self._get_port_info(port.label))
+            response[port] = [('vlan/%s' % x, x) for x in tagged]
             if native is not None:
-                response[port].append(native)
+                response[port].append(('vlan/native', native))
+            else:
+                logger.error('Unexpected: No native vlan found')
 
         return response
 
@@ -137,17 +148,8 @@ class DellNOS9(Switch, SwitchSession):
 
         if not self._is_port_on(interface):
             return []
-        response = self._get_port_info(interface)
-
-        # finds a comma separated list of integers and/or ranges starting with
-        # T. Sample T12,14-18,23,28,80-90 or T20 or T20,22 or T20-22
-        match = re.search(r'T(\d+(-\d+)?)(,\d+(-\d+)?)*', response)
-        if match is None:
-            return []
-
-        vlan_list = parse_vlans(match.group().replace('T', ''))
-
-        return [('vlan/%s' % x, x) for x in vlan_list]
+        tagged, _ = _parsers.nos9_switchport(self._get_port_info(interface))
+        return [('vlan/%s' % x, x) for x in tagged]
 
     def _get_native_vlan(self, interface):
         """ Return the native vlan of an interface.
@@ -161,11 +163,8 @@ class DellNOS9(Switch, SwitchSession):
         """
         if not self._is_port_on(interface):
             return None
-        response = self._get_port_info(interface)
-        match = re.search(r'NativeVlanId:(\d+)\.', response)
-        if match is not None:
-            vlan = match.group(1)
-        else:
+        _, vlan = _parsers.nos9_switchport(self._get_port_info(interface))
+        if vlan is None:
             logger.error('Unexpected: No native vlan found')
             return
 
@@ -419,7 +418,9 @@ class DellNOS9(Switch, SwitchSession):
         return '{http://www.dell.com/ns/dell:0.1/root}%s' % name
 
     def _make_request(self, method, url, data=None):
-        r = requests.request(method, url, data=data, auth=self._auth)
+        with tracing.span('switch_command', command='%s %s' % (method, url)), \
+                trace_call('switch', '%s %s' % (method, url)):
+            r = requests.request(method, url, data=data, auth=self._auth)
         if r.status_code >= 400:
             logger.error('Bad Request to switch. Response: %s', r.text)
         return r
@@ -1,23 +1,73 @@
 """A switch driver that maintains local state only.
 
 Meant for use in the test suite.
+
+To stand in for real hardware in benchmarks, the switch can be made slow or
+unreliable with the following options in the ``[hil.ext.switches.mock]``
+section of hil.cfg (all default to 0):
+
+* ``latency_ms``: how long each modify_port, modify_port_channels or
+  revert_port takes.
+* ``jitter_ms``: up to this much (chosen at random) is added to each of them.
+* ``failure_percent``: the percentage of them which fail with a
+  SwitchConnectionError.
+* ``session_ms``: how long connecting to the switch takes.
+* ``save_ms``: how long disconnecting (i.e. saving the config) takes.
 """
 
 from collections import defaultdict
+from hil import throttling
 from hil.model import Switch, SwitchSession
 from hil.migrations import paths
 import schema
+import random
 import re
+import time
 from sqlalchemy import Column, ForeignKey, String
 from os.path import dirname, join
-from hil.errors import BadArgumentError
+from hil.config import cfg, core_schema, string_is_non_negative_float
+from hil.errors import BadArgumentError, SwitchConnectionError
 from hil.model import BigIntegerType
 
 paths[__name__] = join(dirname(__file__), 'migrations', 'mock')
 
+core_schema[__name__] = {
+    schema.Optional('latency_ms'): string_is_non_negative_float,
+    schema.Optional('jitter_ms'): string_is_non_negative_float,
+    schema.Optional('failure_percent'): schema.And(
+        string_is_non_negative_float, lambda p: float(p) <= 100),
+    schema.Optional('session_ms'): string_is_non_negative_float,
+    schema.Optional('save_ms'): string_is_non_negative_float,
+}
+core_schema[__name__].update(throttling.SCHEMA)
+
 LOCAL_STATE = defaultdict(lambda: defaultdict(dict))
 
 
+def _option(name):
+    """Return the value of the option `name`, or 0 if it isn't set."""
+    if cfg.has_option(__name__, name):
+        return cfg.getfloat(__name__, name)
+    return 0.0
+
+
+def _delay(ms):
+    """Sleep for `ms` milliseconds, if it's positive."""
+    if ms > 0:
+        time.sleep(ms / 1000.0)
+
+
+def _command():
+    """Simulate sending a command to the switch.
+
+    Waits for ``latency_ms`` plus up to ``jitter_ms``, then fails
+    ``failure_percent`` percent of the time.
+    """
+    _delay(_option('latency_ms') + random.uniform(0, _option('jitter_ms')))
+    if random.random() * 100 < _option('failure_percent'):
+        raise SwitchConnectionError('Simulated failure on mock switch')
+
+
 class MockSwitch(Switch, SwitchSession):
     """A switch which stores configuration in memory.
 
@@ -61,9 +111,11 @@ class MockSwitch(Switch, SwitchSession):
         return
 
     def session(self):
+        _delay(_option('session_ms'))
         return self
 
-    def modify_port(self, port, channel, new_network):
+    def modify_port(self, port, channel, new_network, context=None):
+        _command()
         state = LOCAL_STATE[self.label]
 
         if new_network is None:
@@ -71,12 +123,23 @@ class MockSwitch(Switch, SwitchSession):
         else:
             state[port][channel] = new_network
 
+    def modify_port_channels(self, port, changes, context=None):
+        _command()
+        state = LOCAL_STATE[self.label]
+
+        for channel, new_network in changes:
+            if new_network is None:
+                del state[port][channel]
+            else:
+                state[port][channel] = new_network
+
     def revert_port(self, port):
+        _command()
         if LOCAL_STATE[self.label][port]:
             del LOCAL_STATE[self.label][port]
 
     def disconnect(self):
-        pass
+        _delay(_option('save_ms'))
 
     def get_port_networks(self, ports):
         state = LOCAL_STATE[self.label]
@@ -8,9 +8,11 @@ import re
 import logging
 from schema import Schema, Optional, And, Use
 
+from hil import throttling, tracing
 from hil.model import db, Switch
+from hil.profiler import trace_call
 from hil.migrations import paths
-from hil.ext.switches import _console
+from hil.ext.switches import _console, _parsers
 from hil.ext.switches._dell_base import _BaseSession
 from os.path import dirname, join
 from hil.errors import BadArgumentError
@@ -23,6 +25,7 @@ paths[__name__] = join(dirname(__file__), 'migrations', 'n3000')
 core_schema[__name__] = {
     Optional('save'): string_is_bool
 }
+core_schema[__name__].update(throttling.SCHEMA)
 
 
 class DellN3000(Switch):
@@ -90,7 +93,9 @@ class _DellN3000Session(_BaseSession):
     def _sendline(self, line):
         logger.debug('Sending to switch` switch %r: %r',
                      self.switch, line)
-        self.console.sendline(line)
+        with tracing.span('switch_command', command=line), \
+                trace_call('switch', '%s: %s' % (self.switch.label, line)):
+            self.console.sendline(line)
 
     @staticmethod
     def connect(switch):
@@ -138,52 +143,28 @@ class _DellN3000Session(_BaseSession):
         """Collect information about the specified interface
 
         Returns a dictionary from the output of ``show int sw <interfaces>``.
+        Paging must be off.
         """
-
         self._sendline('show int sw %s' % interface)
         self.console.expect('Port: .*')
-        k, v = 'key', 'value'
-        result = {k: v}
-        key_lines = self.console.after.splitlines()
-        del key_lines[-3:]
-        for line in key_lines:
-            k, v = line.split(':', 1)
-            result[k] = v
+        lines = self.console.after.splitlines()
+        del lines[-3:]
         # expecting main_prompt here fails, because it appears that the
         # main_prompt is a part of the interface configuration (console.after)
         # sending a new line clears things up here.
         self._sendline('\n')
         self.console.expect(self.main_prompt)
-        return result
+        return _parsers.n3000_int_config('\n'.join(lines))
 
     def get_port_networks(self, ports):
-        num_re = re.compile(r'(\d+)')
         port_configs = self._port_configs(ports)
         result = {}
         for k, v in port_configs.iteritems():
-            native = v['Trunking Mode Native VLAN'].strip()
-            match = re.match(num_re, native)
-            if match:
-                # We need to call groups to get the part of the string that
-                # actually matched, because it could include some junk on the
-                # end, e.g. "100 (Inactive)".
-                num_str = match.groups()[0]
-                native = int(num_str)
-                if native == int(self.switch.dummy_vlan):
-                    native = None
-            else:
+            native = _parsers.first_number(v['Trunking Mode Native VLAN'])
+            if native == int(self.switch.dummy_vlan):
                 native = None
-            networks = []
-            for range_str in v['Trunking Mode VLANs Enabled'].split(','):
-                for num_str in range_str.split('-'):
-                    num_str = num_str.strip()
-                    match = re.match(num_re, num_str)
-                    if match:
-                        # There may be other tokens in the output, e.g.
-                        # the string "(Inactive)" somteimtes appears.
-                        # We should only use the value if it's an actual number
-                        num_str = match.groups()[0]
-                        networks.append(('vlan/%s' % num_str, int(num_str)))
+            vlans = _parsers.vlan_numbers(v['Trunking Mode VLANs Enabled'])
+            networks = [('vlan/%d' % vlan, vlan) for vlan in vlans]
             if native is not None:
                 networks.append(('vlan/native', native))
             result[k] = networks
@@ -8,8 +8,9 @@ import re
 from schema import Schema, Optional, And, Use
 import logging
 
+from hil import throttling
 from hil.model import db, Switch
-from hil.ext.switches import _console
+from hil.ext.switches import _console, _parsers
 from hil.errors import BadArgumentError
 from os.path import join, dirname
 from hil.migrations import paths
@@ -24,6 +25,7 @@ paths[__name__] = join(dirname(__file__), 'migrations', 'nexus')
 core_schema[__name__] = {
     Optional('save'): string_is_bool
 }
+core_schema[__name__].update(throttling.SCHEMA)
 
 
 class Nexus(Switch):
@@ -129,34 +131,12 @@ class _Session(_console.Session):
                         **prompts)
 
     def _port_configs(self, ports):
-        alternatives = [
-            re.escape(r'--More--'),
-            r'Name:[^\n]*\n',
-            r'  [A-Z][^:]*:[^\n]*\n',
-            r'[\r\n]+.+# ',
-        ]
-        self._sendline('show int sw')
-
-        # Find the first interface name
-        self.console.expect(alternatives[1])
-
-        _, interface = self.console.after.split(':', 1)
-        interface = interface.strip()
-        info = {interface: {}}
-
-        while True:
-            index = self.console.expect(alternatives)
-            if index == 0:
-                self.console.send(' ')
-            elif index == 1:
-                _, interface = self.console.after.split(':', 1)
-                interface = interface.strip()
-                info[interface] = {}
-            elif index == 2:
-                k, v = self.console.after.split(':', 1)
-                info[interface][k.strip()] = v.strip()
-            elif index == 3:
-                break
+        self._set_terminal_lines('unlimited')
+        try:
+            output = self._show('show int sw', 'Name:')
+        finally:
+            self._set_terminal_lines('default')
+        info = _parsers.nexus_int_configs(output)
 
         # The output of show int sw calls things "EthernetX/YY", but
         # everything else calls things "ethernet X/YY". Let's do the conversion
@@ -180,40 +160,22 @@ class _Session(_console.Session):
         return result
 
     def get_port_networks(self, ports):
-        num_re = re.compile(r'(\d+)')
         port_configs = self._port_configs(ports)
         result = {}
 
         for k, v in port_configs.iteritems():
-            networks = []
             if 'Trunking Native Mode VLAN' not in v:
                 # XXX (probable BUG): For some reason the last port on the
                 # switch sometimes isn't read correctly. For now just don't use
                 # that port for the test suite, and will skip it if this
                 # happens.
                 continue
-            native = v['Trunking Native Mode VLAN'].strip()
-            match = re.match(num_re, native)
-            if match:
-                num_str = match.groups()[0]
-                native = int(num_str)
-                if native == int(self.switch.dummy_vlan):
-                    native = None
-            else:
+            native = _parsers.first_number(v['Trunking Native Mode VLAN'])
+            if native == int(self.switch.dummy_vlan):
                 native = None
-            for range_str in v['Trunking VLANs Allowed'].split(','):
-                # XXX TODO make this actualy interpret e.g. 2-7 as a *range*
-                for num_str in range_str.split('-'):
-                    num_str = num_str.strip()
-                    match = re.match(num_re, num_str)
-                    if match:
-                        # There may be other tokens in the output, e.g.
-                        # the string "(Inactive)" somteimtes appears.
-                        # We should only use the value if it's an actual
-                        # number.
-                        num_str = match.groups()[0]
-                        networks.append(('vlan/%s' % num_str, int(num_str)))
-
+            # XXX TODO make this actualy interpret e.g. 2-7 as a *range*
+            networks = [('vlan/%d' % vlan, vlan) for vlan in
+                        _parsers.vlan_numbers(v['Trunking VLANs Allowed'])]
             if native is not None:
                 networks.append(('vlan/native', native))
             result[k] = networks
@@ -4,12 +4,17 @@ import logging
 import schema
 import subprocess
 
-from hil.model import db, Switch, Port, BigIntegerType, SwitchSession
+from hil import throttling, tracing
+from hil.config import core_schema
+from hil.model import db, Switch, BigIntegerType, SwitchSession
+from hil.profiler import trace_call
 from hil.errors import SwitchError
-from hil.ext.switches.common import string_to_dict, string_to_list
+from hil.ext.switches import _parsers
 
 logger = logging.getLogger(__name__)
 
+core_schema[__name__] = dict(throttling.SCHEMA)
+
 # Class layout
 # 1. Public methods:
 # 2. Private methods
@@ -40,188 +45,117 @@ class Ovs(Switch, SwitchSession):
     def get_capabilities(self):
         return ['nativeless-trunk-mode']
 
-    def ovs_connect(self, *command_strings):
+    def ovs_connect(self, *commands):
         """Interacts with the Openvswitch.
 
+        All of the `commands` are run by a single ovs-vsctl, separated by
+        "--", so that they are applied to the database in one transaction:
+        either all of them take effect, or none do.
+
         Args:
-            *command_strings (tuple) : tuple of list of arguments required
-                        to make changes to openvswitch
+            *commands (tuple) : each is the list of arguments to ovs-vsctl
+                        making up one command, e.g. ['del-port', 'veth-0']
         Raises: SwitchError
         Returns: If successful returns None else logs error message
         """
+        args = ['sudo', 'ovs-vsctl']
+        for command in commands:
+            args.append('--')
+            args.extend(str(arg) for arg in command)
         try:
-            for arg_list in command_strings:
-                subprocess.check_call(arg_list)
+            with tracing.span('switch_command', command=' '.join(args)), \
+                    trace_call('switch', ' '.join(args)):
+                subprocess.check_call(args)
         except subprocess.CalledProcessError as e:
             logger.error('%s', e)
             raise SwitchError('ovs command failed: %s', e)
 
     def get_port_networks(self, ports):
 
+        if not ports:
+            # With no records, ovs-vsctl would list every port.
+            return {}
+        ports_info = self._ports_info([port.label for port in ports])
         response = {}
-        for port in ports:
-            trunk_id_list = self._interface_info(port.label)['trunks']
-            if trunk_id_list == []:
-                response[port] = []
-            else:
-                result = []
-                for trunk in trunk_id_list:
-                    name = "vlan/"+trunk
-                    result.append((name, trunk))
-                response[port] = result
-            native = self._interface_info(port.label)['tag']
+        for port, port_info in zip(ports, ports_info):
+            response[port] = [("vlan/" + trunk, trunk)
+                              for trunk in port_info['trunks']]
+            native = port_info['tag']
             if native != []:
                 response[port].append(("vlan/native", native))
 
         return response
 
     def revert_port(self, port):
+        self.ovs_connect(['del-port', port],
+                         ['add-port', self.ovs_bridge, port,
+                          'vlan_mode=native-untagged'])
 
-        args_1 = ['sudo', 'ovs-vsctl', 'del-port', str(port)]
-        args_2 = [
-                'sudo', 'ovs-vsctl', 'add-port', str(self.ovs_bridge),
-                str(port), 'vlan_mode=native-untagged'
-                ]
-        self.ovs_connect(args_1, args_2)
+    def modify_port(self, port, channel, new_network, context=None):
+        return self.ovs_connect(self._port_command(port, channel,
+                                                   new_network))
 
-    def modify_port(self, port, channel, new_network):
+    def modify_port_channels(self, port, changes, context=None):
+        """Make all of the `changes` with a single ovs-vsctl.
 
-        port_obj = Port.query.filter_by(label=port).one()
-        interface = port_obj.label
-
-        if channel == 'vlan/native':
-            if new_network is None:
-                return self._remove_native_vlan(interface)
-            else:
-                return self._set_native_vlan(interface, new_network)
-        else:
-            match = re.match(re.compile(r'vlan/(\d+)'), channel)
-            assert match is not None, "HIL passed an invalid channel to the" \
-                " switch!"
-            vlan_id = match.groups()[0]
+        The changes are applied in one transaction (see `ovs_connect`).
+        """
+        return self.ovs_connect(*[self._port_command(port, channel,
+                                                     new_network)
+                                  for channel, new_network in changes])
 
-            if new_network is None:
-                return self._remove_vlan_from_port(interface, vlan_id)
-            else:
-                assert new_network == vlan_id
-                return self._add_vlan_to_trunk(interface, vlan_id)
+    def _ports_info(self, ports):
+        """Gets latest configuration of ports from switch.
 
-    def _interface_info(self, port):
-        """Gets latest configuration of port from switch.
+        All of the ports are read by a single ovs-vsctl.
 
         Args:
-            port: Valid port name
-        Returns intermediate output which processed to return final output:
-        It is a string of the following format:
-        '_uuid               : ad489368-9b53-4a3e-8732-697ad5141de9\n
-        bond_downdelay      : 0\nbon    d_fake_iface     : false\n
-        external_ids        : {}\nfake_bridge         : false\n
-        interfaces              : [fc61c8ff99c5,fc61c8ff99c6]\n
-        name                : "veth-0"\n
-        statistics          : {abc:123    , def:xyz,  space  :  lot of it , \
-                2345:some number}\n
-        status              : {}\ntag                     : 100\n
-        trunks              : [200,300,400]\n
-        vlan_mode           : native-untagged\n'
-
-        Which is used as input for further processing.
-        Returns: A dictionary of configuration status of the port.
-             String, Dictionary and list are valid values of this dictionary.
-             eg: Sample output.
-               {
-                '_uuid': 'ad489368-9b53-4a3e-8732-697ad5141de9',
-                'bond_downdelay': '0',
-                'bond_fake_iface': 'false',
-                'external_ids': {},
-                'fake_bridge': 'false',
-                'interfaces': ['fc61c8ff99c5', 'fc61c8ff99c6'],
-                'name': '"veth-0"',
-                'statistics': {'2345': 'some number','abc': '123','def': 'xyz'
-                                ,'space': 'lot of it'},
-                'status': {},
-                'tag': '100',
-                'trunks': ['200', '300', '400'],
-                'vlan_mode': 'native-untagged'
-              }
+            ports: Valid port names
+        Returns: A list with a dictionary for each port, giving the columns
+             of its record which the driver uses. Lists are valid values of
+             this dictionary, as are strings. eg: Sample output.
+               [{'tag': '100', 'trunks': ['200', '300', '400']},
+                {'tag': [], 'trunks': []}]
         """
         # This function is differnet then `ovs_connect` as it uses
         # subprocess.check_output because it only needs read info from switch
         # and pass the output to calling funtion.
-        args = ['sudo', 'ovs-vsctl', 'list', 'port', str(port)]
+        args = ['sudo', 'ovs-vsctl', '--columns=tag,trunks', 'list', 'port']
+        args.extend(str(port) for port in ports)
         try:
-            output = subprocess.check_output(args)
+            with tracing.span('switch_command', command=' '.join(args)), \
+                    trace_call('switch', ' '.join(args)):
+                output = subprocess.check_output(args)
         except subprocess.CalledProcessError as e:
             logger.error(" %s ", e)
             raise SwitchError('Ovs command failed: %s', e)
-        output = output.split('\n')
-        output.remove('')
-        i_info = dict(s.split(':', 1) for s in output)
-        i_info = {k.strip(): v.strip() for k, v in i_info.iteritems()}
-        for x in i_info.keys():
-            if i_info[x][0] == "{":
-                i_info[x] = string_to_dict(i_info[x])
-            elif i_info[x][0] == "[":
-                i_info[x] = string_to_list(i_info[x])
-        return i_info
-
-    def _remove_native_vlan(self, port):
-        """Removes native vlan from a trunked port.
-        If it is the last vlan to be removed, it disables the port and
-        reverts its state to default configuration
-        Args:
-            port: Valid switch port
-        Returns: if successful None else error message
-        """
-        port_info = self._interface_info(port)
-        vlan_id = port_info['tag']
-        args = [
-                'sudo', 'ovs-vsctl', 'remove', 'port', str(port), 'tag',
-                str(vlan_id)
-                ]
-        return self.ovs_connect(args)
-
-    def _set_native_vlan(self, port, new_network):
-        """Sets native vlan for a trunked port.
-        It enables the port, if it is the first vlan for the port.
-        Args:
-            port: valid port of switch
-            new_network: vlan_id
+        return _parsers.ovs_records(output)
+
+    def _port_command(self, port, channel, new_network):
+        """Return the ovs-vsctl command which moves `channel` of `port`.
+
+        The channel is moved to `new_network` (a vlan id), or detached if
+        that is None, as by `modify_port`. None of these commands read the
+        port first: ovsdb adds a vlan to (or removes it from) the port's
+        trunks itself, and removing a vlan which is not on the port does
+        nothing. Setting the native vlan enables the port, if it is the
+        first vlan for the port.
         """
-        args = [
-                'sudo', 'ovs-vsctl', 'set', 'port', str(port),
-                'tag='+str(new_network), 'vlan_mode=native-untagged'
-                ]
-
-        return self.ovs_connect(args)
-
-    def _add_vlan_to_trunk(self, port, vlan_id):
-        """ Adds vlans to a trunk port. """
-        port_info = self._interface_info(port)
-
-        if not port_info['trunks']:
-            args = [
-                    'sudo', 'ovs-vsctl', 'set', 'port', str(port),
-                    'trunks='+str(vlan_id)
-                    ]
-        else:
-            all_trunks = ','.join(port_info['trunks'])+','+vlan_id
-            args = [
-                    'sudo', 'ovs-vsctl', 'set', 'port', str(port),
-                    'trunks='+str(all_trunks)
-                    ]
-
-        return self.ovs_connect(args)
-
-    def _remove_vlan_from_port(self, port, vlan_id):
-        """ removes a single vlan specified by `vlan_id` """
-        port_info = self._interface_info(port)
-        args = [
-                'sudo', 'ovs-vsctl', 'remove', 'port', str(port), 'trunks',
-                str(vlan_id)
-                ]
-        if port_info['trunks']:
-            return self.ovs_connect(args)
-        return None
+        if channel == 'vlan/native':
+            if new_network is None:
+                return ['clear', 'port', port, 'tag']
+            return ['set', 'port', port, 'tag=' + str(new_network),
+                    'vlan_mode=native-untagged']
+
+        match = re.match(re.compile(r'vlan/(\d+)'), channel)
+        assert match is not None, "HIL passed an invalid channel to the" \
+            " switch!"
+        vlan_id = match.groups()[0]
+
+        if new_network is None:
+            return ['remove', 'port', port, 'trunks', vlan_id]
+        assert new_network == vlan_id
+        return ['add', 'port', port, 'trunks', vlan_id]
 
 # 3. Other superclass methods:
 
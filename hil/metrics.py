@@ -0,0 +1,248 @@
+"""Per-endpoint metrics for the REST API.
+
+`rest._rest_wrapper` calls `start_call` and `finish_call` around each API
+call, and `add_auth_time` after invoking the auth backend. SQL statements
+are counted and timed via SQLAlchemy engine events, and attributed to the
+API call running in the same thread.
+
+To keep this cheap, there are no locks on the hot path: each thread keeps
+its own statistics, which only it writes to, and `render` adds up the
+statistics of all threads when the metrics are scraped. When a new thread
+starts keeping statistics, those of threads which have exited are folded
+into a single total, so a server which starts a thread per request doesn't
+keep every thread's statistics forever. The numbers are per process; if the
+API server runs several processes, each has its own.
+"""
+
+from bisect import bisect_left
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (in seconds) of the latency histogram buckets:
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class _EndpointStats(object):
+    """Statistics for one endpoint, as seen by one thread."""
+
+    __slots__ = ('buckets', 'count', 'seconds', 'statuses',
+                 'sql_statements', 'sql_seconds', 'auth_seconds')
+
+    def __init__(self):
+        # One more bucket than there are bounds, for +Inf:
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.statuses = {}
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.auth_seconds = 0.0
+
+
+class _Call(object):
+    """The API call a thread is currently running."""
+
+    __slots__ = ('endpoint', 'start', 'sql_statements', 'sql_seconds',
+                 'auth_seconds')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.time()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.auth_seconds = 0.0
+
+
+def _add(totals, thread_stats):
+    """Add `thread_stats` (a thread's statistics, by endpoint) to `totals`."""
+    for endpoint, stats in list(thread_stats.items()):
+        total = totals.get(endpoint)
+        if total is None:
+            total = totals[endpoint] = _EndpointStats()
+        for i, n in enumerate(stats.buckets):
+            total.buckets[i] += n
+        total.count += stats.count
+        total.seconds += stats.seconds
+        for status, n in list(stats.statuses.items()):
+            total.statuses[status] = total.statuses.get(status, 0) + n
+        total.sql_statements += stats.sql_statements
+        total.sql_seconds += stats.sql_seconds
+        total.auth_seconds += stats.auth_seconds
+
+
+def _register(thread_stats):
+    """Register the current thread's statistics, `thread_stats`.
+
+    The statistics of threads which have exited are folded into
+    `_finished_stats`. A thread whose id is the current thread's has exited
+    too, as thread ids may be reused.
+    """
+    ident = threading.current_thread().ident
+    with _lock:
+        alive = set(thread.ident for thread in threading.enumerate())
+        for other in list(_live_stats):
+            if other == ident or other not in alive:
+                _add(_finished_stats, _live_stats.pop(other))
+        _live_stats[ident] = thread_stats
+
+
+class _ThreadState(threading.local):
+    """Per-thread state: the current call, and this thread's statistics.
+
+    Each thread's statistics are registered (see `_register`) when the
+    thread first touches them.
+    """
+
+    def __init__(self):
+        self.call = None
+        self.stats = {}
+        _register(self.stats)
+
+
+# Guards `_live_stats` and `_finished_stats`; it is only taken when a thread
+# starts keeping statistics, and when they are collected:
+_lock = threading.Lock()
+# The statistics of the threads which were alive when a thread last
+# registered, by thread id:
+_live_stats = {}
+# The statistics of all threads which have exited since, added up:
+_finished_stats = {}
+_state = _ThreadState()
+
+
+def start_call(endpoint):
+    """Note that this thread has started handling a call to `endpoint`."""
+    _state.call = _Call(endpoint)
+
+
+def add_auth_time(seconds):
+    """Record time spent in the auth backend by the current call."""
+    call = _state.call
+    if call is not None:
+        call.auth_seconds += seconds
+
+
+def finish_call(status):
+    """Record the current call as finished, with the HTTP status `status`."""
+    call = _state.call
+    if call is None:
+        return
+    _state.call = None
+    elapsed = time.time() - call.start
+
+    stats = _state.stats.get(call.endpoint)
+    if stats is None:
+        stats = _state.stats[call.endpoint] = _EndpointStats()
+    stats.buckets[bisect_left(BUCKETS, elapsed)] += 1
+    stats.count += 1
+    stats.seconds += elapsed
+    stats.statuses[status] = stats.statuses.get(status, 0) + 1
+    stats.sql_statements += call.sql_statements
+    stats.sql_seconds += call.sql_seconds
+    stats.auth_seconds += call.auth_seconds
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    """Note when a statement starts, if we're inside an API call."""
+    if _state.call is not None:
+        conn.info.setdefault('hil_metrics_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    """Charge a finished statement to the current API call."""
+    call = _state.call
+    starts = conn.info.get('hil_metrics_start')
+    if call is None or not starts:
+        return
+    call.sql_statements += 1
+    call.sql_seconds += time.time() - starts.pop()
+
+
+def _collect():
+    """Add up the statistics of all threads, by endpoint."""
+    totals = {}
+    with _lock:
+        _add(totals, _finished_stats)
+        for thread_stats in _live_stats.values():
+            _add(totals, thread_stats)
+    return totals
+
+
+def sql_statements_per_call():
+    """Return the mean number of SQL statements per call, by endpoint."""
+    return {endpoint: stats.sql_statements / float(stats.count)
+            for endpoint, stats in _collect().items()
+            if stats.count}
+
+
+def render(extra=()):
+    """Return the metrics in the Prometheus text exposition format.
+
+    `extra` is a list of further metrics to include, each a tuple of
+    ``(name, kind, doc, samples)``, with samples as described in `metric`,
+    below.
+    """
+    totals = sorted(_collect().items())
+    lines = []
+
+    def metric(name, kind, doc, samples):
+        """Add a metric, with samples given as (suffix, labels, value)."""
+        lines.append('# HELP %s %s' % (name, doc))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for suffix, labels, value in samples:
+            labels = ','.join('%s="%s"' % label for label in labels)
+            lines.append('%s%s{%s} %r' % (name, suffix, labels, value))
+
+    def histogram():
+        """Yield the samples of the latency histogram."""
+        for endpoint, stats in totals:
+            cumulative = 0
+            bounds = [repr(b) for b in BUCKETS] + ['+Inf']
+            for bound, n in zip(bounds, stats.buckets):
+                cumulative += n
+                yield ('_bucket', [('endpoint', endpoint), ('le', bound)],
+                       cumulative)
+            yield '_sum', [('endpoint', endpoint)], stats.seconds
+            yield '_count', [('endpoint', endpoint)], stats.count
+
+    def per_endpoint(attr):
+        """Yield a sample of `attr` for each endpoint."""
+        for endpoint, stats in totals:
+            yield '', [('endpoint', endpoint)], getattr(stats, attr)
+
+    metric('hil_api_request_duration_seconds', 'histogram',
+           'Time spent handling API calls.', histogram())
+    metric('hil_api_requests_total', 'counter',
+           'API calls handled, by HTTP status.',
+           (('', [('endpoint', endpoint), ('status', status)], n)
+            for endpoint, stats in totals
+            for status, n in sorted(stats.statuses.items())))
+    metric('hil_api_sql_statements_total', 'counter',
+           'SQL statements executed by API calls.',
+           per_endpoint('sql_statements'))
+    metric('hil_api_sql_seconds_total', 'counter',
+           'Time spent executing SQL statements in API calls.',
+           per_endpoint('sql_seconds'))
+    metric('hil_api_auth_seconds_total', 'counter',
+           'Time spent in the auth backend by API calls.',
+           per_endpoint('auth_seconds'))
+    for name, kind, doc, samples in extra:
+        metric(name, kind, doc, samples)
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    """Forget all statistics collected so far. Intended for tests."""
+    with _lock:
+        _finished_stats.clear()
+        for thread_stats in _live_stats.values():
+            thread_stats.clear()
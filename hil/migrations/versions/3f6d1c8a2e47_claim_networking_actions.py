@@ -0,0 +1,34 @@
+"""add claims to networking_action
+
+Revision ID: 3f6d1c8a2e47
+Revises: b71e3d5f0c92
+Create Date: 2026-10-18 23:41:12.518306
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6d1c8a2e47'
+down_revision = 'b71e3d5f0c92'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.add_column('networking_action', sa.Column('claimed_by', sa.String(),
+                  nullable=True))
+    op.add_column('networking_action', sa.Column('claimed_until',
+                  sa.DateTime(), nullable=True))
+    op.create_index(op.f('ix_networking_action_claimed_until'),
+                    'networking_action', ['claimed_until'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_networking_action_claimed_until'),
+                  table_name='networking_action')
+    op.drop_column('networking_action', 'claimed_until')
+    op.drop_column('networking_action', 'claimed_by')
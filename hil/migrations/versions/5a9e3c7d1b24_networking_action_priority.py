@@ -0,0 +1,27 @@
+"""add priority to networking_action
+
+Revision ID: 5a9e3c7d1b24
+Revises: 8c2e5f0b7d19
+Create Date: 2026-10-19 01:05:12.417902
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a9e3c7d1b24'
+down_revision = '8c2e5f0b7d19'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.add_column('networking_action', sa.Column('priority', sa.Integer(),
+                  nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('networking_action', 'priority')
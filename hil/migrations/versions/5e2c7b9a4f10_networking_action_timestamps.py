@@ -0,0 +1,42 @@
+"""add timestamps to networking_action
+
+Revision ID: 5e2c7b9a4f10
+Revises: d65a9dc873d7
+Create Date: 2026-10-18 22:31:07.418520
+
+"""
+
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2c7b9a4f10'
+down_revision = 'd65a9dc873d7'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.add_column('networking_action',
+                  sa.Column('queued_at', sa.DateTime(), nullable=True))
+    op.add_column('networking_action',
+                  sa.Column('started_at', sa.DateTime(), nullable=True))
+    op.add_column('networking_action',
+                  sa.Column('finished_at', sa.DateTime(), nullable=True))
+
+    # We don't know when existing actions were queued; the best we can do is
+    # to say they were queued now:
+    networking_action = sa.table('networking_action',
+                                 sa.column('queued_at', sa.DateTime()))
+    op.execute(networking_action.update()
+               .values(queued_at=datetime.utcnow()))
+
+
+def downgrade():
+    op.drop_column('networking_action', 'finished_at')
+    op.drop_column('networking_action', 'started_at')
+    op.drop_column('networking_action', 'queued_at')
@@ -0,0 +1,36 @@
+"""add retries to networking_action, and circuit breakers to switch
+
+Revision ID: 8c2e5f0b7d19
+Revises: 3f6d1c8a2e47
+Create Date: 2026-10-19 00:12:37.820415
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2e5f0b7d19'
+down_revision = '3f6d1c8a2e47'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.add_column('networking_action', sa.Column('attempts', sa.Integer(),
+                  nullable=False, server_default='0'))
+    op.add_column('networking_action', sa.Column('retry_at', sa.DateTime(),
+                  nullable=True))
+    op.add_column('switch', sa.Column('breaker_failures', sa.Integer(),
+                  nullable=False, server_default='0'))
+    op.add_column('switch', sa.Column('breaker_open_until', sa.DateTime(),
+                  nullable=True))
+
+
+def downgrade():
+    op.drop_column('switch', 'breaker_open_until')
+    op.drop_column('switch', 'breaker_failures')
+    op.drop_column('networking_action', 'retry_at')
+    op.drop_column('networking_action', 'attempts')
@@ -0,0 +1,31 @@
+"""add archived_networking_action.trace_id
+
+Revision ID: a6d2f9c4e318
+Revises: f3a7c2d9e816
+Create Date: 2026-10-19 09:12:37.551203
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d2f9c4e318'
+down_revision = 'f3a7c2d9e816'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.add_column('archived_networking_action',
+                  sa.Column('trace_id', sa.String(), nullable=True))
+    op.create_index(op.f('ix_archived_networking_action_trace_id'),
+                    'archived_networking_action', ['trace_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_archived_networking_action_trace_id'),
+                  table_name='archived_networking_action')
+    op.drop_column('archived_networking_action', 'trace_id')
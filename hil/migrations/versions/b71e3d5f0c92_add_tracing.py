@@ -0,0 +1,51 @@
+"""add trace spans, and trace ids to networking_action
+
+Revision ID: b71e3d5f0c92
+Revises: 5e2c7b9a4f10
+Create Date: 2026-10-18 22:58:44.102934
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71e3d5f0c92'
+down_revision = '5e2c7b9a4f10'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+BigIntegerType = sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite')
+
+
+def upgrade():
+    op.create_table(
+        'trace_span',
+        sa.Column('id', BigIntegerType, nullable=False),
+        sa.Column('trace_id', sa.String(), nullable=False),
+        sa.Column('parent_id', BigIntegerType, nullable=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('seconds', sa.Float(), nullable=False),
+        sa.Column('info', sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(['parent_id'], ['trace_span.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_trace_span_trace_id'), 'trace_span',
+                    ['trace_id'], unique=False)
+
+    op.add_column('networking_action', sa.Column('trace_id', sa.String(),
+                  nullable=True))
+    op.create_index(op.f('ix_networking_action_trace_id'),
+                    'networking_action', ['trace_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_networking_action_trace_id'),
+                  table_name='networking_action')
+    op.drop_column('networking_action', 'trace_id')
+    op.drop_index(op.f('ix_trace_span_trace_id'), table_name='trace_span')
+    op.drop_table('trace_span')
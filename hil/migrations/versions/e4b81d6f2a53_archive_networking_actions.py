@@ -0,0 +1,47 @@
+"""add archived_networking_action
+
+Revision ID: e4b81d6f2a53
+Revises: 5a9e3c7d1b24
+Create Date: 2026-10-19 02:14:45.106283
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b81d6f2a53'
+down_revision = '5a9e3c7d1b24'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+BigIntegerType = sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite')
+
+
+def upgrade():
+    op.create_table(
+        'archived_networking_action',
+        sa.Column('id', BigIntegerType, nullable=False),
+        sa.Column('uuid', sa.String(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('channel', sa.String(), nullable=False),
+        sa.Column('queued_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('node', sa.String(), nullable=False),
+        sa.Column('nic', sa.String(), nullable=False),
+        sa.Column('project', sa.String(), nullable=True),
+        sa.Column('new_network', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_archived_networking_action_uuid'),
+                    'archived_networking_action', ['uuid'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_archived_networking_action_uuid'),
+                  table_name='archived_networking_action')
+    op.drop_table('archived_networking_action')
@@ -0,0 +1,37 @@
+"""add change
+
+Revision ID: f3a7c2d9e816
+Revises: e4b81d6f2a53
+Create Date: 2026-10-19 05:31:02.417936
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a7c2d9e816'
+down_revision = 'e4b81d6f2a53'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+BigIntegerType = sa.BigInteger().with_variant(sqlite.INTEGER(), 'sqlite')
+
+
+def upgrade():
+    op.create_table(
+        'change',
+        sa.Column('id', BigIntegerType, nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('label', sa.String(), nullable=False),
+        sa.Column('op', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('change')
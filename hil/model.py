@@ -11,15 +11,18 @@ Extensions are permitted to create new database objects by subclassing from
 # from sqlalchemy import *
 # from sqlalchemy.ext.declarative import declarative_base, declared_attr
 # from sqlalchemy.orm import relationship, sessionmaker,backref
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from subprocess import call, check_call, Popen, PIPE
 from hil.flaskapp import app
 from hil.config import cfg
 from hil.dev_support import no_dry_run
+from datetime import datetime
+import sqlite3
 import uuid
 import xml.etree.ElementTree
-from sqlalchemy import BigInteger
+from sqlalchemy import BigInteger, event
 from sqlalchemy.dialects import sqlite
+from sqlalchemy.engine import Engine
 
 # without setting this explicitly, we get a warning that this option
 # will default to disabled in future versions (due to incurring a lot
@@ -27,7 +30,48 @@ from sqlalchemy.dialects import sqlite
 # just opt-in to the change now:
 app.config.update(SQLALCHEMY_TRACK_MODIFICATIONS=False)
 
-db = SQLAlchemy(app)
+
+class _RoutingSession(SignallingSession):
+    """A session which reads from a read replica, if asked to.
+
+    See `hil.replicas`, which sets ``info['hil_replica']`` to the bind key
+    of the replica to use. Flushes, and so all writes, still go to the
+    primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('hil_replica')
+        if replica is not None and not self._flushing:
+            return db.get_engine(self.app, bind=replica)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class _SQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, using `_RoutingSession` for its sessions.
+
+    This also applies the pool options from `init_db` which Flask-SQLAlchemy
+    doesn't know about.
+    """
+
+    def create_session(self, options):
+        return _RoutingSession(self, **options)
+
+    def apply_pool_defaults(self, app, options):
+        SQLAlchemy.apply_pool_defaults(self, app, options)
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING'):
+            options['pool_pre_ping'] = True
+
+    def apply_driver_hacks(self, app, info, options):
+        if info.drivername == 'sqlite':
+            # SQLite connections aren't kept in a queue (see
+            # SQLAlchemy.apply_driver_hacks), so the options for one don't
+            # apply:
+            for option in 'pool_size', 'pool_timeout', 'max_overflow':
+                options.pop(option, None)
+        SQLAlchemy.apply_driver_hacks(self, app, info, options)
+
+
+db = _SQLAlchemy(app)
 
 # Sets up variant type so that postgresql can use BIGINT primary keys
 # while sqlite uses Integer primary keys.
@@ -35,15 +79,72 @@ BigIntegerType = BigInteger().with_variant(
         sqlite.INTEGER(), 'sqlite')
 
 
+# The pragmas applied to each new SQLite connection, as (pragma, option in
+# the [database] section, default value). Write-ahead logging lets the API
+# server and the network daemon read while the other writes, and a writer
+# waits for the other to finish rather than failing with "database is
+# locked". The busy timeout comes first, so that switching to write-ahead
+# logging waits as well:
+SQLITE_PRAGMAS = (
+    ('busy_timeout', 'sqlite_busy_timeout_ms', '5000'),
+    ('journal_mode', 'sqlite_journal_mode', 'wal'),
+    ('synchronous', 'sqlite_synchronous', 'normal'),
+)
+
+
+def _database_option(option, get=cfg.get):
+    """Return the ``[database]`` `option`, or None if it isn't set."""
+    if cfg.has_option('database', option):
+        return get('database', option)
+    return None
+
+
 def init_db(uri=None):
     """Start up the DB connection.
 
     `uri` is the uri to use for the database. If it is None, the uri from the
     config file will be used.
+
+    The pool options (``pool_size``, ``max_overflow``, ``pool_timeout``,
+    ``pool_recycle`` and ``pool_pre_ping``) and the SQLite pragmas
+    (``sqlite_journal_mode``, ``sqlite_busy_timeout_ms`` and
+    ``sqlite_synchronous``; see `SQLITE_PRAGMAS` for the defaults) come from
+    the ``[database]`` section of the config file.
     """
     if uri is None:
         uri = cfg.get('database', 'uri')
-    app.config.update(SQLALCHEMY_DATABASE_URI=uri)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=uri,
+        SQLALCHEMY_POOL_SIZE=_database_option('pool_size', cfg.getint),
+        SQLALCHEMY_MAX_OVERFLOW=_database_option('max_overflow', cfg.getint),
+        SQLALCHEMY_POOL_TIMEOUT=_database_option('pool_timeout', cfg.getint),
+        SQLALCHEMY_POOL_RECYCLE=_database_option('pool_recycle', cfg.getint),
+        SQLALCHEMY_POOL_PRE_PING=_database_option('pool_pre_ping',
+                                                  cfg.getboolean),
+    )
+    app.config.update(HIL_SQLITE_PRAGMAS=[
+        (pragma, _database_option(option) or default)
+        for pragma, option, default in SQLITE_PRAGMAS
+    ])
+
+    # Each read replica is a bind of its own, named 'replica-<n>', though
+    # no tables are bound to them; see `hil.replicas`:
+    binds = {}
+    if cfg.has_option('database', 'replicas'):
+        for i, replica in enumerate(cfg.get('database', 'replicas').split()):
+            binds['replica-%d' % i] = replica
+    app.config.update(SQLALCHEMY_BINDS=binds or None)
+
+
+@event.listens_for(Engine, 'connect')
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply the pragmas chosen by `init_db` to new SQLite connections."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma, value in app.config.get('HIL_SQLITE_PRAGMAS', ()):
+        cursor.execute('PRAGMA %s = %s' % (pragma, value))
+    cursor.close()
 
 
 # A joining table for project's access to networks, which have a many to many
@@ -77,6 +178,22 @@ class Nic(db.Model):
         self.label = label
         self.mac_addr = mac_addr
 
+    def pending_actions(self):
+        """Return the nic's pending networking actions, oldest first."""
+        return [action for action in self.actions
+                if action.status == 'PENDING']
+
+    def planned_networks(self):
+        """Return the networks the nic will be on after its pending actions.
+
+        The result is a dict mapping channels to `Network`s.
+        """
+        networks = dict((attachment.channel, attachment.network)
+                        for attachment in self.attachments)
+        for action in self.pending_actions():
+            action.apply_to(networks)
+        return networks
+
 
 class Node(db.Model):
     """a (physical) machine"""
@@ -209,11 +326,32 @@ class Switch(db.Model):
 
     type = db.Column(db.String, nullable=False)
 
+    # The switch's circuit breaker, kept by the network daemon (see
+    # `hil.deferred`): the number of calls to the switch which have failed in
+    # a row, and, once the breaker has tripped, when (in UTC) the daemon may
+    # try the switch again. The first call after that is a probe; the
+    # breaker is reset if it succeeds, and trips again if it fails.
+    breaker_failures = db.Column(db.Integer, nullable=False, default=0)
+    breaker_open_until = db.Column(db.DateTime, nullable=True)
+
     __mapper_args__ = {
         'polymorphic_identity': 'switch',
         'polymorphic_on': type,
     }
 
+    def breaker_state(self, now=None):
+        """Return the state of the switch's circuit breaker at `now`.
+
+        This is 'closed' if the daemon is using the switch normally, 'open'
+        if it is leaving the switch alone, and 'half-open' if the next call
+        to the switch is a probe. `now` defaults to the current time.
+        """
+        if self.breaker_open_until is None:
+            return 'closed'
+        if self.breaker_open_until > (now or datetime.utcnow()):
+            return 'open'
+        return 'half-open'
+
     def validate_port_name(self, port):
         """Verify that port name is valid for switch"""
 
@@ -266,7 +404,7 @@ class SwitchSession(object):
     HIL avoid connecting and disconnecting for each change.
     """
 
-    def modify_port(self, port, channel, new_network):
+    def modify_port(self, port, channel, new_network, context=None):
         """Move the specified (port, channel) pair to new_network.
 
         `port` is the name of a port (`Port.label`) on the switch.
@@ -276,9 +414,32 @@ class SwitchSession(object):
         `new_network` is the network ID for the network to move to.
         If `new_network` is `None`, The (port, channel) pair should be
         removed from it's existing network (if any).
+
+        `context` is an `ActionContext` for the port, when called by the
+        network daemon. Drivers should get what they need to know about the
+        port from it, rather than querying the database. If it is `None`
+        (e.g. when called by the test suite), drivers must look things up
+        themselves; see `ActionContext.for_port`.
         """
         assert False, "Subclasses MUST override modify_port"
 
+    def modify_port_channels(self, port, changes, context=None):
+        """Make several changes to the channels of a port.
+
+        `changes` is a list of ``(channel, new_network)`` pairs, each of
+        which is applied in turn as by `modify_port`; `port` and `context`
+        are as for `modify_port`, with `context` describing the port before
+        the first change.
+
+        The network daemon calls this when it has coalesced several actions
+        on a port. By default, this calls `modify_port` for each change;
+        drivers which can make several changes at once should override it.
+        """
+        for channel, new_network in changes:
+            self.modify_port(port, channel, new_network, context=context)
+            if context is not None:
+                context = context.after(channel, new_network)
+
     def revert_port(self, port):
         """Detach the port from all networks.
 
@@ -331,6 +492,53 @@ class SwitchSession(object):
         assert False, "Subclasses MUST override save_running_config"
 
 
+class ActionContext(object):
+    """What HIL already knows about a port which it asks a driver to change.
+
+    The network daemon loads this along with the networking action, and
+    passes it to `SwitchSession.modify_port`.
+
+    Attributes:
+        port: the `Port` being changed.
+        attachments: the `NetworkAttachment`s of the nic on the port, as they
+            were before the change.
+        network_ids: a dict mapping the port's channels to the network IDs
+            on them, before the change.
+    """
+
+    def __init__(self, port, attachments):
+        self.port = port
+        self.attachments = attachments
+        self.network_ids = dict((attachment.channel,
+                                 attachment.network.network_id)
+                                for attachment in attachments)
+
+    @staticmethod
+    def for_port(port):
+        """Return the context for `port` (a `Port`), from the database."""
+        return ActionContext(port, list(port.nic.attachments))
+
+    def after(self, channel, new_network):
+        """Return the context for the port after a change.
+
+        The change is moving `channel` to `new_network` (a network ID, or
+        None), as by `SwitchSession.modify_port`. `attachments` is left as
+        it is, but `network_ids` and `old_native` reflect the change.
+        """
+        context = ActionContext(self.port, self.attachments)
+        context.network_ids = dict(self.network_ids)
+        if new_network is None:
+            context.network_ids.pop(channel, None)
+        else:
+            context.network_ids[channel] = new_network
+        return context
+
+    @property
+    def old_native(self):
+        """The network ID of the port's native network, or None."""
+        return self.network_ids.get('vlan/native')
+
+
 class Obm(db.Model):
     """Obm superclass supporting various drivers
 
@@ -397,8 +605,20 @@ class Obm(db.Model):
         """Delete the console log."""
         assert False, "Subclasses MUST override the delete_console method"
 
-    def get_console(self):
-        """Return the contents of the console log."""
+    def get_console(self, offset=None, tail=None, max_bytes=None):
+        """Return (part of) the contents of the console log.
+
+        Returns None if there is no log. Otherwise, returns a pair
+        ``(chunks, next_offset)``, where ``chunks`` is an iterable of strings
+        which together make up the requested part of the log, and
+        ``next_offset`` is the offset to pass to a later call to get only
+        output logged after this call (or None, if the driver does not
+        support offsets).
+
+        ``offset`` is the (byte) position in the log to start reading from,
+        ``tail`` asks for just the last ``tail`` bytes instead, and
+        ``max_bytes`` limits the amount of output returned.
+        """
         assert False, "Subclasses MUST override the get_console method"
 
     def get_console_log_filename(self):
@@ -406,6 +626,21 @@ class Obm(db.Model):
         assert False, "Subclasses MUST override the get_console_log_filename" \
             "method"
 
+    @classmethod
+    def stop_orphan_consoles(cls, obms):
+        """Stop any orphaned console logging for ``obms``, and delete the logs.
+
+        ``obms`` is a list of obms of this class. This is called once at
+        server startup, for all of the obms of each driver. By default it
+        just calls ``stop_console`` and ``delete_console`` on each of them;
+        drivers may override it to do the work in bulk. Work which needn't
+        finish before the server starts may be left running in the
+        background.
+        """
+        for obm in obms:
+            obm.stop_console()
+            obm.delete_console()
+
 
 def _on_virt_uri(args_list):
     """Make an argument list to libvirt tools use right URI.
@@ -580,6 +815,11 @@ class NetworkingAction(db.Model):
     # Legal values for `type`
     legal_types = ('modify_port', 'revert_port')
 
+    # Values for `priority`
+    NORMAL_PRIORITY = 0
+    MAINTENANCE_PRIORITY = 1
+    ADMIN_PRIORITY = 2
+
     id = db.Column(BigIntegerType, primary_key=True)
 
     # UUID of a networking action. Useful for querying the status of a
@@ -589,6 +829,36 @@ class NetworkingAction(db.Model):
     # status of the operation; it can either be 'PENDING', 'DONE' or 'ERROR'
     status = db.Column(db.String, nullable=False)
 
+    # When the action was added to the journal, and when the network daemon
+    # started and finished working on it (all in UTC). The latter two are
+    # None until the daemon gets to the action.
+    queued_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # The id of the trace (see `hil.tracing`) the action is part of; this is
+    # the uuid of the API request which queued it. If None (e.g. the action
+    # predates tracing), the action's own uuid is used instead.
+    trace_id = db.Column(db.String, nullable=True, index=True)
+
+    # The network daemon which has claimed the action (see `hil.deferred`),
+    # and when its claim runs out (in UTC), unless the daemon renews it.
+    # Both are None until a daemon claims the action.
+    claimed_by = db.Column(db.String, nullable=True)
+    claimed_until = db.Column(db.DateTime, nullable=True, index=True)
+
+    # The number of times the network daemon has tried the action and
+    # failed, and, if it is to try again, when (in UTC) it may do so. The
+    # action stays PENDING until it is done, or the daemon gives up.
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    retry_at = db.Column(db.DateTime, nullable=True)
+
+    # How soon the action should be applied: the network daemon applies
+    # actions with a higher priority first (see `hil.deferred`). Actions
+    # queued by an admin get ADMIN_PRIORITY, and those on the nodes of the
+    # maintenance pool MAINTENANCE_PRIORITY.
+    priority = db.Column(db.Integer, nullable=False, default=NORMAL_PRIORITY)
+
     # The type of action.
     #
     # * 'modify_port' attaches the (nic, channel) pair to a specified network,
@@ -605,9 +875,11 @@ class NetworkingAction(db.Model):
     channel = db.Column(db.String, nullable=False)
 
     # The nic affected by the action. for 'revert_port', this is the nic
-    # attached to the specified port.
+    # attached to the specified port. A nic may have several pending actions,
+    # which are applied in order (see `hil.deferred`).
     nic = db.relationship("Nic",
-                          backref=db.backref('current_action', uselist=False))
+                          backref=db.backref('actions',
+                                             order_by='NetworkingAction.id'))
 
     # For 'modify_port', this is the new network that the (nic, channel) pair
     # should be moved to, or None if the (nic, channel) should just be detached
@@ -616,6 +888,94 @@ class NetworkingAction(db.Model):
                                   backref=db.backref('scheduled_nics',
                                                      uselist=True))
 
+    def apply_to(self, networks):
+        """Update `networks` with the change the action makes.
+
+        `networks` is a dict mapping channels to `Network`s, as returned by
+        `Nic.planned_networks`.
+        """
+        if self.type == 'revert_port':
+            networks.clear()
+        elif self.new_network is None:
+            networks.pop(self.channel, None)
+        else:
+            networks[self.channel] = self.new_network
+
+
+class ArchivedNetworkingAction(db.Model):
+    """A finished networking action, moved out of the journal.
+
+    Finished actions are archived when a new action is queued on their nic,
+    or after a while (see `hil.deferred.archive_actions`), so that the
+    journal only holds recent actions, while the status of older ones can
+    still be looked up by their uuid. The archive refers to the node, nic,
+    network and project by label, so it is unaffected by their deletion.
+    """
+    id = db.Column(BigIntegerType, primary_key=True)
+
+    uuid = db.Column(db.String, nullable=False, index=True)
+
+    # As for NetworkingAction:
+    status = db.Column(db.String, nullable=False)
+    type = db.Column(db.String, nullable=False)
+    channel = db.Column(db.String, nullable=False)
+    queued_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    # The labels of the nic and its node, the node's project at the time the
+    # action was archived (None if it had none), and the new network (None
+    # if there was none):
+    node = db.Column(db.String, nullable=False)
+    nic = db.Column(db.String, nullable=False)
+    project = db.Column(db.String, nullable=True)
+    new_network = db.Column(db.String, nullable=True)
+
+    # The id of the action's trace (see `hil.tracing`), which is kept until
+    # the action is deleted from the archive:
+    trace_id = db.Column(db.String, nullable=True, index=True)
+
+
+class Change(db.Model):
+    """A change to the inventory, in the log kept by `hil.changes`.
+
+    The id of a change is its revision.
+    """
+    id = db.Column(BigIntegerType, primary_key=True)
+
+    # When (in UTC) the change was committed:
+    changed_at = db.Column(db.DateTime, nullable=False)
+
+    # What changed: the type ('node', 'network', 'project', 'switch' or
+    # 'headnode') and label of the thing, and whether it was 'created',
+    # 'updated' or 'deleted':
+    type = db.Column(db.String, nullable=False)
+    label = db.Column(db.String, nullable=False)
+    op = db.Column(db.String, nullable=False)
+
+
+class TraceSpan(db.Model):
+    """A timed step in the handling of a networking action.
+
+    Spans form a tree; see `hil.tracing`.
+    """
+    id = db.Column(BigIntegerType, primary_key=True)
+
+    trace_id = db.Column(db.String, nullable=False, index=True)
+    parent_id = db.Column(BigIntegerType, db.ForeignKey('trace_span.id'),
+                          nullable=True)
+
+    # What the span covers, e.g. 'switch_command':
+    name = db.Column(db.String, nullable=False)
+
+    # When the span started (in UTC), and how long it took:
+    started_at = db.Column(db.DateTime, nullable=False)
+    seconds = db.Column(db.Float, nullable=False)
+
+    # Extra details (e.g. the command sent to a switch), as a JSON object:
+    info = db.Column(db.String, nullable=True)
+
+    parent = db.relationship('TraceSpan', remote_side=[id])
+
 
 class NetworkAttachment(db.Model):
     """An attachment of a network to a particular nic on a channel"""
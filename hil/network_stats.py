@@ -0,0 +1,168 @@
+"""Statistics about the network daemon.
+
+The daemon (`hil-admin serve-networks`) records how long each switch driver
+call takes in `stats`, and, if ``stats_port`` is set in the
+``[network-daemon]`` section of hil.cfg, serves them as JSON on
+``http://127.0.0.1:<stats_port>/``, along with the state of the journal.
+`hil-admin network-stats` prints them.
+"""
+
+import BaseHTTPServer
+from collections import deque
+from datetime import datetime
+import json
+import logging
+import threading
+import time
+
+from hil import model
+from hil.config import cfg
+from hil.flaskapp import app
+
+logger = logging.getLogger(__name__)
+
+# How many of the most recent calls to each switch the percentiles are
+# computed over:
+SAMPLES_PER_SWITCH = 1000
+
+# The period (in seconds) over which the action rate is measured:
+RATE_WINDOW = 60
+
+
+def _percentile(ordered, fraction):
+    """Return the `fraction` percentile of the sorted list `ordered`."""
+    if not ordered:
+        return None
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+class _SwitchStats(object):
+    """Statistics for the driver calls to a single switch."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.recent = deque(maxlen=SAMPLES_PER_SWITCH)
+
+
+class Stats(object):
+    """Statistics collected by the network daemon.
+
+    These are written by the daemon's main loop and read by the stats
+    server's thread, so access is guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._switches = {}
+        self._finished = deque()
+
+    def record_call(self, switch, seconds, ok):
+        """Record a driver call to `switch` which took `seconds` seconds.
+
+        `ok` says whether the call succeeded.
+        """
+        key = (switch.type, switch.label)
+        with self._lock:
+            switch_stats = self._switches.get(key)
+            if switch_stats is None:
+                switch_stats = self._switches[key] = _SwitchStats()
+            switch_stats.calls += 1
+            if not ok:
+                switch_stats.errors += 1
+            switch_stats.recent.append(seconds)
+
+    def record_action(self):
+        """Record that the daemon has finished an action."""
+        now = time.time()
+        with self._lock:
+            self._finished.append(now)
+            while self._finished[0] < now - RATE_WINDOW:
+                self._finished.popleft()
+
+    def snapshot(self):
+        """Return the statistics, as a JSON-friendly dictionary."""
+        now = time.time()
+        with self._lock:
+            while self._finished and self._finished[0] < now - RATE_WINDOW:
+                self._finished.popleft()
+            rate = len(self._finished) / float(RATE_WINDOW)
+            switches = []
+            for (switch_type, label), switch_stats in \
+                    sorted(self._switches.items()):
+                recent = sorted(switch_stats.recent)
+                switches.append({
+                    'type': switch_type,
+                    'label': label,
+                    'calls': switch_stats.calls,
+                    'errors': switch_stats.errors,
+                    'p50': _percentile(recent, 0.5),
+                    'p99': _percentile(recent, 0.99),
+                })
+        return {
+            'actions_per_sec': rate,
+            'switches': switches,
+        }
+
+
+stats = Stats()
+
+
+def journal_stats():
+    """Return the depth of the journal, and the age of its oldest entry.
+
+    The result is a dictionary with the keys 'depth' (the number of pending
+    actions) and 'oldest_pending_age' (in seconds, or None if there are no
+    pending actions). Must be called inside an app context.
+    """
+    pending = model.NetworkingAction.query.filter_by(status='PENDING')
+    depth = pending.count()
+    oldest = pending.order_by(model.NetworkingAction.id).first()
+    age = None
+    if oldest is not None and oldest.queued_at is not None:
+        age = (datetime.utcnow() - oldest.queued_at).total_seconds()
+    model.db.session.commit()
+    return {
+        'depth': depth,
+        'oldest_pending_age': age,
+    }
+
+
+def get_stats_port():
+    """Return the configured stats port, or None if there isn't one."""
+    if cfg.has_option('network-daemon', 'stats_port'):
+        return cfg.getint('network-daemon', 'stats_port')
+    return None
+
+
+class _StatsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves the statistics as JSON, in response to any GET request."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle a GET request."""
+        with app.app_context():
+            result = stats.snapshot()
+            result['journal'] = journal_stats()
+        body = json.dumps(result)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Log requests at debug level, rather than to stderr."""
+        logger.debug('%s', format % args)
+
+
+def serve(port):
+    """Serve the statistics on 127.0.0.1:`port`, in a background thread.
+
+    Returns the server.
+    """
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', port), _StatsHandler)
+    thread = threading.Thread(target=server.serve_forever,
+                              name='hil-network-stats')
+    thread.daemon = True
+    thread.start()
+    return server
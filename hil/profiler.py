@@ -0,0 +1,231 @@
+"""Opt-in profiling of API calls.
+
+If the ``[profiling]`` section is present in hil.cfg, `rest._rest_wrapper`
+traces API calls:
+
+* ``sample_percent`` percent of calls are run under cProfile, and always
+  dumped.
+* If ``slow_ms`` is set, every call's SQL statements and out-of-band calls
+  (to ipmitool, obmd and switches; see `trace_call`) are recorded, and calls
+  which take longer than ``slow_ms`` milliseconds are dumped. Their cProfile
+  stats are included only if they were also sampled.
+
+Each dump is a directory under ``dir``, named after the request's uuid (see
+`rest.request_info`), holding ``trace.json`` and, if the call was profiled,
+``profile.pstats`` (which can be loaded with the ``pstats`` module). Only the
+``keep`` most recent dumps are kept.
+"""
+
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+import errno
+import json
+import logging
+import os
+from os.path import join
+import random
+import shutil
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from hil.config import cfg
+
+logger = logging.getLogger(__name__)
+
+TRACE_NAME = 'trace.json'
+PROFILE_NAME = 'profile.pstats'
+
+DEFAULT_KEEP = 100
+
+_state = threading.local()
+
+
+class Trace(object):
+    """What we record about one API call."""
+
+    def __init__(self, endpoint, uuid, sampled):
+        self.endpoint = endpoint
+        self.uuid = uuid
+        self.sampled = sampled
+        self.started_at = datetime.utcnow()
+        self.start = time.time()
+        self.seconds = None
+        self.sql = []
+        self.calls = []
+        self.profile = None
+
+    def run(self, f, *args, **kwargs):
+        """Call ``f(*args, **kwargs)`` as part of this trace.
+
+        If the trace is sampled, the call is run under cProfile.
+        """
+        _state.trace = self
+        try:
+            if not self.sampled:
+                return f(*args, **kwargs)
+            self.profile = cProfile.Profile()
+            return self.profile.runcall(f, *args, **kwargs)
+        finally:
+            _state.trace = None
+            self.seconds = time.time() - self.start
+
+    def to_json(self, status):
+        """Return the contents of ``trace.json`` for this trace."""
+        return {
+            'uuid': self.uuid,
+            'endpoint': self.endpoint,
+            'status': status,
+            'started_at': self.started_at.isoformat(),
+            'seconds': self.seconds,
+            'profiled': self.profile is not None,
+            'sql': self.sql,
+            'calls': self.calls,
+        }
+
+
+def _dir():
+    """Return the directory dumps go in."""
+    return cfg.get('profiling', 'dir')
+
+
+def _slow_seconds():
+    """Return the slow call threshold in seconds, or None if it's unset."""
+    if cfg.has_option('profiling', 'slow_ms'):
+        return cfg.getint('profiling', 'slow_ms') / 1000.0
+    return None
+
+
+def start_trace(endpoint, uuid):
+    """Decide whether to trace this call to `endpoint`.
+
+    Returns a `Trace`, or None if the call should not be traced.
+    """
+    if not cfg.has_section('profiling'):
+        return None
+    sampled = False
+    if cfg.has_option('profiling', 'sample_percent'):
+        percent = cfg.getfloat('profiling', 'sample_percent')
+        sampled = random.random() * 100 < percent
+    if not sampled and _slow_seconds() is None:
+        return None
+    return Trace(endpoint, str(uuid), sampled)
+
+
+def finish_trace(trace, status):
+    """Dump `trace` if it was sampled or was slow.
+
+    `status` is the HTTP status of the response.
+    """
+    slow = _slow_seconds()
+    if not trace.sampled and (slow is None or trace.seconds < slow):
+        return
+    try:
+        _dump(trace, status)
+    except (IOError, OSError) as e:
+        logger.error('Could not save profile for request %s: %s',
+                     trace.uuid, e)
+
+
+def _dump(trace, status):
+    """Write `trace` out to its directory, and prune old dumps."""
+    path = join(_dir(), trace.uuid)
+    os.makedirs(path)
+    with open(join(path, TRACE_NAME), 'w') as f:
+        json.dump(trace.to_json(status), f, indent=2)
+    if trace.profile is not None:
+        trace.profile.dump_stats(join(path, PROFILE_NAME))
+
+    keep = DEFAULT_KEEP
+    if cfg.has_option('profiling', 'keep'):
+        keep = cfg.getint('profiling', 'keep')
+    for old in _dump_dirs()[keep:]:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+def _dump_dirs():
+    """Return the paths of all of the dumps, newest first."""
+    try:
+        names = os.listdir(_dir())
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return []
+        raise
+    paths = [join(_dir(), name) for name in names]
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.stat(join(path, TRACE_NAME)).st_mtime
+        except OSError:
+            # Being written, or being pruned by another process.
+            pass
+    return sorted(mtimes, key=mtimes.get, reverse=True)
+
+
+def recent_traces(limit):
+    """Return summaries of the `limit` most recent dumps, newest first.
+
+    Each summary is the dump's ``trace.json``, without the 'sql' and 'calls'
+    lists, but with the number of entries in each ('sql_count' and
+    'call_count').
+    """
+    if not cfg.has_section('profiling'):
+        return []
+    result = []
+    for path in _dump_dirs()[:limit]:
+        try:
+            with open(join(path, TRACE_NAME)) as f:
+                summary = json.load(f)
+        except (IOError, ValueError):
+            continue
+        summary['sql_count'] = len(summary.pop('sql'))
+        summary['call_count'] = len(summary.pop('calls'))
+        result.append(summary)
+    return result
+
+
+@contextmanager
+def trace_call(kind, description):
+    """Record a call to something outside of HIL, if we're tracing.
+
+    `kind` says what sort of call it is (e.g. 'ipmitool', or 'switch' for
+    commands sent to switches), and `description` what was called.
+    """
+    trace = getattr(_state, 'trace', None)
+    if trace is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        trace.calls.append({
+            'kind': kind,
+            'description': description,
+            'seconds': time.time() - start,
+        })
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    """Note when a statement starts, if we're tracing."""
+    if getattr(_state, 'trace', None) is not None:
+        conn.info.setdefault('hil_profiler_start', []).append(time.time())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    """Record a finished statement in the current trace."""
+    trace = getattr(_state, 'trace', None)
+    starts = conn.info.get('hil_profiler_start')
+    if trace is None or not starts:
+        return
+    trace.sql.append({
+        'statement': statement,
+        'seconds': time.time() - starts.pop(),
+    })
@@ -0,0 +1,193 @@
+"""Serving read-only API calls from read replicas of the database.
+
+If ``[database] replicas`` lists the URIs of one or more read replicas,
+`model.init_db` registers each as a bind named ``replica-<n>``, and
+`rest._rest_wrapper` calls `route` before each API call. ``GET`` calls then
+read from a replica picked at random, while everything else -- other API
+calls, flushes within ``GET`` calls, and the network daemon -- uses the
+primary.
+
+Replicas lag behind the primary a little, so a client which has just
+written something may not see it on a replica yet. To avoid that, calls
+which may have written something set a cookie, and for
+``[database] replica_sticky_seconds`` (default `DEFAULT_STICKY_SECONDS`)
+after that, the client's ``GET`` calls are served from the primary. Clients
+which don't keep cookies (or which write and read through different
+sessions) may still see stale data, as they may with any other client
+writing at the same time. As a last resort, a ``GET`` call which fails on a
+replica is retried once on the primary (see `use_primary`): always if the
+replica is down, and if something it looks up isn't there, only if the
+replica may not have it yet; see `may_be_stale`.
+
+How far behind each replica is shows up in the metrics (see `metrics`).
+"""
+
+import random
+import time
+
+import flask
+from sqlalchemy.exc import DBAPIError
+
+from hil import model
+from hil.config import cfg
+from hil.flaskapp import app
+from hil.model import db
+
+DEFAULT_STICKY_SECONDS = 5.0
+
+# The cookie holding the time until which a client's reads go to the
+# primary:
+COOKIE = 'hil_primary_until'
+
+
+def replicas():
+    """Return the bind keys of the configured replicas."""
+    return sorted(key for key in app.config.get('SQLALCHEMY_BINDS') or ()
+                  if key.startswith('replica-'))
+
+
+def _sticky_seconds():
+    """Return how long a client's reads go to the primary after a write."""
+    if cfg.has_option('database', 'replica_sticky_seconds'):
+        return cfg.getfloat('database', 'replica_sticky_seconds')
+    return DEFAULT_STICKY_SECONDS
+
+
+def _wrote_recently():
+    """Return whether the client has written something recently."""
+    try:
+        return float(flask.request.cookies[COOKIE]) > time.time()
+    except (KeyError, ValueError):
+        return False
+
+
+def route():
+    """Pick the database the current API call should read from."""
+    keys = replicas()
+    if keys and flask.request.method == 'GET' and not _wrote_recently():
+        db.session().info['hil_replica'] = random.choice(keys)
+
+
+def using_replica():
+    """Return whether the current session reads from a replica."""
+    return 'hil_replica' in db.session().info
+
+
+def use_primary():
+    """Read from the primary for the rest of the current session.
+
+    Anything read from the replica so far is rolled back. Returns whether
+    the session was reading from a replica; if it wasn't, this does
+    nothing.
+    """
+    session = db.session()
+    if session.info.pop('hil_replica', None) is None:
+        return False
+    session.rollback()
+    return True
+
+
+def may_be_stale():
+    """Return whether the current session's replica may be missing writes.
+
+    That is the case if the replica is behind the primary (see
+    `_replica_lag`), or if the client wrote something recently: its cookie
+    is still around, even once its reads have gone back to the replicas.
+    Returns False if the session reads from the primary.
+    """
+    key = db.session().info.get('hil_replica')
+    if key is None:
+        return False
+    if COOKIE in flask.request.cookies:
+        return True
+    _, revisions, seconds = _replica_lag(key, _latest_revision(db.engine))
+    return bool(revisions or seconds)
+
+
+@app.after_request
+def _stick_to_primary(response):
+    """Send the client's reads to the primary for a while after a write."""
+    if replicas() and flask.request.method != 'GET' and \
+            response.status_code < 400:
+        sticky = _sticky_seconds()
+        response.set_cookie(COOKIE, repr(time.time() + sticky),
+                            max_age=int(sticky) + 1)
+    return response
+
+
+# How far behind the primary a PostgreSQL replica is, in seconds. Replicas
+# which have replayed everything they have received count as caught up,
+# even if the primary hasn't written anything for a while. PostgreSQL 10
+# renamed the functions for the write-ahead log from ``pg_last_xlog_*`` to
+# ``pg_last_wal_*``, so the names are filled in by `_pg_lag_query`:
+_PG_LAG = '''
+SELECT CASE WHEN pg_last_{log}_receive_{pos}() = pg_last_{log}_replay_{pos}()
+            THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+       END
+'''
+
+
+def _latest_revision(engine):
+    """Return the latest revision in the change log of `engine`'s database.
+
+    See `hil.changes`.
+    """
+    query = db.select([db.func.max(model.Change.id)])
+    with engine.connect() as connection:
+        return connection.execute(query).scalar() or 0
+
+
+def _pg_lag_query(connection):
+    """Return `_PG_LAG` for the version of the server `connection` is to."""
+    version = int(connection.execute(
+        db.text('SHOW server_version_num')).scalar())
+    if version >= 100000:
+        return _PG_LAG.format(log='wal', pos='lsn')
+    return _PG_LAG.format(log='xlog', pos='location')
+
+
+def _replica_lag(key, primary_revision):
+    """Return ``(up, revisions, seconds)`` for the replica `key`.
+
+    `revisions` is how many revisions of the change log the replica has
+    yet to replay; this works for any database. `seconds` is how far
+    behind it is in time, which only PostgreSQL can tell, so it is None
+    elsewhere.
+    """
+    engine = db.get_engine(app, bind=key)
+    try:
+        revisions = max(primary_revision - _latest_revision(engine), 0)
+        seconds = None
+        if engine.dialect.name == 'postgresql':
+            with engine.connect() as connection:
+                seconds = connection.execute(
+                    db.text(_pg_lag_query(connection))).scalar()
+            if seconds is not None:
+                seconds = float(seconds)
+        return 1, revisions, seconds
+    except DBAPIError:
+        return 0, None, None
+
+
+def metrics():
+    """Return the replicas' metrics, in the form `hil.metrics.render` takes.
+    """
+    keys = replicas()
+    if not keys:
+        return []
+    primary_revision = _latest_revision(db.engine)
+    lags = [(key, _replica_lag(key, primary_revision)) for key in keys]
+    return [
+        ('hil_db_replica_up', 'gauge',
+         'Whether the read replica could be queried.',
+         [('', [('replica', key)], up) for key, (up, _, _) in lags]),
+        ('hil_db_replica_lag_revisions', 'gauge',
+         'Change log revisions the read replica has yet to replay.',
+         [('', [('replica', key)], revisions)
+          for key, (_, revisions, _) in lags if revisions is not None]),
+        ('hil_db_replica_lag_seconds', 'gauge',
+         'How far behind the primary the read replica is (PostgreSQL only).',
+         [('', [('replica', key)], seconds)
+          for key, (_, _, seconds) in lags if seconds is not None]),
+    ]
@@ -8,18 +8,22 @@ The main things of interest in this module are:
 """
 import logging
 import json
+import time
 
 import flask
 from flask import _app_ctx_stack as ctx_stack
 
 from hil.flaskapp import app
-from hil.errors import APIError, AuthorizationError
+from hil.errors import APIError, AuthorizationError, NotFoundError
 from hil.config import cfg
 
 from schema import SchemaError
 from uuid import uuid4
+from sqlalchemy.exc import DBAPIError
+from werkzeug.exceptions import HTTPException
 
-from hil import auth
+from hil import auth, metrics, profiler, replicas, tracing
+from hil.model import db
 
 local = flask.g
 
@@ -258,29 +262,97 @@ def _rest_wrapper(f, schema, dont_log):
       `rest_call`.
     * Log arguments, except those in `dont_log`.
     * Convert `None` return values to empty bodies.
+    * Record metrics for the call; see `hil.metrics`.
+    * Profile the call, if so configured; see `hil.profiler`.
+    * Trace the call, saving the trace if it queues networking actions; see
+      `hil.tracing`.
+    * Serve ``GET`` calls from a read replica, if any are configured,
+      retrying them on the primary if they fail there; see `hil.replicas`.
 
     The result of this is suitable to hand directly to flask.
     """
 
     def wrapper(**kwargs):
-        """The wrapper described above."""
-        kwargs = _do_validation(schema, kwargs)
+        """Record metrics around `call`, below, and maybe profile it."""
+        metrics.start_call(f.__name__)
+        tracing.start(str(request_info.uuid), 'api_call',
+                      endpoint=f.__name__)
+        trace = profiler.start_trace(f.__name__, request_info.uuid)
+        status = 500
+        try:
+            if trace is None:
+                ret = call(**kwargs)
+            else:
+                ret = trace.run(call, **kwargs)
+            if isinstance(ret, tuple):
+                status = ret[1]
+            elif isinstance(ret, flask.Response):
+                status = ret.status_code
+            else:
+                status = 200
+            return ret
+        except HTTPException as e:
+            status = getattr(e, 'status_code', e.code)
+            raise
+        finally:
+            metrics.finish_call(status)
+            if trace is not None:
+                profiler.finish_trace(trace, status)
+            _save_trace(tracing.finish())
+
+    def call(**kwargs):
+        """The rest of the wrapper described above."""
+        replicas.route()
+        with tracing.span('validate'):
+            kwargs = _do_validation(schema, kwargs)
 
         censored_kwargs = kwargs.copy()
         for argname in dont_log:
             censored_kwargs[argname] = '<<CENSORED>>'
 
-        init_auth()
+        start = time.time()
+        try:
+            with tracing.span('auth'):
+                init_auth()
+        finally:
+            metrics.add_auth_time(time.time() - start)
         logger.info('API call: %s(%s)',
                     f.__name__, _format_arglist(**censored_kwargs))
 
-        ret = f(**kwargs)
+        with tracing.span('handler'):
+            try:
+                ret = f(**kwargs)
+            except (NotFoundError, DBAPIError) as e:
+                # The replica may be down, or, if it is behind, may not have
+                # caught up with a recent write:
+                if isinstance(e, NotFoundError) and \
+                        not replicas.may_be_stale():
+                    raise
+                if not replicas.use_primary():
+                    raise
+                logger.info('Retrying %s on the primary', f.__name__)
+                ret = f(**kwargs)
         if ret is None:
             ret = ''
         return ret
     return wrapper
 
 
+def _save_trace(tracer):
+    """Save the spans of `tracer`, if the call asked for them to be kept.
+
+    Failing to save a trace is logged, but doesn't fail the call.
+    """
+    if not tracer.keep:
+        return
+    try:
+        tracer.save()
+        db.session.commit()
+    except Exception:  # pylint: disable=broad-except
+        db.session.rollback()
+        logger.exception('Could not save the trace of this request')
+
+
 def _format_arglist(*args, **kwargs):
     """Format the argument list in a human readable way.
 
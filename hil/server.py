@@ -1,4 +1,5 @@
 """Manage server-side startup"""
+from collections import defaultdict
 import sys
 
 # api must be loaded to register the api callbacks, even though we don't
@@ -45,11 +46,13 @@ def stop_orphan_consoles():
 
     These may exist if HIL was shut down uncleanly.
     """
-    # Stop all orphan console logging processes on startup
-    nodes = model.Node.query.all()
-    for node in nodes:
-        node.obm.stop_console()
-        node.obm.delete_console()
+    # Stop all orphan console logging processes on startup. Each driver gets
+    # all of its obms at once, so it can do the work in bulk:
+    by_class = defaultdict(list)
+    for obm in model.Obm.query.with_polymorphic('*').all():
+        by_class[type(obm)].append(obm)
+    for cls, obms in by_class.items():
+        cls.stop_orphan_consoles(obms)
 
 
 def init():
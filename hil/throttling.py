@@ -0,0 +1,137 @@
+"""Rate limits and concurrency caps on the network daemon's switch calls.
+
+The section of hil.cfg for each switch driver (e.g.
+``[hil.ext.switches.dellnos9]``) may set the following options, to keep the
+network daemon (see `hil.deferred`) within what the switches can take:
+
+* ``switch_rate``: the number of calls per second the daemon may make to
+  each switch of that type, and ``switch_burst``, the number of calls it may
+  make in a burst, after the switch has been left alone for a while
+  (default 1).
+* ``type_rate`` and ``type_burst``: the same, for all of the switches of
+  that type together. This is per daemon: if several daemons are running,
+  the switches may get that many calls per second from each of them.
+* ``max_in_flight``: the number of switches of that type which the daemons
+  work on at once (all daemons together).
+
+A call is one ``modify_port``, ``modify_port_channels`` or ``revert_port``.
+Rather than sleeping when a switch has used up its calls, the daemon moves
+on to actions on other switches; see `hil.deferred.apply_networking`. Each
+driver includes `SCHEMA` in its section of `hil.config.core_schema`.
+"""
+
+import time
+
+from schema import And, Optional
+
+from hil.config import cfg, string_is_non_negative_float, \
+    string_is_positive_int
+
+_string_is_positive_float = And(string_is_non_negative_float,
+                                lambda option: float(option) > 0)
+
+SCHEMA = {
+    Optional('switch_rate'): _string_is_positive_float,
+    Optional('switch_burst'): string_is_positive_int,
+    Optional('type_rate'): _string_is_positive_float,
+    Optional('type_burst'): string_is_positive_int,
+    Optional('max_in_flight'): string_is_positive_int,
+}
+
+
+class TokenBucket(object):
+    """A token bucket, which refills at `rate` tokens a second.
+
+    The bucket holds at most `burst` tokens, and starts out full.
+    """
+
+    def __init__(self, rate, burst, clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+
+    def _refill(self):
+        """Add the tokens accumulated since the last refill."""
+        now = self.clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Return the number of seconds until a token is available.
+
+        This is 0 if one is available now.
+        """
+        self._refill()
+        return max(0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        """Take a token.
+
+        The bucket may go into debt, if there weren't any tokens; callers
+        should check `wait_time` first.
+        """
+        self._refill()
+        self.tokens -= 1
+
+
+def _bucket(driver, prefix, clock):
+    """Return a bucket for the ``<prefix>_rate`` options of `driver`.
+
+    Returns None if the rate isn't set.
+    """
+    if not cfg.has_option(driver, prefix + '_rate'):
+        return None
+    burst = 1
+    if cfg.has_option(driver, prefix + '_burst'):
+        burst = cfg.getint(driver, prefix + '_burst')
+    return TokenBucket(cfg.getfloat(driver, prefix + '_rate'), burst, clock)
+
+
+class Throttle(object):
+    """The token buckets for the switches the daemon calls.
+
+    Switches are identified by their label and `driver`, the name of the
+    driver's module (and so of its section of hil.cfg). Buckets are made the
+    first time a switch or type is seen, from the options at that time.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.buckets = {}
+
+    def _buckets(self, label, driver):
+        """Return the buckets which apply to the switch."""
+        result = []
+        for key, prefix in ((('switch', label), 'switch'),
+                            (('type', driver), 'type')):
+            if key not in self.buckets:
+                self.buckets[key] = _bucket(driver, prefix, self.clock)
+            if self.buckets[key] is not None:
+                result.append(self.buckets[key])
+        return result
+
+    def wait_time(self, label, driver):
+        """Return the number of seconds until the switch may be called.
+
+        This is 0 if it may be called now.
+        """
+        return max([0] + [bucket.wait_time()
+                          for bucket in self._buckets(label, driver)])
+
+    def take(self, label, driver):
+        """Record a call to the switch."""
+        for bucket in self._buckets(label, driver):
+            bucket.take()
+
+
+def max_in_flight(driver):
+    """Return the ``max_in_flight`` option of `driver`, or None if unset."""
+    if cfg.has_option(driver, 'max_in_flight'):
+        return cfg.getint(driver, 'max_in_flight')
+    return None
+
+
+throttle = Throttle()
@@ -0,0 +1,204 @@
+"""Tracing of networking actions, from the API call to the switch commands.
+
+Each API call gets a trace, whose id is the request's uuid (the one
+`rest.ContextLogger` puts in log lines). While it runs, we record timed
+spans for validation, authentication, the handler itself and each database
+commit. If the call queues a networking action, it calls `keep_trace`,
+which records the trace id on the action and causes the spans to be saved
+to the database (as `model.TraceSpan`s) once the call finishes; otherwise
+they are thrown away.
+
+When the network daemon picks up the action, it continues the same trace:
+the time the action spent in the queue, acquiring a switch session, each
+command sent to the switch (drivers wrap these in `span`), and saving the
+switch's configuration.
+
+Spans are kept per thread, and `span` does nothing if the thread isn't
+tracing, so drivers can use it unconditionally.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from hil import model
+
+_state = threading.local()
+
+
+class _Span(object):
+    """A span which hasn't been saved yet."""
+
+    def __init__(self, name, parent, start, info):
+        self.name = name
+        self.parent = parent
+        self.start = start
+        self.end = None
+        self.info = info
+
+
+class Tracer(object):
+    """The spans of one trace, recorded in the current thread."""
+
+    def __init__(self, trace_id, root):
+        self.trace_id = trace_id
+        self.root = root
+        self.spans = [root]
+        self.stack = [root]
+        self.keep = False
+
+    def save(self):
+        """Add the spans to the database session, as `model.TraceSpan`s.
+
+        The caller is responsible for committing.
+        """
+        rows = {}
+        for recorded in self.spans:
+            row = model.TraceSpan(
+                trace_id=self.trace_id,
+                parent=rows.get(recorded.parent),
+                name=recorded.name,
+                started_at=datetime.utcfromtimestamp(recorded.start),
+                seconds=recorded.end - recorded.start,
+                info=json.dumps(recorded.info) if recorded.info else None)
+            rows[recorded] = row
+            model.db.session.add(row)
+
+
+def start(trace_id, name, started_at=None, **info):
+    """Start tracing this thread, under a root span called `name`.
+
+    `started_at`, a UTC datetime, backdates the root span. `info` is
+    recorded with the span. Returns the new `Tracer`.
+    """
+    now = time.time()
+    if started_at is not None:
+        now = _timestamp(started_at)
+    tracer = Tracer(trace_id, _Span(name, None, now, info))
+    _state.tracer = tracer
+    return tracer
+
+
+def finish():
+    """Stop tracing this thread, and return the `Tracer` (or None)."""
+    tracer = getattr(_state, 'tracer', None)
+    _state.tracer = None
+    if tracer is not None:
+        tracer.root.end = time.time()
+    return tracer
+
+
+def current():
+    """Return the current thread's `Tracer`, or None if it isn't tracing."""
+    return getattr(_state, 'tracer', None)
+
+
+def keep_trace():
+    """Mark the current trace to be saved, and return its id.
+
+    Returns None if the thread isn't tracing.
+    """
+    tracer = current()
+    if tracer is None:
+        return None
+    tracer.keep = True
+    return tracer.trace_id
+
+
+@contextmanager
+def span(name, **info):
+    """Record the enclosed block as a span called `name`, if tracing."""
+    tracer = current()
+    if tracer is None:
+        yield
+        return
+    new = _Span(name, tracer.stack[-1], time.time(), info)
+    tracer.spans.append(new)
+    tracer.stack.append(new)
+    try:
+        yield
+    finally:
+        new.end = time.time()
+        tracer.stack.pop()
+
+
+def add_span(name, started_at, finished_at, **info):
+    """Record a span which has already happened, if tracing.
+
+    `started_at` and `finished_at` are UTC datetimes.
+    """
+    tracer = current()
+    if tracer is None:
+        return
+    new = _Span(name, tracer.stack[-1], _timestamp(started_at), info)
+    new.end = _timestamp(finished_at)
+    tracer.spans.append(new)
+
+
+def _timestamp(utc):
+    """Convert the UTC datetime `utc` to seconds since the epoch."""
+    return (utc - datetime(1970, 1, 1)).total_seconds()
+
+
+def span_tree(trace_id):
+    """Return the saved spans of the trace `trace_id`, as a tree.
+
+    The result is a list of the root spans, oldest first. Each span is a
+    dictionary with the keys 'name', 'started_at' (in ISO 8601 format),
+    'seconds', 'info' and 'children' (a list of spans, oldest first).
+    """
+    rows = model.TraceSpan.query.filter_by(trace_id=trace_id) \
+        .order_by(model.TraceSpan.started_at, model.TraceSpan.id).all()
+    nodes = {}
+    roots = []
+    for row in rows:
+        nodes[row.id] = {
+            'name': row.name,
+            'started_at': row.started_at.isoformat(),
+            'seconds': row.seconds,
+            'info': json.loads(row.info) if row.info else {},
+            'children': [],
+        }
+    for row in rows:
+        if row.parent_id in nodes:
+            nodes[row.parent_id]['children'].append(nodes[row.id])
+        else:
+            roots.append(nodes[row.id])
+    return roots
+
+
+def delete_trace(trace_id):
+    """Delete the saved spans of the trace `trace_id`.
+
+    The caller is responsible for committing.
+    """
+    model.TraceSpan.query.filter_by(trace_id=trace_id) \
+        .update({'parent_id': None}, synchronize_session=False)
+    model.TraceSpan.query.filter_by(trace_id=trace_id) \
+        .delete(synchronize_session=False)
+
+
+@event.listens_for(Session, 'before_commit')
+def _before_commit(session):
+    """Note when a commit starts, if we're tracing."""
+    if current() is not None:
+        session.info['hil_tracing_commit'] = datetime.utcnow()
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    """Record a finished commit as a span."""
+    started_at = session.info.pop('hil_tracing_commit', None)
+    if started_at is not None:
+        add_span('db_commit', started_at, datetime.utcnow())
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    """Forget about a commit which failed."""
+    session.info.pop('hil_tracing_commit', None)
@@ -79,7 +79,12 @@ setup(name='hil',
       # We are blacklisting keystonemiddleware version 4.19 due to a bug[3].
       # [3]: https://bugs.launchpad.net/keystonemiddleware/+bug/1737115
       # See #923 for details.
+      #
+      # SQLAlchemy itself is a dependency of Flask-SQLAlchemy, but we need
+      # at least 1.2, for the pool_pre_ping option (see [database] in
+      # examples/hil.cfg).
       install_requires=['Flask-SQLAlchemy>=2.1,<2.2',
+                        'SQLAlchemy>=1.2,<2.0',
                         'Flask-Migrate>=1.8,<2.0',
                         'Flask-Script>=2.0.5,<3.0',
                         'Werkzeug>=0.9.4,<0.10',
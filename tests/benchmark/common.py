@@ -0,0 +1,25 @@
+"""Helpers shared by the benchmarks."""
+
+import json
+
+
+def percentile(ordered, fraction):
+    """Return the `fraction` percentile of the sorted list `ordered`.
+
+    Returns None if `ordered` is empty.
+    """
+    if not ordered:
+        return None
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def write_report(report, filename):
+    """Save `report` (a JSON-friendly dictionary) to `filename`.
+
+    The separators are given explicitly, since Python 2's defaults leave
+    trailing whitespace at the end of lines when indenting.
+    """
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True,
+                  separators=(',', ': '))
+        f.write('\n')
@@ -0,0 +1,249 @@
+"""Benchmark of the API server and the network daemon writing at once.
+
+This builds a synthetic fleet (see `fleet.py`), then for a fixed time runs
+the network daemon's loop in one thread while others make write API calls
+through the flask test client: setting and deleting node metadata, and
+detaching nics from their networks and connecting them again (which queues
+networking actions for the daemon). For example::
+
+    python tests/benchmark/concurrency.py --api-threads 8 --seconds 30
+
+The report has the API calls' throughput and latency, how many of them
+failed (by HTTP status), how many networking actions the daemon finished,
+and how many times its loop failed. With SQLite, failures with status 500
+and daemon errors are usually "database is locked"; the ``--sqlite-*``
+options set the pragmas of the same names in the ``[database]`` section of
+hil.cfg, so e.g.::
+
+    python tests/benchmark/concurrency.py --sqlite-journal-mode delete \\
+        --sqlite-busy-timeout-ms 0
+
+shows how SQLite fares without write-ahead logging or waiting for locks.
+Calls which fail with 409 were turned away because too many networking
+actions were already queued on the nic; that means the daemon fell behind,
+not that anything went wrong.
+
+Like ``daemon.py``, this uses the ``[database]`` uri from
+``testsuite.cfg``, unless it is an in-memory sqlite database, in which case
+a temporary sqlite file is used instead, so that the threads each have
+their own connection.
+"""
+
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from hil import deferred, model
+from hil.flaskapp import app
+from hil.model import db
+from hil.test_common import config_merge, newDB, releaseDB, server_init
+
+# This directory is on the path, both when this is run as a script and
+# when pytest collects it:
+from common import percentile
+from daemon import write_config
+from fleet import Fleet, populate, smoke_fleet
+
+# How long (in seconds) the daemon's loop sleeps when there's nothing to do:
+POLL_INTERVAL = 0.01
+
+# The options of the [database] section which can be set from the command
+# line:
+DATABASE_OPTIONS = ('sqlite_journal_mode', 'sqlite_busy_timeout_ms',
+                    'sqlite_synchronous', 'pool_size', 'max_overflow')
+
+
+def configure(workdir, database_options, latency_ms=0):
+    """Configure HIL for the benchmark, and create a fresh database.
+
+    `database_options` maps options of the [database] section to their
+    values; options whose value is None are left out. `latency_ms` is the
+    mock switches' latency.
+    """
+    write_config(workdir, {'latency_ms': latency_ms},
+                 {'max_attempts': 1, 'breaker_failures': 1000})
+    config_merge({'database': {option: str(value)
+                               for option, value in database_options.items()
+                               if value is not None}})
+    newDB()
+    server_init()
+
+
+def api_writer(fleet, attachments, deadline, seed, result):
+    """Make write API calls until `deadline`.
+
+    `attachments` are the ((node, nic), network) labels of the attachments
+    this thread may detach and connect again; no other thread touches them.
+    The latencies and the number of failures by status are stored in the
+    dictionary `result`.
+    """
+    rng = random.Random(seed)
+    client = app.test_client()
+    latencies = result['latencies'] = []
+    errors = result['errors'] = {}
+
+    def request(method, path, body):
+        """Make a request, and record how long it took."""
+        start = time.time()
+        resp = client.open('/v0' + path, method=method, data=json.dumps(body))
+        latencies.append(time.time() - start)
+        if not 200 <= resp.status_code < 300:
+            errors[resp.status_code] = errors.get(resp.status_code, 0) + 1
+
+    while time.time() < deadline:
+        if attachments and rng.random() < 0.5:
+            (node, nic), network = rng.choice(attachments)
+            request('POST', '/node/%s/nic/%s/detach_network' % (node, nic),
+                    {'network': network})
+            request('POST', '/node/%s/nic/%s/connect_network' % (node, nic),
+                    {'network': network})
+        else:
+            path = '/node/node-%d/metadata/bench-%d' % (
+                rng.randrange(fleet.nodes), seed)
+            request('PUT', path, {'value': 'benchmark'})
+            request('DELETE', path, {})
+
+
+def network_daemon(deadline, result):
+    """Run the network daemon's loop until `deadline`.
+
+    The number of times the loop failed is stored in the dictionary
+    `result`.
+    """
+    result['errors'] = 0
+    with app.app_context():
+        while time.time() < deadline:
+            try:
+                if not deferred.apply_networking():
+                    time.sleep(POLL_INTERVAL)
+            except DBAPIError:
+                traceback.print_exc()
+                db.session.rollback()
+                result['errors'] += 1
+
+
+def run(fleet, api_threads, seconds):
+    """Run the benchmark for `seconds` seconds; return the report.
+
+    Must be called after `populate(fleet)`, outside of an app context.
+    """
+    attachments = sorted(fleet.attachments.items())
+    deadline = time.time() + seconds
+    api_results = [{} for _ in range(api_threads)]
+    daemon_result = {}
+    threads = [threading.Thread(target=api_writer,
+                                args=(fleet, attachments[i::api_threads],
+                                      deadline, i, api_results[i]))
+               for i in range(api_threads)]
+    threads.append(threading.Thread(target=network_daemon,
+                                    args=(deadline, daemon_result)))
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies = sorted(latency for result in api_results
+                       for latency in result['latencies'])
+    errors = {}
+    for result in api_results:
+        for status, n in result['errors'].items():
+            errors[status] = errors.get(status, 0) + n
+    with app.app_context():
+        finished = model.NetworkingAction.query \
+            .filter(model.NetworkingAction.status != 'PENDING').count()
+        db.session.commit()
+    return {
+        'seconds': elapsed,
+        'api_calls': len(latencies),
+        'api_calls_per_sec': len(latencies) / elapsed,
+        'api_errors': errors,
+        'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'actions_finished': finished,
+        'daemon_errors': daemon_result['errors'],
+    }
+
+
+def format_report(report):
+    """Return `report` (as returned by `run`) as human readable text."""
+    lines = [
+        '%d API calls in %.1f seconds (%.1f calls/sec)' % (
+            report['api_calls'], report['seconds'],
+            report['api_calls_per_sec']),
+        'Failed API calls: ' + (', '.join(
+            '%d=%d' % item for item in sorted(report['api_errors'].items()))
+            or 'none'),
+        'Networking actions finished: %d, daemon errors: %d' % (
+            report['actions_finished'], report['daemon_errors']),
+    ]
+    if report['p50_ms'] is not None:
+        lines.insert(1, 'API latency: p50 %.2fms, p99 %.2fms' % (
+            report['p50_ms'], report['p99_ms']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Build a fleet, and run the benchmark against it."""
+    parser = argparse.ArgumentParser(
+        description='Measure the API server and the network daemon writing '
+        'to the database at the same time.')
+    parser.add_argument('--api-threads', type=int, default=4,
+                        help='number of threads making API calls')
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='how long to run for')
+    parser.add_argument('--nodes', type=int, default=200)
+    parser.add_argument('--switches', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='latency of the mock switches')
+    parser.add_argument('--seed', type=int, default=0)
+    for option in DATABASE_OPTIONS:
+        parser.add_argument('--' + option.replace('_', '-'),
+                            help='[database] option %s' % option)
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        configure(workdir,
+                  {option: getattr(args, option)
+                   for option in DATABASE_OPTIONS},
+                  args.latency_ms)
+        fleet = Fleet(nodes=args.nodes, switches=args.switches,
+                      seed=args.seed)
+        with app.app_context():
+            populate(fleet)
+        print(format_report(run(fleet, args.api_threads, args.seconds)))
+        releaseDB()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@pytest.fixture
+def workdir(tmpdir):
+    """Configure HIL for the smoke test, with the default pragmas."""
+    configure(str(tmpdir), {})
+    yield str(tmpdir)
+    releaseDB()
+
+
+def test_smoke(workdir):
+    """Run briefly, and check that nothing failed on a locked database."""
+    fleet = smoke_fleet(projects=2, nodes=20, switches=2)
+    report = run(fleet, api_threads=2, seconds=1)
+    assert report['api_calls'] > 0
+    assert all(status < 500 for status in report['api_errors'])
+    assert report['daemon_errors'] == 0
+    assert report['actions_finished'] > 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""Throughput benchmark for the network daemon.
+
+This builds a synthetic fleet (see `fleet.py`) whose switches are mock
+switches configured to behave like slow, unreliable hardware (see
+`hil.ext.switches.mock`), queues a `NetworkingAction` for each of its nics,
+and measures how long ``hil-admin serve-networks`` takes to drain the
+journal. For example::
+
+    python tests/benchmark/daemon.py --actions 5000 --switches 100 \\
+        --latency-ms 50 --jitter-ms 20 --session-ms 500 --save-ms 1000
+
+The report includes the drain time, the overall action rate, and the
+distribution of the time each action spent between being queued and being
+finished. With ``--daemons N``, N daemons are started at once.
+
+Failed actions are not tried again unless ``--max-attempts`` is given (see
+``max_attempts`` in the ``[network-daemon]`` section of hil.cfg), so that
+failures don't add retry delays to the drain time.
+
+The daemons are run as subprocesses, so they must share a database with
+this process: the ``[database]`` uri from ``testsuite.cfg`` is used, unless
+it is an in-memory sqlite database, in which case a temporary sqlite file is
+used instead. Since ``hil-admin`` refuses to run as root, so does this,
+unless ``--in-process`` is given; that runs the daemon's loop in this
+process instead, which is also what the pytest smoke test does.
+"""
+
+import argparse
+from datetime import datetime
+import os
+from os.path import join
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import pytest
+
+from hil import config, deferred, model, network_stats
+from hil.flaskapp import app
+from hil.model import db
+from hil.network_allocator import get_network_allocator
+from hil.test_common import config_testsuite, config_clear, newDB, \
+    releaseDB, server_init
+
+# This directory is on the path, both when this is run as a script and
+# when pytest collects it:
+from common import percentile
+from fleet import Fleet, populate, smoke_fleet
+
+# How often (in seconds) to check whether the journal has been drained:
+POLL_INTERVAL = 0.1
+
+# The options of the mock switch which can be set from the command line:
+MOCK_OPTIONS = ('latency_ms', 'jitter_ms', 'failure_percent', 'session_ms',
+                'save_ms')
+
+# The options of the network daemon which can be set from the command line:
+DAEMON_OPTIONS = ('max_attempts', 'breaker_failures')
+
+
+def write_config(workdir, mock_options, daemon_options=None):
+    """Write a hil.cfg for the benchmark to `workdir`, and load it.
+
+    `mock_options` maps mock switch options to their values, and
+    `daemon_options` the options of the [network-daemon] section; options
+    whose value is None are left out.
+    """
+    config_testsuite()
+    uri = config.cfg.get('database', 'uri')
+    if uri == 'sqlite:///:memory:':
+        uri = 'sqlite:///' + join(workdir, 'hil.db')
+    sections = {
+        'general': {'log_level': 'warning'},
+        'headnode': {
+            'trunk_nic': 'eth0',
+            'base_imgs': 'base-headnode',
+            'libvirt_endpoint': 'qemu:///system',
+        },
+        'client': {'endpoint': 'http://127.0.0.1:5000'},
+        'database': {'uri': uri},
+        'extensions': {
+            'hil.ext.auth.null': '',
+            'hil.ext.network_allocators.null': '',
+            'hil.ext.obm.mock': '',
+            'hil.ext.switches.mock': '',
+        },
+        'hil.ext.switches.mock': mock_options,
+        'network-daemon': daemon_options or {},
+    }
+    config_clear()
+    for section, options in sections.items():
+        config.cfg.add_section(section)
+        for name, value in options.items():
+            if value is not None:
+                config.cfg.set(section, name, str(value))
+    with open(join(workdir, 'hil.cfg'), 'w') as f:
+        config.cfg.write(f)
+    config.load_extensions()
+
+
+def enqueue(count, seed=0):
+    """Queue a modify_port action for each of the first `count` nics.
+
+    Each action connects its nic to a random network. Returns the number of
+    actions queued. Must be called inside an app context, after
+    `fleet.populate`.
+    """
+    rng = random.Random(seed)
+    channel = get_network_allocator().get_default_channel()
+    networks = model.Network.query.all()
+    nics = model.Nic.query.filter(model.Nic.port_id.isnot(None)) \
+        .order_by(model.Nic.id).limit(count).all()
+    for i, nic in enumerate(nics):
+        db.session.add(model.NetworkingAction(type='modify_port',
+                                              nic=nic,
+                                              new_network=rng.choice(networks),
+                                              channel=channel,
+                                              uuid=str(uuid.uuid4()),
+                                              status='PENDING'))
+        if i % 1000 == 999:
+            db.session.commit()
+    db.session.commit()
+    return len(nics)
+
+
+def _wait_for_drain(procs=()):
+    """Wait until the journal is empty.
+
+    Raises RuntimeError if any of the processes `procs` exits first.
+    """
+    while network_stats.journal_stats()['depth'] > 0:
+        for proc in procs:
+            if proc.poll() is not None:
+                raise RuntimeError('serve-networks exited with status %d' %
+                                   proc.returncode)
+        time.sleep(POLL_INTERVAL)
+
+
+def drain(workdir, daemons):
+    """Start `daemons` network daemons in `workdir`, and wait for the drain.
+
+    Returns the number of seconds it took.
+    """
+    start = time.time()
+    procs = [subprocess.Popen([sys.executable, '-c',
+                               'from hil.commands.admin import main; main()',
+                               'serve-networks'],
+                              cwd=workdir)
+             for _ in range(daemons)]
+    try:
+        _wait_for_drain(procs)
+        return time.time() - start
+    finally:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.terminate()
+            proc.wait()
+
+
+def drain_in_process():
+    """Run the network daemon's loop in this process until it's drained.
+
+    Returns the number of seconds it took.
+    """
+    start = time.time()
+    while network_stats.journal_stats()['depth'] > 0:
+        # Actions may be waiting to be tried again:
+        if not deferred.apply_networking():
+            time.sleep(POLL_INTERVAL)
+    return time.time() - start
+
+
+def report(seconds):
+    """Summarise the finished actions, which took `seconds` to drain.
+
+    Must be called inside an app context.
+    """
+    actions = model.NetworkingAction.query.all()
+    latencies = sorted((a.finished_at - a.queued_at).total_seconds()
+                       for a in actions
+                       if a.queued_at is not None and
+                       a.finished_at is not None)
+    statuses = {}
+    for action in actions:
+        statuses[action.status] = statuses.get(action.status, 0) + 1
+    db.session.commit()
+    return {
+        'actions': len(actions),
+        'statuses': statuses,
+        'seconds': seconds,
+        'actions_per_sec': len(actions) / seconds if seconds else None,
+        'p50_latency': percentile(latencies, 0.5),
+        'p99_latency': percentile(latencies, 0.99),
+        'max_latency': percentile(latencies, 1.0),
+    }
+
+
+def format_report(result):
+    """Return `result` (as returned by `report`) as human readable text."""
+    lines = [
+        'Drained %d actions in %.2f seconds (%.1f actions/sec)' % (
+            result['actions'], result['seconds'],
+            result['actions_per_sec'] or 0),
+        'Statuses: ' + ', '.join('%s=%d' % item
+                                 for item in sorted(result['statuses']
+                                                    .items())),
+    ]
+    if result['p50_latency'] is not None:
+        lines.append('Queued to finished: p50 %.2fs, p99 %.2fs, max %.2fs' % (
+            result['p50_latency'], result['p99_latency'],
+            result['max_latency']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """Build a fleet, queue actions, and time the daemon draining them."""
+    parser = argparse.ArgumentParser(
+        description='Measure how fast the network daemon drains the journal.')
+    parser.add_argument('--actions', type=int, default=1000,
+                        help='number of actions to queue')
+    parser.add_argument('--switches', type=int, default=50)
+    parser.add_argument('--nics-per-node', type=int, default=2)
+    parser.add_argument('--daemons', type=int, default=1,
+                        help='number of serve-networks processes to run')
+    parser.add_argument('--in-process', action='store_true',
+                        help="run the daemon's loop in this process")
+    parser.add_argument('--seed', type=int, default=0)
+    for option in MOCK_OPTIONS:
+        parser.add_argument('--' + option.replace('_', '-'), type=float,
+                            default=0,
+                            help='mock switch option %s' % option)
+    parser.add_argument('--max-attempts', type=int, default=1,
+                        help='times to try each action (default: 1)')
+    parser.add_argument('--breaker-failures', type=int,
+                        help='failures in a row which open a switch\'s '
+                        'circuit breaker (default: the daemon\'s default)')
+    args = parser.parse_args(argv)
+
+    if not args.in_process and os.getuid() == 0:
+        sys.exit('hil-admin refuses to run as root; use --in-process.')
+
+    workdir = tempfile.mkdtemp()
+    try:
+        write_config(workdir,
+                     {option: getattr(args, option)
+                      for option in MOCK_OPTIONS},
+                     {option: getattr(args, option)
+                      for option in DAEMON_OPTIONS})
+        newDB()
+        server_init()
+        fleet = Fleet(projects=10,
+                      nodes=-(-args.actions // args.nics_per_node),
+                      nics_per_node=args.nics_per_node,
+                      switches=args.switches,
+                      allocated=0,
+                      seed=args.seed)
+        with app.app_context():
+            populate(fleet)
+            queued = enqueue(args.actions, args.seed)
+            print('Queued %d actions at %s' % (queued, datetime.utcnow()))
+            if args.in_process:
+                seconds = drain_in_process()
+            else:
+                seconds = drain(workdir, args.daemons)
+            print(format_report(report(seconds)))
+        releaseDB()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@pytest.fixture
+def workdir(tmpdir):
+    """Configure HIL for the smoke test, and create a fresh database."""
+    # Failed actions aren't tried again, and the switches' circuit breakers
+    # stay closed, so that the journal drains right away:
+    write_config(str(tmpdir),
+                 {'latency_ms': 1, 'failure_percent': 10},
+                 {'max_attempts': 1, 'breaker_failures': 100})
+    newDB()
+    server_init()
+    yield str(tmpdir)
+    releaseDB()
+
+
+def test_smoke(workdir):
+    """Drain a small journal in-process, and check the report adds up."""
+    smoke_fleet(projects=2, nodes=10, switches=3, allocated=0)
+    with app.app_context():
+        assert enqueue(15) == 15
+        seconds = drain_in_process()
+        result = report(seconds)
+    assert result['actions'] == 15
+    assert sum(result['statuses'].values()) == 15
+    assert 'PENDING' not in result['statuses']
+    # 15 commands, each taking at least 1ms:
+    assert seconds >= 0.015
+    assert result['p50_latency'] <= result['max_latency']
+
+
+if __name__ == '__main__':
+    main()
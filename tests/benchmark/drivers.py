@@ -0,0 +1,249 @@
+"""Throughput benchmark for the switch drivers, against fake switches.
+
+This runs a real switch driver against a local stand-in for the switch: the
+console-based drivers (``powerconnect55xx``, ``delln3000`` and ``nexus``)
+talk to `hil.ext.switches._fake_console`, via an ``ssh`` shim put first in
+the ``$PATH``, and the REST-based ones (``brocade`` and ``dellnos9``) to
+`hil.ext.switches._fake_rest`. For each of a number of ports, it sets a
+native vlan, adds a tagged vlan, reads the port's vlans back and reverts the
+port, repeating that for a number of cycles. For example::
+
+    python tests/benchmark/drivers.py --driver nexus --ports 20 \\
+        --cycles 5 --latency-ms 30 --session-ms 500 --save-ms 2000
+
+The report gives, for each kind of operation, how many were done, and their
+latency percentiles. ``connect`` is the time to get a session, and
+``disconnect`` includes saving the configuration.
+
+When collected by pytest, this runs each driver through a single cycle on
+two ports, as a smoke test of the benchmark itself.
+"""
+
+import argparse
+import importlib
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+
+from hil import config, model
+from hil.ext.obm.mock import MockObm
+from hil.ext.switches._fake_console import write_ssh_shim
+from hil.ext.switches._fake_rest import Server
+from hil.flaskapp import app
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, newDB, \
+    releaseDB
+
+# This directory is on the path, both when this is run as a script and
+# when pytest collects it:
+from common import percentile
+
+# For each driver: its module, its switch class, the format of its port
+# names, and any extra arguments its switches take.
+DRIVERS = {
+    'powerconnect55xx': ('hil.ext.switches.dell', 'PowerConnect55xx',
+                         'gi1/0/%d', {}),
+    'delln3000': ('hil.ext.switches.n3000', 'DellN3000',
+                  'gi1/0/%d', {'dummy_vlan': '2222'}),
+    'nexus': ('hil.ext.switches.nexus', 'Nexus',
+              'Ethernet1/%d', {'dummy_vlan': '2222'}),
+    'brocade': ('hil.ext.switches.brocade', 'Brocade',
+                '1/0/%d', {'interface_type': 'TenGigabitEthernet'}),
+    'dellnos9': ('hil.ext.switches.dellnos9', 'DellNOS9',
+                 '1/%d', {'interface_type': 'GigabitEthernet'}),
+}
+
+CONSOLE_DRIVERS = ('powerconnect55xx', 'delln3000', 'nexus')
+
+# The first native and tagged vlans used; port i uses these plus i:
+NATIVE_BASE = 100
+TAGGED_BASE = 500
+
+
+def configure(driver):
+    """Configure HIL for benchmarking `driver`, and create the database."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.obm.mock': '',
+            DRIVERS[driver][0]: '',
+            'hil.ext.network_allocators.null': None,
+            'hil.ext.network_allocators.vlan_pool': '',
+        },
+        'hil.ext.network_allocators.vlan_pool': {
+            'vlans': '%d-%d' % (NATIVE_BASE, TAGGED_BASE * 2),
+        },
+    })
+    config.load_extensions()
+    newDB()
+
+
+def start_fake(driver, workdir, ports, options):
+    """Start a fake switch for `driver`, with the given latency `options`.
+
+    Console drivers get an ``ssh`` shim in `workdir`, first in the $PATH.
+    Returns the hostname to give the switch, and a function which stops the
+    fake.
+    """
+    if driver in CONSOLE_DRIVERS:
+        write_ssh_shim(workdir, driver, os.path.join(workdir, 'vlans.json'),
+                       ports=ports, **options)
+        path = os.environ['PATH']
+        os.environ['PATH'] = workdir + os.pathsep + path
+
+        def stop():
+            """Restore the $PATH."""
+            os.environ['PATH'] = path
+        return 'switch.example.com', stop
+
+    server = Server(switch='switch', **options)
+    server.start()
+    return server.url, server.stop
+
+
+def make_switch(driver, hostname, ports):
+    """Add a `driver` switch with `ports` ports, each with a nic.
+
+    Returns the switch and its ports. Must be called inside an app context.
+    """
+    module, cls, port_format, extra = DRIVERS[driver]
+    cls = getattr(importlib.import_module(module), cls)
+    switch = cls(label='switch',
+                 hostname=hostname,
+                 username='admin',
+                 password='secret',
+                 **extra)
+    db.session.add(switch)
+    result = []
+    for i in range(ports):
+        port = model.Port(port_format % (i + 1), switch)
+        label = 'node-%d' % i
+        node = model.Node(label=label,
+                          obm=MockObm(type=MockObm.api_name,
+                                      host='ipmi-%d.example.com' % i,
+                                      user='root',
+                                      password='secret'),
+                          obmd_uri='http://obmd.example.com/nodes/' + label,
+                          obmd_admin_token='secret')
+        nic = model.Nic(node, 'eth0', '00:00:00:00:%02x:%02x' % (i >> 8,
+                                                                 i & 0xff))
+        nic.port = port
+        db.session.add_all([port, node, nic])
+        result.append(port)
+    db.session.commit()
+    return switch, result
+
+
+def run(switch, ports, cycles):
+    """Run `cycles` cycles of operations on `ports` of `switch`.
+
+    Returns a dictionary mapping the name of each kind of operation to a
+    list of how long (in seconds) each one took.
+    """
+    timings = {}
+
+    def timed(name, func, *args):
+        """Call func(*args), and record how long it took under `name`."""
+        start = time.time()
+        result = func(*args)
+        timings.setdefault(name, []).append(time.time() - start)
+        return result
+
+    session = timed('connect', switch.session)
+    for _ in range(cycles):
+        for i, port in enumerate(ports):
+            timed('set_native', session.modify_port, port.label,
+                  'vlan/native', str(NATIVE_BASE + i))
+            vlan = str(TAGGED_BASE + i)
+            timed('add_vlan', session.modify_port, port.label,
+                  'vlan/' + vlan, vlan)
+            networks = timed('get_port_networks',
+                             session.get_port_networks, [port])
+            assert ('vlan/' + vlan) in [net[0] for net in networks[port]]
+            timed('revert_port', session.revert_port, port.label)
+    timed('disconnect', session.disconnect)
+    return timings
+
+
+def format_report(timings):
+    """Return `timings` (as returned by `run`) as human readable text."""
+    lines = ['%-18s %6s %9s %9s %9s' % (
+        'operation', 'count', 'p50 ms', 'p99 ms', 'max ms')]
+    total = 0
+    count = 0
+    for name in ('connect', 'set_native', 'add_vlan', 'get_port_networks',
+                 'revert_port', 'disconnect'):
+        ordered = sorted(timings.get(name, []))
+        if not ordered:
+            continue
+        if name not in ('connect', 'disconnect'):
+            total += sum(ordered)
+            count += len(ordered)
+        lines.append('%-18s %6d %9.1f %9.1f %9.1f' % (
+            name, len(ordered), percentile(ordered, 0.5) * 1000,
+            percentile(ordered, 0.99) * 1000, ordered[-1] * 1000))
+    if total:
+        lines.append('%.1f port operations/sec' % (count / total))
+    return '\n'.join(lines)
+
+
+def benchmark(driver, ports, cycles, options):
+    """Benchmark `driver`, and return the timings (see `run`)."""
+    workdir = tempfile.mkdtemp()
+    hostname, stop = start_fake(driver, workdir, ports, options)
+    try:
+        configure(driver)
+        with app.app_context():
+            switch, port_objs = make_switch(driver, hostname, ports)
+            timings = run(switch, port_objs, cycles)
+        releaseDB()
+        return timings
+    finally:
+        stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    """Benchmark a switch driver against a fake switch."""
+    parser = argparse.ArgumentParser(
+        description='Measure switch driver throughput against a fake switch.')
+    parser.add_argument('--driver', choices=sorted(DRIVERS), required=True)
+    parser.add_argument('--ports', type=int, default=10)
+    parser.add_argument('--cycles', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='time each command or request takes')
+    parser.add_argument('--jitter-ms', type=float, default=0,
+                        help='maximum random extra time per command')
+    parser.add_argument('--session-ms', type=float, default=0,
+                        help='time logging in takes (console drivers)')
+    parser.add_argument('--save-ms', type=float, default=0,
+                        help='time saving the configuration takes')
+    args = parser.parse_args(argv)
+
+    options = {
+        'latency_ms': args.latency_ms,
+        'jitter_ms': args.jitter_ms,
+        'save_ms': args.save_ms,
+    }
+    if args.driver in CONSOLE_DRIVERS:
+        options['session_ms'] = args.session_ms
+    print(format_report(benchmark(args.driver, args.ports, args.cycles,
+                                  options)))
+
+
+@pytest.mark.parametrize('driver', sorted(DRIVERS))
+def test_smoke(driver):
+    """Run each driver through one cycle on two ports."""
+    timings = benchmark(driver, ports=2, cycles=1,
+                        options={'latency_ms': 1})
+    assert len(timings['connect']) == 1
+    assert len(timings['set_native']) == 2
+    assert len(timings['revert_port']) == 2
+    assert 'port operations/sec' in format_report(timings)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Synthetic fleet generator for the benchmarks.
+
+`populate` fills the database with a fleet of the requested size: projects,
+nodes with nics, switches with ports (one per nic), networks, and network
+attachments. Objects are inserted directly through the model, rather than
+the API, so that building a fleet of tens of thousands of nodes takes
+seconds rather than hours.
+
+Nodes use the mock obm driver and switches the mock switch driver, so the
+corresponding extensions must be loaded. Attachments are also recorded in
+the mock switch's in-memory state, so the network daemon can detach them
+again.
+"""
+
+import random
+
+from hil import model
+from hil.ext.obm.mock import MockObm
+from hil.ext.switches import mock
+from hil.flaskapp import app
+from hil.model import db
+from hil.network_allocator import get_network_allocator
+
+# How many objects to add to the session between commits:
+BATCH_SIZE = 1000
+
+
+class Fleet(object):
+    """The size of a synthetic fleet, and the labels of what's in it.
+
+    The labels are filled in by `populate`; the benchmarks use them to pick
+    the objects their requests refer to.
+    """
+
+    def __init__(self, projects=10, nodes=100, nics_per_node=2, switches=4,
+                 networks_per_project=2, allocated=0.5, seed=0):
+        self.projects = projects
+        self.nodes = nodes
+        self.nics_per_node = nics_per_node
+        self.switches = switches
+        self.networks_per_project = networks_per_project
+        # The fraction of the nodes which belong to a project:
+        self.allocated = allocated
+        self.seed = seed
+
+        self.project_labels = []
+        self.switch_labels = []
+        self.network_labels = []
+        # Maps each port's (switch, port) labels to the (node, nic) labels
+        # connected to it:
+        self.ports = {}
+        self.free_nodes = []
+        # Maps the labels of each allocated node to its project's label:
+        self.allocated_nodes = {}
+        # Maps the (node, nic) labels of each attached nic to the label of
+        # its network:
+        self.attachments = {}
+
+    def params(self):
+        """Return the parameters the fleet was generated from."""
+        return {
+            'projects': self.projects,
+            'nodes': self.nodes,
+            'nics_per_node': self.nics_per_node,
+            'switches': self.switches,
+            'networks_per_project': self.networks_per_project,
+            'allocated': self.allocated,
+            'seed': self.seed,
+        }
+
+
+def _mac(i):
+    """Return a unique mac address for the `i`th nic."""
+    return ':'.join('%02x' % ((i >> shift) & 0xff)
+                    for shift in (40, 32, 24, 16, 8, 0))
+
+
+def populate(fleet):
+    """Add the objects described by `fleet` to the database.
+
+    Must be called inside an app context, with a freshly created database.
+    """
+    rng = random.Random(fleet.seed)
+    allocator = get_network_allocator()
+    channel = allocator.get_default_channel()
+    pending = [0]
+
+    def add(obj):
+        """Add `obj` to the session, committing every BATCH_SIZE objects."""
+        db.session.add(obj)
+        pending[0] += 1
+        if pending[0] >= BATCH_SIZE:
+            db.session.commit()
+            pending[0] = 0
+
+    projects = []
+    networks = {}
+    for i in range(fleet.projects):
+        project = model.Project('project-%d' % i)
+        add(project)
+        projects.append(project)
+        fleet.project_labels.append(project.label)
+        networks[project.label] = []
+        for j in range(fleet.networks_per_project):
+            network = model.Network(project, [project], True,
+                                    allocator.get_new_network_id(),
+                                    'net-%d-%d' % (i, j))
+            add(network)
+            networks[project.label].append(network)
+            fleet.network_labels.append(network.label)
+
+    switches = []
+    for i in range(fleet.switches):
+        switch = mock.MockSwitch(label='switch-%d' % i,
+                                 hostname='switch-%d.example.com' % i,
+                                 username='admin',
+                                 password='secret')
+        add(switch)
+        switches.append(switch)
+        fleet.switch_labels.append(switch.label)
+
+    nic_count = 0
+    for i in range(fleet.nodes):
+        label = 'node-%d' % i
+        node = model.Node(
+            label=label,
+            obm=MockObm(type=MockObm.api_name,
+                        host='ipmi-%d.example.com' % i,
+                        user='root',
+                        password='secret'),
+            obmd_uri='http://obmd.example.com/nodes/' + label,
+            obmd_admin_token='secret',
+        )
+        project = None
+        if projects and rng.random() < fleet.allocated:
+            project = rng.choice(projects)
+            node.project = project
+            fleet.allocated_nodes[label] = project.label
+        else:
+            fleet.free_nodes.append(label)
+        add(node)
+
+        for j in range(fleet.nics_per_node):
+            nic = model.Nic(node, 'eth%d' % j, _mac(nic_count))
+            if switches:
+                # Spread the nics over the switches round-robin, one port
+                # each:
+                switch = switches[nic_count % len(switches)]
+                port_label = 'gi1/0/%d' % (nic_count // len(switches))
+                nic.port = model.Port(port_label, switch)
+                fleet.ports[(switch.label, port_label)] = (label, nic.label)
+                if j == 0 and project is not None and \
+                        networks[project.label]:
+                    network = rng.choice(networks[project.label])
+                    add(model.NetworkAttachment(nic=nic,
+                                                network=network,
+                                                channel=channel))
+                    mock.LOCAL_STATE[switch.label][port_label][channel] = \
+                        network.network_id
+                    fleet.attachments[(label, nic.label)] = network.label
+            add(nic)
+            nic_count += 1
+    db.session.commit()
+
+
+def smoke_fleet(**params):
+    """Return a `Fleet` with `params`, populated in an app context of its own.
+
+    The benchmarks' smoke tests use this for their tiny fleets.
+    """
+    fleet = Fleet(**params)
+    with app.app_context():
+        populate(fleet)
+    return fleet
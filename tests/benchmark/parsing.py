@@ -0,0 +1,425 @@
+"""Benchmark for parsing switch output in ``get_port_networks``.
+
+This compares the parsers in `hil.ext.switches._parsers`, which parse a
+command's whole output in one go, with the way the drivers used to parse it
+(kept below, as the ``legacy_*`` functions): the console-based drivers
+matched it a line at a time with pexpect, OVS went through
+``string_to_dict``/``string_to_list`` and read each port twice, and Dell OS 9
+searched each port's output twice. For example::
+
+    python tests/benchmark/parsing.py --ports 96 --repeat 20
+
+For each driver, it generates the output of a switch with that many ports
+(in the formats of the fake switches, see `hil.ext.switches._fake_console`),
+reads every port's vlans both ways, and reports how long each took, after
+checking that both give the same networks. The console-based drivers are
+run against a `hil.ext.switches._replay.ReplayConsole`. The legacy code gets
+its output the way its patterns rely on: a line at a time, except for the
+N3000's, which needs the whole output at once.
+Only parsing is measured: there is no switch, so no waiting for output.
+
+When collected by pytest, this runs each driver on a few ports, and checks
+that both ways give the same networks.
+"""
+
+import argparse
+import random
+import re
+import time
+
+import pytest
+
+from hil import config, model
+from hil.ext.switches import _fake_console, _parsers, _replay
+from hil.ext.switches.common import parse_vlans, string_to_dict, \
+    string_to_list
+from hil.ext.switches._fake_vlans import format_vlans
+from hil.test_common import config_testsuite, config_merge
+
+DRIVERS = ('powerconnect55xx', 'delln3000', 'nexus', 'ovs', 'dellnos9')
+
+PORT_FORMATS = {
+    'powerconnect55xx': 'gi1/0/%d',
+    'delln3000': 'gi1/0/%d',
+    'nexus': 'Ethernet1/%d',
+    'ovs': 'veth-%d',
+    'dellnos9': '1/%d',
+}
+
+DUMMY_VLAN = '2222'
+
+OVS_OUTPUT = '''\
+_uuid               : ad489368-9b53-4a3e-8732-697ad5141de9
+bond_active_slave   : []
+bond_downdelay      : 0
+bond_fake_iface     : false
+bond_mode           : []
+bond_updelay        : 0
+external_ids        : {}
+fake_bridge         : false
+interfaces          : [fc61c8ff-99c5-4a1e-b3d8-0c3c62d4a7e2]
+lacp                : []
+mac                 : []
+name                : "%(name)s"
+other_config        : {}
+qos                 : []
+statistics          : {}
+status              : {}
+tag                 : %(tag)s
+trunks              : [%(trunks)s]
+vlan_mode           : native-untagged
+'''
+
+NOS9_OUTPUT = '''\
+<output xmlns='http://www.dell.com/ns/dell:0.1/root'>
+<command>show interfaces switchport GigabitEthernet%(name)s
+
+Codes: U - Untagged, T - Tagged
+       x - Dot1x untagged, X - Dot1x tagged
+       G - GVRP tagged, M - Trunk
+       i - Internal untagged, I - Internal tagged, v - VLT untagged, \
+V - VLT tagged
+
+Name: GigabitEthernet %(name)s
+802.1QTagged: Hybrid
+Vlan membership:
+Q       Vlans
+U       %(native)s
+%(tagged)s
+Native Vlan Id: %(native)s.
+
+
+
+MOC-Dell-S3048-ON#</command>
+</output>
+'''
+
+
+def configure():
+    """Configure HIL with the drivers being benchmarked."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.dell': '',
+            'hil.ext.switches.n3000': '',
+            'hil.ext.switches.nexus': '',
+            'hil.ext.switches.ovs': '',
+            'hil.ext.switches.dellnos9': '',
+        },
+    })
+    config.load_extensions()
+
+
+def port_configs(ports):
+    """Return the (random, but repeatable) configuration of `ports` ports.
+
+    Each configuration is a dictionary like those of a
+    `hil.ext.switches._fake_vlans.VlanTable`. The tagged vlans are never
+    consecutive, so that they don't make up ranges.
+    """
+    rng = random.Random(ports)
+    result = []
+    for _ in range(ports):
+        vlans = sorted(rng.sample(range(100, 4000, 2), rng.randint(0, 8)))
+        native = rng.choice([None] + vlans) if vlans else None
+        result.append({
+            'switchport': True,
+            'mode': 'trunk' if vlans else 'access',
+            'native': native,
+            'vlans': vlans,
+            'shutdown': False,
+        })
+    return result
+
+
+def outputs(driver, labels, configs):
+    """Return the output of reading `labels` (configured as `configs`).
+
+    The result maps each command which `driver` runs to its output.
+    """
+    if driver in _replay.CONSOLE_DRIVERS:
+        show = _fake_console.FLAVORS[driver]['show']
+        lines = {}
+        for label, port in zip(labels, configs):
+            lines[label] = [line for line in show(label, port)
+                            if line is not _fake_console.SETTLE]
+        if driver == 'nexus':
+            return {'show int sw':
+                    '\r\n'.join(sum((lines[l] for l in labels), [])) + '\r\n'}
+        return dict(('show int sw ' + label, '\r\n'.join(lines[label]) +
+                     '\r\n') for label in labels)
+    result = {}
+    for label, port in zip(labels, configs):
+        if driver == 'ovs':
+            result[label] = OVS_OUTPUT % {
+                'name': label,
+                'tag': port['native'] or '[]',
+                'trunks': ', '.join(str(vlan) for vlan in port['vlans']),
+            }
+        else:
+            tagged = format_vlans(port['vlans'])
+            result[label] = NOS9_OUTPUT % {
+                'name': label,
+                'native': port['native'] or 1,
+                'tagged': 'T       %s\n' % tagged if tagged else '',
+            }
+    return result
+
+
+def legacy_dell_int_config(self, interface):
+    """``_BaseSession._int_config``, as the PowerConnect driver used to."""
+    alternatives = [
+        r'More: .*',  # Prompt to press a key to continue
+        r'Classification rules:\r\n',  # End
+        r'[^ \t\r\n][^:]*:[^\n]*\n',   # Key:Value\r\n,
+        r' [^\n]*\n',                  # continuation line (from k:v)
+    ]
+    self._sendline('show int sw %s' % interface)
+
+    # Name is the first field:
+    self.console.expect('Name: .*')
+    k, v = self.console.after.split(':', 1)
+    result = {k: v}
+    while True:
+        index = self.console.expect(alternatives)
+        if index == 0:
+            self.console.send(' ')
+        elif index == 1:
+            break
+        elif index == 2:
+            k, v = self.console.after.split(':', 1)
+            result[k] = v
+        elif index == 3:
+            result[k] += self.console.after
+
+    self.console.expect(self.main_prompt)
+    return result
+
+
+def legacy_n3000_int_config(self, interface):
+    """``_DellN3000Session._int_config``, as it used to be."""
+    self._sendline('show int sw %s' % interface)
+    self.console.expect('Port: .*')
+    k, v = 'key', 'value'
+    result = {k: v}
+    key_lines = self.console.after.splitlines()
+    del key_lines[-3:]
+    for line in key_lines:
+        k, v = line.split(':', 1)
+        result[k] = v
+    self._sendline('\n')
+    self.console.expect(self.main_prompt)
+    return result
+
+
+def legacy_dell_port_configs(self, ports):
+    """``_BaseSession._port_configs``, as it used to be."""
+    result = {}
+    for port in ports:
+        result[port] = self._int_config(port.label)
+    return result
+
+
+def legacy_nexus_port_configs(self, ports):
+    """``nexus._Session._port_configs``, as it used to be."""
+    alternatives = [
+        re.escape(r'--More--'),
+        r'Name:[^\n]*\n',
+        r'  [A-Z][^:]*:[^\n]*\n',
+        r'[\r\n]+.+# ',
+    ]
+    self._sendline('show int sw')
+
+    # Find the first interface name
+    self.console.expect(alternatives[1])
+
+    _, interface = self.console.after.split(':', 1)
+    interface = interface.strip()
+    info = {interface: {}}
+
+    while True:
+        index = self.console.expect(alternatives)
+        if index == 0:
+            self.console.send(' ')
+        elif index == 1:
+            _, interface = self.console.after.split(':', 1)
+            interface = interface.strip()
+            info[interface] = {}
+        elif index == 2:
+            k, v = self.console.after.split(':', 1)
+            info[interface][k.strip()] = v.strip()
+        elif index == 3:
+            break
+
+    names_result = {}
+    pattern = re.compile(r'Ethernet(\d+)/(\d+)')
+    for k, v in info.iteritems():
+        match = re.match(pattern, k)
+        if match is None:
+            continue
+        switch, port = match.groups()
+        names_result['Ethernet%s/%s' % (switch, port)] = v
+
+    result = {}
+    for port in ports:
+        result[port] = names_result[port.label]
+    return result
+
+
+LEGACY_METHODS = {
+    'powerconnect55xx': {'_port_configs': legacy_dell_port_configs,
+                         '_int_config': legacy_dell_int_config},
+    'delln3000': {'_port_configs': legacy_dell_port_configs,
+                  '_int_config': legacy_n3000_int_config},
+    'nexus': {'_port_configs': legacy_nexus_port_configs},
+}
+
+# Whether the legacy code needs its output a line at a time:
+LEGACY_TRICKLE = {
+    'powerconnect55xx': True,
+    'delln3000': False,
+    'nexus': True,
+}
+
+
+def legacy_ovs_interface_info(output):
+    """What ``Ovs._interface_info`` used to make of `output`."""
+    output = output.split('\n')
+    output.remove('')
+    i_info = dict(s.split(':', 1) for s in output)
+    i_info = {k.strip(): v.strip() for k, v in i_info.iteritems()}
+    for x in i_info.keys():
+        if i_info[x][0] == "{":
+            i_info[x] = string_to_dict(i_info[x])
+        elif i_info[x][0] == "[":
+            i_info[x] = string_to_list(i_info[x])
+    return i_info
+
+
+def legacy_ovs_networks(output):
+    """What ``Ovs.get_port_networks`` used to make of a port's `output`.
+
+    It read the port twice, once for its trunks and once for its tag.
+    """
+    result = [("vlan/" + trunk, trunk)
+              for trunk in legacy_ovs_interface_info(output)['trunks']]
+    native = legacy_ovs_interface_info(output)['tag']
+    if native != []:
+        result.append(("vlan/native", native))
+    return result
+
+
+def legacy_nos9_networks(output):
+    """What ``DellNOS9.get_port_networks`` used to make of `output`.
+
+    It fetched the port's output twice, for its vlans and its native vlan.
+    """
+    response = output.replace(' ', '')
+    match = re.search(r'T(\d+(-\d+)?)(,\d+(-\d+)?)*', response)
+    if match is None:
+        result = []
+    else:
+        result = [('vlan/%s' % x, x) for x in
+                  parse_vlans(match.group().replace('T', ''))]
+    response = output.replace(' ', '')
+    match = re.search(r'NativeVlanId:(\d+)\.', response)
+    if match is not None:
+        result.append(('vlan/native', match.group(1)))
+    return result
+
+
+def nos9_networks(output):
+    """What ``DellNOS9.get_port_networks`` makes of a port's `output`."""
+    tagged, native = _parsers.nos9_switchport(output.replace(' ', ''))
+    result = [('vlan/%s' % x, x) for x in tagged]
+    if native is not None:
+        result.append(('vlan/native', native))
+    return result
+
+
+def ovs_networks(output):
+    """What ``Ovs.get_port_networks`` makes of a port's `output`."""
+    info = _parsers.ovs_record(output)
+    result = [("vlan/" + trunk, trunk) for trunk in info['trunks']]
+    if info['tag'] != []:
+        result.append(("vlan/native", info['tag']))
+    return result
+
+
+def read_networks(driver, responses, labels, legacy):
+    """Read the networks of `labels` from `responses` (see `outputs`).
+
+    Uses the legacy code if `legacy` is true. Returns a dictionary mapping
+    each label to its networks.
+    """
+    if driver == 'ovs':
+        parse = legacy_ovs_networks if legacy else ovs_networks
+        return dict((label, parse(responses[label])) for label in labels)
+    if driver == 'dellnos9':
+        parse = legacy_nos9_networks if legacy else nos9_networks
+        return dict((label, parse(responses[label])) for label in labels)
+    session = _replay.console_session(
+        driver, responses,
+        dummy_vlan=DUMMY_VLAN if driver != 'powerconnect55xx' else None,
+        trickle=legacy and LEGACY_TRICKLE[driver])
+    if legacy:
+        session.__class__ = type('Legacy', (session.__class__,),
+                                 LEGACY_METHODS[driver])
+    ports = [model.Port(label, session.switch) for label in labels]
+    networks = session.get_port_networks(ports)
+    return dict((port.label, networks[port]) for port in ports)
+
+
+def benchmark(driver, ports, repeat):
+    """Time reading `ports` ports' networks both ways, `repeat` times.
+
+    Returns the best times (in seconds) for the legacy code and for the
+    new parsers.
+    """
+    labels = [PORT_FORMATS[driver] % (i + 1) for i in range(ports)]
+    responses = outputs(driver, labels, port_configs(ports))
+    times = {}
+    results = {}
+    for legacy in (True, False):
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            results[legacy] = read_networks(driver, responses, labels, legacy)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        times[legacy] = best
+    assert results[True] == results[False], \
+        'The parsers disagree with the legacy code'
+    return times[True], times[False]
+
+
+def main(argv=None):
+    """Compare the switch output parsers with the legacy code."""
+    parser = argparse.ArgumentParser(
+        description='Time parsing the output of switch commands.')
+    parser.add_argument('--driver', choices=DRIVERS, action='append',
+                        help='driver to benchmark (default: all of them)')
+    parser.add_argument('--ports', type=int, default=96)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    configure()
+    print('%-18s %6s %10s %10s %8s' % (
+        'driver', 'ports', 'legacy ms', 'new ms', 'speedup'))
+    for driver in args.driver or DRIVERS:
+        legacy, new = benchmark(driver, args.ports, args.repeat)
+        print('%-18s %6d %10.2f %10.2f %7.1fx' % (
+            driver, args.ports, legacy * 1000, new * 1000, legacy / new))
+
+
+@pytest.mark.parametrize('driver', DRIVERS)
+def test_smoke(driver):
+    """Both ways of parsing agree, on a few ports."""
+    configure()
+    legacy, new = benchmark(driver, ports=6, repeat=1)
+    assert legacy > 0 and new > 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+"""Scale benchmark for the REST API.
+
+This builds a synthetic fleet (see `fleet.py`), then drives the flask test
+client through a mix of representative API calls, and reports for each
+endpoint the throughput, latency percentiles, and the number of SQL
+statements per call (as counted by `hil.metrics`). The report can be saved
+as a baseline, and later runs compared against it, so that regressions show
+up. For example::
+
+    python tests/benchmark/scale.py --nodes 10000 --switches 200 \\
+        --output baseline.json
+    # ... change things ...
+    python tests/benchmark/scale.py --nodes 10000 --switches 200 \\
+        --baseline baseline.json
+
+exits non-zero if any endpoint got slower, or issues more SQL statements,
+than in the baseline. Run it with ``--help`` for all of the options.
+
+The benchmark uses ``testsuite.cfg`` (or the test suite's defaults) for the
+database, so it can be pointed at postgres the same way the tests are.
+
+When collected by pytest, this runs a tiny fleet through each mix, as a
+smoke test of the benchmark itself, and checks that the default options
+issue no more SQL statements per call than in ``baseline.json``, a report
+taken with them (its latencies aren't compared, as they depend on the
+machine).
+"""
+
+import argparse
+import json
+from os.path import dirname, join
+import random
+import sys
+import time
+
+import pytest
+
+from hil import config, deferred, metrics
+from hil.flaskapp import app
+from hil.test_common import config_testsuite, config_merge, newDB, \
+    releaseDB, server_init
+
+# This directory is on the path, both when this is run as a script and
+# when pytest collects it:
+from common import percentile, write_report
+from fleet import Fleet, populate, smoke_fleet
+
+# A report taken with the default options, which `test_baseline_sql`
+# checks against:
+BASELINE = join(dirname(__file__), 'baseline.json')
+
+# Relative slack allowed when comparing latencies against a baseline:
+DEFAULT_TOLERANCE = 0.25
+
+# Absolute slack (in milliseconds) allowed when comparing latencies, so that
+# noise in very fast calls isn't reported as a regression:
+LATENCY_SLACK_MS = 1.0
+
+
+def _read_ops(fleet, rng):
+    """Return the read operations for `fleet`, as (weight, function) pairs.
+
+    Each function makes its requests via the `request` function it is
+    passed; see `run`.
+    """
+
+    def list_nodes(request):
+        """List the free nodes."""
+        request('list_nodes', 'GET', '/nodes/free')
+
+    def show_node(request):
+        """Show a random node."""
+        request('show_node', 'GET',
+                '/node/node-%d' % rng.randrange(fleet.nodes))
+
+    def list_projects(request):
+        """List the projects."""
+        request('list_projects', 'GET', '/projects')
+
+    def list_project_nodes(request):
+        """List a random project's nodes."""
+        request('list_project_nodes', 'GET',
+                '/project/%s/nodes' % rng.choice(fleet.project_labels))
+
+    def list_project_networks(request):
+        """List a random project's networks."""
+        request('list_project_networks', 'GET',
+                '/project/%s/networks' % rng.choice(fleet.project_labels))
+
+    def show_network(request):
+        """Show a random network."""
+        request('show_network', 'GET',
+                '/network/%s' % rng.choice(fleet.network_labels))
+
+    def list_network_attachments(request):
+        """List a random network's attachments."""
+        request('list_network_attachments', 'GET',
+                '/network/%s/attachments' % rng.choice(fleet.network_labels))
+
+    def show_switch(request):
+        """Show a random switch."""
+        request('show_switch', 'GET',
+                '/switch/%s' % rng.choice(fleet.switch_labels))
+
+    def show_port(request):
+        """Show a random port."""
+        switch, port = rng.choice(ports)
+        request('show_port', 'GET', '/switch/%s/port/%s' % (switch, port))
+
+    ports = sorted(fleet.ports)
+    ops = [(5, show_node), (1, list_nodes)]
+    if fleet.project_labels:
+        ops += [(1, list_projects),
+                (3, list_project_nodes),
+                (2, list_project_networks)]
+    if fleet.network_labels:
+        ops += [(2, show_network), (2, list_network_attachments)]
+    if fleet.switch_labels:
+        ops += [(1, show_switch), (3, show_port)]
+    return ops
+
+
+def _write_ops(fleet, rng):
+    """Return the write operations for `fleet`; see `_read_ops`.
+
+    Each operation undoes itself, so that the fleet looks the same before
+    and after it (and the mix can run indefinitely). The network daemon's
+    work is done between requests, but isn't timed.
+    """
+
+    def network_create_delete(request):
+        """Create a network in a random project, then delete it."""
+        project = rng.choice(fleet.project_labels)
+        network = 'bench-net'
+        request('network_create', 'PUT', '/network/' + network,
+                {'owner': project, 'access': project, 'net_id': ''})
+        request('network_delete', 'DELETE', '/network/' + network)
+
+    def metadata_set_delete(request):
+        """Set metadata on a random node, then delete it."""
+        node = 'node-%d' % rng.randrange(fleet.nodes)
+        request('node_set_metadata', 'PUT', '/node/%s/metadata/bench' % node,
+                {'value': 'benchmark'})
+        request('node_delete_metadata', 'DELETE',
+                '/node/%s/metadata/bench' % node)
+
+    def project_connect_detach(request):
+        """Connect a free node to a project, then detach it."""
+        node = rng.choice(fleet.free_nodes)
+        project = rng.choice(fleet.project_labels)
+        request('project_connect_node', 'POST',
+                '/project/%s/connect_node' % project, {'node': node})
+        request('project_detach_node', 'POST',
+                '/project/%s/detach_node' % project, {'node': node})
+
+    def network_detach_connect(request):
+        """Detach a nic from its network, then reconnect it."""
+        (node, nic), network = rng.choice(attachments)
+        request('node_detach_network', 'POST',
+                '/node/%s/nic/%s/detach_network' % (node, nic),
+                {'network': network})
+        deferred.apply_networking()
+        request('node_connect_network', 'POST',
+                '/node/%s/nic/%s/connect_network' % (node, nic),
+                {'network': network})
+        deferred.apply_networking()
+
+    attachments = sorted(fleet.attachments.items())
+    ops = [(2, metadata_set_delete)]
+    if fleet.project_labels:
+        ops.append((1, network_create_delete))
+        if fleet.free_nodes:
+            ops.append((1, project_connect_detach))
+    if attachments:
+        ops.append((2, network_detach_connect))
+    return ops
+
+
+def _mixed_ops(fleet, rng):
+    """Return the read and write operations, weighted 9 to 1."""
+    reads = _read_ops(fleet, rng)
+    writes = _write_ops(fleet, rng)
+    read_total = sum(weight for weight, _ in reads)
+    write_total = sum(weight for weight, _ in writes)
+    return [(weight * 9 * write_total, op) for weight, op in reads] + \
+        [(weight * read_total, op) for weight, op in writes]
+
+
+MIXES = {
+    'read': _read_ops,
+    'write': _write_ops,
+    'mixed': _mixed_ops,
+}
+
+
+def run(fleet, mix, operations, seed=0):
+    """Run `operations` operations from the mix named `mix` against `fleet`.
+
+    Must be called inside an app context, after `populate(fleet)`. Returns
+    the report, a JSON-friendly dictionary.
+    """
+    rng = random.Random(seed)
+    ops = MIXES[mix](fleet, rng)
+    total_weight = sum(weight for weight, _ in ops)
+    client = app.test_client()
+    latencies = {}
+    errors = {}
+
+    def request(endpoint, method, path, body=None):
+        """Make a request, and record how long it took."""
+        if body is not None:
+            body = json.dumps(body)
+        start = time.time()
+        resp = client.open('/v0' + path, method=method, data=body)
+        latencies.setdefault(endpoint, []).append(time.time() - start)
+        if not 200 <= resp.status_code < 300:
+            errors[endpoint] = errors.get(endpoint, 0) + 1
+
+    metrics.reset()
+    start = time.time()
+    for _ in range(operations):
+        pick = rng.uniform(0, total_weight)
+        for weight, op in ops:
+            pick -= weight
+            if pick <= 0:
+                break
+        op(request)
+    elapsed = time.time() - start
+
+    sql = metrics.sql_statements_per_call()
+    endpoints = {}
+    for endpoint, times in latencies.items():
+        times.sort()
+        endpoints[endpoint] = {
+            'calls': len(times),
+            'errors': errors.get(endpoint, 0),
+            'per_sec': len(times) / sum(times),
+            'p50_ms': percentile(times, 0.5) * 1000,
+            'p90_ms': percentile(times, 0.9) * 1000,
+            'p99_ms': percentile(times, 0.99) * 1000,
+            'sql_per_call': sql.get(endpoint),
+        }
+    return {
+        'fleet': fleet.params(),
+        'mix': mix,
+        'operations': operations,
+        'seconds': elapsed,
+        'requests_per_sec': sum(len(t) for t in latencies.values()) / elapsed,
+        'endpoints': endpoints,
+    }
+
+
+def compare(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Compare `report` against `baseline`.
+
+    Returns a list of regressions, as human readable strings. An endpoint
+    regresses if its p50 or p99 latency grew by more than `tolerance`
+    (relative) plus `LATENCY_SLACK_MS`, or if it issues more SQL statements
+    per call than it used to. Endpoints missing from either report are
+    ignored.
+
+    Raises ValueError if the reports aren't for the same fleet and mix.
+    """
+    for key in 'fleet', 'mix':
+        if report[key] != baseline[key]:
+            raise ValueError('The baseline is for a different %s: %r' %
+                             (key, baseline[key]))
+    regressions = []
+    for endpoint, new in sorted(report['endpoints'].items()):
+        old = baseline['endpoints'].get(endpoint)
+        if old is None:
+            continue
+        for key in 'p50_ms', 'p99_ms':
+            if new[key] > old[key] * (1 + tolerance) + LATENCY_SLACK_MS:
+                regressions.append('%s: %s went from %.2f to %.2f' %
+                                   (endpoint, key, old[key], new[key]))
+        if new['sql_per_call'] is not None and \
+                old['sql_per_call'] is not None and \
+                new['sql_per_call'] > old['sql_per_call'] + 0.01:
+            regressions.append('%s: SQL statements per call went from '
+                               '%.2f to %.2f' % (endpoint,
+                                                 old['sql_per_call'],
+                                                 new['sql_per_call']))
+    return regressions
+
+
+def format_report(report):
+    """Return `report` as a human readable table."""
+    lines = ['%-26s %7s %6s %9s %9s %9s %9s %7s' % (
+        'endpoint', 'calls', 'errors', 'req/s', 'p50 ms', 'p90 ms',
+        'p99 ms', 'sql')]
+    for endpoint, stats in sorted(report['endpoints'].items()):
+        sql = stats['sql_per_call']
+        lines.append('%-26s %7d %6d %9.1f %9.2f %9.2f %9.2f %7s' % (
+            endpoint, stats['calls'], stats['errors'], stats['per_sec'],
+            stats['p50_ms'], stats['p90_ms'], stats['p99_ms'],
+            '-' if sql is None else '%.1f' % sql))
+    lines.append('%d operations in %.1f seconds (%.1f requests/sec)' % (
+        report['operations'], report['seconds'], report['requests_per_sec']))
+    return '\n'.join(lines)
+
+
+def configure_hil():
+    """Configure HIL for the benchmark, and create a fresh database."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.obm.mock': '',
+            'hil.ext.switches.mock': '',
+        },
+    })
+    config.load_extensions()
+    newDB()
+    server_init()
+
+
+def main(argv=None):
+    """Build a fleet, run the benchmark, and report (and compare) results."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the REST API against a synthetic fleet.')
+    defaults = Fleet()
+    parser.add_argument('--projects', type=int, default=defaults.projects)
+    parser.add_argument('--nodes', type=int, default=defaults.nodes)
+    parser.add_argument('--nics-per-node', type=int,
+                        default=defaults.nics_per_node)
+    parser.add_argument('--switches', type=int, default=defaults.switches)
+    parser.add_argument('--networks-per-project', type=int,
+                        default=defaults.networks_per_project)
+    parser.add_argument('--allocated', type=float, default=defaults.allocated,
+                        help='fraction of nodes which belong to a project')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--operations', type=int, default=1000,
+                        help='number of operations to run')
+    parser.add_argument('--output', help='save the report to this file')
+    parser.add_argument('--baseline', help='compare against this report')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative latency increase to tolerate')
+    args = parser.parse_args(argv)
+
+    fleet = Fleet(projects=args.projects,
+                  nodes=args.nodes,
+                  nics_per_node=args.nics_per_node,
+                  switches=args.switches,
+                  networks_per_project=args.networks_per_project,
+                  allocated=args.allocated,
+                  seed=args.seed)
+    configure_hil()
+    try:
+        with app.app_context():
+            start = time.time()
+            populate(fleet)
+            print('Populated the database in %.1f seconds' %
+                  (time.time() - start))
+            report = run(fleet, args.mix, args.operations, args.seed)
+    finally:
+        releaseDB()
+
+    print(format_report(report))
+    if args.output:
+        write_report(report, args.output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION: ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+@pytest.fixture
+def configure():
+    """Set up HIL for the smoke test."""
+    configure_hil()
+    yield
+    releaseDB()
+
+
+@pytest.mark.parametrize('mix', sorted(MIXES))
+def test_smoke(configure, mix):
+    """Run a tiny fleet through `mix`, and check the report makes sense."""
+    fleet = smoke_fleet(projects=2, nodes=20, switches=2)
+    with app.app_context():
+        report = run(fleet, mix, 50)
+    assert report['endpoints']
+    for endpoint, stats in report['endpoints'].items():
+        assert stats['errors'] == 0, endpoint
+        assert stats['calls'] > 0
+        assert stats['p50_ms'] <= stats['p90_ms'] <= stats['p99_ms']
+        assert stats['sql_per_call'] >= 1, endpoint
+    assert compare(report, report) == []
+
+
+def test_baseline_sql(configure):
+    """The default options issue no more SQL statements than in `BASELINE`.
+
+    Latencies depend on the machine the baseline was taken on, so they
+    aren't compared.
+    """
+    with open(BASELINE) as f:
+        baseline = json.load(f)
+    fleet = Fleet(**baseline['fleet'])
+    with app.app_context():
+        populate(fleet)
+        report = run(fleet, baseline['mix'], baseline['operations'])
+    assert compare(report, baseline, tolerance=float('inf')) == []
+
+
+if __name__ == '__main__':
+    main()
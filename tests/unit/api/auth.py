@@ -653,6 +653,8 @@ admin_calls = [
     (api.node_delete_metadata, ['runway_node_0', 'EK'], {}),
     (api.port_revert, ['stock_switch_0', 'free_node_0_port'], {}),
     (api.list_active_extensions, [], {}),
+    (api.show_metrics, [], {}),
+    (api.list_slow_requests, [], {}),
 ]
 
 
@@ -804,7 +806,8 @@ class Test_show_networking_action(unittest.TestCase):
                             'nic': 'boot-nic',
                             'type': 'modify_port',
                             'channel': 'null',
-                            'new_network': 'stock_int_pub'}
+                            'new_network': 'stock_int_pub',
+                            'queue_position': 1}
 
     def test_show_networking_action_failure(self):
         """Test that project with no access to node can't get the status"""
@@ -823,4 +826,21 @@ class Test_show_networking_action(unittest.TestCase):
                             'nic': 'boot-nic',
                             'type': 'modify_port',
                             'channel': 'null',
-                            'new_network': 'stock_int_pub'}
+                            'new_network': 'stock_int_pub',
+                            'queue_position': 1}
+
+    def test_show_networking_action_trace_success(self):
+        """Projects with access to the node can get the action's trace.
+
+        The action wasn't queued through the REST API, so no spans were
+        saved.
+        """
+        self.auth_backend.set_project(self.manhattan)
+        response = api.show_networking_action_trace(self.status_id)
+        assert json.loads(response) == []
+
+    def test_show_networking_action_trace_failure(self):
+        """Projects with no access to the node can't get the trace."""
+        self.auth_backend.set_project(self.runway)
+        with pytest.raises(AuthorizationError):
+            api.show_networking_action_trace(self.status_id)
@@ -43,6 +43,7 @@ General advice on working with this module:
 """
 import hil
 from hil import model, deferred, errors, config, api
+from hil.model import db
 from hil.test_common import config_testsuite, config_merge, fresh_database, \
     fail_on_log_warnings, additional_db, with_request_context, \
     network_create_simple, server_init, uuid_pattern
@@ -51,7 +52,9 @@ from hil.auth import get_auth_backend
 import pytest
 import unittest
 import json
+import time
 import uuid
+from datetime import datetime
 from schema import SchemaError
 
 MOCK_SWITCH_TYPE = 'http://schema.massopencloud.org/haas/v0/switches/mock'
@@ -1623,6 +1626,7 @@ class Test_list_show_switch:
             'name': 'sw0',
             'ports': [{'label': PORTS[2]}],
             'capabilities': ['nativeless-trunk-mode'],
+            'breaker': {'state': 'closed', 'failures': 0, 'open_until': None},
         }
 
         api.switch_register_port('sw0', PORTS[1])
@@ -1633,6 +1637,19 @@ class Test_list_show_switch:
             'ports': [{'label': PORTS[2]},
                       {'label': PORTS[1]}],
             'capabilities': ['nativeless-trunk-mode'],
+            'breaker': {'state': 'closed', 'failures': 0, 'open_until': None},
+        }
+
+    def test_show_switch_breaker(self, switchinit):
+        """show_switch shows the state of the switch's circuit breaker."""
+        switch = api.get_or_404(model.Switch, 'sw0')
+        switch.breaker_failures = 3
+        switch.breaker_open_until = datetime(2030, 1, 1, 12, 30)
+        model.db.session.commit()
+        assert json.loads(api.show_switch('sw0'))['breaker'] == {
+            'state': 'open',
+            'failures': 3,
+            'open_until': '2030-01-01T12:30:00',
         }
 
 
@@ -2434,6 +2451,110 @@ class TestExtensions:
             ]
 
 
+class TestMetrics:
+    """Test the show_metrics api call."""
+
+    def test_sql_statements_counted(self):
+        """SQL statements issued by an API call are charged to it."""
+        from hil import metrics
+        metrics.reset()
+        api.project_create('anvil-nextgen')
+        # Calling the api function directly bypasses the rest machinery, so
+        # record a call by hand:
+        metrics.start_call('list_projects')
+        api.list_projects()
+        metrics.finish_call(200)
+
+        text = api.show_metrics().get_data()
+        assert 'hil_api_requests_total{endpoint="list_projects",' \
+            'status="200"} 1\n' in text
+        for line in text.splitlines():
+            if line.startswith('hil_api_sql_statements_total{'
+                               'endpoint="list_projects"}'):
+                assert int(line.split()[-1]) >= 1
+                break
+        else:
+            assert False, 'No SQL statement count for list_projects'
+
+
+class TestListChanges:
+    """Test the change log, and the list_changes api call."""
+
+    @staticmethod
+    def _changes(since=0):
+        """Return the changes after `since`, as (type, label, op) tuples."""
+        result = json.loads(api.list_changes(since=since))
+        return [(change['type'], change['label'], change['op'])
+                for change in result['changes']]
+
+    def test_changes_recorded(self):
+        """Each change is recorded, against the thing it belongs to."""
+        api.project_create('anvil-nextgen')
+        new_node('node-1')
+        api.node_register_nic('node-1', 'eth0', 'DE:AD:BE:EF:20:14')
+        api.project_connect_node('anvil-nextgen', 'node-1')
+        api.node_delete_nic('node-1', 'eth0')
+        api.project_detach_node('anvil-nextgen', 'node-1')
+        api.node_delete('node-1')
+        assert self._changes() == [
+            ('project', 'anvil-nextgen', 'created'),
+            ('node', 'node-1', 'created'),
+            ('node', 'node-1', 'updated'),
+            ('node', 'node-1', 'updated'),
+            ('node', 'node-1', 'updated'),
+            ('node', 'node-1', 'updated'),
+            ('node', 'node-1', 'deleted'),
+        ]
+
+    def test_network_attachment(self, switchinit):
+        """Attaching a network changes both the node and the network."""
+        api.project_create('anvil-nextgen')
+        new_node('node-1')
+        api.node_register_nic('node-1', 'eth0', 'DE:AD:BE:EF:20:14')
+        api.port_connect_nic('sw0', PORTS[2], 'node-1', 'eth0')
+        api.project_connect_node('anvil-nextgen', 'node-1')
+        network_create_simple('hammernet', 'anvil-nextgen')
+        since = json.loads(api.list_changes())['latest']
+
+        # Queueing the action changes nothing yet:
+        api.node_connect_network('node-1', 'eth0', 'hammernet')
+        assert self._changes(since) == []
+        deferred.apply_networking()
+        assert self._changes(since) == [
+            ('network', 'hammernet', 'updated'),
+            ('node', 'node-1', 'updated'),
+        ]
+
+    def test_rollback(self):
+        """Changes which are rolled back aren't recorded."""
+        db.session.add(model.Project('anvil-nextgen'))
+        db.session.flush()
+        db.session.rollback()
+        assert self._changes() == []
+
+    def test_paging(self):
+        """The changes can be listed a page at a time."""
+        for i in range(5):
+            api.project_create('project-%d' % i)
+        result = json.loads(api.list_changes(limit=2))
+        assert [change['label'] for change in result['changes']] == \
+            ['project-0', 'project-1']
+        assert result['latest'] > result['next']
+
+        labels = []
+        since = result['next']
+        while since < result['latest']:
+            result = json.loads(api.list_changes(since=since, limit=2))
+            labels.extend(change['label'] for change in result['changes'])
+            since = result['next']
+        assert labels == ['project-2', 'project-3', 'project-4']
+        assert json.loads(api.list_changes(since=since)) == {
+            'changes': [],
+            'next': since,
+            'latest': since,
+        }
+
+
 class TestDryRun:
     """
     Test that api calls using functions with @no_dry_run behave reasonably.
@@ -2485,23 +2606,63 @@ class TestShowNetworkingAction(unittest.TestCase):
                             'nic': '99-eth0',
                             'type': 'modify_port',
                             'channel': 'vlan/native',
-                            'new_network': 'hammernet'}
+                            'new_network': 'hammernet',
+                            'queue_position': 1}
 
         deferred.apply_networking()
         response = json.loads(api.show_networking_action(status_id))
         assert response['status'] == 'DONE'
+        assert response['queue_position'] is None
+
+    def test_show_networking_action_wait(self):
+        """A pending action is waited for, up to `wait` seconds."""
+        response = api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        status_id = json.loads(response[0])['status_id']
+
+        start = time.time()
+        response = json.loads(api.show_networking_action(status_id, wait=1))
+        assert response['status'] == 'PENDING'
+        assert time.time() - start >= 1
+
+        deferred.apply_networking()
+        start = time.time()
+        response = json.loads(api.show_networking_action(status_id, wait=10))
+        assert response['status'] == 'DONE'
+        assert time.time() - start < 10
+
+    def test_show_networking_actions(self):
+        """Several actions' statuses can be shown at once."""
+        first = json.loads(api.node_connect_network(
+            'node-99', '99-eth0', 'hammernet')[0])['status_id']
+        deferred.apply_networking()
+        second = json.loads(api.node_detach_network(
+            'node-99', '99-eth0', 'hammernet')[0])['status_id']
+
+        response = json.loads(api.show_networking_actions(
+            first + ',' + second))
+        assert response == {
+            first: json.loads(api.show_networking_action(first)),
+            second: json.loads(api.show_networking_action(second)),
+        }
+        assert response[first]['status'] == 'DONE'
+        assert response[second]['status'] == 'PENDING'
+
+        with pytest.raises(errors.NotFoundError):
+            api.show_networking_actions(first + ',nonexistent')
+        with pytest.raises(errors.BadArgumentError):
+            api.show_networking_actions(',')
+
+    def test_networking_action_priority(self):
+        """Actions queued by an admin get ADMIN_PRIORITY."""
+        api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        action = model.NetworkingAction.query.one()
+        assert action.priority == model.NetworkingAction.ADMIN_PRIORITY
 
     def test_show_networking_action_detach(self):
         """Show networking action on an operation detaching a network"""
         api.node_connect_network('node-99', '99-eth0', 'hammernet')
 
-        # adding another action shouldn't work unless the last one is cleared
-        with pytest.raises(errors.BlockedError):
-            api.node_detach_network('node-99', '99-eth0', 'hammernet')
-
-        # add another network operation on the same nic, the previous action
-        # should be deleted. And the new one should be successfully added.
-        deferred.apply_networking()
+        # The detach may be queued behind the pending connect:
         response = api.node_detach_network('node-99', '99-eth0', 'hammernet')
 
         response = json.loads(response[0])
@@ -2512,6 +2673,56 @@ class TestShowNetworkingAction(unittest.TestCase):
         assert response['channel'] == 'vlan/native'
         assert response['new_network'] is None
 
+        # The two cancel out:
+        deferred.apply_networking()
+        response = json.loads(api.show_networking_action(status_id))
+        assert response['status'] == 'DONE'
+        assert model.NetworkAttachment.query.count() == 0
+
+    def test_queued_actions(self):
+        """Actions are checked against the networks pending actions leave.
+        """
+        network_create_simple('othernet', 'anvil-nextgen')
+        api.node_connect_network('node-99', '99-eth0', 'hammernet')
+
+        # The network will be attached once the first action is done:
+        with pytest.raises(errors.BlockedError):
+            api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        with pytest.raises(errors.BadArgumentError):
+            api.node_detach_network('node-99', '99-eth0', 'othernet')
+
+        # A nic may only have so many pending actions:
+        for i in range(1, api.MAX_QUEUED_ACTIONS):
+            if i % 2:
+                api.node_detach_network('node-99', '99-eth0', 'hammernet')
+            else:
+                api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        with pytest.raises(errors.BlockedError):
+            api.node_connect_network('node-99', '99-eth0', 'hammernet')
+
+        # Once they are done, more may be queued:
+        deferred.apply_networking()
+        api.node_connect_network('node-99', '99-eth0', 'hammernet')
+
+    def test_show_networking_action_archived(self):
+        """The status of an archived networking action can still be shown."""
+        response = api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        status_id = json.loads(response[0])['status_id']
+        deferred.apply_networking()
+
+        # Queueing another action on the nic archives the first:
+        api.node_detach_network('node-99', '99-eth0', 'hammernet')
+        assert model.ArchivedNetworkingAction.query.count() == 1
+
+        response = json.loads(api.show_networking_action(status_id))
+        assert response == {'status': 'DONE',
+                            'node': 'node-99',
+                            'nic': '99-eth0',
+                            'type': 'modify_port',
+                            'channel': 'vlan/native',
+                            'new_network': 'hammernet',
+                            'queue_position': None}
+
     def test_show_networking_action_revert_port(self):
         """Show networking action on a revert port type of operation"""
         response = api.port_revert('sw0', PORTS[2])
@@ -2524,10 +2735,56 @@ class TestShowNetworkingAction(unittest.TestCase):
                             'nic': '99-eth0',
                             'type': 'revert_port',
                             'channel': '',
-                            'new_network': None}
+                            'new_network': None,
+                            'queue_position': 1}
 
     def test_show_networking_action_nonexistent(self):
         """Show networking action on a a non existent status_id"""
         status_id = '96c888a9-3257-491b-bca9-06be26b15525'
         with pytest.raises(errors.NotFoundError):
             api.show_networking_action(status_id)
+
+    def test_show_networking_action_trace(self):
+        """The trace follows the action from the API call to the daemon."""
+        from hil import tracing
+        # Calling the api function directly bypasses the rest machinery, so
+        # trace the call by hand:
+        tracer = tracing.start('some-trace', 'api_call',
+                               endpoint='node_connect_network')
+        response = api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        assert tracing.finish() is tracer
+        assert tracer.keep
+        tracer.save()
+        model.db.session.commit()
+        status_id = json.loads(response[0])['status_id']
+
+        deferred.apply_networking()
+
+        roots = json.loads(api.show_networking_action_trace(status_id))
+        assert [root['name'] for root in roots] == \
+            ['api_call', 'networking_action', 'disconnect']
+        assert 'db_commit' in [child['name']
+                               for child in roots[0]['children']]
+        assert roots[1]['info']['uuid'] == status_id
+        assert [child['name'] for child in roots[1]['children']] == \
+            ['queue_wait', 'session', 'modify_port']
+
+    def test_show_networking_action_trace_archived(self):
+        """The trace of an archived networking action can still be shown."""
+        response = api.node_connect_network('node-99', '99-eth0', 'hammernet')
+        status_id = json.loads(response[0])['status_id']
+        deferred.apply_networking()
+        before = json.loads(api.show_networking_action_trace(status_id))
+        assert before
+
+        # Queueing another action on the nic archives the first:
+        api.node_detach_network('node-99', '99-eth0', 'hammernet')
+        assert model.ArchivedNetworkingAction.query.count() == 1
+        assert json.loads(api.show_networking_action_trace(status_id)) == \
+            before
+
+    def test_show_networking_action_trace_nonexistent(self):
+        """Show the trace of a non existent status_id"""
+        status_id = '96c888a9-3257-491b-bca9-06be26b15525'
+        with pytest.raises(errors.NotFoundError):
+            api.show_networking_action_trace(status_id)
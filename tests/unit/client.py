@@ -6,7 +6,7 @@ from hil.client.client import Client, HTTPClient, HTTPResponse
 from hil.test_common import config_testsuite, config_merge, \
     fresh_database, fail_on_log_warnings, server_init, uuid_pattern
 from hil.model import db
-from hil import config, deferred
+from hil import config, deferred, model
 
 import json
 import pytest
@@ -448,6 +448,17 @@ class Test_node:
         with pytest.raises(FailedAPICallException):
             C.node.show_console('node-01')
 
+    def test_node_read_console(self):
+        """read_console with offsets, tails and max_bytes."""
+        C.node.start_console('node-01')
+        assert C.node.read_console('node-01') == ('Some console output', 19)
+        assert C.node.read_console('node-01', offset=5, max_bytes=7) == \
+            ('console', 12)
+        assert C.node.show_console('node-01', tail=6) == 'output'
+        assert C.node.read_console('node-01', offset=19, follow=0) == \
+            ('', 19)
+        C.node.stop_console('node-01')
+
     def test_node_show_console_reserved_chars(self):
         """test for cataching illegal argument characters"""
         with pytest.raises(BadArgumentError):
@@ -625,7 +636,9 @@ class Test_switch:
         """(successful) call to show_switch"""
         assert C.switch.show('dell-01') == {
             u'name': u'dell-01', u'ports': [],
-            u'capabilities': ['nativeless-trunk-mode']}
+            u'capabilities': ['nativeless-trunk-mode'],
+            u'breaker': {u'state': u'closed', u'failures': 0,
+                         u'open_until': None}}
 
     def test_show_switch_reserved_chars(self):
         """ test for catching illegal argument characters"""
@@ -1039,7 +1052,8 @@ class TestShowNetworkingAction:
                             'nic': 'eth0',
                             'type': 'modify_port',
                             'channel': 'vlan/native',
-                            'new_network': 'net-01'}
+                            'new_network': 'net-01',
+                            'queue_position': 1}
 
         deferred.apply_networking()
         response = C.node.show_networking_action(status_id)
@@ -1049,3 +1063,30 @@ class TestShowNetworkingAction:
         """(unsuccessful) call to show_networking_action"""
         with pytest.raises(FailedAPICallException):
             C.node.show_networking_action('non-existent-entry')
+
+    def test_wait_for_actions(self, monkeypatch):
+        """wait_for_actions returns once the actions have finished."""
+        from hil import completion
+        status_ids = [
+            C.node.connect_network('node-01', 'eth0', 'net-01',
+                                   'vlan/native')['status_id'],
+            C.node.connect_network('node-02', 'eth0', 'net-04',
+                                   'vlan/native')['status_id'],
+        ]
+        waits = []
+
+        def wait(self, uuids, timeout):
+            """Finish the actions, as the network daemon would."""
+            waits.append(sorted(uuids))
+            model.NetworkingAction.query \
+                .filter(model.NetworkingAction.uuid.in_(uuids)) \
+                .update({'status': 'DONE'}, synchronize_session=False)
+            db.session.commit()
+
+        monkeypatch.setattr(completion.Listener, 'wait', wait)
+        statuses = C.node.wait_for_actions(status_ids)
+        assert waits == [sorted(status_ids)]
+        assert sorted(statuses) == sorted(status_ids)
+        assert [statuses[status_id]['status']
+                for status_id in status_ids] == ['DONE', 'DONE']
+        assert statuses == C.node.show_networking_actions(status_ids)
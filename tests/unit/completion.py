@@ -0,0 +1,133 @@
+"""Unit tests for hil.completion"""
+
+import os
+import time
+
+import pytest
+
+from hil import completion, config
+from hil.model import db
+from hil.test_common import config_testsuite, fresh_database
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL."""
+    config_testsuite()
+    config.load_extensions()
+
+
+fresh_database = pytest.fixture(fresh_database)
+
+
+pytestmark = pytest.mark.usefixtures('configure', 'fresh_database')
+
+
+class Action(object):
+    """Stands in for a finished networking action."""
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+def test_listener_wakes_up():
+    """A listener stops waiting soon after an action it waits for finishes.
+    """
+    with completion.Listener() as listener:
+        completion.notify(Action('other'))
+        completion.notify(Action('done'))
+        db.session.commit()
+        start = time.time()
+        listener.wait(['done'], 10)
+        assert time.time() - start <= completion.POLL_INTERVAL + 1
+
+
+def test_listener_times_out():
+    """A listener waits no longer than it is told to."""
+    with completion.Listener() as listener:
+        start = time.time()
+        listener.wait(['pending'], 0.2)
+        assert time.time() - start < 1
+
+
+class FakeConnection(object):
+    """Stands in for a psycopg2 connection listening for notifications.
+
+    `send` delivers a notification, waking up `select` through a pipe.
+    """
+
+    def __init__(self):
+        self.read_end, self.write_end = os.pipe()
+        self.notifies = []
+        self.pending = []
+
+    def fileno(self):
+        """Return the end of the pipe `select` waits on."""
+        return self.read_end
+
+    def send(self, payload):
+        """Deliver a notification with the given payload."""
+        self.pending.append(Notification(payload))
+        os.write(self.write_end, 'x')
+
+    def poll(self):
+        """Receive a notification, or fail if the connection was closed."""
+        os.read(self.read_end, 1)
+        if not self.pending:
+            # `close` wrote to the pipe:
+            raise IOError('connection closed')
+        self.notifies.append(self.pending.pop(0))
+
+    def close(self):
+        """Make the next `poll` fail."""
+        os.write(self.write_end, 'x')
+
+
+class Notification(object):
+    """Stands in for a psycopg2 notification."""
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    """Hand out the notifications sent on a FakeConnection to listeners."""
+    dispatcher = completion._Dispatcher(FakeConnection())
+    dispatcher.start()
+    monkeypatch.setattr(completion, '_have_notifications', lambda: True)
+    monkeypatch.setattr(completion, '_dispatcher', dispatcher)
+    yield dispatcher
+    dispatcher.connection.close()
+
+
+def test_dispatcher_wakes_listeners(dispatcher):
+    """Every listener waiting for an action is woken up when it finishes."""
+    with completion.Listener() as first, completion.Listener() as second:
+        dispatcher.connection.send('other')
+        dispatcher.connection.send('done')
+        start = time.time()
+        first.wait(['done'], 10)
+        second.wait(['done', 'pending'], 10)
+        assert time.time() - start < 1
+    assert not dispatcher.listeners
+
+
+def test_dispatcher_ignores_other_actions(dispatcher):
+    """Notifications about other actions don't end the wait."""
+    with completion.Listener() as listener:
+        dispatcher.connection.send('other')
+        start = time.time()
+        listener.wait(['pending'], 0.5)
+        assert time.time() - start >= 0.5
+
+
+def test_dispatcher_failure(dispatcher):
+    """If the connection fails, listeners go back to polling."""
+    with completion.Listener() as listener:
+        dispatcher.connection.close()
+        listener.wait(['pending'], 10)
+        assert dispatcher.failed
+        start = time.time()
+        listener.wait(['pending'], 10)
+        assert time.time() - start <= completion.POLL_INTERVAL + 1
@@ -185,3 +185,51 @@ def test_bad_vlans():
     "Test strings for invalid VLAN ranges."""
     opts = ['12-', 'p13,q14,15,16,17,18,1234x', '1-900, 902-904, 905, 5000']
     assert all(not config.string_has_vlans(s) for s in opts)
+
+
+def test_good_sqlite_pragmas():
+    """Test valid settings of the SQLite pragmas."""
+    assert all(config.string_is_sqlite_journal_mode(s)
+               for s in ['wal', 'WAL', 'delete'])
+    assert all(config.string_is_sqlite_synchronous(s)
+               for s in ['normal', 'Full', 'off'])
+
+
+def test_bad_sqlite_pragmas():
+    """Test invalid settings of the SQLite pragmas."""
+    for s in ['wall', '1', '']:
+        with pytest.raises(SchemaError):
+            config.string_is_sqlite_journal_mode(s)
+    for s in ['normal; drop table node', '2', '']:
+        with pytest.raises(SchemaError):
+            config.string_is_sqlite_synchronous(s)
+
+
+def test_validate_profiling_config(tmpdir):
+    """The [profiling] options pass validation unchanged."""
+    config_testsuite()
+    config_merge({
+        'headnode': {
+            'trunk_nic': 'eth0',
+            'libvirt_endpoint': 'qemu:///system',
+        },
+        'client': {
+            'endpoint': 'http://127.0.0.1:5000',
+        },
+        'profiling': {
+            'dir': str(tmpdir),
+            'sample_percent': '10',
+            'slow_ms': '500',
+            'keep': '20',
+        },
+    })
+    config.load_extensions()
+    config.validate_config()
+
+
+def test_bad_percents():
+    """Test numbers which aren't percentages."""
+    assert config.string_is_percent('0')
+    assert config.string_is_percent('99.5')
+    assert not any(config.string_is_percent(s)
+                   for s in ['100.1', '-1', 'ten'])
@@ -3,10 +3,11 @@
 import pytest
 import tempfile
 import uuid
+from datetime import datetime, timedelta
 
 from hil import config, deferred, model, api
-from hil.model import db, Switch
-from hil.errors import SwitchError
+from hil.model import db, Switch, SwitchSession
+from hil.errors import SwitchConnectionError, SwitchError
 from hil.test_common import config_testsuite, config_merge, \
                              fresh_database
 from flask import Flask
@@ -17,7 +18,7 @@ fresh_database = pytest.fixture(fresh_database)
 DeferredTestSwitch = None
 
 
-class RevertPortError(SwitchError):
+class RevertPortError(SwitchConnectionError):
     """An exception thrown by the switch implementation's revert_port.
 
     This is used as part of the error handling tests.
@@ -47,7 +48,12 @@ def configure():
     additional_config = {
         'extensions': {
             'hil.ext.obm.mock': ''
-            }
+            },
+        # Most of these tests expect a failed action to be marked as an
+        # ERROR straight away:
+        'network-daemon': {
+            'max_attempts': '1',
+            },
         }
 
     # if we are using sqlite's in memory db, then change uri to a db on disk
@@ -69,7 +75,7 @@ def configure():
 def _deferred_test_switch_class():
     global DeferredTestSwitch
 
-    class DeferredTestSwitch_(Switch):
+    class DeferredTestSwitch_(Switch, SwitchSession):
         '''DeferredTestSwitch
 
         This is a switch implemented to test the deferred.apply_networking()
@@ -120,7 +126,7 @@ def _deferred_test_switch_class():
             This is a no-op, since session() doesn't establish a connection.
             """
 
-        def modify_port(self, port, channel, network_id):
+        def modify_port(self, port, channel, new_network, context=None):
             """Implement Switch.modify_port.
 
             This implementation keeps track of how many pending
@@ -309,3 +315,580 @@ def test_apply_networking(switch, network, fresh_database):
 
     local_db.session.commit()
     local_db.session.close()
+
+
+def test_apply_networking_stats(switch, network, fresh_database, monkeypatch):
+    """apply_networking records timestamps and per-switch statistics."""
+    from hil import network_stats
+    stats = network_stats.Stats()
+    monkeypatch.setattr(deferred, 'stats', stats)
+
+    nic = new_nic('0')
+    nic.port = model.Port(label='gi1/0/0', switch=switch)
+    db.session.add(model.NetworkingAction(nic=nic,
+                                          new_network=None,
+                                          uuid=str(uuid.uuid4()),
+                                          channel='',
+                                          status='PENDING',
+                                          type='revert_port'))
+    db.session.commit()
+
+    journal = network_stats.journal_stats()
+    assert journal['depth'] == 1
+    assert journal['oldest_pending_age'] >= 0
+
+    deferred.apply_networking()
+
+    action = model.NetworkingAction.query.one()
+    assert action.status == 'ERROR'
+    assert action.queued_at <= action.started_at <= action.finished_at
+    assert network_stats.journal_stats() == {
+        'depth': 0,
+        'oldest_pending_age': None,
+    }
+
+    snapshot = stats.snapshot()
+    assert snapshot['actions_per_sec'] > 0
+    [switch_stats] = snapshot['switches']
+    assert switch_stats['type'] == DeferredTestSwitch.api_name
+    assert switch_stats['label'] == 'switch'
+    assert switch_stats['calls'] == 1
+    assert switch_stats['errors'] == 1
+    assert switch_stats['p50'] == switch_stats['p99'] >= 0
+
+
+def test_apply_networking_trace(switch, network, fresh_database):
+    """apply_networking records spans under the action's trace id."""
+    from hil import tracing
+
+    nic = new_nic('0')
+    nic.port = model.Port(label='gi1/0/0', switch=switch)
+    db.session.add(model.NetworkingAction(nic=nic,
+                                          new_network=None,
+                                          uuid=str(uuid.uuid4()),
+                                          trace_id='some-trace',
+                                          channel='',
+                                          status='PENDING',
+                                          type='revert_port'))
+    db.session.commit()
+
+    deferred.apply_networking()
+
+    [handled, disconnect] = tracing.span_tree('some-trace')
+    assert handled['name'] == 'networking_action'
+    assert handled['info']['type'] == 'revert_port'
+    assert [child['name'] for child in handled['children']] == \
+        ['queue_wait', 'session', 'revert_port']
+    assert handled['children'][1]['info'] == {
+        'switch': 'switch',
+        'cached': False,
+    }
+    assert disconnect['name'] == 'disconnect'
+    assert disconnect['info'] == {'switch': 'switch'}
+    for root in handled, disconnect:
+        assert root['seconds'] >= 0
+
+
+def test_apply_networking_context(switch, network, fresh_database,
+                                  monkeypatch):
+    """modify_port is passed the port, and the nic's current attachments."""
+    nic = new_nic('0')
+    nic.port = model.Port(label='gi1/0/0', switch=switch)
+    db.session.add(model.NetworkAttachment(nic=nic,
+                                           network=network,
+                                           channel='vlan/native'))
+    db.session.add(model.NetworkingAction(nic=nic,
+                                          new_network=None,
+                                          uuid=str(uuid.uuid4()),
+                                          channel='vlan/native',
+                                          status='PENDING',
+                                          type='modify_port'))
+    db.session.commit()
+
+    calls = []
+
+    def modify_port(self, port, channel, new_network, context=None):
+        """Record what the driver is passed."""
+        calls.append((port, channel, new_network,
+                      context.port.label, context.old_native))
+
+    monkeypatch.setattr(DeferredTestSwitch, 'modify_port', modify_port)
+    deferred.apply_networking()
+
+    assert calls == [('gi1/0/0', 'vlan/native', None, 'gi1/0/0', '102')]
+    assert model.NetworkAttachment.query.count() == 0
+
+
+def test_coalesce(network):
+    """Only the net result of a nic's actions is kept, in a safe order."""
+    project = network.owner
+    trunk = model.Network(project, [], True, '200', 'trunk')
+    other = model.Network(project, [], True, '300', 'other')
+    new_native = model.Network(project, [], True, '400', 'new-native')
+
+    def _action(channel, new_network, type='modify_port'):
+        """Return an action, which isn't added to the session."""
+        return model.NetworkingAction(type=type,
+                                      channel=channel,
+                                      new_network=new_network)
+
+    networks = {'vlan/native': network, 'vlan/200': trunk}
+    actions = [
+        _action('vlan/200', None),
+        # Attaching and detaching cancel out:
+        _action('vlan/300', other),
+        _action('vlan/300', None),
+        # Only the last change to the native network is made:
+        _action('vlan/native', None),
+        _action('vlan/native', other),
+        _action('vlan/native', new_native),
+    ]
+    assert deferred.coalesce(networks, actions) == [
+        ('vlan/200', None),
+        ('vlan/native', new_native),
+    ]
+    # The networks passed in are left alone:
+    assert networks == {'vlan/native': network, 'vlan/200': trunk}
+
+    # Trunks are detached before the native network, and attached after it:
+    assert deferred.coalesce(networks, [
+        _action('vlan/native', None),
+        _action('vlan/200', None),
+    ]) == [('vlan/200', None), ('vlan/native', None)]
+    assert deferred.coalesce({}, [
+        _action('vlan/native', network),
+        _action('vlan/200', trunk),
+    ]) == [('vlan/native', network), ('vlan/200', trunk)]
+    assert deferred.coalesce(networks, [
+        _action('', None, type='revert_port'),
+    ]) == [('vlan/200', None), ('vlan/native', None)]
+    assert deferred.coalesce(networks, [
+        _action('vlan/native', network),
+        _action('vlan/200', trunk),
+    ]) == []
+
+
+def test_apply_networking_coalesces(switch, network, fresh_database,
+                                    monkeypatch):
+    """A nic's pending actions are made with a single call to the switch."""
+    trunk = model.Network(network.owner, [], True, '200', 'trunk')
+    calls = []
+
+    def modify_port(self, port, channel, new_network, context=None):
+        """Record the call."""
+        calls.append(('modify_port', port, channel, new_network))
+
+    def modify_port_channels(self, port, changes, context=None):
+        """Record the call, and the native network the port had before."""
+        calls.append(('modify_port_channels', port, changes,
+                      context.old_native))
+
+    monkeypatch.setattr(DeferredTestSwitch, 'modify_port', modify_port)
+    monkeypatch.setattr(DeferredTestSwitch, 'modify_port_channels',
+                        modify_port_channels)
+
+    nics = []
+    for i, changes in enumerate([
+            # connect native, then trunk:
+            [('vlan/native', network), ('vlan/200', trunk)],
+            # connect then detach:
+            [('vlan/native', network), ('vlan/native', None)],
+            # change the native network twice:
+            [('vlan/native', trunk), ('vlan/native', network)],
+    ]):
+        nic = new_nic(str(i))
+        nic.port = model.Port(label='gi1/0/%d' % i, switch=switch)
+        for channel, new_network in changes:
+            db.session.add(model.NetworkingAction(nic=nic,
+                                                  new_network=new_network,
+                                                  uuid=str(uuid.uuid4()),
+                                                  channel=channel,
+                                                  status='PENDING',
+                                                  type='modify_port'))
+        nics.append(nic)
+    db.session.commit()
+
+    assert deferred.apply_networking()
+    assert calls == [
+        ('modify_port_channels', 'gi1/0/0',
+         [('vlan/native', '102'), ('vlan/200', '200')], None),
+        ('modify_port', 'gi1/0/2', 'vlan/native', '102'),
+    ]
+    assert [action.status for action in model.NetworkingAction.query] == \
+        ['DONE'] * 6
+    assert [sorted((attachment.channel, attachment.network.label)
+                   for attachment in nic.attachments)
+            for nic in nics] == [
+        [('vlan/200', 'trunk'), ('vlan/native', 'hammernet')],
+        [],
+        [('vlan/native', 'hammernet')],
+    ]
+
+
+def test_apply_networking_coalesced_failure(switch, network, fresh_database,
+                                            monkeypatch):
+    """A nic's actions fail together."""
+    calls = []
+    monkeypatch.setattr(DeferredTestSwitch, 'modify_port',
+                        lambda self, *args, **kwargs: calls.append(args))
+    nic = new_nic('0')
+    nic.port = model.Port(label='gi1/0/0', switch=switch)
+    for type, new_network in (('revert_port', None),
+                              ('modify_port', network)):
+        db.session.add(model.NetworkingAction(nic=nic,
+                                              new_network=new_network,
+                                              uuid=str(uuid.uuid4()),
+                                              channel='vlan/native',
+                                              status='PENDING',
+                                              type=type))
+    db.session.commit()
+
+    deferred.apply_networking()
+    # The revert_port failed, so the change after it wasn't made:
+    assert calls == []
+    assert [(action.status, action.attempts)
+            for action in model.NetworkingAction.query] == [('ERROR', 1)] * 2
+
+
+def _queue_actions(*switches):
+    """Queue a modify_port action on a new nic on each of `switches`.
+
+    Each nic starts out with a native network, which the action detaches.
+    Returns the actions' ids.
+    """
+    label = str(uuid.uuid4())
+    network = model.Network(model.Project(label), [], True, '102', label)
+    actions = []
+    for i, switch in enumerate(switches):
+        nic = new_nic(str(i))
+        nic.port = model.Port(label='gi1/0/%d' % i, switch=switch)
+        db.session.add(model.NetworkAttachment(nic=nic,
+                                               network=network,
+                                               channel='vlan/native'))
+        actions.append(model.NetworkingAction(nic=nic,
+                                              new_network=None,
+                                              uuid=str(uuid.uuid4()),
+                                              channel='vlan/native',
+                                              status='PENDING',
+                                              type='modify_port'))
+        db.session.add(actions[-1])
+    db.session.commit()
+    return [action.id for action in actions]
+
+
+def _claims():
+    """Return the switch label, claimant and status of each action."""
+    result = [(action.nic.port.owner.label, action.claimed_by, action.status)
+              for action in model.NetworkingAction.query
+              .order_by(model.NetworkingAction.id)]
+    db.session.commit()
+    return result
+
+
+def test_claim_actions(switch, fresh_database):
+    """A switch's actions are claimed by one daemon, until its claim runs out.
+    """
+    config_merge({'network-daemon': {'claim_switches': '1'}})
+    other = DeferredTestSwitch(label='other',
+                               hostname='http://example.com',
+                               username='admin',
+                               password='admin')
+    _queue_actions(switch, other, switch)
+
+    assert deferred.claim_actions('a') == 1
+    assert deferred.claim_actions('b') == 1
+    assert deferred.claim_actions('c') == 0
+    db.session.commit()
+    assert _claims() == [('switch', 'a', 'PENDING'),
+                         ('other', 'b', 'PENDING'),
+                         ('switch', 'a', 'PENDING')]
+
+    # Each daemon only applies its own actions, and keeps its switch
+    # afterwards:
+    assert deferred.apply_networking('b')
+    assert not deferred.apply_networking('c')
+    _queue_actions(other)
+    assert deferred.claim_actions('c') == 0
+    assert deferred.claim_actions('b') == 1
+    db.session.commit()
+    assert _claims() == [('switch', 'a', 'PENDING'),
+                         ('other', 'b', 'DONE'),
+                         ('switch', 'a', 'PENDING'),
+                         ('other', 'b', 'PENDING')]
+
+    # Once a's claims run out, another daemon can take over its switch:
+    model.NetworkingAction.query.filter_by(claimed_by='a') \
+        .update({'claimed_until': datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+    assert deferred.claim_actions('c') == 1
+    db.session.commit()
+    assert [claimant for (_, claimant, _) in _claims()] == \
+        ['c', 'b', 'c', 'b']
+
+
+def test_lock_rows():
+    """SKIP LOCKED is only used where the server supports it."""
+    from sqlalchemy.dialects import postgresql
+    dialect = postgresql.dialect()
+    query = db.session.query(model.Switch.id)
+
+    dialect.server_version_info = (9, 3)
+    sql = str(deferred._lock_rows(query, dialect).statement
+              .compile(dialect=dialect))
+    assert 'FOR UPDATE' in sql
+    assert 'SKIP LOCKED' not in sql
+
+    dialect.server_version_info = (9, 6)
+    sql = str(deferred._lock_rows(query, dialect).statement
+              .compile(dialect=dialect))
+    assert 'FOR UPDATE SKIP LOCKED' in sql
+
+
+def _queue_reverts(switch, count):
+    """Queue `count` revert_port actions, on new nics on `switch`."""
+    for i in range(count):
+        nic = new_nic(str(i))
+        nic.port = model.Port(label='gi1/0/%d' % i, switch=switch)
+        db.session.add(model.NetworkingAction(nic=nic,
+                                              new_network=None,
+                                              uuid=str(uuid.uuid4()),
+                                              channel='',
+                                              status='PENDING',
+                                              type='revert_port'))
+    db.session.commit()
+
+
+def _make_due():
+    """Make every pending action due to be tried, as if time had passed.
+
+    This also lets the switches' circuit breakers go half-open.
+    """
+    model.NetworkingAction.query.update({'retry_at': None})
+    model.Switch.query.update({
+        'breaker_open_until': datetime.utcnow() - timedelta(seconds=1),
+    })
+    db.session.commit()
+
+
+def test_retry_with_backoff(switch, fresh_database, monkeypatch):
+    """A failed action is tried again later, until max_attempts is reached.
+    """
+    from hil import network_stats
+    stats = network_stats.Stats()
+    monkeypatch.setattr(deferred, 'stats', stats)
+    config_merge({'network-daemon': {
+        'max_attempts': '3',
+        'retry_delay': '10',
+        'breaker_failures': '10',
+    }})
+    _queue_reverts(switch, 1)
+
+    for attempt, delay in (1, 10), (2, 20):
+        before = datetime.utcnow()
+        assert deferred.apply_networking('worker')
+        action = model.NetworkingAction.query.one()
+        assert action.status == 'PENDING'
+        assert action.attempts == attempt
+        assert action.finished_at is None
+        assert before + timedelta(seconds=delay) <= action.retry_at <= \
+            datetime.utcnow() + timedelta(seconds=delay)
+        # It hasn't finished yet:
+        assert stats.snapshot()['actions_per_sec'] == 0
+        db.session.commit()
+
+        # Not due yet:
+        assert not deferred.apply_networking('worker')
+        _make_due()
+
+    assert deferred.apply_networking('worker')
+    action = model.NetworkingAction.query.one()
+    assert action.status == 'ERROR'
+    assert action.attempts == 3
+    assert action.finished_at is not None
+    assert stats.snapshot()['actions_per_sec'] > 0
+
+
+def test_permanent_error(switch, fresh_database, monkeypatch):
+    """An action the switch refuses fails straight away."""
+    config_merge({'network-daemon': {'max_attempts': '3'}})
+    _queue_reverts(switch, 1)
+
+    def revert_port(self, port):
+        """Refuse the change, rather than fail to reach the switch."""
+        raise SwitchError('Bad Request to switch.')
+
+    monkeypatch.setattr(DeferredTestSwitch, 'revert_port', revert_port)
+    assert deferred.apply_networking('worker')
+    action = model.NetworkingAction.query.one()
+    assert action.status == 'ERROR'
+    assert action.attempts == 1
+    assert action.retry_at is None
+    assert model.Switch.query.one().breaker_failures == 0
+
+
+def test_circuit_breaker(switch, fresh_database, monkeypatch):
+    """Actions are put off while a switch's breaker is open, then probed."""
+    config_merge({'network-daemon': {
+        'max_attempts': '5',
+        'breaker_failures': '2',
+        'breaker_open_time': '30',
+    }})
+    _queue_reverts(switch, 3)
+
+    before = datetime.utcnow()
+    assert deferred.apply_networking('worker')
+    switch = model.Switch.query.one()
+    assert switch.breaker_state() == 'open'
+    assert switch.breaker_failures == 2
+    assert switch.breaker_open_until >= before + timedelta(seconds=30)
+    actions = model.NetworkingAction.query \
+        .order_by(model.NetworkingAction.id).all()
+    # The first two failed, and the third wasn't tried. The ones after the
+    # breaker opened wait for it:
+    assert [action.attempts for action in actions] == [1, 1, 0]
+    assert actions[2].started_at is None
+    assert [action.status for action in actions] == ['PENDING'] * 3
+    assert all(action.retry_at >= switch.breaker_open_until
+               for action in actions[1:])
+    db.session.commit()
+
+    # Once the breaker is half-open, a successful probe closes it:
+    _make_due()
+    assert model.Switch.query.one().breaker_state() == 'half-open'
+    db.session.commit()
+    monkeypatch.setattr(DeferredTestSwitch, 'revert_port',
+                        lambda self, port: None)
+    assert deferred.apply_networking('worker')
+    switch = model.Switch.query.one()
+    assert switch.breaker_state() == 'closed'
+    assert switch.breaker_failures == 0
+    assert [action.status for action in model.NetworkingAction.query] == \
+        ['DONE'] * 3
+
+
+def test_rate_limits(switch, fresh_database, monkeypatch):
+    """A switch at its rate limit doesn't hold up the other switches."""
+    from hil.throttling import Throttle
+    config_merge({DeferredTestSwitch.__module__: {'switch_rate': '1'}})
+    clock = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        """Record `seconds`, and move the clock on."""
+        sleeps.append(seconds)
+        clock[0] += seconds
+
+    monkeypatch.setattr(deferred, 'throttle', Throttle(lambda: clock[0]))
+    monkeypatch.setattr(deferred.time, 'sleep', sleep)
+    calls = []
+    monkeypatch.setattr(DeferredTestSwitch, 'modify_port',
+                        lambda self, port, *args, **kwargs:
+                        calls.append((self.label, port)))
+
+    other = DeferredTestSwitch(label='other',
+                               hostname='http://example.com',
+                               username='admin',
+                               password='admin')
+    _queue_actions(switch, switch, other)
+    assert deferred.apply_networking('worker')
+    assert calls == [('switch', 'gi1/0/0'),
+                     ('other', 'gi1/0/2'),
+                     ('switch', 'gi1/0/1')]
+    assert sleeps == [1.0]
+
+
+def test_max_in_flight(switch, fresh_database):
+    """No more than max_in_flight switches of a type are claimed at once."""
+    config_merge({DeferredTestSwitch.__module__: {'max_in_flight': '1'}})
+    other = DeferredTestSwitch(label='other',
+                               hostname='http://example.com',
+                               username='admin',
+                               password='admin')
+    _queue_actions(switch, other)
+    assert deferred.claim_actions('a') == 1
+    assert deferred.claim_actions('b') == 0
+    db.session.commit()
+    assert [claimant for (_, claimant, _) in _claims()] == ['a', None]
+
+
+def test_fair_keys():
+    """Projects take turns, after higher priorities, keeping nics in order.
+    """
+    keys = deferred.fair_keys([
+        (1, 0, 'busy', 10),
+        (2, 0, 'busy', 11),
+        (3, 0, 'busy', 12),
+        (4, 0, 'quiet', 13),
+        (5, 2, None, 14),
+        # A higher priority doesn't jump an older action on the same nic:
+        (6, 2, None, 11),
+    ])
+    assert sorted(keys, key=keys.get) == [5, 1, 4, 2, 6, 3]
+
+
+def test_fair_order(switch, fresh_database, monkeypatch):
+    """A project with many actions queued doesn't hold up the others."""
+    calls = []
+    monkeypatch.setattr(DeferredTestSwitch, 'modify_port',
+                        lambda self, port, *args, **kwargs:
+                        calls.append(port))
+    ids = _queue_actions(switch, switch, switch, switch, switch)
+    actions = [model.NetworkingAction.query.get(i) for i in ids]
+    busy = actions[0].nic.owner.project
+    for action in actions[1:3]:
+        action.nic.owner.project = busy
+    actions[4].priority = model.NetworkingAction.ADMIN_PRIORITY
+    db.session.commit()
+
+    assert [deferred.queue_position(model.NetworkingAction.query.get(i))
+            for i in ids] == [2, 4, 5, 3, 1]
+    assert deferred.apply_networking('worker')
+    assert calls == ['gi1/0/4', 'gi1/0/0', 'gi1/0/3', 'gi1/0/1', 'gi1/0/2']
+    assert deferred.queue_position(model.NetworkingAction.query.get(ids[0])) \
+        is None
+
+
+def test_archive_actions(switch, fresh_database, monkeypatch):
+    """Actions which finished a while ago are archived, a batch at a time.
+    """
+    config_merge({'network-daemon': {
+        'retention_hours': '1',
+        'archive_batch': '2',
+    }})
+    monkeypatch.setattr(DeferredTestSwitch, 'modify_port',
+                        lambda self, *args, **kwargs: None)
+    ids = _queue_actions(switch, switch, switch, switch)
+    assert deferred.apply_networking('worker')
+    # Only the first three finished over an hour ago:
+    model.NetworkingAction.query \
+        .filter(model.NetworkingAction.id != ids[3]) \
+        .update({'finished_at': datetime.utcnow() - timedelta(hours=2)},
+                synchronize_session=False)
+    db.session.commit()
+
+    assert deferred.archive_actions() == 2
+    assert deferred.archive_actions() == 1
+    assert deferred.archive_actions() == 0
+    assert [action.id for action in model.NetworkingAction.query] == \
+        [ids[3]]
+    archived = model.ArchivedNetworkingAction.query \
+        .order_by(model.ArchivedNetworkingAction.id).all()
+    assert [(action.status, action.nic, action.channel, action.new_network)
+            for action in archived] == \
+        [('DONE', str(i), 'vlan/native', None) for i in range(3)]
+    assert archived[0].project.startswith('anvil-nextgen-')
+    # Their traces are kept:
+    trace_ids = [action.trace_id for action in archived]
+    assert all(model.TraceSpan.query.filter_by(trace_id=trace_id).count()
+               for trace_id in trace_ids)
+
+    # Once archive_days have passed, they are deleted, traces and all:
+    config_merge({'network-daemon': {'archive_days': '1'}})
+    model.ArchivedNetworkingAction.query \
+        .filter_by(id=archived[0].id) \
+        .update({'finished_at': datetime.utcnow() - timedelta(days=2)})
+    db.session.commit()
+    deferred.archive_actions()
+    assert model.ArchivedNetworkingAction.query.count() == 2
+    assert [model.TraceSpan.query.filter_by(trace_id=trace_id).count() > 0
+            for trace_id in trace_ids] == [False, True, True]
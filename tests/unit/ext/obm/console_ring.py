@@ -0,0 +1,145 @@
+"""Unit tests for hil.ext.obm._console_ring"""
+
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+# Note that we import hil.ext.obm._console_ring inside the tests, rather
+# than at the top level; importing extensions while the tests are being
+# collected pollutes the set of loaded extensions for other tests.
+
+
+def read_all(path, **kwargs):
+    """Call read_ring, and join up the chunks it returns."""
+    from hil.ext.obm._console_ring import read_ring
+    chunks, next_offset = read_ring(path, **kwargs)
+    return ''.join(chunks), next_offset
+
+
+@pytest.fixture
+def path(tmpdir):
+    """The path of a console log, which does not exist yet."""
+    return str(tmpdir.join('console'))
+
+
+def test_no_log(path):
+    """read_ring returns None if there is no log."""
+    from hil.ext.obm._console_ring import read_ring
+    assert read_ring(path) is None
+
+
+def test_rotation(path):
+    """Old segments are compressed, and the oldest ones dropped."""
+    from hil.ext.obm._console_ring import RingWriter, read_index
+    # 4 segments of 10 bytes each:
+    writer = RingWriter(path, 40, 4)
+    data = ''.join('%02d' % i for i in range(50))
+    writer.write(data)
+    writer.close()
+
+    # We've written 100 bytes, so the first 60 are gone:
+    assert read_index(path) == [[6, 60], [7, 70], [8, 80], [9, 90]]
+    assert read_all(path) == (data[60:], 100)
+    assert sorted(os.listdir(path)) == [
+        '00000006.log.gz',
+        '00000007.log.gz',
+        '00000008.log',
+        '00000009.log',
+        'index',
+    ]
+
+
+def test_compression_in_background(path, monkeypatch):
+    """Writes which rotate the log don't wait for compression."""
+    from hil.ext.obm._console_ring import RingWriter
+    go = threading.Event()
+    compress = RingWriter._compress
+
+    def slow_compress(self, num):
+        """Compress segment `num` once `go` is set."""
+        go.wait()
+        compress(self, num)
+
+    monkeypatch.setattr(RingWriter, '_compress', slow_compress)
+    writer = RingWriter(path, 40, 4)
+    # This starts the fourth segment, so the first one is due to be
+    # compressed:
+    writer.write('x' * 35)
+    assert '00000000.log' in os.listdir(path)
+    go.set()
+    writer.close()
+    assert '00000000.log.gz' in os.listdir(path)
+    assert '00000000.log' not in os.listdir(path)
+
+
+def test_dropped_while_compressing(path, monkeypatch):
+    """A segment dropped while it is being compressed leaves nothing behind.
+    """
+    from hil.ext.obm._console_ring import RingWriter
+    go = threading.Event()
+    compress = RingWriter._compress
+
+    def slow_compress(self, num):
+        """Compress segment `num` once `go` is set."""
+        go.wait()
+        compress(self, num)
+
+    monkeypatch.setattr(RingWriter, '_compress', slow_compress)
+    writer = RingWriter(path, 40, 4)
+    data = ''.join('%02d' % i for i in range(50))
+    writer.write(data)
+    go.set()
+    writer.close()
+    assert read_all(path) == (data[60:], 100)
+    assert sorted(os.listdir(path)) == [
+        '00000006.log.gz',
+        '00000007.log.gz',
+        '00000008.log',
+        '00000009.log',
+        'index',
+    ]
+
+
+def test_offsets(path):
+    """Offsets are positions in the whole stream, across segments."""
+    from hil.ext.obm._console_ring import RingWriter
+    writer = RingWriter(path, 40, 4)
+    data = ''.join('%02d' % i for i in range(50))
+    writer.write(data)
+    writer.close()
+
+    # Spanning compressed and uncompressed segments:
+    assert read_all(path, offset=65, max_bytes=20) == (data[65:85], 85)
+    assert read_all(path, tail=15) == (data[85:], 100)
+    # Asking for dropped output gets the oldest output available:
+    assert read_all(path, offset=10, max_bytes=5) == (data[60:65], 65)
+    assert read_all(path, offset=100) == ('', 100)
+
+
+def test_reopen(path):
+    """A new writer appends to the existing log."""
+    from hil.ext.obm._console_ring import RingWriter
+    writer = RingWriter(path, 40, 4)
+    writer.write('hello, ')
+    writer.close()
+    writer = RingWriter(path, 40, 4)
+    writer.write('world!')
+    writer.close()
+    assert read_all(path) == ('hello, world!', 13)
+
+
+def test_capture_process(path):
+    """The module copies its stdin into a log when run as a program."""
+    from hil.ext.obm._console_ring import read_index
+    proc = subprocess.Popen([sys.executable, '-m', 'hil.ext.obm._console_ring',
+                             '--max-bytes', '1000',
+                             '--segments', '4',
+                             path],
+                            stdin=subprocess.PIPE)
+    proc.communicate('x' * 600 + '\xff' + 'y' * 200)
+    assert proc.returncode == 0
+    assert read_all(path, tail=300) == ('x' * 99 + 'y' * 200, 801)
+    assert len(read_index(path)) == 4
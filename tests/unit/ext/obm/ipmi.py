@@ -1,6 +1,12 @@
 """Unit tests for ipmi.py"""
+# pylint: disable=protected-access
+import os
+import subprocess
+import sys
+import threading
+
 import pytest
-from hil import api, errors
+from hil import api, errors, model
 from hil.test_common import config, config_testsuite, fresh_database, \
     fail_on_log_warnings, with_request_context, config_merge, server_init
 
@@ -74,3 +80,419 @@ class TestIpmi:
 
         with pytest.raises(errors.BadArgumentError):
             instance.require_legal_bootdev("not_valid_bootdev")
+
+
+def log_console(path, data):
+    """Log `data` to the console log at `path`, like the capture process."""
+    from hil.ext.obm._console_ring import RingWriter
+    writer = RingWriter(path, 1024 * 1024, 8)
+    writer.write(data)
+    writer.close()
+
+
+class TestIpmiConsole:
+    """Test reading the console log."""
+
+    @pytest.fixture
+    def log_dir(self, tmpdir, monkeypatch):
+        """Register a node, and point its console log at a temporary dir.
+
+        Returns the path of the log, which does not exist yet.
+        """
+        from hil.ext.obm.ipmi import Ipmi
+        path = str(tmpdir.join('ipmihost'))
+        monkeypatch.setattr(Ipmi, 'get_console_log_filename',
+                            lambda self: path)
+        api.node_register(
+            node='node-99',
+            obm={
+                "type": "http://schema.massopencloud.org/haas/v0/obm/ipmi",
+                "host": "ipmihost",
+                "user": "root",
+                "password": "tapeworm",
+            },
+            obmd={
+                "uri": "http://obmd.example.com/nodes/node-99",
+                "admin_token": "secret",
+            },
+        )
+        return path
+
+    def test_no_log(self, log_dir):
+        """show_console returns a 404 if there is no log."""
+        with pytest.raises(errors.NotFoundError):
+            api.show_console('node-99')
+
+    def test_show_console(self, log_dir):
+        """Check the whole log, offsets, tails and max_bytes."""
+        log_console(log_dir, '0123456789\xff\xfeabcdef')
+
+        resp = api.show_console('node-99')
+        assert resp.get_data() == '0123456789abcdef'
+        assert resp.headers['X-Console-Offset'] == '18'
+
+        resp = api.show_console('node-99', offset=4, max_bytes=4)
+        assert resp.get_data() == '4567'
+        assert resp.headers['X-Console-Offset'] == '8'
+
+        resp = api.show_console('node-99', tail=3)
+        assert resp.get_data() == 'def'
+
+        resp = api.show_console('node-99', offset=100)
+        assert resp.get_data() == ''
+        assert resp.headers['X-Console-Offset'] == '18'
+
+        with pytest.raises(errors.BadArgumentError):
+            api.show_console('node-99', offset=1, tail=1)
+
+    def test_large_log_is_chunked(self, log_dir):
+        """Large logs are streamed in chunks, not returned all at once."""
+        from hil.ext.obm.common import CHUNK_SIZE
+        log_console(log_dir, 'x' * (CHUNK_SIZE * 3 + 1))
+        resp = api.show_console('node-99')
+        chunks = list(resp.response)
+        assert len(chunks) == 4
+        assert ''.join(chunks) == 'x' * (CHUNK_SIZE * 3 + 1)
+
+    def test_follow(self, log_dir, monkeypatch):
+        """In follow mode, we wait for new output past the offset."""
+        log_console(log_dir, 'old output\n')
+
+        def fake_sleep(seconds):
+            """Log some more output, instead of sleeping."""
+            log_console(log_dir, 'new output\n')
+
+        monkeypatch.setattr(api.time, 'sleep', fake_sleep)
+        resp = api.show_console('node-99', offset=11, follow=10)
+        assert resp.get_data() == 'new output\n'
+        assert resp.headers['X-Console-Offset'] == '22'
+
+    def test_follow_timeout(self, log_dir, monkeypatch):
+        """If no new output arrives, follow mode returns nothing."""
+        log_console(log_dir, 'old output\n')
+        resp = api.show_console('node-99', offset=11, follow=0)
+        assert resp.get_data() == ''
+        assert resp.headers['X-Console-Offset'] == '11'
+
+    def test_delete_console(self, log_dir):
+        """delete_console removes the whole log."""
+        log_console(log_dir, 'some output')
+        model.Node.query.filter_by(label='node-99').one().obm.delete_console()
+        with pytest.raises(errors.NotFoundError):
+            api.show_console('node-99')
+
+
+class TestStopOrphanConsoles:
+    """Test cleaning up console processes left behind by a previous run."""
+
+    @pytest.fixture
+    def fake_procs(self, tmpdir, monkeypatch):
+        """Stub out everything which touches real processes.
+
+        Console logs go in `tmpdir`, the process table is replaced with a
+        fake one, and the pids we kill & hosts we deactivate are recorded
+        rather than acted upon. Returns a dictionary with the keys 'table',
+        'killed' and 'deactivated'.
+        """
+        from hil.ext.obm import ipmi
+        monkeypatch.setattr(ipmi.Ipmi, 'get_console_log_filename',
+                            lambda self: str(tmpdir.join(self.host)))
+        state = {'table': {}, 'killed': set(), 'deactivated': set()}
+        monkeypatch.setattr(ipmi, '_process_table', lambda: state['table'])
+        monkeypatch.setattr(ipmi, '_cmdline',
+                            lambda pid: state['table'].get(pid))
+        monkeypatch.setattr(ipmi, '_kill', state['killed'].update)
+        monkeypatch.setattr(ipmi, '_deactivate_sol',
+                            lambda creds: state['deactivated'].add(creds[0]))
+        for host in 'host-a', 'host-b', 'host-c':
+            api.node_register(
+                node='node-' + host,
+                obm={
+                    "type": "http://schema.massopencloud.org/haas/v0/obm/"
+                            "ipmi",
+                    "host": host,
+                    "user": "root",
+                    "password": "tapeworm",
+                },
+                obmd={
+                    "uri": "http://obmd.example.com/nodes/node-" + host,
+                    "admin_token": "secret",
+                },
+            )
+        return state
+
+    @staticmethod
+    def sol_activate(host):
+        """Return the argument list of ipmitool logging `host`'s console."""
+        return ['ipmitool', '-H', host, '-U', 'root', '-P', 'tapeworm',
+                '-I', 'lanplus', 'sol', 'activate']
+
+    @staticmethod
+    def capture(log_dir):
+        """Return the argument list of a capture process logging to log_dir.
+        """
+        return ['/usr/bin/python', '-m', 'hil.ext.obm._console_ring',
+                '--max-bytes', '16777216', '--segments', '8', log_dir]
+
+    def test_stop_orphan_consoles(self, fake_procs, tmpdir):
+        """Orphaned console processes are found and killed in one go."""
+        from hil import server
+        from hil.ext.obm import ipmi
+
+        dir_a = str(tmpdir.join('host-a'))
+        log_console(dir_a, 'output')
+        with open(tmpdir.join('host-a', 'pids').strpath, 'w') as f:
+            f.write('101\n102\n103\n')
+
+        fake_procs['table'].update({
+            # registered:
+            101: self.sol_activate('host-a'),
+            102: self.capture(dir_a),
+            # registered, but the pid has since been reused:
+            103: ['/bin/bash'],
+            # not registered (e.g. started by an older HIL):
+            201: self.sol_activate('host-b'),
+            # not ours:
+            301: self.sol_activate('some-other-host'),
+            302: ['/usr/sbin/sshd'],
+        })
+
+        server.stop_orphan_consoles()
+        for thread in threading.enumerate():
+            if thread.name == ipmi.SOL_DEACTIVATE_THREAD:
+                thread.join()
+
+        assert fake_procs['killed'] == {101, 102, 201}
+        assert fake_procs['deactivated'] == {'host-a', 'host-b'}
+        assert not tmpdir.join('host-a').check()
+
+    def test_stop_console(self, fake_procs, tmpdir):
+        """stop_console kills only the node's registered processes."""
+        dir_a = str(tmpdir.join('host-a'))
+        log_console(dir_a, 'output')
+        with open(tmpdir.join('host-a', 'pids').strpath, 'w') as f:
+            f.write('101\n102\n')
+
+        fake_procs['table'].update({
+            101: self.sol_activate('host-a'),
+            102: ['/bin/bash'],
+            201: self.sol_activate('host-a2'),
+        })
+        model.Node.query.filter_by(label='node-host-a').one()\
+            .obm.stop_console()
+        assert fake_procs['killed'] == {101}
+        assert fake_procs['deactivated'] == {'host-a'}
+
+
+class TestKill:
+    """Test stopping console processes, and waiting for them to exit."""
+
+    @staticmethod
+    def start(ignore_sigterm=False):
+        """Start a process which sleeps for a minute; return its Popen.
+
+        If `ignore_sigterm` is true, it ignores SIGTERM. Either way, it has
+        set up its signal handlers by the time this returns.
+        """
+        proc = subprocess.Popen(
+            [sys.executable, '-c',
+             'import signal, sys, time\n'
+             'if %r:\n'
+             '    signal.signal(signal.SIGTERM, signal.SIG_IGN)\n'
+             'sys.stdout.write("ready\\n")\n'
+             'sys.stdout.flush()\n'
+             'time.sleep(60)\n' % ignore_sigterm],
+            stdout=subprocess.PIPE)
+        assert proc.stdout.readline() == 'ready\n'
+        return proc
+
+    def test_waits_for_exit(self):
+        """_kill returns once the processes have exited, and reaps them."""
+        from hil.ext.obm import ipmi
+        procs = [self.start(), self.start()]
+        ipmi._kill([proc.pid for proc in procs])
+        for proc in procs:
+            assert ipmi._exited(proc.pid)
+            assert not os.path.exists('/proc/%d' % proc.pid)
+
+    def test_sigkill(self, monkeypatch):
+        """Processes which ignore SIGTERM are sent SIGKILL."""
+        from hil.ext.obm import ipmi
+        monkeypatch.setattr(ipmi, 'KILL_TIMEOUT', 0.2)
+        proc = self.start(ignore_sigterm=True)
+        ipmi._kill([proc.pid])
+        assert ipmi._exited(proc.pid)
+
+    def test_already_gone(self):
+        """Processes which have already exited are ignored."""
+        from hil.ext.obm import ipmi
+        proc = self.start()
+        proc.kill()
+        proc.wait()
+        ipmi._kill([proc.pid])
+
+
+# A stand-in for ipmitool, simulating a single BMC. It records each process
+# started in the file 'spawns', and each command run in 'commands'. Like a
+# real BMC, it refuses to power cycle a machine which is off.
+FAKE_IPMITOOL = '''#!%(python)s
+import os
+import sys
+
+STATE_DIR = %(state_dir)r
+
+
+def log(name, line):
+    with open(os.path.join(STATE_DIR, name), 'a') as f:
+        f.write(line + '\\n')
+
+
+def power(new=None):
+    path = os.path.join(STATE_DIR, 'power')
+    if new is not None:
+        with open(path, 'w') as f:
+            f.write(new)
+    if not os.path.exists(path):
+        return 'on'
+    with open(path) as f:
+        return f.read()
+
+
+def execute(command):
+    log('commands', command)
+    words = command.split()
+    if words[:2] == ['chassis', 'power']:
+        if words[2] in ('cycle', 'reset') and power() == 'off':
+            sys.stderr.write('Set Chassis Power Control failed\\n')
+            sys.stderr.flush()
+            return 1
+        if words[2] in ('on', 'off'):
+            power(words[2])
+        sys.stdout.write('Chassis Power Control: %%s\\n' %% words[2])
+        return 0
+    if words[:2] == ['chassis', 'bootdev']:
+        sys.stdout.write('Set Boot Device to %%s\\n' %% words[2])
+        return 0
+    sys.stderr.write('Invalid command: %%s\\n' %% command)
+    sys.stderr.flush()
+    return 1
+
+
+args = sys.argv[1:]
+log('spawns', ' '.join(args))
+command = args[args.index('-H') + 2:]
+if command == ['shell']:
+    while True:
+        sys.stdout.write('ipmitool> ')
+        sys.stdout.flush()
+        line = sys.stdin.readline()
+        if not line or line.strip() == 'exit':
+            break
+        execute(line.strip())
+else:
+    sys.exit(execute(' '.join(command)))
+'''
+
+
+class TestPersistentSessions:
+    """Test running ipmitool commands through a persistent shell."""
+
+    @pytest.fixture
+    def bmc(self, tmpdir, monkeypatch):
+        """Put a fake ipmitool on the path, and register a node using it.
+
+        Returns a function which reads one of the fake BMC's logs, as a
+        list of lines.
+        """
+        from hil.ext.obm import _ipmi_shell
+        bin_dir = tmpdir.mkdir('bin')
+        state_dir = tmpdir.mkdir('bmc')
+        script = bin_dir.join('ipmitool')
+        script.write(FAKE_IPMITOOL % {'python': sys.executable,
+                                      'state_dir': str(state_dir)})
+        script.chmod(0o755)
+        monkeypatch.setenv('PATH',
+                           str(bin_dir) + os.pathsep + os.environ['PATH'])
+        api.node_register(
+            node='node-99',
+            obm={
+                "type": "http://schema.massopencloud.org/haas/v0/obm/ipmi",
+                "host": "ipmihost",
+                "user": "root",
+                "password": "tapeworm",
+            },
+            obmd={
+                "uri": "http://obmd.example.com/nodes/node-99",
+                "admin_token": "secret",
+            },
+        )
+
+        def read_log(name):
+            """Return the lines of the fake BMC's log `name`."""
+            if not state_dir.join(name).check():
+                return []
+            return state_dir.join(name).read().splitlines()
+
+        yield read_log
+        _ipmi_shell.close_all()
+
+    @pytest.fixture
+    def persistent(self):
+        """Turn on persistent sessions."""
+        config_merge({
+            'hil.ext.obm.ipmi': {
+                'persistent_sessions': 'True',
+            },
+        })
+
+    def test_fork_per_command(self, bmc):
+        """Without persistent sessions, every command is a new process."""
+        api.node_power_cycle('node-99')
+        api.node_set_bootdev('node-99', 'disk')
+        assert bmc('commands') == [
+            'chassis bootdev pxe',
+            'chassis power cycle',
+            'chassis bootdev disk options=persistent',
+        ]
+        assert len(bmc('spawns')) == 3
+
+    def test_one_shell_per_bmc(self, bmc, persistent):
+        """With persistent sessions, commands share a single process."""
+        api.node_power_cycle('node-99')
+        api.node_power_off('node-99')
+        api.node_set_bootdev('node-99', 'disk')
+        assert bmc('commands') == [
+            'chassis bootdev pxe',
+            'chassis power cycle',
+            'chassis power off',
+            'chassis bootdev disk options=persistent',
+        ]
+        assert len(bmc('spawns')) == 1
+        assert bmc('spawns')[0].endswith(' shell')
+
+    def test_shell_errors(self, bmc, persistent):
+        """Errors reported by the shell are treated as failures.
+
+        Power cycling a node which is off fails, so the driver should fall
+        back to powering it on.
+        """
+        api.node_power_off('node-99')
+        api.node_power_cycle('node-99')
+        assert bmc('commands') == [
+            'chassis power off',
+            'chassis bootdev pxe',
+            'chassis power cycle',
+            'chassis power on',
+        ]
+        assert len(bmc('spawns')) == 1
+
+    def test_dead_shell_replaced(self, bmc, persistent):
+        """If the shell dies, a new one is started for the next command."""
+        from hil.ext.obm import _ipmi_shell
+        api.node_power_off('node-99')
+        shell = _ipmi_shell.get_shell('ipmihost', 'root', 'tapeworm', 30)
+        with shell.lock:
+            shell.close()
+        api.node_power_cycle('node-99')
+        assert len(bmc('spawns')) == 2
+        assert bmc('commands')[-1] == 'chassis power on'
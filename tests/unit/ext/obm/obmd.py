@@ -0,0 +1,257 @@
+"""Unit tests for obmd.py"""
+import json
+
+import pytest
+import requests_mock
+
+from hil import api, errors, model, server
+from hil.model import db
+from hil.test_common import config, config_testsuite, fresh_database, \
+    fail_on_log_warnings, with_request_context, config_merge, server_init
+
+OBMD_TYPE = 'http://schema.massopencloud.org/haas/v0/obm/obmd'
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.obm.obmd': '',
+            # For nodes without obmd obms:
+            'hil.ext.obm.mock': '',
+        },
+        'devel': {
+           'dry_run': None
+        }
+    })
+    config.load_extensions()
+
+
+fresh_database = pytest.fixture(fresh_database)
+fail_on_log_warnings = pytest.fixture(fail_on_log_warnings)
+with_request_context = pytest.yield_fixture(with_request_context)
+server_init = pytest.fixture(server_init)
+
+
+default_fixtures = ['fail_on_log_warnings',
+                    'configure',
+                    'fresh_database',
+                    'server_init',
+                    'with_request_context']
+
+pytestmark = pytest.mark.usefixtures(*default_fixtures)
+
+
+def node_uri(label):
+    """Return the obmd uri we register for the node named `label`."""
+    return 'http://obmd.example.com/node/' + label
+
+
+def register(label):
+    """Register a node named `label` with an obmd obm."""
+    api.node_register(
+        node=label,
+        obm={'type': OBMD_TYPE},
+        obmd={
+            'uri': node_uri(label),
+            'admin_token': 'secret',
+        },
+    )
+
+
+class TestObmd:
+    """Test obmd functions."""
+
+    def test_power_cycle(self):
+        """A power cycle fetches a token, and then uses it."""
+        register('node-99')
+        with requests_mock.mock() as mock:
+            mock.post(node_uri('node-99') + '/token',
+                      text=json.dumps({'token': 'tok'}))
+            mock.post(node_uri('node-99') + '/power_cycle?token=tok')
+            api.node_power_cycle('node-99', force=True)
+
+            token_req, cycle_req = mock.request_history
+            assert token_req.headers['Authorization'].startswith('Basic ')
+            assert json.loads(cycle_req.body) == {'force': True}
+
+        node = model.Node.query.filter_by(label='node-99').one()
+        assert node.obmd_node_token == 'tok'
+
+    def test_token_is_reused(self):
+        """Once we have a token, we don't ask for another one."""
+        register('node-99')
+        node = model.Node.query.filter_by(label='node-99').one()
+        node.obmd_node_token = 'tok'
+        with requests_mock.mock() as mock:
+            mock.post(node_uri('node-99') + '/power_off?token=tok')
+            api.node_power_off('node-99')
+            assert mock.call_count == 1
+
+    def test_stale_token(self):
+        """If obmd rejects our token, we get a new one and try again."""
+        register('node-99')
+        node = model.Node.query.filter_by(label='node-99').one()
+        node.obmd_node_token = 'stale'
+        with requests_mock.mock() as mock:
+            mock.put(node_uri('node-99') + '/boot_device?token=stale',
+                     status_code=401)
+            mock.post(node_uri('node-99') + '/token',
+                      text=json.dumps({'token': 'fresh'}))
+            mock.put(node_uri('node-99') + '/boot_device?token=fresh')
+            api.node_set_bootdev('node-99', 'pxe')
+            assert json.loads(mock.last_request.body) == {'bootdev': 'pxe'}
+        assert node.obmd_node_token == 'fresh'
+
+    def test_obmd_error(self):
+        """A failure from obmd is reported as an OBMError."""
+        register('node-99')
+        with requests_mock.mock() as mock:
+            mock.post(node_uri('node-99') + '/token',
+                      text=json.dumps({'token': 'tok'}))
+            mock.post(node_uri('node-99') + '/power_off', status_code=500)
+            with pytest.raises(errors.OBMError):
+                api.node_power_off('node-99')
+
+    def test_set_bootdev_invalid(self):
+        """node_set_bootdev throws an error for invalid devices."""
+        register('node-99')
+        with pytest.raises(errors.BadArgumentError):
+            api.node_set_bootdev('node-99', 'invalid-device')
+
+    def test_console(self):
+        """Starting, reading and stopping the console."""
+        register('node-99')
+        with pytest.raises(errors.NotFoundError):
+            api.show_console('node-99')
+        with requests_mock.mock() as mock:
+            mock.post(node_uri('node-99') + '/token',
+                      text=json.dumps({'token': 'tok'}))
+            mock.get(node_uri('node-99') + '/console?token=tok',
+                     content='Some console output\xff')
+            mock.delete(node_uri('node-99') + '/token')
+            api.start_console('node-99')
+            resp = api.show_console('node-99')
+            assert resp.get_data() == 'Some console output'
+            assert 'X-Console-Offset' not in resp.headers
+            api.stop_console('node-99')
+        with pytest.raises(errors.NotFoundError):
+            api.show_console('node-99')
+
+    def test_token_saved_by_the_call(self):
+        """A new token is committed along with the rest of the API call."""
+        register('node-99')
+        with requests_mock.mock() as mock:
+            mock.post(node_uri('node-99') + '/token',
+                      text=json.dumps({'token': 'tok'}))
+            mock.post(node_uri('node-99') + '/power_off?token=tok')
+            api.node_power_off('node-99')
+        db.session.remove()
+        node = model.Node.query.filter_by(label='node-99').one()
+        assert node.obmd_node_token == 'tok'
+
+    def test_token_not_committed_on_failure(self):
+        """A call which fails doesn't commit anything, the token included."""
+        register('node-99')
+        with requests_mock.mock() as mock:
+            mock.post(node_uri('node-99') + '/token',
+                      text=json.dumps({'token': 'tok'}))
+            mock.post(node_uri('node-99') + '/power_off', status_code=500)
+            with pytest.raises(errors.OBMError):
+                api.node_power_off('node-99')
+        db.session.rollback()
+        node = model.Node.query.filter_by(label='node-99').one()
+        assert node.obmd_node_token is None
+
+    def test_stop_orphan_consoles(self):
+        """Stopping orphaned consoles at startup doesn't call obmd."""
+        register('node-99')
+        node = model.Node.query.filter_by(label='node-99').one()
+        node.obmd_node_token = 'tok'
+        with requests_mock.mock() as mock:
+            server.stop_orphan_consoles()
+            assert mock.call_count == 0
+        assert node.obmd_node_token == 'tok'
+
+    def test_bulk_power_off(self):
+        """bulk_power_off reports the nodes for which it failed."""
+        from hil.ext.obm.obmd import bulk_power_off
+        labels = ['node-%02d' % i for i in range(10)]
+        for label in labels:
+            register(label)
+        with requests_mock.mock() as mock:
+            for label in labels:
+                mock.post(node_uri(label) + '/token',
+                          text=json.dumps({'token': label + '-tok'}))
+                mock.post(node_uri(label) + '/power_off',
+                          status_code=500 if label == 'node-03' else 200)
+            nodes = model.Node.query.all()
+            failures = bulk_power_off(nodes, jobs=4)
+        assert failures.keys() == ['node-03']
+        assert isinstance(failures['node-03'], errors.OBMError)
+        for node in nodes:
+            assert node.obmd_node_token == node.label + '-tok'
+
+    def test_bulk_set_bootdev_invalid(self):
+        """bulk_set_bootdev rejects unknown boot devices up front."""
+        from hil.ext.obm.obmd import bulk_set_bootdev
+        register('node-99')
+        with requests_mock.mock() as mock:
+            with pytest.raises(errors.BadArgumentError):
+                bulk_set_bootdev(model.Node.query.all(), 'cdrom')
+            assert mock.call_count == 0
+
+    def test_bulk_power_command(self):
+        """hil-admin bulk-power sets the boot device, then power cycles.
+
+        Nodes for which setting the boot device fails aren't power cycled,
+        and the new tokens are committed.
+        """
+        from hil.commands.bulk_power import bulk_power
+        api.project_create('runway')
+        labels = ['node-%02d' % i for i in range(4)]
+        for label in labels:
+            register(label)
+            api.project_connect_node('runway', label)
+        with requests_mock.mock() as mock:
+            for label in labels:
+                mock.post(node_uri(label) + '/token',
+                          text=json.dumps({'token': label + '-tok'}))
+                mock.put(node_uri(label) + '/boot_device',
+                         status_code=500 if label == 'node-01' else 200)
+                mock.post(node_uri(label) + '/power_cycle',
+                          status_code=500 if label == 'node-02' else 200)
+            failures = bulk_power('cycle', [], project='runway',
+                                  bootdev='pxe', jobs=2)
+            cycled = sorted(request.url.split('/')[-2]
+                            for request in mock.request_history
+                            if request.path.endswith('/power_cycle'))
+        assert sorted(failures) == ['node-01', 'node-02']
+        assert cycled == ['node-00', 'node-02', 'node-03']
+        db.session.remove()
+        assert [node.obmd_node_token
+                for node in model.Node.query.order_by(model.Node.label)] == \
+            [label + '-tok' for label in labels]
+
+    def test_bulk_power_command_errors(self):
+        """hil-admin bulk-power only works on existing obmd nodes."""
+        from hil.commands.bulk_power import bulk_power
+        register('node-99')
+        api.node_register(node='ipmi-node',
+                          obm={'type': 'http://schema.massopencloud.org/'
+                                       'haas/v0/obm/mock',
+                               'host': 'ipmihost',
+                               'user': 'root',
+                               'password': 'tapeworm'},
+                          obmd={'uri': 'http://obmd.example.com/ipmi-node',
+                                'admin_token': 'secret'})
+        for labels, kwargs in [
+                (['node-98'], {}),
+                ([], {'project': 'no-such-project'}),
+                ([], {}),
+                (['node-99', 'ipmi-node'], {}),
+                (['node-99'], {'bootdev': 'cdrom'})]:
+            with pytest.raises(ValueError):
+                bulk_power('off', labels, **kwargs)
@@ -0,0 +1,137 @@
+"""Test the console-based switch drivers against a fake console.
+
+See hil.ext.switches._fake_console.
+"""
+
+import os
+
+import pytest
+
+from hil import config, model
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, \
+    fresh_database, fail_on_log_warnings, with_request_context
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+FLAVORS = ['powerconnect55xx', 'delln3000', 'nexus']
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL with the console-based switch drivers."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.obm.mock': '',
+            'hil.ext.switches.dell': '',
+            'hil.ext.switches.n3000': '',
+            'hil.ext.switches.nexus': '',
+        },
+    })
+    config.load_extensions()
+
+
+pytestmark = pytest.mark.usefixtures('configure',
+                                     'fresh_database',
+                                     'with_request_context')
+
+
+@pytest.fixture(params=FLAVORS)
+def flavor(request):
+    """Run the test against each flavor of fake console."""
+    return request.param
+
+
+@pytest.fixture
+def table(flavor, tmpdir, monkeypatch):
+    """Put an ``ssh`` running the fake console first in the $PATH.
+
+    Returns the console's VLAN table.
+    """
+    from hil.ext.switches._fake_console import write_ssh_shim
+    from hil.ext.switches._fake_vlans import VlanTable
+    state = str(tmpdir.join('vlans.json'))
+    write_ssh_shim(str(tmpdir), flavor, state, ports=8)
+    monkeypatch.setenv('PATH', str(tmpdir) + os.pathsep + os.environ['PATH'])
+    return VlanTable(state)
+
+
+@pytest.fixture
+def port(flavor):
+    """Create a switch of the right kind, with a port connected to a nic.
+
+    Returns the port.
+    """
+    from hil.ext.switches.dell import PowerConnect55xx
+    from hil.ext.switches.n3000 import DellN3000
+    from hil.ext.switches.nexus import Nexus
+    from hil.ext.obm.mock import MockObm
+
+    args = {
+        'label': 'sw0',
+        'hostname': 'sw0.example.com',
+        'username': 'admin',
+        'password': 'secret',
+    }
+    if flavor == 'powerconnect55xx':
+        switch = PowerConnect55xx(**args)
+        label = 'gi1/0/5'
+    elif flavor == 'delln3000':
+        switch = DellN3000(dummy_vlan='2222', **args)
+        label = 'gi1/0/5'
+    else:
+        switch = Nexus(dummy_vlan='2222', **args)
+        label = 'Ethernet1/5'
+    port = model.Port(label, switch)
+    node = model.Node(label='node-99',
+                      obm=MockObm(type=MockObm.api_name,
+                                  host='ipmihost',
+                                  user='root',
+                                  password='tapeworm'),
+                      obmd_uri='http://obmd.example.com/nodes/node-99',
+                      obmd_admin_token='secret')
+    nic = model.Nic(node, 'eth0', '00:11:22:33:44:55')
+    nic.port = port
+    db.session.add_all([switch, port, node, nic])
+    db.session.commit()
+    return port
+
+
+def test_modify_and_revert(table, port):
+    """The driver can configure the fake, and read the result back."""
+    switch = port.owner
+    session = switch.session()
+    session.modify_port(port.label, 'vlan/native', '102')
+    session.modify_port(port.label, 'vlan/110', '110')
+    assert sorted(session.get_port_networks([port])[port]) == [
+        ('vlan/102', 102),
+        ('vlan/110', 110),
+        ('vlan/native', 102),
+    ]
+    assert table.port('sw0.example.com', port.label)['native'] == 102
+
+    session.revert_port(port.label)
+    assert session.get_port_networks([port]) == {port: []}
+    session.disconnect()
+
+    # Disconnecting saves the configuration:
+    saved = table.ports('sw0.example.com', startup=True)[port.label]
+    assert saved['vlans'] == []
+
+
+def test_state_is_shared(table, port):
+    """A second session sees what the first one configured."""
+    switch = port.owner
+    session = switch.session()
+    session.modify_port(port.label, 'vlan/native', '102')
+    session.disconnect()
+
+    session = switch.session()
+    assert session.get_port_networks([port])[port] == [
+        ('vlan/102', 102),
+        ('vlan/native', 102),
+    ]
+    session.disconnect()
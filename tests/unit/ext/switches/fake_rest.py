@@ -0,0 +1,91 @@
+"""Test the REST-based switch drivers against a fake REST server.
+
+See hil.ext.switches._fake_rest.
+"""
+
+import pytest
+
+from hil import config, model
+from hil.test_common import config_testsuite, config_merge, \
+    fail_on_log_warnings
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+
+@pytest.fixture(autouse=True)
+def configure():
+    """Configure HIL with the REST-based switch drivers."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.brocade': '',
+            'hil.ext.switches.dellnos9': '',
+            'hil.ext.network_allocators.null': None,
+            'hil.ext.network_allocators.vlan_pool': '',
+        },
+        'hil.ext.network_allocators.vlan_pool': {
+            'vlans': '100-200',
+        },
+    })
+    config.load_extensions()
+
+
+@pytest.fixture
+def server():
+    """Start a fake switch, and stop it after the test."""
+    from hil.ext.switches._fake_rest import Server
+    server = Server(switch='sw0')
+    server.start()
+    yield server
+    server.stop()
+
+
+def test_brocade(server):
+    """The Brocade driver can configure the fake, and read it back."""
+    from hil.ext.switches.brocade import Brocade
+    switch = Brocade(label='sw0',
+                     hostname=server.url,
+                     username='admin',
+                     password='secret',
+                     interface_type='TenGigabitEthernet')
+    port = model.Port('104/0/10', switch)
+
+    switch.modify_port(port.label, 'vlan/native', '102')
+    switch.modify_port(port.label, 'vlan/110', '110')
+    switch.modify_port(port.label, 'vlan/112', '112')
+    assert switch._get_mode(port.label) == 'trunk'
+    assert switch.get_port_networks([port]) == {
+        port: [('vlan/native', '102'),
+               ('vlan/110', '110'),
+               ('vlan/112', '112')],
+    }
+
+    switch.modify_port(port.label, 'vlan/110', None)
+    assert server.table.port('sw0', port.label)['vlans'] == [112]
+
+    switch.revert_port(port.label)
+    assert switch.get_port_networks([port]) == {port: []}
+
+
+def test_dellnos9(server):
+    """The Dell OS 9 driver can configure the fake, and read it back."""
+    from hil.ext.switches.dellnos9 import DellNOS9
+    switch = DellNOS9(label='sw0',
+                      hostname=server.url,
+                      username='admin',
+                      password='secret',
+                      interface_type='GigabitEthernet')
+    port = model.Port('1/3', switch)
+
+    assert switch.get_port_networks([port]) == {port: []}
+    switch.modify_port(port.label, 'vlan/native', '102')
+    switch.modify_port(port.label, 'vlan/110', '110')
+    assert switch.get_port_networks([port]) == {
+        port: [('vlan/110', '110'), ('vlan/native', '102')],
+    }
+
+    switch.revert_port(port.label)
+    assert switch.get_port_networks([port]) == {port: []}
+    assert server.table.port('sw0', port.label)['shutdown']
+    # revert_port saves the configuration:
+    assert server.table.ports('sw0', startup=True)[port.label]['vlans'] == []
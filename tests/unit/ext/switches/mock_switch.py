@@ -0,0 +1,85 @@
+"""Unit tests for the latency and failure options of hil.ext.switches.mock"""
+
+import pytest
+
+from hil import config
+from hil.errors import SwitchError
+from hil.test_common import config_testsuite, config_merge
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL with the mock switch."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.mock': '',
+        },
+    })
+    config.load_extensions()
+
+
+@pytest.fixture
+def switch(configure):
+    """Return a mock switch (not in the database)."""
+    from hil.ext.switches.mock import MockSwitch
+    return MockSwitch(label='sw0',
+                      hostname='switch.example.com',
+                      username='admin',
+                      password='secret')
+
+
+def test_delays(switch, monkeypatch):
+    """Each option delays the corresponding operation."""
+    from hil.ext.switches import mock
+    sleeps = []
+    monkeypatch.setattr(mock.time, 'sleep', sleeps.append)
+    config_merge({
+        'hil.ext.switches.mock': {
+            'latency_ms': '20',
+            'session_ms': '300',
+            'save_ms': '4000',
+        },
+    })
+
+    session = switch.session()
+    session.modify_port('gi1/0/1', 'vlan/native', '102')
+    session.revert_port('gi1/0/1')
+    session.disconnect()
+    assert sleeps == [0.3, 0.02, 0.02, 4.0]
+
+
+def test_no_delay_by_default(switch, monkeypatch):
+    """Without any options, nothing sleeps."""
+    from hil.ext.switches import mock
+    sleeps = []
+    monkeypatch.setattr(mock.time, 'sleep', sleeps.append)
+    switch.session().modify_port('gi1/0/1', 'vlan/native', '102')
+    switch.disconnect()
+    assert sleeps == []
+
+
+def test_failures(switch):
+    """With failure_percent = 100, every command fails, and does nothing."""
+    from hil.ext.switches import mock
+    config_merge({
+        'hil.ext.switches.mock': {
+            'failure_percent': '100',
+        },
+    })
+    with pytest.raises(SwitchError):
+        switch.modify_port('gi1/0/2', 'vlan/native', '102')
+    assert 'gi1/0/2' not in mock.LOCAL_STATE['sw0']
+
+
+def test_options_validate(configure):
+    """The options pass validate_config as they are, and bad ones don't."""
+    import schema
+    from hil.ext.switches import mock
+    options = {'latency_ms': '20', 'failure_percent': '12.5'}
+    section = schema.Schema(config.core_schema[mock.__name__])
+    assert section.validate(options) == options
+    for bad in {'latency_ms': '-1'}, {'failure_percent': '101'}, \
+            {'jitter_ms': 'lots'}:
+        with pytest.raises(schema.SchemaError):
+            section.validate(bad)
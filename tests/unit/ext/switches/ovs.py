@@ -0,0 +1,129 @@
+"""Unit tests for the openvswitch driver.
+
+These don't need openvswitch: they check the ovs-vsctl commands which the
+driver runs, with ``subprocess`` replaced.
+"""
+
+import pytest
+
+from hil import config, model
+from hil.test_common import config_testsuite, config_merge, \
+    fail_on_log_warnings
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+LIST_OUTPUT = '''\
+tag                 : 100
+trunks              : [200, 300]
+
+tag                 : []
+trunks              : []
+'''
+
+
+@pytest.fixture(autouse=True)
+def configure():
+    """Configure HIL with the ovs driver."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.ovs': '',
+        },
+    })
+    config.load_extensions()
+
+
+@pytest.fixture
+def commands(monkeypatch):
+    """Record the commands the driver runs, instead of running them.
+
+    ``ovs-vsctl list`` gives `LIST_OUTPUT`.
+    """
+    from hil.ext.switches import ovs
+    result = []
+
+    def check_call(args):
+        """Record `args`."""
+        result.append(args)
+
+    def check_output(args):
+        """Record `args`, and return LIST_OUTPUT."""
+        result.append(args)
+        return LIST_OUTPUT
+
+    monkeypatch.setattr(ovs.subprocess, 'check_call', check_call)
+    monkeypatch.setattr(ovs.subprocess, 'check_output', check_output)
+    return result
+
+
+@pytest.fixture
+def switch():
+    """An ovs switch, on the bridge br0."""
+    from hil.ext.switches.ovs import Ovs
+    return Ovs(label='sw0', ovs_bridge='br0')
+
+
+def test_revert_port_is_one_transaction(switch, commands):
+    """Deleting and re-adding the port is done by a single ovs-vsctl."""
+    switch.revert_port('veth-0')
+    assert commands == [
+        ['sudo', 'ovs-vsctl',
+         '--', 'del-port', 'veth-0',
+         '--', 'add-port', 'br0', 'veth-0', 'vlan_mode=native-untagged'],
+    ]
+
+
+def test_vlan_changes_do_not_read_the_port(switch, commands):
+    """Adding and removing vlans are single commands, with no reads."""
+    switch.modify_port('veth-0', 'vlan/300', '300')
+    switch.modify_port('veth-0', 'vlan/200', None)
+    switch.modify_port('veth-0', 'vlan/native', '100')
+    switch.modify_port('veth-0', 'vlan/native', None)
+    assert commands == [
+        ['sudo', 'ovs-vsctl', '--', 'add', 'port', 'veth-0', 'trunks', '300'],
+        ['sudo', 'ovs-vsctl',
+         '--', 'remove', 'port', 'veth-0', 'trunks', '200'],
+        ['sudo', 'ovs-vsctl',
+         '--', 'set', 'port', 'veth-0', 'tag=100',
+         'vlan_mode=native-untagged'],
+        ['sudo', 'ovs-vsctl', '--', 'clear', 'port', 'veth-0', 'tag'],
+    ]
+
+
+def test_modify_port_channels_is_one_transaction(switch, commands):
+    """Several changes to a port are made by a single ovs-vsctl."""
+    switch.modify_port_channels('veth-0', [('vlan/200', None),
+                                           ('vlan/native', '100'),
+                                           ('vlan/300', '300')])
+    assert commands == [
+        ['sudo', 'ovs-vsctl',
+         '--', 'remove', 'port', 'veth-0', 'trunks', '200',
+         '--', 'set', 'port', 'veth-0', 'tag=100', 'vlan_mode=native-untagged',
+         '--', 'add', 'port', 'veth-0', 'trunks', '300'],
+    ]
+
+
+def test_get_port_networks_reads_all_ports_at_once(switch, commands):
+    """All of the ports are listed by a single ovs-vsctl."""
+    ports = [model.Port('veth-0', switch), model.Port('veth-1', switch)]
+    assert switch.get_port_networks(ports) == {
+        ports[0]: [('vlan/200', '200'),
+                   ('vlan/300', '300'),
+                   ('vlan/native', '100')],
+        ports[1]: [],
+    }
+    assert commands == [
+        ['sudo', 'ovs-vsctl', '--columns=tag,trunks', 'list', 'port',
+         'veth-0', 'veth-1'],
+    ]
+    assert switch.get_port_networks([]) == {}
+
+
+def test_commands_are_profiled(switch, commands):
+    """The commands show up in the trace of a profiled API call."""
+    from hil import profiler
+    trace = profiler.Trace('node_connect_network', 'some-uuid', False)
+    trace.run(switch.modify_port, 'veth-0', 'vlan/300', '300')
+    assert [(call['kind'], call['description']) for call in trace.calls] == [
+        ('switch', 'sudo ovs-vsctl -- add port veth-0 trunks 300'),
+    ]
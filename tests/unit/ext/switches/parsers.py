@@ -0,0 +1,169 @@
+"""Unit tests for hil.ext.switches._parsers and hil.ext.switches._replay.
+
+The drivers are also checked against the recorded outputs in
+tests/corpus/switches.
+"""
+
+import glob
+import os
+
+import pexpect
+import pytest
+
+from hil import config
+from hil.test_common import config_testsuite, config_merge, \
+    fail_on_log_warnings
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+CORPUS = os.path.join(os.path.dirname(__file__),
+                      '..', '..', '..', 'corpus', 'switches')
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL with the drivers which have recorded outputs."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.dell': '',
+            'hil.ext.switches.n3000': '',
+            'hil.ext.switches.nexus': '',
+            'hil.ext.switches.dellnos9': '',
+            'hil.ext.switches.ovs': '',
+        },
+    })
+    config.load_extensions()
+
+
+@pytest.fixture
+def parsers():
+    """Return the `hil.ext.switches._parsers` module.
+
+    This is imported here rather than at the top, so that collecting the
+    tests doesn't load any extensions.
+    """
+    from hil.ext.switches import _parsers
+    return _parsers
+
+
+def test_key_values(parsers):
+    """key_values joins continuation lines, and skips other lines."""
+    assert parsers.key_values(
+        'show int sw gi1/0/5\r\n'
+        'Name: gi1/0/5\r\n'
+        'Trunking VLANs Enabled: 200,202,\r\n'
+        '                        204 (Inactive)\r\n'
+        'General VLANs Enabled:\r\n'
+        '\r\n'
+        'switch# '
+    ) == {
+        'Name': 'gi1/0/5',
+        'Trunking VLANs Enabled': '200,202, 204 (Inactive)',
+        'General VLANs Enabled': '',
+    }
+
+
+def test_dell_int_config_stops_at_classification_rules(parsers):
+    """Nothing after "Classification rules:" is read."""
+    assert parsers.dell_int_config(
+        'Name: gi1/0/5\nForbidden VLANs: none\n\n'
+        'Classification rules:\nProtocol: ip\n'
+    ) == {'Name': 'gi1/0/5', 'Forbidden VLANs': 'none'}
+
+
+def test_nexus_int_configs(parsers):
+    """Each interface gets its own fields."""
+    assert parsers.nexus_int_configs(
+        'Name: Ethernet1/1\r\n'
+        '  Trunking Native Mode VLAN: 1 (default)\r\n'
+        '  Extended Trust State : not trusted [COS = 0]\r\n'
+        '\r\n'
+        'Name: port-channel1\r\n'
+        '  Trunking VLANs Allowed: 1-4094\r\n'
+        'switch# '
+    ) == {
+        'Ethernet1/1': {
+            'Trunking Native Mode VLAN': '1 (default)',
+            'Extended Trust State': 'not trusted [COS = 0]',
+        },
+        'port-channel1': {'Trunking VLANs Allowed': '1-4094'},
+    }
+
+
+def test_numbers(parsers):
+    """Numbers are read the way the console drivers always have."""
+    assert parsers.first_number(' 100 (Inactive)') == 100
+    assert parsers.first_number('none') is None
+    assert parsers.vlan_numbers('none') == []
+    assert parsers.vlan_numbers('12,14, 16 (Inactive)') == [12, 14, 16]
+    # Ranges only give their ends:
+    assert parsers.vlan_numbers('20-22,30') == [20, 22, 30]
+
+
+def test_nos9_switchport(parsers):
+    """Tagged vlan ranges are expanded; a missing native vlan is None."""
+    assert parsers.nos9_switchport(
+        'Name: GigabitEthernet 1/3\r\nU 1512\r\nT 1511,1612-1614\r\n'
+        'Native Vlan Id: 1512.\r\n'
+    ) == (['1511', '1612', '1613', '1614'], '1512')
+    assert parsers.nos9_switchport('Name: GigabitEthernet 1/3\r\n') == \
+        ([], None)
+
+
+def test_ovs_record(parsers):
+    """Lists and maps are split, except inside quotes."""
+    assert parsers.ovs_record(
+        'external_ids        : {attached-mac="fa:16:3e:2b:5c:01", a=b}\n'
+        'statistics          : {abc:123    , space  :  lot of it }\n'
+        'interfaces          : [fc61c8ff99c5, "x, y"]\n'
+        'name                : "veth-0"\n'
+        'tag                 : []\n'
+        'status              : {}\n'
+    ) == {
+        'external_ids': {'attached-mac': '"fa:16:3e:2b:5c:01"', 'a': 'b'},
+        'statistics': {'abc': '123', 'space': 'lot of it'},
+        'interfaces': ['fc61c8ff99c5', '"x, y"'],
+        'name': '"veth-0"',
+        'tag': [],
+        'status': {},
+    }
+
+
+def test_replay_console():
+    """The replay console echoes commands, and matches like pexpect."""
+    from hil.ext.switches._replay import ReplayConsole
+    console = ReplayConsole({'show foo': 'foo: 1\r\nbar: 2\r\n'})
+    console.expect(r'[\r\n]+.+#')
+    console.sendline('show foo')
+    # The earliest match wins, then the first pattern:
+    assert console.expect([r'bar: \d', r'foo: \d', r'foo: ']) == 1
+    assert console.before == ' show foo\r\n'
+    assert console.expect(r'switch# ') == 0
+    assert console.before == '\r\nbar: 2\r\n'
+    with pytest.raises(pexpect.TIMEOUT):
+        console.expect('more')
+    assert console.expect([pexpect.EOF, '>']) == 0
+    assert console.sent == ['show foo']
+
+
+def test_replay_console_trickle():
+    """With `trickle`, output becomes available a line at a time."""
+    from hil.ext.switches._replay import ReplayConsole
+    console = ReplayConsole({'show foo': 'foo: 1\r\nbar: 2\r\n'},
+                            trickle=True)
+    console.sendline('show foo')
+    console.expect('foo: .*')
+    assert console.after == 'foo: 1\r\n'
+
+
+@pytest.mark.parametrize('path', sorted(
+    os.path.splitext(path)[0]
+    for path in glob.glob(os.path.join(CORPUS, '*', '*.json'))))
+def test_corpus(configure, path):
+    """The drivers read the recorded networks from each recorded output."""
+    from hil.ext.switches._replay import load, port_networks
+    driver = os.path.basename(os.path.dirname(path))
+    recording = load(path)
+    networks = port_networks(driver, recording)
+    assert [list(network) for network in networks] == recording['networks']
@@ -386,12 +386,14 @@ def test_db_eq(filename, make_objects, extra_config):
     def censor_nondeterminism(string):
         """Censor parts of the output whose values are non-deterministic.
 
-        Certain objects (currently just uuids) are generated
+        Certain objects (currently uuids and timestamps) are generated
         non-deterministically, and will thus be different between databases
         even if everything is working. This function censors the relevant
         parts of `string`, so that they don't cause the tests to fail.
         """
-        return re.sub(uuid_pattern, '<<UUID>>', string)
+        string = re.sub(uuid_pattern, '<<UUID>>', string)
+        return re.sub(r'datetime\.datetime\([^)]*\)', '<<DATETIME>>',
+                      string)
 
     differ = difflib.Differ()
     upgraded = censor_nondeterminism(pformat(upgraded)).split('\n')
@@ -8,12 +8,15 @@
 # to make sure it isn't throwing an exception.
 
 from hil.model import Node, Nic, Project, Headnode, Hnic, Network, \
-    NetworkingAction, Metadata
-from hil import config
+    NetworkingAction, Metadata, db
+from hil import config, model
+from hil.flaskapp import app
 
 from hil.test_common import fresh_database, config_testsuite, ModelTest, \
-    fail_on_log_warnings
+    fail_on_log_warnings, config_merge
 import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
 
 fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
 
@@ -117,3 +120,71 @@ class TestNetworkingAction(ModelTest):
         return NetworkingAction(nic=nic,
                                 new_network=network,
                                 channel='null')
+
+
+def _pool_options(uri):
+    """Return the options `db` would create an engine for `uri` with."""
+    options = {}
+    db.apply_pool_defaults(app, options)
+    db.apply_driver_hacks(app, make_url(uri), options)
+    return options
+
+
+def test_pool_options():
+    """The [database] pool options are passed on to the engine."""
+    config_merge({
+        'database': {
+            'pool_size': '3',
+            'max_overflow': '2',
+            'pool_timeout': '10',
+            'pool_recycle': '60',
+            'pool_pre_ping': 'True',
+        },
+    })
+    model.init_db()
+    options = _pool_options('postgresql://hil@localhost/hil')
+    assert options == {
+        'pool_size': 3,
+        'max_overflow': 2,
+        'pool_timeout': 10,
+        'pool_recycle': 60,
+        'pool_pre_ping': True,
+    }
+    # SQLite doesn't keep connections in a queue, so only some apply:
+    options = _pool_options('sqlite:///hil.db')
+    assert 'pool_size' not in options
+    assert options['pool_recycle'] == 60
+    assert options['pool_pre_ping'] is True
+
+
+def _pragmas(tmpdir):
+    """Return the pragmas a new connection to a SQLite file ends up with."""
+    engine = create_engine('sqlite:///%s' % tmpdir.join('pragmas.db'))
+    try:
+        with engine.connect() as connection:
+            return tuple(connection.execute('PRAGMA %s' % pragma).scalar()
+                         for pragma in ('busy_timeout', 'journal_mode',
+                                        'synchronous'))
+    finally:
+        engine.dispose()
+
+
+def test_sqlite_pragmas(tmpdir):
+    """New SQLite connections use write-ahead logging, and wait for locks.
+    """
+    # synchronous = normal is 1:
+    assert _pragmas(tmpdir) == (5000, 'wal', 1)
+
+
+def test_sqlite_pragmas_configured(tmpdir):
+    """The SQLite pragmas can be configured."""
+    config_merge({
+        'database': {
+            'sqlite_busy_timeout_ms': '100',
+            'sqlite_journal_mode': 'delete',
+            'sqlite_synchronous': 'full',
+        },
+    })
+    model.init_db()
+    # synchronous = full is 2:
+    assert _pragmas(tmpdir) == (100, 'delete', 2)
@@ -0,0 +1,184 @@
+"""Unit tests for hil.replicas"""
+
+import json
+
+import pytest
+
+from hil import api  # pylint: disable=unused-import
+from hil import config, model, replicas, rest
+from hil.flaskapp import app
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, newDB, \
+    releaseDB
+
+
+@pytest.fixture
+def configure(tmpdir):
+    """Configure HIL with a primary database and one read replica.
+
+    Both are SQLite databases of their own, and nothing replicates from one
+    to the other, so the tests can tell which one a call reads from.
+    """
+    config_testsuite()
+    config_merge({
+        'database': {
+            'uri': 'sqlite:///%s' % tmpdir.join('primary.db'),
+            'replicas': 'sqlite:///%s' % tmpdir.join('replica.db'),
+        },
+    })
+    config.load_extensions()
+
+
+@pytest.fixture
+def fresh_database(request, configure):
+    """Create the schema in both databases."""
+    newDB()
+    with app.app_context():
+        db.Model.metadata.create_all(db.get_engine(app, bind='replica-0'))
+
+    def release():
+        """Drop the primary, and forget about the replica.
+
+        The replica goes away along with `tmpdir`.
+        """
+        app.config.update(SQLALCHEMY_BINDS=None)
+        releaseDB()
+    request.addfinalizer(release)
+
+
+pytestmark = pytest.mark.usefixtures('configure', 'fresh_database')
+
+
+def _projects(client):
+    """Return the projects `client` gets from list_projects."""
+    response = client.get('/v0/projects')
+    assert response.status_code == 200
+    return json.loads(response.get_data())
+
+
+def test_replica_binds():
+    """Each replica is registered as a bind."""
+    assert replicas.replicas() == ['replica-0']
+
+
+def test_get_reads_from_replica():
+    """GET calls read from the replica, other calls write to the primary."""
+    writer = rest.app.test_client()
+    assert writer.put('/v0/project/anvil-nextgen').status_code == 200
+    # Nothing replicates to the replica here, so another client doesn't see
+    # the project:
+    assert _projects(rest.app.test_client()) == []
+
+
+def test_reads_stick_to_primary_after_write():
+    """A client's GET calls go to the primary for a while after it writes.
+    """
+    writer = rest.app.test_client()
+    writer.put('/v0/project/anvil-nextgen')
+    assert _projects(writer) == ['anvil-nextgen']
+
+
+def test_stickiness_expires():
+    """Once `replica_sticky_seconds` are over, reads go to the replica."""
+    config_merge({'database': {'replica_sticky_seconds': '0'}})
+    writer = rest.app.test_client()
+    writer.put('/v0/project/anvil-nextgen')
+    assert _projects(writer) == []
+
+
+def test_not_found_retried_on_primary():
+    """A GET call which fails on the replica is retried on the primary."""
+    rest.app.test_client().put('/v0/project/anvil-nextgen')
+    response = rest.app.test_client().get('/v0/project/anvil-nextgen/nodes')
+    assert response.status_code == 200
+    assert json.loads(response.get_data()) == []
+
+
+def test_not_found_replica_caught_up(monkeypatch):
+    """If the replica isn't behind, a GET call which fails there fails."""
+    monkeypatch.setattr(replicas, '_replica_lag',
+                        lambda key, primary_revision: (1, 0, None))
+    rest.app.test_client().put('/v0/project/anvil-nextgen')
+    response = rest.app.test_client().get('/v0/project/anvil-nextgen/nodes')
+    assert response.status_code == 404
+
+
+def test_not_found_after_write(monkeypatch):
+    """A client which wrote recently gets its failed reads retried.
+
+    This is so even when its reads have gone back to the replica, and the
+    replica seems to have caught up.
+    """
+    monkeypatch.setattr(replicas, '_replica_lag',
+                        lambda key, primary_revision: (1, 0, None))
+    config_merge({'database': {'replica_sticky_seconds': '0'}})
+    writer = rest.app.test_client()
+    writer.put('/v0/project/anvil-nextgen')
+    response = writer.get('/v0/project/anvil-nextgen/nodes')
+    assert response.status_code == 200
+
+
+def test_not_found_on_primary():
+    """A GET call which fails on the primary too still fails."""
+    response = rest.app.test_client().get('/v0/project/anvil-nextgen/nodes')
+    assert response.status_code == 404
+
+
+def test_metrics():
+    """The metrics show how far behind the replica is."""
+    client = rest.app.test_client()
+    client.put('/v0/project/anvil-nextgen')
+    client.put('/v0/project/pxe')
+    text = client.get('/v0/metrics').get_data()
+    assert 'hil_db_replica_up{replica="replica-0"} 1' in text
+    assert 'hil_db_replica_lag_revisions{replica="replica-0"} 2' in text
+    # Only PostgreSQL can tell how far behind in time a replica is:
+    assert 'hil_db_replica_lag_seconds{' not in text
+
+
+def test_replica_down(tmpdir):
+    """If the replica can't be reached, reads go to the primary."""
+    config_merge({
+        'database': {
+            'replicas': 'sqlite:///%s' % tmpdir.join('missing', 'db'),
+        },
+    })
+    model.init_db()
+    rest.app.test_client().put('/v0/project/anvil-nextgen')
+    client = rest.app.test_client()
+    assert _projects(client) == ['anvil-nextgen']
+    text = client.get('/v0/metrics').get_data()
+    assert 'hil_db_replica_up{replica="replica-0"} 0' in text
+
+
+class _VersionConnection(object):
+    """Stands in for a connection to a PostgreSQL server of some version.
+
+    It only answers ``SHOW server_version_num``.
+    """
+
+    def __init__(self, version_num):
+        self.version_num = version_num
+
+    def execute(self, query):
+        """Return a result holding the version."""
+        assert str(query) == 'SHOW server_version_num'
+        return self
+
+    def scalar(self):
+        """Return the version, as PostgreSQL does."""
+        return str(self.version_num)
+
+
+@pytest.mark.parametrize('version_num,functions', [
+    (90300, ('pg_last_xlog_receive_location()',
+             'pg_last_xlog_replay_location()')),
+    (100004, ('pg_last_wal_receive_lsn()', 'pg_last_wal_replay_lsn()')),
+])
+def test_pg_lag_query(version_num, functions):
+    """The lag query uses the function names of the server's version."""
+    # pylint: disable=protected-access
+    query = replicas._pg_lag_query(_VersionConnection(version_num))
+    for function in functions:
+        assert function in query
+    assert '{' not in query
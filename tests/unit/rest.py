@@ -608,3 +608,104 @@ def test_dont_log(client, caplog):
             "An error occured handling the request!"
         for record in caplog.records:
             assert 'sensitive info' not in record.getMessage()
+
+
+def test_metrics(client):
+    """Calls made through rest_call show up in ``metrics.render``."""
+    from hil import errors, metrics
+    metrics.reset()
+
+    @rest.rest_call('GET', '/metrics-ok', Schema({}))
+    # pylint: disable=unused-variable
+    def metrics_ok():
+        """API call that succeeds."""
+
+    @rest.rest_call('GET', '/metrics-missing', Schema({}))
+    # pylint: disable=unused-variable
+    def metrics_missing():
+        """API call that fails with a 404."""
+        raise errors.NotFoundError('Nothing here.')
+
+    for _ in range(3):
+        assert client.get('/v0/metrics-ok').status_code == 200
+    assert client.get('/v0/metrics-missing').status_code == 404
+
+    text = metrics.render()
+    assert 'hil_api_requests_total{endpoint="metrics_ok",status="200"} 3\n' \
+        in text
+    assert 'hil_api_requests_total{endpoint="metrics_missing",' \
+        'status="404"} 1\n' in text
+    assert 'hil_api_request_duration_seconds_bucket{endpoint="metrics_ok",' \
+        'le="+Inf"} 3\n' in text
+    assert 'hil_api_request_duration_seconds_count{' \
+        'endpoint="metrics_ok"} 3\n' in text
+
+
+def test_metrics_of_exited_threads():
+    """Threads which have exited don't each keep their own statistics.
+
+    Their counts are still included in the metrics.
+    """
+    import threading
+    from hil import metrics
+    metrics.reset()
+
+    def call():
+        """Record a call to "threaded"."""
+        metrics.start_call('threaded')
+        metrics.finish_call(200)
+
+    for _ in range(20):
+        thread = threading.Thread(target=call)
+        thread.start()
+        thread.join()
+    call()
+
+    # Only the statistics of this thread, and of the last one started (as
+    # no thread has registered since it exited), can be left:
+    assert len(metrics._live_stats) <= 2  # pylint: disable=protected-access
+    assert 'hil_api_requests_total{endpoint="threaded",status="200"} 21\n' \
+        in metrics.render()
+
+
+def test_profiler(client, tmpdir):
+    """Slow and sampled calls are dumped by the profiler."""
+    from hil import profiler
+    from hil.test_common import config_merge
+    config_merge({
+        'profiling': {
+            'dir': str(tmpdir),
+            'slow_ms': '50',
+        },
+    })
+
+    @rest.rest_call('GET', '/profiled/<delay>', Schema({
+        'delay': Use(float),
+    }))
+    # pylint: disable=unused-variable
+    def profiled(delay):
+        """API call that takes `delay` seconds, and calls out to "ipmitool"."""
+        import time
+        with profiler.trace_call('ipmitool', 'chassis power status'):
+            time.sleep(delay)
+
+    assert client.get('/v0/profiled/0').status_code == 200
+    assert profiler.recent_traces(10) == []
+
+    assert client.get('/v0/profiled/0.1').status_code == 200
+    [summary] = profiler.recent_traces(10)
+    assert summary['endpoint'] == 'profiled'
+    assert summary['status'] == 200
+    assert summary['seconds'] >= 0.1
+    assert not summary['profiled']
+    assert summary['call_count'] == 1
+    with open(str(tmpdir.join(summary['uuid'], profiler.TRACE_NAME))) as f:
+        trace = json.load(f)
+    assert trace['calls'][0]['kind'] == 'ipmitool'
+    assert trace['calls'][0]['seconds'] >= 0.1
+
+    config_merge({'profiling': {'sample_percent': '100'}})
+    assert client.get('/v0/profiled/0').status_code == 200
+    summary = profiler.recent_traces(10)[0]
+    assert summary['profiled']
+    assert tmpdir.join(summary['uuid'], profiler.PROFILE_NAME).check()
@@ -0,0 +1,112 @@
+"""Unit tests for hil.throttling"""
+
+import pytest
+import schema
+
+from hil import config
+from hil.throttling import SCHEMA, Throttle, TokenBucket, max_in_flight
+from hil.test_common import config_testsuite, config_merge
+
+
+class Clock(object):
+    """A clock which only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        """Move the clock on by `seconds`."""
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    """A `Clock`."""
+    return Clock()
+
+
+@pytest.fixture
+def configure():
+    """Set rate limits for the mock switch driver."""
+    config_testsuite()
+    config_merge({
+        'hil.ext.switches.mock': {
+            'switch_rate': '2',
+            'switch_burst': '2',
+            'type_rate': '3',
+            'max_in_flight': '4',
+        },
+    })
+
+
+def test_token_bucket(clock):
+    """A bucket starts full, refills at its rate, and holds `burst` tokens.
+    """
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    for _ in range(3):
+        assert bucket.wait_time() == 0
+        bucket.take()
+    assert bucket.wait_time() == 0.5
+
+    clock.sleep(0.25)
+    assert bucket.wait_time() == 0.25
+    clock.sleep(10)
+    for _ in range(3):
+        bucket.take()
+    assert bucket.wait_time() == 0.5
+
+
+def test_throttle(configure, clock):
+    """Each switch has its own bucket, and shares its type's."""
+    throttle = Throttle(clock)
+    driver = 'hil.ext.switches.mock'
+    throttle.take('sw0', driver)
+    throttle.take('sw0', driver)
+    # sw0 has used up its burst, and has to wait for half a second; but
+    # the type's bucket (burst 1) has gone into debt, which holds up every
+    # switch for longer:
+    assert throttle.buckets['switch', 'sw0'].wait_time() == 0.5
+    assert throttle.wait_time('sw0', driver) == pytest.approx(2 / 3.0)
+    assert throttle.wait_time('sw1', driver) == pytest.approx(2 / 3.0)
+    clock.sleep(1)
+    assert throttle.wait_time('sw0', driver) == 0
+    assert throttle.wait_time('sw1', driver) == 0
+
+    # Drivers without limits are never held up:
+    for _ in range(10):
+        throttle.take('sw2', 'hil.ext.switches.ovs')
+    assert throttle.wait_time('sw2', 'hil.ext.switches.ovs') == 0
+
+
+def test_max_in_flight(configure):
+    """max_in_flight is None unless it is set."""
+    assert max_in_flight('hil.ext.switches.mock') == 4
+    assert max_in_flight('hil.ext.switches.ovs') is None
+
+
+def test_schema():
+    """The options are checked, and validate to themselves."""
+    options = {'switch_rate': '0.5', 'type_burst': '10'}
+    assert schema.Schema(SCHEMA).validate(options) == options
+    for bad in {'switch_rate': '0'}, {'type_rate': 'fast'}, \
+            {'max_in_flight': '1.5'}, {'burst': '2'}:
+        with pytest.raises(schema.SchemaError):
+            schema.Schema(SCHEMA).validate(bad)
+
+
+def test_drivers_accept_limits():
+    """The switch drivers' sections accept the options."""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.dellnos9': '',
+            'hil.ext.switches.ovs': '',
+        },
+    })
+    config.load_extensions()
+    for driver in 'hil.ext.switches.dellnos9', 'hil.ext.switches.ovs':
+        section = schema.Schema(config.core_schema[driver])
+        assert section.validate({'switch_rate': '5'}) == {'switch_rate': '5'}